@@ -0,0 +1,83 @@
+"""
+Compression throughput of offline archives: single-threaded gzip (what `tarfile` and `tar -z`
+do) against the block-parallel gzip and zstd of cli.compression, over image-layer-like data.
+
+    python -m benchmarks.compression [--size-mb 256] [--workers 1 4 32]
+"""
+
+import argparse
+import gzip
+import os
+import time
+
+from cli.compression import DEFAULT_LEVELS, GZIP, ZSTD, get_available_compressions, get_workers, open_writer
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class CountingSink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+
+def make_data(size: int) -> bytes:
+    """Half random, half repetitive text, roughly what image layers compress like"""
+    chunks = []
+    for index in range(size // CHUNK_SIZE):
+        if index % 2:
+            chunks.append(os.urandom(CHUNK_SIZE))
+        else:
+            chunks.append((b"/usr/lib/python3/site-packages/syntho/%d.py\n" % index) * (CHUNK_SIZE // 44 + 1))
+    return b"".join(chunk[:CHUNK_SIZE] for chunk in chunks)
+
+
+def run(data: bytes, compress) -> (float, int):
+    sink = CountingSink()
+    started_at = time.perf_counter()
+    compress(sink, data)
+    return time.perf_counter() - started_at, sink.size
+
+
+def single_gzip(sink, data):
+    with gzip.GzipFile(fileobj=sink, mode="wb", compresslevel=DEFAULT_LEVELS[GZIP], mtime=0) as file:
+        for offset in range(0, len(data), CHUNK_SIZE):
+            file.write(data[offset : offset + CHUNK_SIZE])
+
+
+def parallel(compression: str, workers: int):
+    def compress(sink, data):
+        writer = open_writer(sink, compression, workers=workers)
+        for offset in range(0, len(data), CHUNK_SIZE):
+            writer.write(data[offset : offset + CHUNK_SIZE])
+        writer.close()
+
+    return compress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 4, get_workers()}))
+    args = parser.parse_args()
+
+    data = make_data(args.size_mb * CHUNK_SIZE)
+    runs = [("gzip (single)", 1, single_gzip)]
+    for compression in (GZIP, ZSTD):
+        if compression in get_available_compressions():
+            runs += [(compression, workers, parallel(compression, workers)) for workers in args.workers]
+
+    print(f"{'compression':<14} {'workers':>7} {'MB/s':>8} {'ratio':>6}")
+    for name, workers, compress in runs:
+        elapsed, size = run(data, compress)
+        print(f"{name:<14} {workers:>7} {len(data) / elapsed / CHUNK_SIZE:>8.1f} {size / len(data):>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
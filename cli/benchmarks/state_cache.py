@@ -0,0 +1,95 @@
+"""
+Deployment state parse count and wall time over simulated k8s deployments, with and
+without the in-process state cache.
+
+    python -m benchmarks.state_cache [--deployments 20]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from unittest import mock
+
+from cli import k8s_deployment
+from cli.k8s_deployment import DeploymentStatus
+from cli.state import STATE_BACKEND_ENV, STATE_BACKENDS
+
+DEPLOYMENT_STEPS = [
+    DeploymentStatus.PREPARING_ENV,
+    DeploymentStatus.INITIALIZED,
+    DeploymentStatus.PRE_REQ_CHECK_IN_PROGRESS,
+    DeploymentStatus.PRE_REQ_CHECK_SUCCEEDED,
+    DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_IN_PROGRESS,
+    DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_SUCCEEDED,
+    DeploymentStatus.SYNTHO_UI_DEPLOYMENT_IN_PROGRESS,
+    DeploymentStatus.SYNTHO_UI_DEPLOYMENT_SUCCEEDED,
+]
+
+
+class NoCache(dict):
+    def __setitem__(self, key, value):
+        pass
+
+
+def simulate_deployment(scripts_dir: str, deployment_id: str):
+    """The state calls `syntho-cli k8s deployment` makes, without running any scripts."""
+    deployments_dir = f"{scripts_dir}/deployments"
+    deployment_dir = f"{deployments_dir}/{deployment_id}"
+
+    k8s_deployment.get_deployment_status(deployments_dir, deployment_dir, deployment_id)
+    k8s_deployment.initialize_deployment(deployment_id, deployment_dir, deployments_dir, "1.0.0")
+    for status in DEPLOYMENT_STEPS:
+        k8s_deployment.get_deployment_status(deployments_dir, deployment_dir, deployment_id)
+        k8s_deployment.set_state(deployment_id, deployments_dir, status)
+    k8s_deployment.get_state(deployments_dir).update_deployment(deployment_id, cluster_name="benchmark")
+    k8s_deployment.set_state(deployment_id, deployments_dir, DeploymentStatus.COMPLETED, is_completed=True)
+    k8s_deployment.is_deployment_completed(deployments_dir, deployment_id)
+    k8s_deployment.get_active_deployment_id(scripts_dir)
+    k8s_deployment.get_deployment(scripts_dir, deployment_id)
+    k8s_deployment.get_deployments(scripts_dir)
+
+
+def run(backend_name: str, cached: bool, deployments: int):
+    backend_cls = STATE_BACKENDS[backend_name]
+    original_load = backend_cls._load_deployments_state
+    loads = 0
+
+    def counting_load(self):
+        nonlocal loads
+        loads += 1
+        return original_load(self)
+
+    cwd = os.getcwd()
+    with (
+        tempfile.TemporaryDirectory() as scripts_dir,
+        mock.patch.dict(os.environ, {STATE_BACKEND_ENV: backend_name}),
+        mock.patch.object(backend_cls, "_load_deployments_state", counting_load),
+        mock.patch("cli.state._STATE_CACHE", {} if cached else NoCache()),
+    ):
+        started_at = time.perf_counter()
+        for index in range(deployments):
+            simulate_deployment(scripts_dir, f"k8s-{index}")
+        elapsed = time.perf_counter() - started_at
+        os.chdir(cwd)
+
+    return loads, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deployments", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'cache':<6} {'parses/deployment':>18} {'ms/deployment':>14}")
+    for backend_name in STATE_BACKENDS:
+        for cached in (False, True):
+            loads, elapsed = run(backend_name, cached, args.deployments)
+            print(
+                f"{backend_name:<8} {'on' if cached else 'off':<6} "
+                f"{loads / args.deployments:>18.1f} {elapsed * 1000 / args.deployments:>14.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
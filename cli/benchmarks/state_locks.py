@@ -0,0 +1,89 @@
+"""
+State-update throughput of N processes that each drive their own deployment, with
+per-deployment shared/exclusive locks and with everything behind the single global
+deployments lock (the previous behaviour).
+
+    python -m benchmarks.state_locks [--processes 8] [--transitions 200] [--backend yaml]
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from unittest import mock
+
+from cli import k8s_deployment, utils
+from cli.k8s_deployment import DeploymentStatus
+from cli.state import STATE_BACKEND_ENV, STATE_BACKENDS
+
+STATUSES = [
+    DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_IN_PROGRESS,
+    DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_SUCCEEDED,
+]
+
+
+def global_exclusive_lock(deployments_dir, shared=False, deployment_id=None, _lock=utils.deployments_lock):
+    return _lock(deployments_dir)
+
+
+def worker(scripts_dir: str, deployment_id: str, transitions: int, global_lock: bool, start):
+    deployments_dir = f"{scripts_dir}/deployments"
+    deployment_dir = f"{deployments_dir}/{deployment_id}"
+
+    with (
+        mock.patch("cli.utils.deployments_lock", global_exclusive_lock if global_lock else utils.deployments_lock),
+        mock.patch("cli.state.deployments_lock", global_exclusive_lock if global_lock else utils.deployments_lock),
+    ):
+        start.wait()
+        for index in range(transitions):
+            k8s_deployment.set_state(deployment_id, deployments_dir, STATUSES[index % len(STATUSES)])
+            # a status poll between the transitions, as `syntho-cli k8s status` does
+            k8s_deployment.get_deployment_status(deployments_dir, deployment_dir, deployment_id)
+
+
+def run(backend_name: str, processes: int, transitions: int, global_lock: bool) -> float:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scripts_dir, mock.patch.dict(os.environ, {STATE_BACKEND_ENV: backend_name}):
+        deployments_dir = f"{scripts_dir}/deployments"
+        deployment_ids = [f"k8s-{index}" for index in range(processes)]
+        for deployment_id in deployment_ids:
+            k8s_deployment.initialize_deployment(
+                deployment_id, f"{deployments_dir}/{deployment_id}", deployments_dir, "1.0.0"
+            )
+        os.chdir(cwd)
+
+        context = multiprocessing.get_context("fork")
+        start = context.Barrier(processes + 1)
+        workers = [
+            context.Process(target=worker, args=(scripts_dir, deployment_id, transitions, global_lock, start))
+            for deployment_id in deployment_ids
+        ]
+        for process in workers:
+            process.start()
+
+        start.wait()
+        started_at = time.perf_counter()
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - started_at
+
+    return processes * transitions / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--transitions", type=int, default=200)
+    parser.add_argument("--backend", choices=list(STATE_BACKENDS), default="yaml")
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes x {args.transitions} transitions, {args.backend} backend")
+    print(f"{'locking':<16} {'transitions/s':>14}")
+    for global_lock in (True, False):
+        throughput = run(args.backend, args.processes, args.transitions, global_lock)
+        print(f"{'global' if global_lock else 'per-deployment':<16} {throughput:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Archives compressed on every core. Gzip output is split into blocks that are compressed on a
+thread pool (zlib releases the GIL), each block a gzip member of its own: `tar -z`, `gunzip`
+and the gzip module read the members back as one stream. Zstandard is used when `zstandard`
+is installed, with its own worker threads.
+
+    python -m cli.compression tar --output <archive> --source-dir <dir> [--compression zstd]
+    python -m cli.compression extract --archive <archive> --output-dir <dir>
+"""
+
+import argparse
+import fnmatch
+import gzip
+import os
+import sys
+import tarfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, NoReturn, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSIONS = (GZIP, ZSTD)
+DEFAULT_COMPRESSION = GZIP
+ARCHIVE_EXTENSIONS = {GZIP: ".tar.gz", ZSTD: ".tar.zst"}
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+BLOCK_SIZE = 1024 * 1024
+# blocks in flight per worker, bounds the memory whatever the size of the input
+PENDING_BLOCKS = 2
+
+
+class CompressionUnavailable(Exception):
+    pass
+
+
+def get_available_compressions() -> List[str]:
+    return [compression for compression in COMPRESSIONS if compression != ZSTD or zstandard is not None]
+
+
+def get_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def compress_member(block: bytes, level: int) -> bytes:
+    # wbits 31 writes the gzip header and trailer, with no name and mtime 0
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipWriter:
+    """Gzips what's written to it into 'fileobj', one member per block, in the order it was written"""
+
+    def __init__(self, fileobj, level: int = DEFAULT_LEVELS[GZIP], workers: int = None, block_size: int = None):
+        self.fileobj = fileobj
+        self.level = level
+        self.workers = workers or get_workers()
+        self.block_size = block_size or BLOCK_SIZE
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._closed = False
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[: self.block_size])
+            del self._buffer[: self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block: bytes) -> NoReturn:
+        while len(self._pending) >= self.workers * PENDING_BLOCKS:
+            self._write_next()
+        self._pending.append(self._executor.submit(compress_member, block, self.level))
+
+    def _write_next(self) -> NoReturn:
+        data = self._pending.popleft().result()
+        self.fileobj.write(data)
+        self.bytes_out += len(data)
+
+    def close(self) -> NoReturn:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # an empty input is still a gzip stream, of one empty member
+            if self._buffer or not self.bytes_in:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+
+
+class ZstdWriter:
+    """Compresses what's written to it into 'fileobj' with zstandard's own worker threads"""
+
+    def __init__(self, fileobj, level: int = DEFAULT_LEVELS[ZSTD], workers: int = None):
+        if zstandard is None:
+            raise CompressionUnavailable('zstd needs the zstandard package, `pip install "syntho-cli[zstd]"`')
+        self.fileobj = fileobj
+        self.bytes_in = 0
+        self._writer = zstandard.ZstdCompressor(level=level, threads=workers or get_workers()).stream_writer(
+            fileobj, closefd=False
+        )
+        self._closed = False
+
+    @property
+    def bytes_out(self) -> int:
+        return self.fileobj.tell()
+
+    def write(self, data) -> int:
+        self.bytes_in += len(data)
+        return self._writer.write(data)
+
+    def close(self) -> NoReturn:
+        if not self._closed:
+            self._closed = True
+            self._writer.close()
+
+
+def open_writer(fileobj, compression: str = DEFAULT_COMPRESSION, level: int = None, workers: int = None):
+    if compression not in COMPRESSIONS:
+        raise CompressionUnavailable(f"Unknown compression: {compression}, one of {', '.join(COMPRESSIONS)}")
+    level = level or DEFAULT_LEVELS[compression]
+    if compression == ZSTD:
+        return ZstdWriter(fileobj, level, workers)
+    return ParallelGzipWriter(fileobj, level, workers)
+
+
+def get_archive_extension(compression: str) -> str:
+    return ARCHIVE_EXTENSIONS[compression]
+
+
+def detect_compression(path: str) -> Optional[str]:
+    with open(path, "rb") as file:
+        magic = file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return GZIP
+    if magic.startswith(ZSTD_MAGIC):
+        return ZSTD
+    return None
+
+
+@contextmanager
+def open_tar_writer(path: str, compression: str = DEFAULT_COMPRESSION, level: int = None, workers: int = None):
+    """A streamed tarfile writing to 'path' through the compression, for adding members to"""
+    with open(path, "wb") as file:
+        writer = open_writer(file, compression, level, workers)
+        try:
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                yield tar
+        finally:
+            writer.close()
+
+
+@contextmanager
+def open_tar_reader(path: str):
+    """
+    A streamed tarfile reading 'path', members are read in order. Multi-member gzip is read
+    through the gzip module, as tarfile's own `r|gz` stops after the first member.
+    """
+    compression = detect_compression(path)
+    with open(path, "rb") as file:
+        if compression == ZSTD:
+            if zstandard is None:
+                raise CompressionUnavailable(f'{path} is zstd compressed, `pip install "syntho-cli[zstd]"` to read it')
+            reader = zstandard.ZstdDecompressor().stream_reader(file, closefd=False)
+        elif compression == GZIP:
+            reader = gzip.GzipFile(fileobj=file, mode="rb")
+        else:
+            reader = file
+        with reader, tarfile.open(fileobj=reader, mode="r|") as tar:
+            yield tar
+
+
+def archive_dir(
+    output: str,
+    source_dir: str,
+    compression: str = DEFAULT_COMPRESSION,
+    level: int = None,
+    workers: int = None,
+    excludes: List[str] = (),
+) -> int:
+    """
+    Archives the content of 'source_dir' as `tar -C <source-dir> .` does, leaving out the
+    members matching 'excludes' (e.g. ./shared/process/*.log). Returns the bytes archived.
+    """
+
+    def exclude(info):
+        return None if any(fnmatch.fnmatch(info.name, pattern) for pattern in excludes) else info
+
+    with open_tar_writer(output, compression, level, workers) as tar:
+        tar.add(source_dir, arcname=".", filter=exclude)
+    return tar.offset
+
+
+def check_members(tar: tarfile.TarFile, output_dir: str):
+    """
+    The members of 'tar', checked as the "data" extraction filter of Python 3.11.4+ does: none
+    may land or link outside of 'output_dir', and none is a device, setuid or owned by another user
+    """
+    root = os.path.realpath(output_dir)
+
+    def check_path(name, path):
+        if os.path.commonpath([root, os.path.realpath(os.path.join(root, path))]) != root:
+            raise tarfile.TarError(f"{name} is outside of {output_dir}")
+
+    for member in tar:
+        check_path(member.name, member.name)
+        if member.issym():
+            check_path(member.name, os.path.join(os.path.dirname(member.name), member.linkname))
+        elif member.islnk():
+            check_path(member.name, member.linkname)
+        elif not (member.isfile() or member.isdir()):
+            raise tarfile.TarError(f"{member.name} isn't a file, a dir or a link")
+        member.mode &= 0o755
+        member.uid, member.gid, member.uname, member.gname = os.getuid(), os.getgid(), "", ""
+        yield member
+
+
+def extract_archive(archive: str, output_dir: str) -> NoReturn:
+    os.makedirs(output_dir, exist_ok=True)
+    with open_tar_reader(archive) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(output_dir, filter="data")
+        else:
+            # Python 3.11.0-3.11.3 has no extraction filters
+            tar.extractall(output_dir, members=check_members(tar, output_dir))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Archives a directory compressed on every core, or extracts one")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    tar = subparsers.add_parser("tar")
+    tar.add_argument("--output", required=True)
+    tar.add_argument("--source-dir", required=True)
+    tar.add_argument("--compression", choices=COMPRESSIONS, default=DEFAULT_COMPRESSION)
+    tar.add_argument("--level", type=int, default=None)
+    tar.add_argument("--workers", type=int, default=None)
+    tar.add_argument("--exclude", action="append", default=[])
+    extract = subparsers.add_parser("extract")
+    extract.add_argument("--archive", required=True)
+    extract.add_argument("--output-dir", required=True)
+    args = parser.parse_args(argv)
+
+    started_at = time.monotonic()
+    try:
+        if args.command == "extract":
+            extract_archive(args.archive, args.output_dir)
+            print(f"extracted {args.archive} into {args.output_dir}")
+            return 0
+        archived = archive_dir(args.output, args.source_dir, args.compression, args.level, args.workers, args.exclude)
+    except (OSError, tarfile.TarError, CompressionUnavailable) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    elapsed = time.monotonic() - started_at
+    print(
+        f"archived {archived} bytes into {os.path.getsize(args.output)} bytes ({args.compression}) "
+        f"in {elapsed:.1f}s, {archived / max(elapsed, 1e-6) / 1024 / 1024:.1f} MB/s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
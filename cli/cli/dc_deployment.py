@@ -1,9 +1,9 @@
 import base64
 import json
 import os
-import shutil
 from datetime import datetime
 from enum import Enum
+from functools import partial
 from hashlib import md5
 from typing import Dict, List, NoReturn
 
@@ -13,17 +13,24 @@ from pydantic import parse_obj_as
 
 from cli.dynamic_configuration.core import dump_envs, enrich_envs, make_envs, proceed_with_questions
 from cli.dynamic_configuration.schema.question_schema import QuestionSchema
+from cli.orchestrator import Step, format_critical_path, run_steps
+from cli.state import StateBackend, get_state_backend
 from cli.utilities.offline_ops import generate_offline_registry_archive_path, generate_offline_registry_dir
 from cli.utilities.prepull_images import generate_prepull_images_dir
 from cli.utils import (
     CleanUpLevel,
     DeploymentResult,
     get_deployments_dir,
+    remove_dir,
     run_script,
-    thread_safe,
+    wait_until,
     with_working_directory,
+    write_env_bundle,
 )
 
+DEPLOYMENT_TOOLING = "dc"
+RELEASE_DOWNLOAD_LOG = ".download-release.log"
+
 
 class DeploymentStatus(Enum):
     INITIALIZING = ("initializing", CleanUpLevel.DIR)
@@ -47,6 +54,41 @@ class DeploymentStatus(Enum):
         return self.value[1]
 
 
+class DeploymentStep(Enum):
+    """Steps of a deployment in their order, a failed deployment can be resumed from any of them."""
+
+    PRE_REQUIREMENTS_CHECK = "pre-requirements-check"
+    DOWNLOAD_RELEASE = "download-release"
+    CONFIGURATION = "configuration"
+    DEPLOYMENT = "deployment"
+
+    def index(self) -> int:
+        return list(DeploymentStep).index(self)
+
+
+STEP_FAILURES = {
+    "pre-requirements-check": ("Pre requirements check failed", DeploymentStatus.PRE_REQ_CHECK_FAILED),
+    "download-release": (
+        "Pre deployment operations failed - Downloading syntho-charts release",
+        DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED,
+    ),
+    "configuration": (
+        "Pre deployment operations failed - Configuration",
+        DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED,
+    ),
+    "deployment": ("Syntho UI deployment failed", DeploymentStatus.DEPLOYMENT_FAILED),
+}
+
+
+UPDATE_STEP_FAILURES = {
+    "compatibility-check": (
+        "Given version and the current version are not backwards-compatible. "
+        "Please reach out to support@syntho.ai for further support."
+    ),
+    "update-release": "Updating release has been failed. Please reach out to support@syntho.ai for further support.",
+}
+
+
 @with_working_directory
 def start(
     scripts_dir: str,
@@ -63,11 +105,13 @@ def start(
     use_offline_registry: bool,
     deployment_tools_version: str,
     dry_run: bool,
+    resume: bool = False,
 ) -> str:
     deployments_dir = get_deployments_dir(scripts_dir)
     deployment_id = generate_deployment_id(docker_host)
     deployment_dir = f"{deployments_dir}/{deployment_id}"
 
+    first_step = DeploymentStep.PRE_REQUIREMENTS_CHECK
     deployment_status = get_deployment_status(deployments_dir, deployment_dir, deployment_id)
     if deployment_status:
         if deployment_status.get() == DeploymentStatus.COMPLETED.get():
@@ -77,7 +121,7 @@ def start(
                 error=None,
                 deployment_status=deployment_status,
             )
-        else:
+        elif not resume:
             return DeploymentResult(
                 succeeded=False,
                 deployment_id=deployment_id,
@@ -85,17 +129,30 @@ def start(
                 deployment_status=deployment_status,
             )
 
-    initialize_deployment(
-        deployment_id,
-        deployment_dir,
-        deployments_dir,
-        version,
-        docker_host,
-        use_trusted_registry,
-        use_offline_registry,
-    )
+        deployment = get_state(deployments_dir).get_deployment(deployment_id)
+        if deployment["version"] != version:
+            return DeploymentResult(
+                succeeded=False,
+                deployment_id=deployment_id,
+                error=(f"Deployment can only be resumed with its own version ({deployment['version']})"),
+                deployment_status=deployment_status,
+            )
 
-    prepare_env(
+        os.chdir(deployment_dir)
+        first_step = get_resume_step(deployments_dir, deployment_id)
+    else:
+        initialize_deployment(
+            deployment_id,
+            deployment_dir,
+            deployments_dir,
+            version,
+            docker_host,
+            use_trusted_registry,
+            use_offline_registry,
+        )
+
+    # options given with --resume replace the failed run's
+    env_changed = prepare_env(
         deployment_id,
         deployment_dir,
         deployments_dir,
@@ -113,50 +170,33 @@ def start(
         deployment_tools_version,
         dry_run,
     )
+    if deployment_status:
+        if env_changed and first_step.index() > DeploymentStep.CONFIGURATION.index():
+            # the configuration holds the license key and the registry credentials
+            first_step = DeploymentStep.CONFIGURATION
+        click.echo(f"Resuming deployment({deployment_id}) from the step: {first_step.value}\n")
 
-    succeeded = pre_requirements_check(scripts_dir, deployment_id)
-    if not succeeded:
-        return DeploymentResult(
-            succeeded=False,
-            deployment_id=deployment_id,
-            error=("Pre requirements check failed"),
-            deployment_status=DeploymentStatus.PRE_REQ_CHECK_FAILED,
-        )
-
-    succeeded = download_syntho_charts_release(scripts_dir, deployment_id)
-    if not succeeded:
-        return DeploymentResult(
-            succeeded=False,
-            deployment_id=deployment_id,
-            error=("Pre deployment operations failed - Downloading syntho-charts release"),
-            deployment_status=DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED,
-        )
-
-    succeeded = configuration_questions(
+    steps = get_deployment_steps(
         scripts_dir,
         deployment_id,
+        first_step,
         skip_configuration,
         version,
         license_key,
         registry_user,
         registry_pwd,
     )
+    result = run_steps(steps)
+    if result.critical_path:
+        click.echo(f"\nCritical path: {format_critical_path(result.critical_path)}")
 
-    if not succeeded:
-        return DeploymentResult(
-            succeeded=False,
-            deployment_id=deployment_id,
-            error=("Pre deployment operations failed - Configuration"),
-            deployment_status=DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED,
-        )
-
-    succeeded = start_deployment(scripts_dir, deployment_id)
-    if not succeeded:
+    if not result.succeeded:
+        error, deployment_status = STEP_FAILURES[result.failed_step]
         return DeploymentResult(
             succeeded=False,
             deployment_id=deployment_id,
-            error=("Syntho UI deployment failed"),
-            deployment_status=DeploymentStatus.DEPLOYMENT_FAILED,
+            error=error,
+            deployment_status=deployment_status,
         )
 
     set_state(deployment_id, deployments_dir, DeploymentStatus.COMPLETED, is_completed=True)
@@ -168,6 +208,72 @@ def start(
     )
 
 
+def get_deployment_steps(
+    scripts_dir: str,
+    deployment_id: str,
+    first_step: DeploymentStep,
+    skip_configuration: bool,
+    version: str,
+    license_key: str,
+    registry_user: str,
+    registry_pwd: str,
+) -> List[Step]:
+    """
+    Steps of a deployment from first_step on, as a dependency graph. The release is fetched
+    in the background while the pre-requirements are checked.
+    """
+    prefetched = {}
+    steps = [
+        (
+            DeploymentStep.PRE_REQUIREMENTS_CHECK,
+            Step("pre-requirements-check", partial(pre_requirements_check, scripts_dir, deployment_id)),
+        ),
+        (
+            DeploymentStep.DOWNLOAD_RELEASE,
+            Step(
+                "fetch-release",
+                partial(fetch_syntho_charts_release, scripts_dir, deployment_id, prefetched),
+                console=False,
+            ),
+        ),
+        (
+            DeploymentStep.DOWNLOAD_RELEASE,
+            Step(
+                "download-release",
+                partial(download_syntho_charts_release, scripts_dir, deployment_id, prefetched),
+                depends_on=("fetch-release",),
+            ),
+        ),
+        (
+            DeploymentStep.CONFIGURATION,
+            Step(
+                "configuration",
+                partial(
+                    configuration_questions,
+                    scripts_dir,
+                    deployment_id,
+                    skip_configuration,
+                    version,
+                    license_key,
+                    registry_user,
+                    registry_pwd,
+                ),
+                depends_on=("download-release",),
+            ),
+        ),
+        (
+            DeploymentStep.DEPLOYMENT,
+            Step(
+                "deployment",
+                partial(start_deployment, scripts_dir, deployment_id),
+                depends_on=("pre-requirements-check", "configuration"),
+            ),
+        ),
+    ]
+
+    return [step for deployment_step, step in steps if deployment_step.index() >= first_step.index()]
+
+
 def generate_deployment_id(docker_host: str) -> str:
     deployment_indicator = f"host:{docker_host}"
     indicator_hash = md5(deployment_indicator.encode(), usedforsecurity=False).hexdigest()
@@ -179,27 +285,32 @@ def get_deployment_status(deployments_dir: str, deployment_dir: str, deployment_
     if not exists:
         return None
 
-    deployments_state = get_deployments_state(deployments_dir)
-    filtered = list(filter(lambda d: d["id"] == deployment_id, deployments_state["deployments"]))
-    deployment = filtered[0]
+    deployment = get_state(deployments_dir).get_deployment(deployment_id)
 
     for deployment_status in DeploymentStatus:
         if deployment_status.get() == deployment["status"]:
             return deployment_status
 
 
-@thread_safe
+def get_state(deployments_dir: str) -> StateBackend:
+    return get_state_backend(deployments_dir, DEPLOYMENT_TOOLING)
+
+
 def get_deployments_state(deployments_dir: str) -> Dict:
-    deployment_state_path = f"{deployments_dir}/dc-deployment-state.yaml"
-    if os.path.exists(deployment_state_path):
-        with open(deployment_state_path, "r") as file:
-            deployment_state_dict = yaml.safe_load(file)
-            return deployment_state_dict
-
-    return {
-        "active_deployment_id": None,
-        "deployments": [],
-    }
+    return get_state(deployments_dir).get_deployments_state()
+
+
+def is_resumable(scripts_dir: str, deployment_id: str) -> bool:
+    """
+    Whether an unfinished deployment is worth keeping for `--resume`: the release is downloaded
+    and the configuration is answered, so only the deployment step needs to run again.
+    """
+    deployments_dir = f"{scripts_dir}/deployments"
+    deployment_dir = f"{deployments_dir}/{deployment_id}"
+    if not os.path.isdir(deployment_dir):
+        return False
+
+    return get_resume_step(deployments_dir, deployment_id).index() > DeploymentStep.CONFIGURATION.index()
 
 
 def cleanup(scripts_dir: str, deployment_id: str, status: DeploymentStatus) -> bool:
@@ -228,31 +339,17 @@ def cleanup_with_cleanup_level(
         if not result.succeeded:
             return False
 
-    shutil.rmtree(deployment_dir)
-
-    deployments_state = get_deployments_state(deployments_dir)
-    deployments_state["active_deployment_id"] = None
+    state = get_state(deployments_dir)
+    state.archive_deployment(deployment_id)
+    # background steps of an interrupted run may still be writing into the directory
+    wait_until(lambda: remove_dir(deployment_dir), timeout=10)
 
-    deployments = deployments_state["deployments"]
-    _deployments = []
-    for deployment in deployments:
-        if deployment["id"] == deployment_id:
-            continue
-
-        _deployments.append(deployment)
-
-    deployments_state["deployments"] = _deployments
-    if _deployments:
-        deployments_state["active_deployment_id"] = _deployments[-1]["id"]
-    update_deployments_state(deployments_dir, deployments_state)
+    state.remove_deployment(deployment_id)
     return True
 
 
-@thread_safe
 def update_deployments_state(deployments_dir: str, deployments_state: Dict) -> NoReturn:
-    deployment_state_path = f"{deployments_dir}/dc-deployment-state.yaml"
-    with open(deployment_state_path, "w") as file:
-        yaml.dump(deployments_state, file, default_flow_style=False)
+    get_state(deployments_dir).update_deployments_state(deployments_state)
 
 
 def initialize_deployment(
@@ -264,8 +361,6 @@ def initialize_deployment(
     use_trusted_registry: bool,
     use_offline_registry: bool,
 ) -> NoReturn:
-    deployments_state = get_deployments_state(deployments_dir)
-
     started_at = datetime.utcnow().isoformat()
     os.makedirs(deployment_dir)
 
@@ -283,19 +378,19 @@ def initialize_deployment(
         "use_trusted_registry": use_trusted_registry,
         "use_offline_registry": use_trusted_registry,
     }
-    deployments_state["deployments"].append(deployment)
-    deployments_state["active_deployment_id"] = deployment_id
-
-    update_deployments_state(deployments_dir, deployments_state)
+    state = get_state(deployments_dir)
+    state.add_deployment(deployment)
+    state.record_transition(deployment_id, DeploymentStatus.INITIALIZING.get())
 
 
 def get_deployment(scripts_dir: str, deployment_id: str) -> Dict:
     deployments_dir = f"{scripts_dir}/deployments"
-    deployments_state = get_deployments_state(deployments_dir)
-    deployments = deployments_state["deployments"]
-    for deployment in deployments:
-        if deployment["id"] == deployment_id:
-            return deployment
+    return get_state(deployments_dir).get_deployment(deployment_id)
+
+
+def get_script_timings(scripts_dir: str, deployment_id: str) -> List[Dict]:
+    deployments_dir = f"{scripts_dir}/deployments"
+    return get_state(deployments_dir).get_script_timings(deployment_id)
 
 
 @with_working_directory
@@ -316,8 +411,7 @@ def destroy(scripts_dir: str, deployment_id: str, force: bool) -> bool:
 
 def get_deployments(scripts_dir: str) -> List[Dict]:
     deployments_dir = f"{scripts_dir}/deployments"
-    deployments_state = get_deployments_state(deployments_dir)
-    return deployments_state["deployments"]
+    return get_state(deployments_dir).get_deployments()
 
 
 def prepare_env(
@@ -337,7 +431,8 @@ def prepare_env(
     use_offline_registry: bool,
     deployment_tools_version: str,
     dry_run: bool,
-):
+) -> bool:
+    """Writes the deployment's env, returns whether it changed"""
     scripts_dir = deployments_dir.replace("/deployments", "")
     set_state(deployment_id, deployments_dir, DeploymentStatus.PREPARING_ENV)
 
@@ -414,27 +509,67 @@ def prepare_env(
         "DEPLOYMENT_TOOLS_VERSION": deployment_tools_version,
         "DRY_RUN": "true" if dry_run else "false",
     }
-    env_file_path = f"{deployment_dir}/.env"
-    with open(env_file_path, "w") as file:
-        for key, value in env.items():
-            if value:
-                file.write(f"{key}={value}\n")
-            else:
-                file.write(f"{key}=\n")
+    changed = write_env_bundle(f"{deployment_dir}/.env", env)
 
     set_state(deployment_id, deployments_dir, DeploymentStatus.INITIALIZED)
+    return changed
 
 
-def set_state(deployment_id: str, deployments_dir: str, status: DeploymentStatus, is_completed: bool = False):
-    deployments_state = get_deployments_state(deployments_dir)
-    for deployment in deployments_state["deployments"]:
-        if deployment["id"] == deployment_id:
-            deployment["status"] = status.get()
-            if is_completed:
-                finished_at = datetime.utcnow().isoformat()
-                deployment["finished_at"] = finished_at
+def set_state(
+    deployment_id: str,
+    deployments_dir: str,
+    status: DeploymentStatus,
+    is_completed: bool = False,
+    exitcode: int = None,
+):
+    finished_at = datetime.utcnow().isoformat() if is_completed else None
+    get_state(deployments_dir).record_transition(
+        deployment_id, status.get(), exitcode=exitcode, finished_at=finished_at
+    )
+
 
-    update_deployments_state(deployments_dir, deployments_state)
+def set_step_succeeded(deployment_id: str, deployments_dir: str, step: DeploymentStep) -> NoReturn:
+    get_state(deployments_dir).update_deployment(deployment_id, last_succeeded_step=step.value)
+
+
+def get_resume_step(deployments_dir: str, deployment_id: str) -> DeploymentStep:
+    """
+    First step to run when resuming: the one after the last succeeded step, or an earlier one
+    whose cached artifacts (the extracted release, the dumped configuration) are gone.
+    """
+    deployment = get_state(deployments_dir).get_deployment(deployment_id)
+    deployment_dir = f"{deployments_dir}/{deployment_id}"
+    last_succeeded_step = deployment.get("last_succeeded_step")
+
+    for step in DeploymentStep:
+        if not last_succeeded_step or step.index() > DeploymentStep(last_succeeded_step).index():
+            return step
+        if not has_step_artifacts(deployment_dir, deployment["version"], step):
+            return step
+
+    return DeploymentStep.DEPLOYMENT
+
+
+def has_step_artifacts(deployment_dir: str, version: str, step: DeploymentStep) -> bool:
+    if step == DeploymentStep.DOWNLOAD_RELEASE:
+        return os.path.isdir(f"{deployment_dir}/syntho-charts-{version}") and os.path.isfile(
+            f"{deployment_dir}/.images.env"
+        )
+
+    if step == DeploymentStep.CONFIGURATION:
+        configuration_questions_yaml_location = (
+            f"{deployment_dir}/syntho-charts-{version}/dynamic-configuration/src/dc_questions.yaml"
+        )
+        if not os.path.isfile(configuration_questions_yaml_location):
+            return False
+
+        with open(configuration_questions_yaml_location, "r") as f:
+            questions_config = yaml.safe_load(f)
+        question_schema_obj = parse_obj_as(QuestionSchema, questions_config)
+        scopes = make_envs(question_schema_obj.envs_configuration).keys()
+        return all(os.path.isfile(f"{deployment_dir}/{scope}") for scope in scopes)
+
+    return True
 
 
 def pre_requirements_check(scripts_dir: str, deployment_id: str) -> bool:
@@ -446,9 +581,10 @@ def pre_requirements_check(scripts_dir: str, deployment_id: str) -> bool:
 
     result = run_script(scripts_dir, deployment_dir, "pre-requirements-dc.sh")
     if result.succeeded:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_REQ_CHECK_SUCCEEDED)
+        set_step_succeeded(deployment_id, deployments_dir, DeploymentStep.PRE_REQUIREMENTS_CHECK)
+        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_REQ_CHECK_SUCCEEDED, exitcode=result.exitcode)
     else:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_REQ_CHECK_FAILED)
+        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_REQ_CHECK_FAILED, exitcode=result.exitcode)
 
     return result.succeeded
 
@@ -493,24 +629,58 @@ def configuration_questions(
     set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_IN_PROGRESS)
 
     result = run_script(scripts_dir, deployment_dir, "configuration-questions-dc.sh")
-    if not result.succeeded:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED)
+    if result.succeeded:
+        set_step_succeeded(deployment_id, deployments_dir, DeploymentStep.CONFIGURATION)
+    else:
+        set_state(
+            deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED, exitcode=result.exitcode
+        )
 
     return result.succeeded
 
 
-def download_syntho_charts_release(scripts_dir: str, deployment_id: str) -> bool:
+def fetch_syntho_charts_release(scripts_dir: str, deployment_id: str, prefetched: Dict) -> bool:
+    """
+    Downloads the release in the background. The output is kept in a log file and shown by
+    download_syntho_charts_release, which also reports the result.
+    """
+    deployment_dir = f"{scripts_dir}/deployments/{deployment_id}"
+    prefetched["result"] = run_script(
+        scripts_dir,
+        deployment_dir,
+        "download-syntho-charts-release-dc.sh",
+        output_path=f"{deployment_dir}/{RELEASE_DOWNLOAD_LOG}",
+    )
+    return True
+
+
+def download_syntho_charts_release(scripts_dir: str, deployment_id: str, prefetched: Dict = None) -> bool:
     click.echo("Step 2: Downloading the release;")
     deployments_dir = f"{scripts_dir}/deployments"
     deployment_dir = f"{deployments_dir}/{deployment_id}"
     set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_IN_PROGRESS)
 
-    result = run_script(scripts_dir, deployment_dir, "download-syntho-charts-release-dc.sh")
+    if prefetched:
+        release_download_log = f"{deployment_dir}/{RELEASE_DOWNLOAD_LOG}"
+        if os.path.exists(release_download_log):
+            with open(release_download_log, "r") as file:
+                click.echo(file.read(), nl=False)
+        result = prefetched["result"]
+    else:
+        result = run_script(scripts_dir, deployment_dir, "download-syntho-charts-release-dc.sh")
     if not result.succeeded:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED)
+        set_state(
+            deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_FAILED, exitcode=result.exitcode
+        )
 
     if result.succeeded:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_SUCCEEDED)
+        set_step_succeeded(deployment_id, deployments_dir, DeploymentStep.DOWNLOAD_RELEASE)
+        set_state(
+            deployment_id,
+            deployments_dir,
+            DeploymentStatus.PRE_DEPLOYMENT_OPERATIONS_SUCCEEDED,
+            exitcode=result.exitcode,
+        )
 
     return result.succeeded
 
@@ -523,9 +693,10 @@ def start_deployment(scripts_dir: str, deployment_id: str) -> bool:
 
     result = run_script(scripts_dir, deployment_dir, "deploy-ray-and-syntho-stack-dc.sh")
     if result.succeeded:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.DEPLOYMENT_SUCCEEDED)
+        set_step_succeeded(deployment_id, deployments_dir, DeploymentStep.DEPLOYMENT)
+        set_state(deployment_id, deployments_dir, DeploymentStatus.DEPLOYMENT_SUCCEEDED, exitcode=result.exitcode)
     else:
-        set_state(deployment_id, deployments_dir, DeploymentStatus.DEPLOYMENT_FAILED)
+        set_state(deployment_id, deployments_dir, DeploymentStatus.DEPLOYMENT_FAILED, exitcode=result.exitcode)
 
     return result.succeeded
 
@@ -554,24 +725,26 @@ def update_dc_deployment(
             deployment_status=None,
         )
 
-    is_compatible = compatibility_check(scripts_dir, deployment_id, current_version, new_version)
-    if not is_compatible:
-        return DeploymentResult(
-            succeeded=False,
-            deployment_id=deployment_id,
-            error=(
-                "Given version and the current version are not backwards-compatible. "
-                "Please reach out to support@syntho.ai for further support."
-            ),
-            deployment_status=None,
-        )
+    steps = [
+        Step(
+            "compatibility-check",
+            partial(compatibility_check, scripts_dir, deployment_id, current_version, new_version),
+        ),
+        Step(
+            "update-release",
+            partial(update_release, scripts_dir, deployment_id, initial_version, current_version, new_version),
+            depends_on=("compatibility-check",),
+        ),
+    ]
+    result = run_steps(steps)
+    if result.critical_path:
+        click.echo(f"\nCritical path: {format_critical_path(result.critical_path)}")
 
-    is_success = update_release(scripts_dir, deployment_id, initial_version, current_version, new_version)
-    if not is_success:
+    if not result.succeeded:
         return DeploymentResult(
             succeeded=False,
             deployment_id=deployment_id,
-            error=("Updating release has been failed. " "Please reach out to support@syntho.ai for further support."),
+            error=UPDATE_STEP_FAILURES[result.failed_step],
             deployment_status=None,
         )
 
@@ -628,9 +801,6 @@ def update_release(
 
 
 def set_version(deployment_id: str, deployments_dir: str, new_version: str):
-    deployments_state = get_deployments_state(deployments_dir)
-    for deployment in deployments_state["deployments"]:
-        if deployment["id"] == deployment_id:
-            deployment["version"] = new_version
-
-    update_deployments_state(deployments_dir, deployments_state)
+    state = get_state(deployments_dir)
+    state.update_deployment(deployment_id, version=new_version)
+    state.compact_deployment(deployment_id)
@@ -2,6 +2,8 @@ import importlib
 
 import click
 
+from cli.utils import write_env_bundle
+
 
 def find_question_by_id(questions, question_id):
     """
@@ -241,7 +243,4 @@ def dump_envs(all_envs, deployment_dir):
     """
     for scope, scope_envs in all_envs.items():
         scope_envs_as_mapping = make_exposed_mapping(scope_envs)
-        env_file_path = f"{deployment_dir}/{scope}"
-        with open(env_file_path, "w") as file:
-            for key, value in scope_envs_as_mapping.items():
-                file.write(f"{key}={value}\n")
+        write_env_bundle(f"{deployment_dir}/{scope}", scope_envs_as_mapping)
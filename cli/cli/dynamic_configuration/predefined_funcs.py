@@ -1,7 +1,8 @@
 import re
 from typing import Any, Tuple
 
-from cli.utils import run_script
+from cli.kubernetes import kubectl_get
+from cli.utils import read_env_bundle, stream_script
 
 
 def regex(deployment_dir, pattern, text) -> bool:
@@ -30,7 +31,8 @@ def lowercase(deployment_dir, val) -> str:
 
 def kubectlget(deployment_dir, *args) -> Tuple[bool, str]:
     """
-    Placeholder function to execute a kubectl get command.
+    Placeholder function to execute a kubectl get command. Queries are answered in-process
+    over the deployment's pooled API connection where possible, and by kubectl otherwise.
 
     :param deployment_dir: The deployment_dir for a specific deployment that holds.
     :param args: The arguments for the kubectl get command.
@@ -39,8 +41,14 @@ def kubectlget(deployment_dir, *args) -> Tuple[bool, str]:
     length = len(args)
     args_with_spaces = [f"{arg}{'' if i == length - 1 else ' '}" for i, arg in enumerate(args)]
     params = concatenate(deployment_dir, *args_with_spaces)
+    kubeconfig = read_env_bundle(f"{deployment_dir}/.env").get("KUBECONFIG")
+    if kubeconfig:
+        output = kubectl_get(kubeconfig, params)
+        if output is not None:
+            return output
+
     scripts_dir, _, _ = deployment_dir.rsplit("/", 2)
-    result = run_script(scripts_dir, deployment_dir, "kubectlget.sh", capture_output=True, **{"PARAMS": params})
+    result = stream_script(scripts_dir, deployment_dir, "kubectlget.sh", collect_output=True, **{"PARAMS": params})
     if result.exitcode != 0:
         return ""
     return result.output
@@ -0,0 +1,417 @@
+"""
+Talks to the Kubernetes API of a deployment in-process, over one keep-alive connection pool
+per kubeconfig, instead of starting `kubectl` for every query.
+
+Kubeconfigs the client can't use on its own, e.g. with exec or auth-provider credentials,
+raise KubernetesUnavailable, and so does an unreachable API server: callers then fall back
+to `kubectl`.
+"""
+
+import atexit
+import base64
+import json
+import os
+import re
+import shlex
+import shutil
+import tempfile
+import threading
+import warnings
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+import yaml
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+# how long the server keeps a watch open without events, besides READ_TIMEOUT
+WATCH_TIMEOUT = 60
+
+# api prefix, plural and whether the resource lives in a namespace
+Resource = namedtuple("Resource", ["api", "plural", "namespaced"])
+
+RESOURCES = {
+    "pods": Resource("/api/v1", "pods", True),
+    "secrets": Resource("/api/v1", "secrets", True),
+    "services": Resource("/api/v1", "services", True),
+    "serviceaccounts": Resource("/api/v1", "serviceaccounts", True),
+    "namespaces": Resource("/api/v1", "namespaces", False),
+    "nodes": Resource("/api/v1", "nodes", False),
+    "persistentvolumes": Resource("/api/v1", "persistentvolumes", False),
+    "storageclasses": Resource("/apis/storage.k8s.io/v1", "storageclasses", False),
+    "ingresses": Resource("/apis/networking.k8s.io/v1", "ingresses", True),
+    "ingressclasses": Resource("/apis/networking.k8s.io/v1", "ingressclasses", False),
+    "customresourcedefinitions": Resource("/apis/apiextensions.k8s.io/v1", "customresourcedefinitions", False),
+    "rayclusters": Resource("/apis/ray.io/v1", "rayclusters", True),
+}
+
+RESOURCE_ALIASES = {
+    "pod": "pods",
+    "po": "pods",
+    "secret": "secrets",
+    "service": "services",
+    "svc": "services",
+    "serviceaccount": "serviceaccounts",
+    "sa": "serviceaccounts",
+    "namespace": "namespaces",
+    "ns": "namespaces",
+    "node": "nodes",
+    "no": "nodes",
+    "persistentvolume": "persistentvolumes",
+    "pv": "persistentvolumes",
+    "storageclass": "storageclasses",
+    "sc": "storageclasses",
+    "ingress": "ingresses",
+    "ing": "ingresses",
+    "ingressclass": "ingressclasses",
+    "customresourcedefinition": "customresourcedefinitions",
+    "crd": "customresourcedefinitions",
+    "crds": "customresourcedefinitions",
+    "raycluster": "rayclusters",
+}
+
+# a `kubectl get` as the question schemas write it, see parse_get_params
+GetQuery = namedtuple("GetQuery", ["resource", "name", "namespace", "label_selector", "output", "path"])
+
+# .items[].spec.storageClassName, .items[*].metadata.name or .items[0].metadata.name
+PATH_SEGMENT = re.compile(r"\.([A-Za-z0-9_-]+)|\[(\*?|\d+)\]")
+
+
+class KubernetesUnavailable(Exception):
+    pass
+
+
+class WatchUnavailable(Exception):
+    pass
+
+
+def get_resource(kind: str) -> Optional[Resource]:
+    kind = kind.lower()
+    return RESOURCES.get(RESOURCE_ALIASES.get(kind, kind))
+
+
+class KubeClient:
+    """
+    A client for the current context of a kubeconfig. Credentials given as data are written
+    to a private directory for the lifetime of the client, since TLS needs them as files.
+    """
+
+    def __init__(self, kubeconfig_path: str):
+        try:
+            with open(kubeconfig_path, "r") as file:
+                config = yaml.safe_load(file) or {}
+        except (OSError, yaml.YAMLError) as exc:
+            raise KubernetesUnavailable(f"The kubeconfig {kubeconfig_path} can't be read") from exc
+        if not isinstance(config, dict):
+            raise KubernetesUnavailable(f"The kubeconfig {kubeconfig_path} isn't valid")
+
+        context_name = config.get("current-context")
+        context = get_named(config.get("contexts"), context_name, "context")
+        cluster = get_named(config.get("clusters"), context.get("cluster"), "cluster")
+        user = get_named(config.get("users"), context.get("user"), "user") if context.get("user") else {}
+        if "exec" in user or "auth-provider" in user:
+            raise KubernetesUnavailable(f"The credentials of context {context_name} need kubectl")
+        if not cluster.get("server"):
+            raise KubernetesUnavailable(f"Context {context_name} has no server")
+
+        self.server = cluster["server"].rstrip("/")
+        self.namespace = context.get("namespace", "default")
+        self._files_dir = tempfile.mkdtemp(prefix="syntho-kube-")
+        base_dir = os.path.dirname(os.path.abspath(kubeconfig_path))
+
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/json"
+        if cluster.get("insecure-skip-tls-verify"):
+            # kubectl doesn't warn on every request either, requests to other hosts still warn
+            host = urlparse(self.server).hostname or ""
+            warnings.filterwarnings(
+                "ignore",
+                message=f"Unverified HTTPS request is being made to host '{re.escape(host)}'",
+                category=urllib3.exceptions.InsecureRequestWarning,
+            )
+            self.session.verify = False
+        else:
+            ca_path = self._get_file(cluster, "certificate-authority", base_dir)
+            if ca_path:
+                self.session.verify = ca_path
+
+        cert_path = self._get_file(user, "client-certificate", base_dir)
+        key_path = self._get_file(user, "client-key", base_dir)
+        if cert_path and key_path:
+            self.session.cert = (cert_path, key_path)
+
+        token = user.get("token")
+        if not token and user.get("tokenFile"):
+            with open(os.path.join(base_dir, user["tokenFile"]), "r") as file:
+                token = file.read().strip()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        elif user.get("username"):
+            self.session.auth = (user["username"], user.get("password", ""))
+
+    def _get_file(self, section: Dict, key: str, base_dir: str) -> Optional[str]:
+        if section.get(f"{key}-data"):
+            path = os.path.join(self._files_dir, key)
+            with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), "wb") as file:
+                file.write(base64.b64decode(section[f"{key}-data"]))
+            return path
+        if section.get(key):
+            return os.path.join(base_dir, section[key])
+        return None
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        try:
+            return self.session.request(
+                method, f"{self.server}{path}", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs
+            )
+        except requests.RequestException as exc:
+            raise KubernetesUnavailable(f"The API server {self.server} can't be reached: {exc}") from exc
+
+    def get_path(self, kind: str, name: Optional[str] = None, namespace: Optional[str] = None) -> str:
+        resource = get_resource(kind)
+        if not resource:
+            raise KubernetesUnavailable(f"Unknown resource type: {kind}")
+
+        path = resource.api
+        if resource.namespaced:
+            path += f"/namespaces/{namespace or self.namespace}"
+        path += f"/{resource.plural}"
+        if name:
+            path += f"/{name}"
+        return path
+
+    def get(
+        self,
+        kind: str,
+        name: Optional[str] = None,
+        namespace: Optional[str] = None,
+        label_selector: Optional[str] = None,
+    ) -> Optional[Dict]:
+        """A resource, or a list of them without 'name'. None when it isn't there."""
+        params = {"labelSelector": label_selector} if label_selector and not name else None
+        response = self.request("GET", self.get_path(kind, name, namespace), params=params)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def delete(self, kind: str, name: str, namespace: Optional[str] = None) -> bool:
+        """Deletes a resource without waiting for it to be gone, returns whether it was there"""
+        response = self.request("DELETE", self.get_path(kind, name, namespace), params={"gracePeriodSeconds": "0"})
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def watch(
+        self,
+        kind: str,
+        namespace: Optional[str] = None,
+        resource_version: Optional[str] = None,
+        timeout: float = WATCH_TIMEOUT,
+    ) -> Iterator[Dict]:
+        """
+        Yields the events of a resource type after 'resource_version', until the server ends
+        the watch after 'timeout' seconds. Raises WatchUnavailable when watches are refused.
+        """
+        params = {"watch": "1", "timeoutSeconds": str(max(int(timeout), 1))}
+        if resource_version:
+            params["resourceVersion"] = resource_version
+
+        try:
+            response = self.session.get(
+                f"{self.server}{self.get_path(kind, namespace=namespace)}",
+                params=params,
+                stream=True,
+                timeout=(CONNECT_TIMEOUT, timeout + READ_TIMEOUT),
+            )
+        except requests.RequestException as exc:
+            raise KubernetesUnavailable(f"The API server {self.server} can't be reached: {exc}") from exc
+
+        with response:
+            if response.status_code != 200:
+                raise WatchUnavailable(f"Watching {kind} has been refused with status {response.status_code}")
+            try:
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
+            except (requests.RequestException, ValueError):
+                # a watch that broke off ends like one the server closed
+                return
+
+    def close(self):
+        self.session.close()
+        shutil.rmtree(self._files_dir, ignore_errors=True)
+
+
+def get_named(items: Optional[List[Dict]], name: Optional[str], section: str) -> Dict:
+    for item in items or []:
+        if item.get("name") == name:
+            return item.get(section) or {}
+    raise KubernetesUnavailable(f"The kubeconfig has no {section} named {name}")
+
+
+# realpath of the kubeconfig -> its mtime and its client
+_clients: Dict[str, Tuple[int, KubeClient]] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(kubeconfig_path: str) -> KubeClient:
+    """The pooled client of a kubeconfig, which is replaced when the kubeconfig changed"""
+    try:
+        path = os.path.realpath(kubeconfig_path)
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as exc:
+        raise KubernetesUnavailable(f"The kubeconfig {kubeconfig_path} can't be read") from exc
+
+    with _clients_lock:
+        if path in _clients:
+            pooled_mtime, client = _clients[path]
+            if pooled_mtime == mtime:
+                return client
+            # its session and the credentials it wrote out go along with it
+            del _clients[path]
+            client.close()
+        client = KubeClient(kubeconfig_path)
+        _clients[path] = (mtime, client)
+        return client
+
+
+@atexit.register
+def close_clients():
+    with _clients_lock:
+        for _, client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def select_path(obj, path: str) -> Optional[List]:
+    """The values at a simple jq or jsonpath path, None for paths it doesn't understand"""
+    values = [obj]
+    position = 0
+    for match in PATH_SEGMENT.finditer(path):
+        if match.start() != position:
+            return None
+        position = match.end()
+
+        key, index = match.groups()
+        selected = []
+        for value in values:
+            if key is not None and isinstance(value, dict):
+                selected.append(value.get(key))
+            elif index in ("", "*") and isinstance(value, list):
+                selected.extend(value)
+            elif index and index.isdigit() and isinstance(value, list) and int(index) < len(value):
+                selected.append(value[int(index)])
+        values = selected
+
+    return values if position == len(path) else None
+
+
+def parse_get_params(params: str) -> Optional[GetQuery]:
+    """
+    Parses the arguments of a `kubectl get`, e.g. `pv -l key=value -o json | jq -r '.items[].spec.x'`
+    or `storageclass name -o jsonpath="{.items[*].metadata.name}"`. None for anything else.
+    """
+    try:
+        tokens = shlex.split(params)
+    except ValueError:
+        return None
+
+    path = None
+    if "|" in tokens:
+        pipe = tokens.index("|")
+        jq = tokens[pipe + 1 :]
+        tokens = tokens[:pipe]
+        if len(jq) != 3 or jq[:2] != ["jq", "-r"]:
+            return None
+        path = jq[2]
+
+    if tokens and tokens[0] == "get":
+        tokens = tokens[1:]
+    if not tokens or not get_resource(tokens[0]):
+        return None
+
+    resource, name, namespace, label_selector, output = tokens[0], None, None, None, None
+    rest = tokens[1:]
+    while rest:
+        token = rest.pop(0)
+        if token in ("-l", "--selector", "-n", "--namespace", "-o", "--output") and rest:
+            value = rest.pop(0)
+        elif "=" in token and token.split("=", 1)[0] in ("--selector", "--namespace", "--output"):
+            token, value = token.split("=", 1)
+        elif not token.startswith("-") and name is None:
+            name = token
+            continue
+        else:
+            return None
+
+        if token in ("-l", "--selector"):
+            label_selector = value
+        elif token in ("-n", "--namespace"):
+            namespace = value
+        else:
+            output = value
+
+    if output and output.startswith("jsonpath="):
+        if path:
+            return None
+        path = output[len("jsonpath=") :]
+        if not (path.startswith("{") and path.endswith("}")):
+            return None
+        path, output = path[1:-1], "jsonpath"
+    elif path and output != "json":
+        return None
+    elif output not in (None, "json", "name"):
+        return None
+
+    return GetQuery(resource, name, namespace, label_selector, output, path)
+
+
+def format_query_output(query: GetQuery, obj: Optional[Dict]) -> Optional[str]:
+    """What kubectl would print for the query, apart from its tables which are reduced to the names"""
+    if obj is None:
+        # kubectl prints nothing to stdout for missing resources
+        return ""
+
+    if query.path:
+        values = select_path(obj, query.path)
+        if values is None:
+            return None
+        if query.output == "jsonpath":
+            return " ".join(format_value(value) for value in values if value is not None)
+        return "\n".join("null" if value is None else format_value(value) for value in values)
+
+    if query.output == "json":
+        return json.dumps(obj, indent=4)
+
+    items = obj.get("items", []) if query.name is None else [obj]
+    return "\n".join(item.get("metadata", {}).get("name", "") for item in items)
+
+
+def format_value(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def kubectl_get(kubeconfig_path: str, params: str) -> Optional[str]:
+    """
+    Runs `kubectl get <params>` in-process. None when it has to be left to kubectl: the
+    query isn't understood or the API can't be used with this kubeconfig.
+    """
+    query = parse_get_params(params)
+    if query is None:
+        return None
+
+    try:
+        client = get_client(kubeconfig_path)
+        obj = client.get(query.resource, query.name, query.namespace, query.label_selector)
+    except KubernetesUnavailable:
+        return None
+    except requests.HTTPError:
+        # like kubectl failing on e.g. missing permissions
+        return ""
+
+    return format_query_output(query, obj)
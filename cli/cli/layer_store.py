@@ -0,0 +1,336 @@
+"""
+A local content-addressed store of image blobs, shared by the offline bundles of every
+version, and the offline bundle format that references those blobs by digest.
+
+An offline bundle holds 'bundle.json' and 'blobs/sha256/<hex>': every blob once, however
+many images and repositories use it. 'bundle.json' lists the tags, manifests and layers of
+every repository, which is all that's needed to rebuild the storage of a `registry:2`:
+
+    python -m cli.layer_store restore --bundle-dir <dir> --registry-dir <dir>
+
+fills '<registry-dir>' the way `/var/lib/registry` of a `registry:2` is filled. A delta bundle
+has the 'base_version' it was made on top of and only the blobs that version's bundle didn't
+have, so it's restored onto the storage of that version.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Callable, Dict, List, NoReturn, Optional, Set
+
+BUNDLE_MANIFEST = "bundle.json"
+BUNDLE_FORMAT = 1
+CHUNK_SIZE = 1024 * 1024
+
+INDEX_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+)
+
+
+def get_blob_relpath(digest: str) -> str:
+    algorithm, _, hex_digest = digest.partition(":")
+    return os.path.join("blobs", algorithm, hex_digest)
+
+
+def get_registry_blob_path(registry_dir: str, digest: str) -> str:
+    algorithm, _, hex_digest = digest.partition(":")
+    return os.path.join(
+        registry_dir, "docker", "registry", "v2", "blobs", algorithm, hex_digest[:2], hex_digest, "data"
+    )
+
+
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return f"sha256:{sha256.hexdigest()}"
+
+
+def link_or_copy(source: str, destination: str) -> NoReturn:
+    """Hard links 'source' to 'destination', copies it when they are on different file systems"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.exists(destination):
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".blob.")
+        os.close(fd)
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+
+
+class LayerStore:
+    """Blobs by digest under 'root', each stored once whatever bundle they came with"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def get_path(self, digest: str) -> str:
+        return os.path.join(self.root, get_blob_relpath(digest))
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(self.get_path(digest))
+
+    def add_file(self, digest: str, path: str) -> bool:
+        """Stores the file as 'digest' after checking its content, returns whether it was new"""
+        if self.has_blob(digest):
+            return False
+        if hash_file(path) != digest:
+            raise ValueError(f"{path} doesn't hold {digest}")
+        link_or_copy(path, self.get_path(digest))
+        return True
+
+    def read_json(self, digest: str) -> Dict:
+        with open(self.get_path(digest), "rb") as file:
+            return json.load(file)
+
+    def get_record_path(self, version: str, arch: str) -> str:
+        return os.path.join(self.root, "bundles", f"{version}-{arch}.json")
+
+    def record_bundle(self, bundle: Dict) -> NoReturn:
+        """Keeps the manifest of a bundle that was made, to make deltas on top of it later"""
+        path = self.get_record_path(bundle["version"], bundle["arch"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(bundle, file, indent=2, sort_keys=True)
+
+    def get_recorded_bundle(self, version: str, arch: str) -> Optional[Dict]:
+        path = self.get_record_path(version, arch)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as file:
+            return json.load(file)
+
+
+def read_link(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return file.read().strip()
+
+
+def get_repositories(registry_dir: str) -> List[str]:
+    """The repositories of the storage of a registry:2, nested ones like `syntho/core` included"""
+    repositories_dir = os.path.join(registry_dir, "docker", "registry", "v2", "repositories")
+    repositories = []
+    for path, dirs, _ in os.walk(repositories_dir):
+        if "_manifests" in dirs:
+            repositories.append(os.path.relpath(path, repositories_dir))
+        dirs[:] = [name for name in dirs if not name.startswith("_")]
+    return sorted(repositories)
+
+
+def get_registry_tags(registry_dir: str) -> Dict[str, Dict[str, str]]:
+    """The manifest digest of every tag of the storage of a registry:2, by repository"""
+    tags = {}
+    for repository in get_repositories(registry_dir):
+        tags_dir = os.path.join(
+            registry_dir, "docker", "registry", "v2", "repositories", repository, "_manifests", "tags"
+        )
+        for tag in os.listdir(tags_dir) if os.path.isdir(tags_dir) else []:
+            digest = read_link(os.path.join(tags_dir, tag, "current", "link"))
+            if digest:
+                tags.setdefault(repository, {})[tag] = digest
+    return tags
+
+
+def read_manifest_blobs(store: LayerStore, digest: str, ensure_blob: Callable[[str], bool]) -> Dict[str, List[str]]:
+    """
+    The manifests, 'digest' and those of its platforms, and the config and layer blobs it uses.
+    'ensure_blob' makes sure a blob is in the store and returns whether the registry has it.
+    """
+    if not ensure_blob(digest):
+        raise ValueError(f"The manifest {digest} is missing")
+    manifest = store.read_json(digest)
+    blobs = {"manifests": [digest], "layers": []}
+
+    if manifest.get("mediaType") in INDEX_TYPES or "manifests" in manifest:
+        for entry in manifest.get("manifests", []):
+            # registries only hold the platforms that were pushed
+            if ensure_blob(entry["digest"]):
+                child = read_manifest_blobs(store, entry["digest"], ensure_blob)
+                blobs["manifests"] += child["manifests"]
+                blobs["layers"] += child["layers"]
+        return blobs
+
+    layers = [manifest["config"], *manifest.get("layers", [])] if "config" in manifest else []
+    for layer in layers:
+        if not ensure_blob(layer["digest"]):
+            raise ValueError(f"The blob {layer['digest']} of the manifest {digest} is missing")
+        blobs["layers"].append(layer["digest"])
+    return blobs
+
+
+def get_repository_contents(
+    store: LayerStore, tags: Dict[str, Dict[str, str]], ensure_blob: Callable[[str], bool]
+) -> Dict[str, Dict]:
+    """The repositories as bundle.json lists them, from their tags"""
+    repositories = {}
+    for repository in sorted(tags):
+        content = {"tags": {}, "manifests": [], "layers": []}
+        for tag, digest in sorted(tags[repository].items()):
+            content["tags"][tag] = digest
+            blobs = read_manifest_blobs(store, digest, ensure_blob)
+            for kind in ("manifests", "layers"):
+                content[kind] += [blob for blob in blobs[kind] if blob not in content[kind]]
+        repositories[repository] = content
+    return repositories
+
+
+def ingest_registry(registry_dir: str, store: LayerStore) -> Dict[str, Dict]:
+    """
+    Adds every image of the storage of a registry:2 to the store, and returns its
+    repositories as bundle.json lists them
+    """
+
+    def ensure_blob(digest):
+        path = get_registry_blob_path(registry_dir, digest)
+        if not os.path.exists(path):
+            return False
+        store.add_file(digest, path)
+        return True
+
+    return get_repository_contents(store, get_registry_tags(registry_dir), ensure_blob)
+
+
+def get_bundle_blobs(repositories: Dict[str, Dict]) -> Set[str]:
+    return {blob for repository in repositories.values() for blob in repository["manifests"] + repository["layers"]}
+
+
+def make_bundle_manifest(version: str, arch: str, repositories: Dict[str, Dict], blobs: Dict[str, int]) -> Dict:
+    return {
+        "format": BUNDLE_FORMAT,
+        "version": version,
+        "arch": arch,
+        "base_version": None,
+        "repositories": repositories,
+        "blobs": blobs,
+    }
+
+
+def write_bundle(
+    bundle_dir: str,
+    store: LayerStore,
+    repositories: Dict[str, Dict],
+    version: str,
+    arch: str,
+) -> Dict:
+    """
+    Links the blobs of the repositories from the store into 'bundle_dir/blobs' and writes
+    bundle.json next to them. Returns the bundle manifest.
+    """
+    blobs = {}
+    for digest in sorted(get_bundle_blobs(repositories)):
+        link_or_copy(store.get_path(digest), os.path.join(bundle_dir, get_blob_relpath(digest)))
+        blobs[digest] = os.path.getsize(store.get_path(digest))
+
+    bundle = make_bundle_manifest(version, arch, repositories, blobs)
+    with open(os.path.join(bundle_dir, BUNDLE_MANIFEST), "w") as file:
+        json.dump(bundle, file, indent=2, sort_keys=True)
+    return bundle
+
+
+def make_delta_bundle(bundle: Dict, base_bundle: Dict) -> Dict:
+    """The manifest of a delta with the blobs of 'bundle' that 'base_bundle' doesn't have"""
+    if bundle["arch"] != base_bundle["arch"]:
+        raise ValueError(f"The bundle of {base_bundle['version']} is for {base_bundle['arch']}, not {bundle['arch']}")
+    base_blobs = get_bundle_blobs(base_bundle["repositories"])
+    return {
+        **bundle,
+        "base_version": base_bundle["version"],
+        "blobs": {digest: size for digest, size in bundle["blobs"].items() if digest not in base_blobs},
+    }
+
+
+def apply_delta_bundle(base_bundle: Dict, delta: Dict) -> Dict:
+    """The manifest of the full bundle that a delta makes of its base, with the blobs it still uses"""
+    if delta.get("base_version") != base_bundle["version"] or delta["arch"] != base_bundle["arch"]:
+        raise ValueError(
+            f"The delta needs the bundle of {delta.get('base_version')} ({delta['arch']}), "
+            f"not of {base_bundle['version']} ({base_bundle['arch']})"
+        )
+    blobs = {**base_bundle["blobs"], **delta["blobs"]}
+    used_blobs = get_bundle_blobs(delta["repositories"])
+    missing = used_blobs - blobs.keys()
+    if missing:
+        raise ValueError(f"{len(missing)} blobs are in neither the delta nor its base, e.g. {sorted(missing)[0]}")
+    return {**delta, "base_version": None, "blobs": {digest: blobs[digest] for digest in sorted(used_blobs)}}
+
+
+def read_bundle(bundle_dir: str) -> Optional[Dict]:
+    path = os.path.join(bundle_dir, BUNDLE_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def write_link(path: str, digest: str) -> NoReturn:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(digest)
+
+
+def restore_registry(bundle_dir: str, registry_dir: str) -> Dict:
+    """Fills the storage of a registry:2 from a bundle, returns the bundle manifest"""
+    bundle = read_bundle(bundle_dir)
+    if bundle is None:
+        raise FileNotFoundError(f"There is no {BUNDLE_MANIFEST} in {bundle_dir}")
+
+    for digest in bundle["blobs"]:
+        link_or_copy(os.path.join(bundle_dir, get_blob_relpath(digest)), get_registry_blob_path(registry_dir, digest))
+    # a delta brings what's new only
+    missing = [
+        digest
+        for digest in sorted(get_bundle_blobs(bundle["repositories"]))
+        if not os.path.exists(get_registry_blob_path(registry_dir, digest))
+    ]
+    if missing:
+        raise ValueError(
+            f"{len(missing)} blobs are missing, e.g. {missing[0]}, restore the bundle of "
+            f"{bundle.get('base_version')} into {registry_dir} first"
+        )
+
+    for repository, content in bundle["repositories"].items():
+        repository_dir = os.path.join(registry_dir, "docker", "registry", "v2", "repositories", repository)
+        for digest in content["layers"]:
+            algorithm, _, hex_digest = digest.partition(":")
+            write_link(os.path.join(repository_dir, "_layers", algorithm, hex_digest, "link"), digest)
+        for digest in content["manifests"]:
+            algorithm, _, hex_digest = digest.partition(":")
+            write_link(os.path.join(repository_dir, "_manifests", "revisions", algorithm, hex_digest, "link"), digest)
+        for tag, digest in content["tags"].items():
+            algorithm, _, hex_digest = digest.partition(":")
+            tag_dir = os.path.join(repository_dir, "_manifests", "tags", tag)
+            write_link(os.path.join(tag_dir, "current", "link"), digest)
+            write_link(os.path.join(tag_dir, "index", algorithm, hex_digest, "link"), digest)
+    return bundle
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Restores the storage of a registry:2 from an offline bundle")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    restore = subparsers.add_parser("restore")
+    restore.add_argument("--bundle-dir", required=True)
+    restore.add_argument("--registry-dir", required=True)
+    args = parser.parse_args(argv)
+
+    try:
+        bundle = restore_registry(args.bundle_dir, args.registry_dir)
+    except (OSError, ValueError) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    print(f"restored {len(bundle['repositories'])} repositories and {len(bundle['blobs'])} blobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
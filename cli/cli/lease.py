@@ -0,0 +1,179 @@
+import fcntl
+import json
+import os
+import socket
+import threading
+from datetime import datetime
+from typing import Dict, NoReturn, Optional
+
+LEASE_FILE = ".lock"
+HEARTBEAT_INTERVAL = 10
+# leases held from another host can't be probed with flock, they count as alive
+# until their heartbeat is older than this
+LEASE_TTL = 60
+
+# file_dir -> Lease held by this process
+_HELD_LEASES = {}
+
+
+class Lease:
+    """
+    Exclusive lease on a job directory, e.g. a utility run.
+
+    The lease file holds the owner's PID, host, start time and last heartbeat, and
+    stays flock'ed by the owner for as long as the job runs. The kernel drops the
+    flock when the owner dies, so a crashed run never blocks the next one.
+    """
+
+    def __init__(self, file_dir: str):
+        self.file_dir = file_dir
+        self.path = lease_path(file_dir)
+        self.info = None
+        self._file = None
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread = None
+
+    def try_acquire(self) -> bool:
+        if not os.path.exists(self.file_dir):
+            os.makedirs(self.file_dir, exist_ok=True)
+
+        while True:
+            file = open(self.path, "a+")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                return False
+
+            # the previous owner may have unlinked the file right before we locked it
+            try:
+                same_file = os.fstat(file.fileno()).st_ino == os.stat(self.path).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if not same_file:
+                file.close()
+                continue
+
+            previous = _parse_lease(file)
+            if previous and previous.get("host") != socket.gethostname() and _is_fresh(previous):
+                file.close()
+                return False
+
+            break
+
+        now = datetime.utcnow().isoformat()
+        self.info = {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "started_at": now,
+            "heartbeat": now,
+        }
+        self._file = file
+        self._write()
+
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._heartbeat_thread.start()
+        return True
+
+    def _write(self) -> NoReturn:
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(json.dumps(self.info))
+        self._file.flush()
+
+    def _heartbeat(self) -> NoReturn:
+        while not self._stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+            self.info["heartbeat"] = datetime.utcnow().isoformat()
+            try:
+                self._write()
+            except (OSError, ValueError):
+                return
+
+    def release(self) -> NoReturn:
+        self._stop_heartbeat.set()
+        if self._heartbeat_thread:
+            self._heartbeat_thread.join()
+
+        if self._file:
+            # unlinked while still locked, so nobody can lock the old file after us
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def lease_path(file_dir: str) -> str:
+    return f"{file_dir}/{LEASE_FILE}"
+
+
+def _parse_lease(file) -> Optional[Dict]:
+    file.seek(0)
+    try:
+        return json.loads(file.read() or "null")
+    except ValueError:
+        # an empty lock file of an older CLI version
+        return None
+
+
+def _is_fresh(info: Dict) -> bool:
+    try:
+        heartbeat = datetime.fromisoformat(info["heartbeat"])
+    except (KeyError, TypeError, ValueError):
+        return False
+
+    return (datetime.utcnow() - heartbeat).total_seconds() < LEASE_TTL
+
+
+def acquire_lease(file_dir: str) -> bool:
+    """Takes the lease of file_dir for this process, returns False if it's held by a live owner."""
+    if file_dir in _HELD_LEASES:
+        return True
+
+    lease = Lease(file_dir)
+    if not lease.try_acquire():
+        return False
+
+    _HELD_LEASES[file_dir] = lease
+    return True
+
+
+def release_lease(file_dir: str) -> NoReturn:
+    lease = _HELD_LEASES.pop(file_dir, None)
+    if lease:
+        lease.release()
+
+
+def is_lease_alive(file_dir: str) -> bool:
+    """
+    Constant-time liveness check: one open and one non-blocking flock. A lease whose
+    owner is gone is reported as free and gets reclaimed by the next acquire.
+    """
+    try:
+        file = open(lease_path(file_dir), "r")
+    except FileNotFoundError:
+        return False
+
+    with file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+
+        try:
+            info = _parse_lease(file)
+            return bool(info) and info.get("host") != socket.gethostname() and _is_fresh(info)
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def get_lease_info(file_dir: str) -> Optional[Dict]:
+    """PID, host, start time and heartbeat of the lease owner, if the lease is alive."""
+    if not is_lease_alive(file_dir):
+        return None
+
+    try:
+        with open(lease_path(file_dir), "r") as file:
+            return _parse_lease(file)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,238 @@
+"""
+Writes the offline archive of activate-offline-mode in a single pass. The storage of the
+offline registry is read as the tar stream `docker cp` writes, and every blob goes straight
+into the archive by digest, and into the layer store when it doesn't have it yet. The
+registry image `docker save` writes follows, and bundle.json comes last, once every blob has
+been seen. Nothing is unpacked on disk in between: the only scratch space is the registry
+image when it's too large to be held in memory, as tar needs the size of a member upfront.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import subprocess
+import tarfile
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import IO, Callable, Dict, NoReturn
+
+from cli.compression import DEFAULT_COMPRESSION, open_tar_writer
+from cli.layer_store import (
+    BUNDLE_MANIFEST,
+    LayerStore,
+    get_blob_relpath,
+    get_bundle_blobs,
+    get_repository_contents,
+    make_bundle_manifest,
+)
+
+REGISTRY_CONTAINER = "syntho-offline-registry"
+REGISTRY_IMAGE = "syntho-offline-registry:latest"
+REGISTRY_IMAGE_MEMBER = "syntho-offline-registry.tar"
+REGISTRY_STORAGE = "/var/lib/registry"
+
+CHUNK_SIZE = 1024 * 1024
+# the registry image is held in memory up to this size, it's spooled to the scratch dir above it
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# `docker cp` names the members after the copied dir, e.g. registry/docker/registry/v2/...
+BLOB_DATA = re.compile(r"(?:^|/)docker/registry/v2/blobs/(?P<algorithm>[^/]+)/[^/]{2}/(?P<hex>[^/]+)/data$")
+TAG_LINK = re.compile(
+    r"(?:^|/)docker/registry/v2/repositories/(?P<repository>.+)/_manifests/tags/(?P<tag>[^/]+)/current/link$"
+)
+
+ArchiveResult = namedtuple("ArchiveResult", ["bundle", "archived_bytes", "stored_blobs", "peak_scratch_bytes"])
+
+
+class ScratchUsage:
+    """The scratch disk space in use, and the most that was in use at once"""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+
+    def add(self, size: int) -> NoReturn:
+        self.current += size
+        self.peak = max(self.peak, self.current)
+
+    def remove(self, size: int) -> NoReturn:
+        self.current -= size
+
+
+class BlobReader:
+    """
+    Reads a blob of the registry stream for the archive, hashing it on the way, and copies
+    it into the layer store when the store doesn't have it
+    """
+
+    def __init__(self, fileobj: IO, digest: str, store: LayerStore, on_read: Callable[[int], NoReturn] = None):
+        self.fileobj = fileobj
+        self.digest = digest
+        self.store = store
+        self.on_read = on_read
+        self._sha256 = hashlib.sha256()
+        self._store_file = None
+        if not store.has_blob(digest):
+            os.makedirs(store.root, exist_ok=True)
+            self._store_file = tempfile.NamedTemporaryFile(dir=store.root, prefix=".blob.", delete=False)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self._sha256.update(data)
+        if self._store_file:
+            self._store_file.write(data)
+        if self.on_read:
+            self.on_read(len(data))
+        return data
+
+    def close(self) -> bool:
+        """Checks what was read against the digest, returns whether it was added to the store"""
+        try:
+            if f"sha256:{self._sha256.hexdigest()}" != self.digest:
+                raise ValueError(f"The registry's {self.digest} doesn't hold what its digest says")
+            if not self._store_file:
+                return False
+            self._store_file.close()
+            os.makedirs(os.path.dirname(self.store.get_path(self.digest)), exist_ok=True)
+            os.replace(self._store_file.name, self.store.get_path(self.digest))
+            self._store_file = None
+            return True
+        finally:
+            self.discard()
+
+    def discard(self) -> NoReturn:
+        """Removes what was copied for the store, without checking it, when the blob wasn't read whole"""
+        if self._store_file:
+            self._store_file.close()
+            os.remove(self._store_file.name)
+            self._store_file = None
+
+
+def make_tarinfo(name: str, size: int) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    return info
+
+
+def add_json(tar, name: str, content: Dict) -> NoReturn:
+    data = json.dumps(content, indent=2, sort_keys=True).encode()
+    info = make_tarinfo(name, len(data))
+    tar.addfile(info, io.BytesIO(data))
+
+
+def add_registry(tar, registry_stream: IO, store: LayerStore, on_read: Callable[[int], NoReturn] = None):
+    """
+    Adds the blobs of the registry storage in 'registry_stream' to the archive, returns the
+    tags of its repositories, the size of every blob, and how many blobs were new to the store
+    """
+    tags, blobs, stored_blobs = {}, {}, 0
+    with tarfile.open(fileobj=registry_stream, mode="r|") as registry:
+        for member in registry:
+            if not member.isfile():
+                continue
+            blob, tag = BLOB_DATA.search(member.name), TAG_LINK.search(member.name)
+            if blob:
+                digest = f"{blob['algorithm']}:{blob['hex']}"
+                reader = BlobReader(registry.extractfile(member), digest, store, on_read)
+                info = make_tarinfo(f"./{get_blob_relpath(digest)}", member.size)
+                info.mtime = member.mtime
+                try:
+                    tar.addfile(info, reader)
+                except BaseException:
+                    # the error of the archive or of the stream is reported, not the digest of a partial blob
+                    reader.discard()
+                    raise
+                stored_blobs += reader.close()
+                blobs[digest] = member.size
+            elif tag:
+                digest = registry.extractfile(member).read().decode().strip()
+                tags.setdefault(tag["repository"], {})[tag["tag"]] = digest
+    # the end of the stream is read too, or `docker cp` fails writing it
+    while registry_stream.read(CHUNK_SIZE):
+        pass
+    return tags, blobs, stored_blobs
+
+
+def add_spooled(tar, name: str, stream: IO, scratch: ScratchUsage, scratch_dir: str = None) -> int:
+    """Adds what 'stream' holds as a member, held in memory or spooled to the scratch dir"""
+    file, spooled = io.BytesIO(), 0
+    try:
+        while chunk := stream.read(CHUNK_SIZE):
+            if not spooled and file.tell() + len(chunk) > SPOOL_SIZE:
+                buffer, file = file, tempfile.TemporaryFile(dir=scratch_dir)
+                file.write(buffer.getvalue())
+                spooled = buffer.tell()
+                scratch.add(spooled)
+            file.write(chunk)
+            if spooled:
+                spooled += len(chunk)
+                scratch.add(len(chunk))
+        size = file.tell()
+        if not size:
+            raise ValueError(f"There is nothing to archive as {name}")
+        file.seek(0)
+        tar.addfile(make_tarinfo(name, size), file)
+        return size
+    finally:
+        file.close()
+        scratch.remove(spooled)
+
+
+def write_offline_archive(
+    archive_path: str,
+    store: LayerStore,
+    version: str,
+    arch: str,
+    registry_stream: IO,
+    image_stream: IO,
+    compression: str = DEFAULT_COMPRESSION,
+    scratch_dir: str = None,
+    on_read: Callable[[int], NoReturn] = None,
+) -> ArchiveResult:
+    """
+    Writes the offline archive from the tar stream of the registry storage and the saved
+    registry image, each read once. The archive is renamed into place when it's complete.
+    """
+    scratch = ScratchUsage()
+    tmp_path = f"{archive_path}.tmp"
+    try:
+        with open_tar_writer(tmp_path, compression) as tar:
+            tags, blobs, stored_blobs = add_registry(tar, registry_stream, store, on_read)
+            if not tags:
+                raise ValueError("The offline registry has no images")
+            add_spooled(tar, f"./{REGISTRY_IMAGE_MEMBER}", image_stream, scratch, scratch_dir)
+
+            # platforms that weren't pushed aren't in the registry
+            repositories = get_repository_contents(store, tags, lambda digest: digest in blobs)
+            used_blobs = {digest: blobs[digest] for digest in sorted(get_bundle_blobs(repositories))}
+            bundle = make_bundle_manifest(version, arch, repositories, used_blobs)
+            add_json(tar, f"./{BUNDLE_MANIFEST}", bundle)
+        os.replace(tmp_path, archive_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return ArchiveResult(bundle, tar.offset, stored_blobs, scratch.peak)
+
+
+@contextmanager
+def docker_output(*args: str, log: IO = None):
+    """
+    The output of a docker command as a stream. Its failure is raised as CalledProcessError
+    when the stream is done with.
+    """
+    process = subprocess.Popen(["docker", *args], stdout=subprocess.PIPE, stderr=log or subprocess.DEVNULL)
+    try:
+        yield process.stdout
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
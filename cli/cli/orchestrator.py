@@ -0,0 +1,138 @@
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List
+
+MAX_WORKERS = 4
+
+# `run` takes no arguments and returns whether the step succeeded, the result of a step
+# that isn't required is ignored. Console steps draw on the terminal, they run one at a
+# time in the order they're given so the output reads the same as a sequential run.
+# Quiet steps run as soon as their dependencies did.
+Step = namedtuple("Step", ["name", "run", "depends_on", "console", "required"], defaults=((), True, True))
+
+StepTiming = namedtuple(
+    "StepTiming",
+    [
+        "name",
+        "succeeded",
+        "started_at",
+        "finished_at",
+    ],
+)
+
+RunResult = namedtuple(
+    "RunResult",
+    [
+        "succeeded",
+        "failed_step",
+        "timings",
+        "critical_path",
+    ],
+)
+
+
+def get_predecessors(steps: List[Step]) -> Dict[str, List[str]]:
+    """
+    Steps each step waits for: its dependencies and, for console steps, the console step
+    before it. Dependencies on steps that aren't part of the run (e.g. steps that already
+    succeeded before a resume) are satisfied.
+    """
+    names = {step.name for step in steps}
+    if len(names) != len(steps):
+        raise ValueError("Step names must be unique")
+
+    predecessors = {}
+    previous_console_step = None
+    for step in steps:
+        predecessors[step.name] = [name for name in step.depends_on if name in names]
+        if step.console:
+            if previous_console_step and previous_console_step not in predecessors[step.name]:
+                predecessors[step.name].append(previous_console_step)
+            previous_console_step = step.name
+
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Steps have a dependency cycle through {name}")
+        visiting.add(name)
+        for predecessor in predecessors[name]:
+            visit(predecessor)
+        visiting.remove(name)
+        visited.add(name)
+
+    for step in steps:
+        visit(step.name)
+
+    return predecessors
+
+
+def run_step(step: Step) -> StepTiming:
+    started_at = time.monotonic()
+    succeeded = bool(step.run()) or not step.required
+    return StepTiming(name=step.name, succeeded=succeeded, started_at=started_at, finished_at=time.monotonic())
+
+
+def run_steps(steps: List[Step], max_workers: int = MAX_WORKERS) -> RunResult:
+    """
+    Runs steps as a dependency graph on a thread pool, each step as soon as the steps it
+    waits for succeeded. After a failure no new step is started, the running ones are
+    waited for, and the first failed step in the given order is reported.
+    """
+    predecessors = get_predecessors(steps)
+    pending = list(steps)
+    running = {}
+    timings = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            failed = any(not timing.succeeded for timing in timings.values())
+            if not failed:
+                for step in list(pending):
+                    if all(name in timings for name in predecessors[step.name]):
+                        pending.remove(step)
+                        running[executor.submit(run_step, step)] = step
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                timings[step.name] = future.result()
+
+    failed_step = next((step.name for step in steps if step.name in timings and not timings[step.name].succeeded), None)
+    ordered_timings = [timings[step.name] for step in steps if step.name in timings]
+    return RunResult(
+        succeeded=failed_step is None and len(timings) == len(steps),
+        failed_step=failed_step,
+        timings=ordered_timings,
+        critical_path=get_critical_path(predecessors, timings),
+    )
+
+
+def get_critical_path(predecessors: Dict[str, List[str]], timings: Dict[str, StepTiming]) -> List[StepTiming]:
+    """The chain of steps that determined the wall time: walks back from the last step to finish."""
+    if not timings:
+        return []
+
+    path = [max(timings.values(), key=lambda timing: timing.finished_at)]
+    while True:
+        ran_before = [timings[name] for name in predecessors[path[-1].name] if name in timings]
+        if not ran_before:
+            break
+        path.append(max(ran_before, key=lambda timing: timing.finished_at))
+
+    return list(reversed(path))
+
+
+def format_critical_path(critical_path: List[StepTiming]) -> str:
+    if not critical_path:
+        return ""
+
+    total = critical_path[-1].finished_at - critical_path[0].started_at
+    steps = " -> ".join(f"{timing.name} ({timing.finished_at - timing.started_at:.1f}s)" for timing in critical_path)
+    return f"{steps}, {total:.1f}s in total"
@@ -0,0 +1,94 @@
+import sys
+import time
+from enum import Enum
+from typing import Callable, NoReturn, TextIO
+
+SPINNER = "/-\\|"
+# how often the spinner and the elapsed time are redrawn on a terminal
+TICK_INTERVAL = 0.25
+
+NC = "\033[0m"
+CLEARUP = "\033[K"
+
+
+class Badge(Enum):
+    DONE = ("done", "\033[1;37;42m")
+    FAILED = ("failed", "\033[1;37;41m")
+    TIMEOUT = ("timeout", "\033[1;37;48;5;208m")
+
+    @property
+    def label(self) -> str:
+        return self.value[0]
+
+    @property
+    def style(self) -> str:
+        return self.value[1]
+
+
+def format_elapsed(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class StepProgress:
+    """
+    Draws the progress of one step the way `with_loading` always did: a spinner with the
+    elapsed time that turns into a done/failed/timeout badge, tab-indented per level with
+    `-` on odd and `*` on even levels.
+
+    Everything is derived from a single monotonic clock. When the stream isn't a terminal,
+    e.g. in CI logs, the step gets a line when it starts and one with its badge and duration
+    when it ends, without spinner, carriage returns or colors.
+    """
+
+    def __init__(
+        self,
+        title: str,
+        indentation_level: int = 1,
+        stream: TextIO = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.title = title
+        self.indentation_level = indentation_level
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+        self._clock = clock
+        self._started_at = None
+        self._frame = 0
+
+    @property
+    def prefix(self) -> str:
+        return "\t" * self.indentation_level + ("-" if self.indentation_level % 2 == 1 else "*")
+
+    @property
+    def elapsed(self) -> float:
+        return self._clock() - self._started_at if self._started_at is not None else 0.0
+
+    def _write(self, text: str) -> NoReturn:
+        self.stream.write(text)
+        self.stream.flush()
+
+    def start(self) -> NoReturn:
+        self._started_at = self._clock()
+        if self.interactive:
+            self.tick()
+        else:
+            self._write(f"{self.prefix} [started] {self.title}\n")
+
+    def tick(self) -> NoReturn:
+        if not self.interactive:
+            return
+
+        spinner_char = SPINNER[self._frame % len(SPINNER)]
+        self._frame += 1
+        self._write(f"\r{self.prefix} [{format_elapsed(self.elapsed)}] {self.title} {spinner_char}")
+
+    def finish(self, badge: Badge, suffix: str = "") -> NoReturn:
+        if self.interactive:
+            self._write(f"\r{self.prefix} [{badge.style}{badge.label}{NC}] {self.title}{suffix} {CLEARUP}\n")
+        else:
+            self._write(f"{self.prefix} [{badge.label}] {self.title}{suffix} (took {format_elapsed(self.elapsed)})\n")
+
+    def interrupt(self) -> NoReturn:
+        if self.interactive:
+            self._write("\n")
@@ -0,0 +1,137 @@
+"""
+Waits for resources of a deployment to get ready, by watching them through the Kubernetes API
+and returning on the first event that shows them ready.
+
+    python -m cli.readiness pod-running --kubeconfig <file> --namespace <ns> --name <pod name prefix>
+    python -m cli.readiness pod-ready --kubeconfig <file> --namespace <ns> --name <pod name prefix>
+    python -m cli.readiness raycluster-ready --kubeconfig <file> --namespace <ns> --name <raycluster>
+                            [--timeout <seconds>]
+
+The resources are listed first and then watched from the version of that list, and listed
+again whenever a watch ends. When the API server refuses watches, they are polled with
+backoff over the same connection instead. The exit code is 0 when ready, 1 on timeout and
+FALLBACK_EXITCODE when the API can't be used without kubectl.
+"""
+
+import argparse
+import sys
+import time
+from typing import Callable, Dict
+
+import requests
+
+from cli.kubernetes import KubeClient, KubernetesUnavailable, WatchUnavailable, get_client
+
+FALLBACK_EXITCODE = 2
+# the same backoff the scripts' wait_for loops use
+POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 5
+# a watch that ends sooner without any event is taken for one the server doesn't keep open
+MIN_WATCH_DURATION = 1
+
+
+def get_name(obj: Dict) -> str:
+    return obj.get("metadata", {}).get("name", "")
+
+
+def is_pod_running(pod: Dict) -> bool:
+    # what `kubectl get pod` shows as Running
+    if pod.get("metadata", {}).get("deletionTimestamp"):
+        return False
+    status = pod.get("status", {})
+    if status.get("phase") != "Running":
+        return False
+    return not any("waiting" in container.get("state", {}) for container in status.get("containerStatuses", []))
+
+
+def is_pod_ready(pod: Dict) -> bool:
+    conditions = pod.get("status", {}).get("conditions", [])
+    return is_pod_running(pod) and any(
+        condition.get("type") == "Ready" and condition.get("status") == "True" for condition in conditions
+    )
+
+
+def is_raycluster_ready(raycluster: Dict) -> bool:
+    return raycluster.get("status", {}).get("state") == "ready"
+
+
+# kind, and whether an object is ready given the name (prefix) that was asked for
+CHECKS = {
+    "pod-running": ("pods", lambda obj, name: get_name(obj).startswith(name) and is_pod_running(obj)),
+    "pod-ready": ("pods", lambda obj, name: get_name(obj).startswith(name) and is_pod_ready(obj)),
+    "raycluster-ready": ("rayclusters", lambda obj, name: get_name(obj) == name and is_raycluster_ready(obj)),
+}
+
+
+def wait_until_ready(
+    client: KubeClient,
+    kind: str,
+    namespace: str,
+    is_ready: Callable[[Dict], bool],
+    timeout: float,
+) -> bool:
+    """Returns whether an object of 'kind' got ready within 'timeout' seconds"""
+    deadline = time.monotonic() + timeout
+    use_watch = True
+    interval = POLL_INTERVAL
+
+    while True:
+        try:
+            listing = client.get(kind, namespace=namespace)
+        except requests.HTTPError:
+            listing = None
+        if listing and any(is_ready(obj) for obj in listing.get("items", [])):
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        # a missing list, e.g. of a custom resource that isn't installed yet, is polled for
+        if use_watch and listing is not None:
+            watch_started = time.monotonic()
+            seen_event = False
+            try:
+                resource_version = listing.get("metadata", {}).get("resourceVersion")
+                for event in client.watch(kind, namespace, resource_version, timeout=remaining):
+                    seen_event = True
+                    if event.get("type") in ("ADDED", "MODIFIED") and is_ready(event.get("object", {})):
+                        return True
+                    if event.get("type") == "ERROR":
+                        # e.g. the version is too old to watch from, it's listed again
+                        break
+                    if time.monotonic() >= deadline:
+                        return False
+            except WatchUnavailable:
+                use_watch = False
+
+            if use_watch and (seen_event or time.monotonic() - watch_started >= MIN_WATCH_DURATION):
+                continue
+            use_watch = False
+
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Waits for resources of a deployment to get ready")
+    parser.add_argument("check", choices=CHECKS)
+    parser.add_argument("--kubeconfig", required=True)
+    parser.add_argument("--namespace", required=True)
+    parser.add_argument("--name", required=True, help="The name of the resource, the prefix of it for pods")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args(argv)
+
+    kind, check = CHECKS[args.check]
+    try:
+        client = get_client(args.kubeconfig)
+        ready = wait_until_ready(client, kind, args.namespace, lambda obj: check(obj, args.name), args.timeout)
+    except KubernetesUnavailable as exc:
+        print(exc, file=sys.stderr)
+        return FALLBACK_EXITCODE
+
+    return 0 if ready else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,464 @@
+"""
+Copies images from registry to registry over the OCI distribution API, without a Docker
+daemon: blobs are streamed from the source to the target as they are, so they are neither
+stored locally nor decompressed and compressed again.
+
+    python -m cli.registry --pairs <file> [--remaining <file>] [--env-file <env bundle>]
+                           [--docker-config <dir>] [--arch amd|arm]
+
+'--pairs' holds one `<source image> <target image>` per line. The credentials of the Syntho
+registry come from the env bundle (REGISTRY_USER, REGISTRY_PWD and SYNTHO_REGISTRY), the
+others from the docker config. Blobs the target already has are skipped, and blobs it has in
+another repository are mounted from there. Images that can't be copied are written to
+'--remaining' in the same format, for `docker pull`, `docker tag` and `docker push`, and the
+exit code is then FALLBACK_EXITCODE.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+from collections import namedtuple
+from typing import Dict, Iterator, List, NoReturn, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+FALLBACK_EXITCODE = 2
+
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+DOCKER_HUB_CONFIG_KEY = "https://index.docker.io/v1/"
+# docker talks plain HTTP to these, e.g. to the offline registry on localhost:<port>
+INSECURE_HOSTS = ("localhost", "127.0.0.1")
+PLATFORMS = {"amd": "amd64", "arm": "arm64"}
+
+MANIFEST_TYPES = (
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+)
+INDEX_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+)
+
+# WWW-Authenticate: Bearer realm="https://...",service="...",scope="..."
+CHALLENGE_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+ImageReference = namedtuple("ImageReference", ["registry", "repository", "tag"])
+
+Manifest = namedtuple("Manifest", ["media_type", "body", "digest"])
+
+CopyResult = namedtuple(
+    "CopyResult",
+    [
+        "digest",
+        "copied_blobs",
+        "mounted_blobs",
+        "skipped_blobs",
+        "copied_bytes",
+    ],
+)
+
+
+class RegistryUnavailable(Exception):
+    """The image can't be copied without docker, e.g. its credentials are kept by docker"""
+
+
+class RegistryError(Exception):
+    pass
+
+
+def parse_reference(image: str) -> ImageReference:
+    """Splits an image the way docker does, e.g. `redis:7.2` is docker.io/library/redis:7.2"""
+    name, _, tag = image.rpartition(":")
+    if not name or "/" in tag:
+        name, tag = image, "latest"
+
+    registry, _, repository = name.partition("/")
+    if not repository or not ("." in registry or ":" in registry or registry == "localhost"):
+        registry, repository = DOCKER_HUB, name
+    if registry == DOCKER_HUB and "/" not in repository:
+        repository = f"library/{repository}"
+    return ImageReference(registry, repository, tag)
+
+
+def get_docker_credentials(docker_config: Optional[str], registry: str) -> Optional[Tuple[str, str]]:
+    """
+    The credentials docker has for 'registry' in '<docker_config>/config.json', None when
+    it has none. Credential helpers are asked the way docker asks them.
+    """
+    if not docker_config or not os.path.exists(f"{docker_config}/config.json"):
+        return None
+    try:
+        with open(f"{docker_config}/config.json", "r") as file:
+            config = json.load(file)
+    except (OSError, ValueError) as exc:
+        raise RegistryUnavailable(f"The docker config {docker_config} can't be read") from exc
+
+    keys = (DOCKER_HUB_CONFIG_KEY, DOCKER_HUB) if registry == DOCKER_HUB else (registry, f"https://{registry}")
+    for key in keys:
+        auth = config.get("auths", {}).get(key, {})
+        if auth.get("auth"):
+            username, _, password = base64.b64decode(auth["auth"]).decode().partition(":")
+            return username, password
+        if auth.get("username"):
+            return auth["username"], auth.get("password", "")
+
+    helper = config.get("credHelpers", {}).get(registry) or config.get("credsStore")
+    if not helper:
+        return None
+    try:
+        result = subprocess.run(
+            [f"docker-credential-{helper}", "get"],
+            input=keys[0],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise RegistryUnavailable(f"The docker credential helper {helper} can't be run") from exc
+    if result.returncode != 0:
+        # the helper has nothing stored for the registry
+        return None
+    secret = json.loads(result.stdout)
+    return secret.get("Username", ""), secret.get("Secret", "")
+
+
+class BlobStream:
+    """A blob being read from one registry, with the length another needs to receive it"""
+
+    def __init__(self, chunks: Iterator[bytes], size: int):
+        self._chunks = chunks
+        self._buffer = b""
+        self.size = size
+        self.read_bytes = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = self.read(CHUNK_SIZE)
+        if not chunk:
+            raise StopIteration
+        return chunk
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, b"")
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.read_bytes += len(data)
+        return data
+
+
+class RegistryClient:
+    """
+    A client for one registry over one keep-alive connection pool. Bearer tokens are
+    fetched on the first 401 for a scope and kept for the next requests of that scope.
+    """
+
+    def __init__(self, registry: str, credentials: Optional[Tuple[str, str]] = None):
+        host = DOCKER_HUB_REGISTRY if registry == DOCKER_HUB else registry
+        scheme = "http" if host.split(":")[0] in INSECURE_HOSTS else "https"
+        self.registry = registry
+        self.base_url = f"{scheme}://{host}"
+        self.credentials = credentials
+        self.session = requests.Session()
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def _authorization(self, scope: str) -> Dict[str, str]:
+        with self._lock:
+            token = self._tokens.get(scope)
+        if token:
+            return {"Authorization": token}
+        return {}
+
+    def _authenticate(self, challenge: str, scope: str) -> bool:
+        scheme, _, params = challenge.partition(" ")
+        if scheme.lower() == "basic":
+            if not self.credentials:
+                return False
+            user_pass = base64.b64encode(":".join(self.credentials).encode()).decode()
+            token = f"Basic {user_pass}"
+        elif scheme.lower() == "bearer":
+            params = dict(CHALLENGE_PARAM.findall(params))
+            # one scope parameter per scope, e.g. to mount from another repository
+            query = {"scope": scope.split(" ")}
+            if params.get("service"):
+                query["service"] = params["service"]
+            response = self.session.get(
+                params["realm"],
+                params=query,
+                auth=self.credentials,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            )
+            if response.status_code != 200:
+                return False
+            body = response.json()
+            token = f"Bearer {body.get('token') or body.get('access_token')}"
+        else:
+            return False
+
+        with self._lock:
+            self._tokens[scope] = token
+        return True
+
+    def request(self, method: str, url: str, scope: str, **kwargs) -> requests.Response:
+        """
+        Sends a request in 'scope', e.g. `repository:syntho-core:pull`, authenticating once
+        when the registry asks for it. Bodies that are streams can't be sent twice, their
+        scope has to be authenticated by an earlier request.
+        """
+        url = urljoin(f"{self.base_url}/", url)
+        headers = kwargs.pop("headers", {})
+        kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        try:
+            response = self.session.request(method, url, headers={**headers, **self._authorization(scope)}, **kwargs)
+            if response.status_code == 401 and not isinstance(kwargs.get("data"), BlobStream):
+                challenge = response.headers.get("WWW-Authenticate", "")
+                response.close()
+                if self._authenticate(challenge, scope):
+                    response = self.session.request(
+                        method, url, headers={**headers, **self._authorization(scope)}, **kwargs
+                    )
+        except requests.RequestException as exc:
+            raise RegistryError(f"{method} {url} failed: {exc}") from exc
+        return response
+
+    def _check(self, response: requests.Response, *statuses: int) -> requests.Response:
+        if response.status_code not in statuses:
+            response.close()
+            raise RegistryError(
+                f"{response.request.method} {response.url} returned {response.status_code}: {response.text[:200]}"
+            )
+        return response
+
+    def get_manifest(self, repository: str, reference: str) -> Manifest:
+        response = self.request(
+            "GET",
+            f"/v2/{repository}/manifests/{reference}",
+            f"repository:{repository}:pull",
+            headers={"Accept": ", ".join(MANIFEST_TYPES + INDEX_TYPES)},
+        )
+        self._check(response, 200)
+        media_type = response.headers.get("Content-Type", "").split(";")[0]
+        if media_type not in MANIFEST_TYPES + INDEX_TYPES:
+            raise RegistryUnavailable(f"The manifest of {repository}:{reference} is of type {media_type}")
+        digest = response.headers.get("Docker-Content-Digest") or get_digest(response.content)
+        return Manifest(media_type, response.content, digest)
+
+    def put_manifest(self, repository: str, reference: str, manifest: Manifest) -> NoReturn:
+        response = self.request(
+            "PUT",
+            f"/v2/{repository}/manifests/{reference}",
+            f"repository:{repository}:pull,push",
+            data=manifest.body,
+            headers={"Content-Type": manifest.media_type},
+        )
+        self._check(response, 200, 201)
+
+    def has_blob(self, repository: str, digest: str) -> bool:
+        response = self.request("HEAD", f"/v2/{repository}/blobs/{digest}", f"repository:{repository}:pull,push")
+        return response.status_code == 200
+
+    def get_blob(self, repository: str, digest: str) -> requests.Response:
+        # registries like ACR redirect to storage, requests drops the Authorization header then
+        response = self.request("GET", f"/v2/{repository}/blobs/{digest}", f"repository:{repository}:pull", stream=True)
+        return self._check(response, 200)
+
+    def start_upload(self, repository: str, digest: str = None, from_repository: str = None) -> Optional[str]:
+        """
+        Starts an upload and returns where to send the blob, or None when the registry
+        mounted 'digest' from 'from_repository' instead.
+        """
+        scope = f"repository:{repository}:pull,push"
+        params = {}
+        if from_repository:
+            scope += f" repository:{from_repository}:pull"
+            params = {"mount": digest, "from": from_repository}
+        response = self.request("POST", f"/v2/{repository}/blobs/uploads/", scope, params=params)
+        self._check(response, 201, 202)
+        if response.status_code == 201:
+            return None
+        return urljoin(f"{self.base_url}/", response.headers["Location"])
+
+    def upload_blob(self, repository: str, location: str, digest: str, stream: BlobStream) -> NoReturn:
+        separator = "&" if "?" in location else "?"
+        response = self.request(
+            "PUT",
+            f"{location}{separator}digest={digest}",
+            f"repository:{repository}:pull,push",
+            data=stream,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        self._check(response, 201)
+
+    def close(self) -> NoReturn:
+        self.session.close()
+
+
+def get_digest(data: bytes) -> str:
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def get_blobs(manifest: Manifest) -> List[Dict]:
+    """The descriptors of the config and the layers of an image manifest"""
+    try:
+        body = json.loads(manifest.body)
+        return [body["config"], *body.get("layers", [])]
+    except (ValueError, KeyError, TypeError) as exc:
+        raise RegistryUnavailable(f"The manifest {manifest.digest} can't be read") from exc
+
+
+class ImageCopier:
+    """
+    Copies images with one client per registry. 'credentials' are used for the registries
+    they name, the docker config for the others. Images of several platforms are copied for
+    'arch' only, as `docker pull` would have.
+    """
+
+    def __init__(self, credentials: Dict[str, Tuple[str, str]] = None, docker_config: str = None, arch: str = "amd"):
+        self.credentials = credentials or {}
+        self.docker_config = docker_config
+        self.platform = PLATFORMS.get(arch, arch)
+        self._clients = {}
+        # the repository of every blob that was copied to a registry, to mount it from
+        self._blob_repositories = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, registry: str) -> RegistryClient:
+        with self._lock:
+            if registry not in self._clients:
+                credentials = self.credentials.get(registry)
+                if credentials is None:
+                    credentials = get_docker_credentials(self.docker_config, registry)
+                self._clients[registry] = RegistryClient(registry, credentials)
+            return self._clients[registry]
+
+    def get_manifest(self, reference: ImageReference) -> Manifest:
+        """The manifest of the image, of the platform of the copier for multi-platform ones"""
+        client = self.get_client(reference.registry)
+        manifest = client.get_manifest(reference.repository, reference.tag)
+        if manifest.media_type not in INDEX_TYPES:
+            return manifest
+
+        for entry in json.loads(manifest.body).get("manifests", []):
+            platform = entry.get("platform", {})
+            if platform.get("os", "linux") == "linux" and platform.get("architecture") == self.platform:
+                return client.get_manifest(reference.repository, entry["digest"])
+        raise RegistryError(f"{reference.repository}:{reference.tag} has no image for linux/{self.platform}")
+
+    def get_size(self, image: str) -> int:
+        """The compressed size of the image, read from its manifest"""
+        return sum(blob.get("size", 0) for blob in get_blobs(self.get_manifest(parse_reference(image))))
+
+    def copy(self, source_image: str, target_image: str) -> CopyResult:
+        source, target = parse_reference(source_image), parse_reference(target_image)
+        source_client = self.get_client(source.registry)
+        target_client = self.get_client(target.registry)
+        manifest = self.get_manifest(source)
+
+        copied = mounted = skipped = copied_bytes = 0
+        for blob in get_blobs(manifest):
+            digest = blob["digest"]
+            if target_client.has_blob(target.repository, digest):
+                skipped += 1
+                continue
+
+            with self._lock:
+                from_repository = self._blob_repositories.get((target.registry, digest))
+            if from_repository is None and source.registry == target.registry:
+                from_repository = source.repository
+            location = target_client.start_upload(target.repository, digest, from_repository)
+            if location is None:
+                mounted += 1
+            else:
+                response = source_client.get_blob(source.repository, digest)
+                try:
+                    stream = BlobStream(response.iter_content(CHUNK_SIZE), blob["size"])
+                    target_client.upload_blob(target.repository, location, digest, stream)
+                finally:
+                    response.close()
+                copied += 1
+                copied_bytes += stream.read_bytes
+
+            with self._lock:
+                self._blob_repositories[(target.registry, digest)] = target.repository
+
+        target_client.put_manifest(target.repository, target.tag, manifest)
+        return CopyResult(manifest.digest, copied, mounted, skipped, copied_bytes)
+
+    def close(self) -> NoReturn:
+        for client in self._clients.values():
+            client.close()
+        self._clients = {}
+
+
+def read_pairs(pairs_path: str) -> List[Tuple[str, str]]:
+    with open(pairs_path, "r") as file:
+        return [tuple(line.split()[:2]) for line in file if len(line.split()) >= 2]
+
+
+def get_syntho_credentials(env_file_path: Optional[str]) -> Dict[str, Tuple[str, str]]:
+    """The Syntho registry credentials of a utility's env bundle"""
+    if not env_file_path or not os.path.exists(f"{env_file_path}.json"):
+        return {}
+    with open(f"{env_file_path}.json", "r") as file:
+        env = json.load(file)
+    if not env.get("SYNTHO_REGISTRY") or not env.get("REGISTRY_USER"):
+        return {}
+    return {env["SYNTHO_REGISTRY"]: (env["REGISTRY_USER"], env.get("REGISTRY_PWD", ""))}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Copies images from registry to registry without docker")
+    parser.add_argument("--pairs", required=True, help="A file of `<source image> <target image>` lines")
+    parser.add_argument("--remaining", help="Where to write the pairs that weren't copied")
+    parser.add_argument("--env-file", help="The env bundle with the Syntho registry credentials")
+    parser.add_argument("--docker-config", default=os.environ.get("DOCKER_CONFIG"))
+    parser.add_argument("--arch", default="amd", help="The architecture to copy of multi-platform images")
+    args = parser.parse_args(argv)
+
+    copier = ImageCopier(get_syntho_credentials(args.env_file), args.docker_config, args.arch)
+    remaining = []
+    try:
+        for source, target in read_pairs(args.pairs):
+            try:
+                result = copier.copy(source, target)
+            except (RegistryUnavailable, RegistryError) as exc:
+                print(f"{source} couldn't be copied to {target}: {exc}", file=sys.stderr)
+                remaining.append((source, target))
+                continue
+            print(
+                f"copied {source} to {target} ({result.digest}): {result.copied_blobs} blobs copied, "
+                f"{result.mounted_blobs} mounted, {result.skipped_blobs} already there, {result.copied_bytes} bytes"
+            )
+    finally:
+        copier.close()
+
+    if args.remaining:
+        with open(args.remaining, "w") as file:
+            file.writelines(f"{source} {target}\n" for source, target in remaining)
+    return FALLBACK_EXITCODE if remaining else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
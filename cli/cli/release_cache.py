@@ -0,0 +1,253 @@
+"""
+Release tarballs downloaded once per host. Every tarball is kept in a cache keyed by version
+under the CLI's scripts dir, release-cache/<version>/<name>, next to a record of the URL it
+came from and its sha256. A cached tarball is checked against the recorded sha256 before it's
+used again, and a download that was cut off is resumed with an HTTP Range request, both
+within a run and from the next one. Downloads share one pool of keep-alive connections.
+
+    python -m cli.release_cache --release <version> <url> <output> [--release ...]
+                                [--cache-dir <dir>]
+
+Each release is copied to its '<output>' from the cache, and is only downloaded when the
+cache doesn't have it yet.
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Dict, NoReturn, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+CACHE_DIR_NAME = "release-cache"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", CACHE_DIR_NAME)
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+POOL_SIZE = 4
+RETRIES = 3
+RETRY_DELAY = 1
+
+FetchResult = namedtuple("FetchResult", ["path", "sha256", "downloaded_bytes", "resumed_from", "cached"])
+
+_SESSION = None
+
+
+class ReleaseFetchError(Exception):
+    pass
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+def get_cache_dir(scripts_dir: str) -> str:
+    return os.path.join(scripts_dir, CACHE_DIR_NAME)
+
+
+def get_session() -> requests.Session:
+    """The session every download goes through, so connections are kept alive between them"""
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        _SESSION.mount("http://", adapter)
+        _SESSION.mount("https://", adapter)
+    return _SESSION
+
+
+def get_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return f"sha256:{sha256.hexdigest()}"
+
+
+def read_record(path: str) -> Dict:
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_record(path: str, record: Dict) -> NoReturn:
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(record, file, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def remove_file(path: str) -> NoReturn:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@contextmanager
+def locked(path: str):
+    """Holds an exclusive flock on 'path', so one deployment downloads and the others wait for it"""
+    with open(path, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def download(session: requests.Session, url: str, part_path: str, record: Dict, record_path: str) -> Tuple[int, int]:
+    """
+    Downloads 'url' into 'part_path', from where an earlier download of the same URL stopped.
+    The range is only resumed when the release is still what was partially downloaded, as the
+    server answers the If-Range with the whole release otherwise. Returns the offset the
+    download was resumed at, and the bytes downloaded.
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) and record.get("url") == url else 0
+    # ranges are of the tarball as it's stored, not of an encoding of it
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        validator = record.get("etag") or record.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+
+    with session.get(url, headers=headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        if response.status_code == 416 and response.headers.get("Content-Range") == f"bytes */{offset}":
+            # the partial download was complete already
+            return offset, 0
+        if response.status_code == 404:
+            raise ReleaseFetchError(f"{url} doesn't exist, make sure that the given version exists")
+        if response.status_code >= 500 or response.status_code == 416:
+            raise IncompleteDownload(f"{url} answered {response.status_code}")
+        if response.status_code >= 400:
+            raise ReleaseFetchError(f"{url} answered {response.status_code}")
+
+        if response.status_code == 206:
+            if not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                raise IncompleteDownload(f"{url} answered another range than bytes={offset}-")
+            mode = "ab"
+        else:
+            mode, offset = "wb", 0
+        record.update(url=url, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+        record.pop("sha256", None)
+        write_record(record_path, record)
+
+        expected = response.headers.get("Content-Length")
+        downloaded = 0
+        # read1 hands over what has arrived, so a dropped connection loses nothing of it. urllib3
+        # 1.x doesn't have it, what arrived of the last chunk is downloaded again there.
+        read = getattr(response.raw, "read1", response.raw.read)
+        with open(part_path, mode) as file:
+            while chunk := read(CHUNK_SIZE):
+                file.write(chunk)
+                downloaded += len(chunk)
+        if expected is not None and downloaded != int(expected):
+            raise IncompleteDownload(f"{url} stopped after {offset + downloaded} bytes")
+        return offset, downloaded
+
+
+def fetch_release(
+    url: str,
+    version: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    sha256: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+) -> FetchResult:
+    """
+    The cached release tarball of 'version' at 'url', downloaded when the cache doesn't have
+    it. It's checked against 'sha256' when given, and against the recorded sha256 otherwise.
+    """
+    name = os.path.basename(urlparse(url).path)
+    version_dir = os.path.join(cache_dir, version)
+    path = os.path.join(version_dir, name)
+    part_path, record_path = f"{path}.part", f"{path}.json"
+    os.makedirs(version_dir, exist_ok=True)
+
+    with locked(os.path.join(version_dir, f".{name}.lock")):
+        record = read_record(record_path)
+        expected = sha256 or (record.get("sha256") if record.get("url") == url else None)
+        if os.path.exists(path) and expected:
+            digest = get_sha256(path)
+            if digest == expected and record.get("url") == url:
+                return FetchResult(path, digest, 0, 0, True)
+        # a tarball that was damaged, or that came from another URL, is downloaded again
+        remove_file(path)
+
+        session = session or get_session()
+        downloaded, attempt = 0, 0
+        while True:
+            try:
+                resumed_from, last_downloaded = download(session, url, part_path, record, record_path)
+                downloaded += last_downloaded
+                break
+            except (
+                IncompleteDownload,
+                requests.ConnectionError,
+                requests.Timeout,
+                urllib3.exceptions.HTTPError,
+            ) as exc:
+                attempt += 1
+                if attempt > RETRIES:
+                    raise ReleaseFetchError(f"{url} couldn't be downloaded: {exc}") from exc
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            except requests.RequestException as exc:
+                raise ReleaseFetchError(f"{url} couldn't be downloaded: {exc}") from exc
+
+        digest = get_sha256(part_path)
+        if expected and digest != expected:
+            remove_file(part_path)
+            raise ReleaseFetchError(f"{url} is {digest}, and not {expected} as recorded")
+        os.replace(part_path, path)
+        record["sha256"] = digest
+        write_record(record_path, record)
+        return FetchResult(path, digest, downloaded, resumed_from, False)
+
+
+def copy_release(result: FetchResult, output: str) -> NoReturn:
+    """Copies the cached tarball to 'output', deployments may remove theirs along with their dir"""
+    output_dir = os.path.dirname(os.path.abspath(output))
+    os.makedirs(output_dir, exist_ok=True)
+    shutil.copyfile(result.path, f"{output}.tmp")
+    os.replace(f"{output}.tmp", output)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fetches release tarballs through the release cache")
+    parser.add_argument(
+        "--release",
+        nargs=3,
+        action="append",
+        required=True,
+        metavar=("VERSION", "URL", "OUTPUT"),
+        help="A release to fetch, and where to copy it",
+    )
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    for version, url, output in args.release:
+        try:
+            result = fetch_release(url, version, args.cache_dir)
+            copy_release(result, output)
+        except (OSError, ReleaseFetchError) as exc:
+            print(exc, file=sys.stderr)
+            return 1
+        if result.cached:
+            print(f"{url} is cached ({result.sha256})")
+        else:
+            resumed = f", resumed at {result.resumed_from} bytes" if result.resumed_from else ""
+            print(f"downloaded {url}: {result.downloaded_bytes} bytes{resumed} ({result.sha256})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,6 @@ SYNTHO_CLI_PROCESS_DIR="$SHARED/process"
 mkdir -p "$SYNTHO_CLI_PROCESS_DIR"
 
 authenticate_registry() {
-    sleep 2
     local errors=""
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/authenticate_registry.log"
@@ -74,6 +74,7 @@ delete_nginx_ingress_controller() {
 
 
 destroy() {
+    stop_probe_pod
     delete_synthoui
     delete_ray_cluster
     delete_image_registry_secret
@@ -32,20 +32,9 @@ NEW_RELEASE_DEPLOYMENT_QUESTIONS_PATH=${NEW_RELEASE_ASSET_DESTINATION_DIR}/dynam
 fetch_releases() {
     local errors=""
 
-    if ! command_exists "curl"; then
-        if ! curl -L -o "${CURRENT_RELEASE_ASSET_DESTINATION}" "${CURRENT_RELEASE_ASSET_URL}" >/dev/null 2>&1; then
-            errors+="Failed to download current release using curl. Make sure that the given version exists.\n"
-        fi
-        if ! curl -L -o "${NEW_RELEASE_ASSET_DESTINATION}" "${NEW_RELEASE_ASSET_URL}" >/dev/null 2>&1; then
-            errors+="Failed to download new release using curl. Make sure that the given version exists.\n"
-        fi
-    else
-        if ! wget -O "${CURRENT_RELEASE_ASSET_DESTINATION}" "${CURRENT_RELEASE_ASSET_URL}" >/dev/null 2>&1; then
-            errors+="Failed to download current release using wget. Make sure that the given version exists.\n"
-        fi
-        if ! wget -O "${NEW_RELEASE_ASSET_DESTINATION}" "${NEW_RELEASE_ASSET_URL}" >/dev/null 2>&1; then
-            errors+="Failed to download new release using wget. Make sure that the given version exists.\n"
-        fi
+    if ! fetch_release "$CURRENT_VERSION" "${CURRENT_RELEASE_ASSET_URL}" "${CURRENT_RELEASE_ASSET_DESTINATION}" \
+        "$NEW_VERSION" "${NEW_RELEASE_ASSET_URL}" "${NEW_RELEASE_ASSET_DESTINATION}" >/dev/null 2>&1; then
+        errors+="Failed to download the current and new releases. Make sure that the given versions exist.\n"
     fi
 
     if ! extract_releases >/dev/null 2>&1; then
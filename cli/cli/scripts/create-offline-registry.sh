@@ -25,21 +25,14 @@ mkdir -p "$SYNTHO_CLI_PROCESS_DIR"
 download_release() {
     local errors=""
 
-    if ! command_exists "curl"; then
-        if ! curl -LJ "${CHARTS_RELEASE_ASSET_URL}" -o "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using curl. Make sure that the given version exists.\n"
-        fi
-    else
-        if ! wget "${CHARTS_RELEASE_ASSET_URL}" -O "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using wget. Make sure that the given version exists.\n"
-        fi
+    if ! fetch_release "$VERSION" "${CHARTS_RELEASE_ASSET_URL}" "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
+        errors+="Failed to download release. Make sure that the given version exists.\n"
     fi
 
     write_and_exit "$errors" "download_release"
 }
 
 extract_release() {
-    sleep 1
     local errors=""
 
 
@@ -48,14 +41,20 @@ extract_release() {
     fi
 
     RELEASE_CONFIG_DIR=${DEPLOYMENT_DIR}/syntho-charts-${VERSION}/helm/config
-    cp ${RELEASE_CONFIG_DIR}/images.env ${DEPLOYMENT_DIR}/.images.env
-    cp ${RELEASE_CONFIG_DIR}/images-arm.env ${DEPLOYMENT_DIR}/.images-arm.env
+    local env_file
+    for env_file in images.env images-arm.env; do
+        # source archives only ship the templates of the images env files
+        if [ -e "${RELEASE_CONFIG_DIR}/${env_file}.tpl" ]; then
+            SYNTHO_STACK_VERSION="$VERSION" render_template "${RELEASE_CONFIG_DIR}/${env_file}.tpl" "${DEPLOYMENT_DIR}/.${env_file}"
+        else
+            cp "${RELEASE_CONFIG_DIR}/${env_file}" "${DEPLOYMENT_DIR}/.${env_file}"
+        fi
+    done
 
     write_and_exit "$errors" "extract_release"
 }
 
 create_offline_image_registry() {
-    sleep 1
     local errors=""
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/create_offline_image_registry.log"
@@ -81,22 +80,30 @@ create_offline_image_registry() {
         errors+="Archiving the offline registry has been unexpectedly failed\n"
     fi
 
-    if ! delete_registry2 >> $SYNTHO_CLI_PROCESS_LOGS 2>&1; then
+    # the stopped container is streamed into the offline archive and removed when it's packaged
+    if [[ $errors != "" ]] && ! delete_registry2 >> $SYNTHO_CLI_PROCESS_LOGS 2>&1; then
         errors+="An unexpected error occured when deleting the syntho-offline-registry container\n"
     fi
 
     write_and_exit "$errors" "create_offline_image_registry"
 }
 
+is_registry2_running() {
+    [ -n "$(DOCKER_CONFIG=$DOCKER_CONFIG docker ps -q -f name=syntho-offline-registry)" ]
+}
+
+is_registry2_gone() {
+    ! is_registry2_running
+}
+
 run_registry2() {
     echo "deploying registry:2 image locally"
+    # a failed packaging may have left the container of the previous run
+    DOCKER_CONFIG=$DOCKER_CONFIG docker rm -f syntho-offline-registry >/dev/null 2>&1 || true
     DOCKER_CONFIG=$DOCKER_CONFIG docker run -d -p $AVAILABLE_PORT:5000 --name syntho-offline-registry -v /var/lib/registry registry:2
 
-    # give some time for docker to start the process
-    sleep 5
-
-    # Verify if Docker container is running
-    if [ "$(DOCKER_CONFIG=$DOCKER_CONFIG docker ps -q -f name=syntho-offline-registry)" ]; then
+    # Verify if Docker container is running, giving docker up to 5 seconds to start the process
+    if wait_for --timeout 5 --interval 0.2 --max-interval 1 --replaces 5 is_registry2_running; then
       echo "The Docker container 'syntho-offline-registry' is running on localhost:$AVAILABLE_PORT."
       return 0
     else
@@ -109,11 +116,8 @@ delete_registry2() {
     echo "deleting syntho-offline-registry container"
     DOCKER_CONFIG=$DOCKER_CONFIG docker rm -f syntho-offline-registry
 
-    # give some time
-    sleep 5
-
-    # Verify if Docker container is NOT running
-    if [ "$(DOCKER_CONFIG=$DOCKER_CONFIG docker ps -q -f name=syntho-offline-registry)" ]; then
+    # Verify if Docker container is NOT running, giving docker up to 5 seconds to remove it
+    if ! wait_for --timeout 5 --interval 0.2 --max-interval 1 --replaces 5 is_registry2_gone; then
       echo "The Docker container 'syntho-offline-registry' is still running on localhost:$AVAILABLE_PORT."
       return 1
     else
@@ -125,25 +129,13 @@ delete_registry2() {
 
 archive_offline_registry() {
     echo "archiving syntho-offline-registry container"
-    echo "copying registry lib in the host machine"
-    OFFLINE_MODE_DATASOURCE="$DEPLOYMENT_DIR/activate-offline-mode"
-    mkdir -p $OFFLINE_MODE_DATASOURCE
-    DOCKER_CONFIG=$DOCKER_CONFIG docker cp syntho-offline-registry:/var/lib/registry $OFFLINE_MODE_DATASOURCE/registry-backup
-
-    echo "archiving registry lib backup in the host machine"
-    tar -czf $OFFLINE_MODE_DATASOURCE/registry-lib.tar.gz -C $OFFLINE_MODE_DATASOURCE/registry-backup .
-
-    echo "removing the backup dir again because it was archived"
-    rm -rf $OFFLINE_MODE_DATASOURCE/registry-backup
-
     echo "stopping container"
-    DOCKER_CONFIG=$DOCKER_CONFIG docker stop syntho-offline-registry
+    DOCKER_CONFIG=$DOCKER_CONFIG docker stop syntho-offline-registry || return 1
 
     echo "commiting container's catalogs into a new image"
-    DOCKER_CONFIG=$DOCKER_CONFIG docker commit syntho-offline-registry syntho-offline-registry:latest
-
-    echo "archiving the new syntho-offline-registry:latest image"
-    DOCKER_CONFIG=$DOCKER_CONFIG docker save -o $OFFLINE_MODE_DATASOURCE/syntho-offline-registry.tar syntho-offline-registry:latest
+    DOCKER_CONFIG=$DOCKER_CONFIG docker commit syntho-offline-registry syntho-offline-registry:latest || return 1
+    # the registry storage (`docker cp`) and this image (`docker save`) are streamed into the
+    # offline archive when the registry is packaged, nothing is copied out here
 }
 
 
@@ -246,6 +238,7 @@ prepare_offline_images() {
 pull_images() {
     # Temporary files
     img_pair="${DEPLOYMENT_DIR}/.img_pair_tmp"
+    img_remaining="${DEPLOYMENT_DIR}/.img_remaining_tmp"
 
     # Create/Empty file
     > $img_pair true
@@ -253,36 +246,50 @@ pull_images() {
     # Source offline image env file
     source "${DEPLOYMENT_DIR}/.images-offline.env"
 
-    # read file line by line
+    # read file line by line, and write the source and offline image of every image
     while IFS='=' read -r key value; do
         if [[ $key == *_IMG_REPO ]]; then
             base_key="${key%_IMG_REPO}"
             original_tag=$(grep "${base_key}_IMG_TAG=" ${DEPLOYMENT_DIR}/.images-final.env | cut -d '=' -f2)
-            echo "$base_key $value $original_tag" >> $img_pair
+
+            offline_repo_var="OFFLINE_${base_key}_IMG_REPO"
+            offline_tag_var="OFFLINE_${base_key}_IMG_TAG"
+
+            echo "${value}:${original_tag} ${!offline_repo_var}:${!offline_tag_var}" >> $img_pair
         fi
     done < "${DEPLOYMENT_DIR}/.images-final.env"
 
-    # generate docker pull, tag and push commands
-    while read -r base_key repo original_tag; do
-        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker pull ${repo}:${original_tag}"
-        DOCKER_CONFIG=$DOCKER_CONFIG docker pull ${repo}:${original_tag}
-
-        offline_repo_var="OFFLINE_${base_key}_IMG_REPO"
-        offline_tag_var="OFFLINE_${base_key}_IMG_TAG"
+    # copy the images from registry to registry without the docker daemon, the ones that
+    # can't be copied that way are left in the remaining file
+    local status=2
+    if [ -n "$SYNTHO_CLI_PYTHON" ]; then
+        PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.registry \
+            --pairs "$img_pair" --remaining "$img_remaining" --env-file "$DEPLOYMENT_DIR/.env" \
+            --docker-config "$DOCKER_CONFIG" --arch "$ARCH"
+        status=$?
+    else
+        cp "$img_pair" "$img_remaining"
+    fi
+    if [ "$status" -ne 0 ] && [ "$status" -ne 2 ]; then
+        rm -f $img_pair $img_remaining
+        return 1
+    fi
 
-        offline_repo=${!offline_repo_var}
-        offline_tag=${!offline_tag_var}
+    # generate docker pull, tag and push commands for the remaining ones
+    while read -r image offline_image; do
+        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker pull ${image}"
+        DOCKER_CONFIG=$DOCKER_CONFIG docker pull ${image}
 
-        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker tag ${repo}:${original_tag} ${offline_repo}:${offline_tag}"
-        DOCKER_CONFIG=$DOCKER_CONFIG docker tag ${repo}:${original_tag} ${offline_repo}:${offline_tag}
+        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker tag ${image} ${offline_image}"
+        DOCKER_CONFIG=$DOCKER_CONFIG docker tag ${image} ${offline_image}
 
-        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker push ${offline_repo}:${offline_tag}"
-        DOCKER_CONFIG=$DOCKER_CONFIG docker push ${offline_repo}:${offline_tag}
+        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker push ${offline_image}"
+        DOCKER_CONFIG=$DOCKER_CONFIG docker push ${offline_image}
 
-    done < "$img_pair"
+    done < "$img_remaining"
 
-    # Clean up temporary file
-    rm -f $img_pair
+    # Clean up temporary files
+    rm -f $img_pair $img_remaining
 }
 
 
@@ -12,7 +12,6 @@ SYNTHO_CLI_PROCESS_DIR="$SHARED/process"
 mkdir -p "$SYNTHO_CLI_PROCESS_DIR"
 
 deauthenticate_registry() {
-    sleep 2
     local errors=""
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/deauthenticate_registry.log"
@@ -37,13 +37,8 @@ echo "USE_TRUSTED_REGISTRY: $USE_TRUSTED_REGISTRY" >> $SYNTHO_CLI_PROCESS_LOGS
 if [[ "$USE_TRUSTED_REGISTRY" == "true" ]]; then
     echo "using trusted image registry instead" >> $SYNTHO_CLI_PROCESS_LOGS
     PREPULL_IMAGES_DIR="$PREPULL_IMAGES_DIR"
-    # Read the .image-trusted.env file line by line
-    while IFS='=' read -r key value; do
-        # Remove the "TRUSTED_" prefix
-        new_key=${key#TRUSTED_}
-        # Export the variable with the new name
-        export $new_key="$value"
-    done < $PREPULL_IMAGES_DIR/.images-trusted.env
+    # Export the variables of the .image-trusted.env file without the "TRUSTED_" prefix
+    source_without_prefix "$PREPULL_IMAGES_DIR/.images-trusted.env" "TRUSTED_"
     echo "env vars are overridden with trusted registry info" >> $SYNTHO_CLI_PROCESS_LOGS
 fi
 
@@ -53,13 +48,8 @@ if [[ "$USE_OFFLINE_REGISTRY" == "true" ]]; then
     echo "using offline image registry instead" >> $SYNTHO_CLI_PROCESS_LOGS
     ACTIVATE_OFFLINE_MODE_DIR="$ACTIVATE_OFFLINE_MODE_DIR"
     ACTIVATE_OFFLINE_MODE_ARCHIVE_PATH="$ACTIVATE_OFFLINE_MODE_ARCHIVE_PATH"
-    # Read the .image-offline.env file line by line
-    while IFS='=' read -r key value; do
-        # Remove the "OFFLINE_" prefix
-        new_key=${key#OFFLINE_}
-        # Export the variable with the new name
-        export $new_key="$value"
-    done < $ACTIVATE_OFFLINE_MODE_DIR/.images-offline.env
+    # Export the variables of the .image-offline.env file without the "OFFLINE_" prefix
+    source_without_prefix "$ACTIVATE_OFFLINE_MODE_DIR/.images-offline.env" "OFFLINE_"
     echo "env vars are overridden with offline registry info" >> $SYNTHO_CLI_PROCESS_LOGS
 fi
 
@@ -100,21 +90,7 @@ generate_env() {
     local TEMPLATE_FILE="$DC_DIR/.env.tpl"
     local OUTPUT_FILE="$DC_DIR/.env"
 
-    # Create a copy of the template file to work with
-    cp "$TEMPLATE_FILE" "$OUTPUT_FILE"
-
-    # Iterate over all environment variables
-    for VAR in $(compgen -v); do
-      echo "processing: $VAR: ${!VAR}"
-      # Check the operating system
-      if [[ "$OSTYPE" == "darwin"* ]]; then
-        # macOS uses BSD sed
-        sed -i '' "s|{{ $VAR }}|${!VAR}|g" "$OUTPUT_FILE"
-      else
-        # Linux uses GNU sed
-        sed -i "s|{{ $VAR }}|${!VAR}|g" "$OUTPUT_FILE"
-      fi
-    done
+    render_template "$TEMPLATE_FILE" "$OUTPUT_FILE"
 }
 
 deploy_docker_compose() {
@@ -188,21 +164,16 @@ EOF
 wait_for_frontend_service_health() {
     if [[ "$DRY_RUN" == "true" ]]; then
         echo "DRY_RUN is enabled. Skipping actual health check and simulating success."
-        sleep 5
         return 0
     fi
 
-    sleep 2
-
     is_fe_running() {
         # Check whether Docker container logs contain "started server on 0.0.0.0:3000"
         DOCKER_CONFIG=$DOCKER_CONFIG DOCKER_HOST=$DOCKER_HOST dockercompose -f $DC_DIR/docker-compose.yaml logs frontend 2>&1 | grep -q "started server on 0.0.0.0:3000"
     }
 
 
-    while ! is_fe_running; do
-        sleep 5
-    done
+    wait_for --timeout 300 --interval 1 --max-interval 5 --replaces 2 is_fe_running
 }
 
 deploy_syntho_stack() {
@@ -233,8 +204,6 @@ wait_for_fe_health() {
 }
 
 all_logs() {
-    sleep 5
-
     OUTPUT_DIR="/tmp/syntho"
     LOGS_DIR="$SHARED/logs"
     TARBALL="$OUTPUT_DIR/diagnosis-dc.tar.gz"
@@ -248,7 +217,7 @@ all_logs() {
         DOCKER_CONFIG=$DOCKER_CONFIG DOCKER_HOST=$DOCKER_HOST dockercompose -f $DC_DIR/docker-compose.yaml logs $service > "$LOGS_DIR/$service.log"
     done
 
-    tar -czvf "$TARBALL" -C "$LOGS_DIR" .
+    compress_dir "$TARBALL" "$LOGS_DIR"
 }
 
 get_all_logs() {
@@ -278,8 +247,29 @@ deploy_offline_image_registry() {
     write_and_exit "$errors" "deploy_offline_image_registry"
 }
 
+restore_offline_registry() {
+    local bundle_dir="$1"
+
+    mkdir -p "$bundle_dir/registry"
+    if [ -f "$bundle_dir/bundle.json" ]; then
+        PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "${SYNTHO_CLI_PYTHON:-python3}" -m cli.layer_store \
+            restore --bundle-dir "$bundle_dir" --registry-dir "$bundle_dir/registry"
+    else
+        # archives of earlier versions of the CLI
+        tar -xzf "$bundle_dir/registry-lib.tar.gz" -C "$bundle_dir/registry"
+    fi
+}
+
 do_deploy_offline_image_registry() {
     AVAILABLE_PORT=$(grep AVAILABLE_PORT $ACTIVATE_OFFLINE_MODE_DIR/.env | cut -d '=' -f2)
+
+    # the registry storage is restored from the bundle here, and sent to the docker host
+    mkdir -p /tmp/syntho
+    rm -rf /tmp/syntho/activate-offline-mode
+    mkdir -p /tmp/syntho/activate-offline-mode
+    extract_archive "$ACTIVATE_OFFLINE_MODE_ARCHIVE_PATH" /tmp/syntho/activate-offline-mode/ || return 1
+    restore_offline_registry /tmp/syntho/activate-offline-mode || return 1
+
     if [ "$IS_REMOTE_DOCKER" = "true" ]; then
         SSH_ENDPOINT=${DOCKER_HOST#*//}
 
@@ -289,40 +279,29 @@ do_deploy_offline_image_registry() {
         echo "docker config: $DOCKER_CONFIG"
         echo "docker host: $DOCKER_HOST"
         echo "ssh endpoint: $SSH_ENDPOINT"
-        # echo "sleeping forever"
-        # sleep 999999999
 
         ssh $SSH_ENDPOINT mkdir -p /tmp/syntho
         ssh $SSH_ENDPOINT rm -rf /tmp/syntho/activate-offline-mode
-        ssh $SSH_ENDPOINT mkdir -p /tmp/syntho/activate-offline-mode
-        scp $ACTIVATE_OFFLINE_MODE_ARCHIVE_PATH $SSH_ENDPOINT:/tmp/syntho/activate-offline-mode/activate-offline-mode.tar.gz
-        ssh $SSH_ENDPOINT tar -xzf /tmp/syntho/activate-offline-mode/activate-offline-mode.tar.gz -C /tmp/syntho/activate-offline-mode/
+        ssh $SSH_ENDPOINT mkdir -p /tmp/syntho/activate-offline-mode/registry
+        scp /tmp/syntho/activate-offline-mode/syntho-offline-registry.tar $SSH_ENDPOINT:/tmp/syntho/activate-offline-mode/syntho-offline-registry.tar
+        tar -cf - -C /tmp/syntho/activate-offline-mode/registry . | ssh $SSH_ENDPOINT tar -xf - -C /tmp/syntho/activate-offline-mode/registry
 
         ssh $SSH_ENDPOINT docker load -i /tmp/syntho/activate-offline-mode/syntho-offline-registry.tar
-        ssh $SSH_ENDPOINT mkdir -p /tmp/syntho/activate-offline-mode/registry
-        ssh $SSH_ENDPOINT tar -xzf /tmp/syntho/activate-offline-mode/registry-lib.tar.gz -C /tmp/syntho/activate-offline-mode/registry
 
+        # a resumed deployment may find the registry of the failed run
+        ssh $SSH_ENDPOINT docker rm -f syntho-offline-registry >/dev/null 2>&1 || true
         ssh $SSH_ENDPOINT docker run -d -p $AVAILABLE_PORT:5000 --name syntho-offline-registry syntho-offline-registry:latest
         ssh $SSH_ENDPOINT docker cp /tmp/syntho/activate-offline-mode/registry syntho-offline-registry:/var/lib/
-        # echo "sleeping forever"
-        # sleep 999999999
     else
-        mkdir -p /tmp/syntho
-        rm -rf /tmp/syntho/activate-offline-mode
-        mkdir -p /tmp/syntho/activate-offline-mode
-        cp $ACTIVATE_OFFLINE_MODE_ARCHIVE_PATH /tmp/syntho/activate-offline-mode/activate-offline-mode.tar.gz
-        tar -xzf /tmp/syntho/activate-offline-mode/activate-offline-mode.tar.gz -C /tmp/syntho/activate-offline-mode/
-
         DOCKER_CONFIG=$DOCKER_CONFIG DOCKER_HOST=$DOCKER_HOST docker load -i /tmp/syntho/activate-offline-mode/syntho-offline-registry.tar
-        mkdir -p /tmp/syntho/activate-offline-mode/registry
-        tar -xzf /tmp/syntho/activate-offline-mode/registry-lib.tar.gz -C /tmp/syntho/activate-offline-mode/registry
 
+        # a resumed deployment may find the registry of the failed run
+        DOCKER_CONFIG=$DOCKER_CONFIG DOCKER_HOST=$DOCKER_HOST docker rm -f syntho-offline-registry >/dev/null 2>&1 || true
         DOCKER_CONFIG=$DOCKER_CONFIG DOCKER_HOST=$DOCKER_HOST docker run -d -p $AVAILABLE_PORT:5000 --name syntho-offline-registry syntho-offline-registry:latest
         DOCKER_CONFIG=$DOCKER_CONFIG DOCKER_HOST=$DOCKER_HOST docker cp /tmp/syntho/activate-offline-mode/registry syntho-offline-registry:/var/lib/
     fi
 }
 
-
 if [[ "$USE_OFFLINE_REGISTRY" == "true" ]]; then
     with_loading "Deploying offline image registry with necessary images in it" deploy_offline_image_registry
 fi
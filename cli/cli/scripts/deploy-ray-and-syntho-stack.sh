@@ -50,13 +50,8 @@ if [[ "$USE_TRUSTED_REGISTRY" == "true" ]]; then
         echo "using trusted image registry instead" >> $SYNTHO_CLI_PROCESS_LOGS
         echo "$(cat "$PREPULL_IMAGES_DIR/.images-trusted.env")" >> "$SYNTHO_CLI_PROCESS_LOGS"
         PREPULL_IMAGES_DIR="$PREPULL_IMAGES_DIR"
-        # Read the .image-trusted.env file line by line
-        while IFS='=' read -r key value; do
-            # Remove the "TRUSTED_" prefix
-            new_key=${key#TRUSTED_}
-            # Export the variable with the new name
-            export $new_key="$value"
-        done < $PREPULL_IMAGES_DIR/.images-trusted.env
+        # Export the variables of the .image-trusted.env file without the "TRUSTED_" prefix
+        source_without_prefix "$PREPULL_IMAGES_DIR/.images-trusted.env" "TRUSTED_"
         echo "env vars are overridden with trusted registry info" >> $SYNTHO_CLI_PROCESS_LOGS
     fi
 fi
@@ -117,21 +112,7 @@ generate_ray_values() {
     local TEMPLATE_FILE="$CHARTS_DIR/ray/chart/values.yaml.tpl"
     local OUTPUT_FILE="$CHARTS_DIR/ray/chart/values-generated.yaml"
 
-    # Create a copy of the template file to work with
-    cp "$TEMPLATE_FILE" "$OUTPUT_FILE"
-
-    # Iterate over all environment variables
-    for VAR in $(compgen -v); do
-      echo "processing: $VAR: ${!VAR}"
-      # Check the operating system
-      if [[ "$OSTYPE" == "darwin"* ]]; then
-        # macOS uses BSD sed
-        sed -i '' "s|{{ $VAR }}|${!VAR}|g" "$OUTPUT_FILE"
-      else
-        # Linux uses GNU sed
-        sed -i "s|{{ $VAR }}|${!VAR}|g" "$OUTPUT_FILE"
-      fi
-    done
+    render_template "$TEMPLATE_FILE" "$OUTPUT_FILE"
 }
 
 deploy_ray() {
@@ -143,7 +124,7 @@ deploy_ray() {
         install_crds_if_not_exists
         helm --kubeconfig $KUBECONFIG install ray-cluster $RAY_CHARTS --values $VALUES_YAML --namespace syntho --dry-run
     else
-        helm --kubeconfig $KUBECONFIG install ray-cluster $RAY_CHARTS --values $VALUES_YAML --namespace syntho
+        helm --kubeconfig $KUBECONFIG upgrade --install ray-cluster $RAY_CHARTS --values $VALUES_YAML --namespace syntho
     fi
 }
 
@@ -164,55 +145,45 @@ install_crds_if_not_exists() {
 wait_for_ray_cluster_health() {
     if [[ "$DRY_RUN" == "true" ]]; then
         echo "DRY_RUN is enabled. Skipping actual health check and simulating success."
-        sleep 5
         return 0
     fi
 
     local POD_PREFIX=ray-cluster-head
-
-    is_pod_running() {
-        kubectl --kubeconfig $KUBECONFIG get pod -n syntho | grep "^$POD_PREFIX" | grep -q "Running"
-    }
+    local USE_PROBE_POD=false
+    if start_probe_pod; then
+        USE_PROBE_POD=true
+    fi
 
     is_cluster_healthy() {
-        local POD_NAME
-        POD_NAME=$(kubectl --kubeconfig "$KUBECONFIG" get pod -n syntho | grep "^$POD_PREFIX" | awk '{print $1}')
-
-        if [ -n "$POD_NAME" ]; then
-            local CONTENT
-            CONTENT=$(kubectl --kubeconfig $KUBECONFIG -n syntho exec -ti $POD_NAME -- /bin/bash -c "ray status")
-            echo $CONTENT | grep -q "(no failures)" && echo $CONTENT | grep -q "(no pending nodes)"
+        local CONTENT
+        if [[ "$USE_PROBE_POD" == "true" ]]; then
+            # the dashboard reports the same cluster status as `ray status`
+            CONTENT=$(probe_http_body "http://ray-cluster-head-svc.syntho.svc.cluster.local:8265/api/cluster_status?format=1")
+        else
+            local POD_NAME
+            POD_NAME=$(kubectl --kubeconfig "$KUBECONFIG" get pod -n syntho | grep "^$POD_PREFIX" | awk '{print $1}')
+            if [ -n "$POD_NAME" ]; then
+                CONTENT=$(kubectl --kubeconfig $KUBECONFIG -n syntho exec -ti $POD_NAME -- /bin/bash -c "ray status")
+            fi
         fi
-    }
 
-    while ! is_pod_running; do
-        sleep 5
-    done
+        echo $CONTENT | grep -q "(no failures)" && echo $CONTENT | grep -q "(no pending nodes)"
+    }
 
-    while ! is_cluster_healthy; do
-        sleep 5
-    done
+    wait_for_running_pod syntho "$POD_PREFIX" 600 || return 1
+    # returns on the operator reporting the cluster ready, `ray status` then confirms it
+    wait_with_readiness raycluster-ready syntho ray-cluster 600
+    if [ $? -eq 1 ]; then
+        return 1
+    fi
+    wait_for --timeout 600 --interval 1 --max-interval 5 is_cluster_healthy
 }
 
 generate_synthoui_values() {
     local TEMPLATE_FILE="$CHARTS_DIR/syntho-ui/values.yaml.tpl"
     local OUTPUT_FILE="$CHARTS_DIR/syntho-ui/values-generated.yaml"
 
-    # Create a copy of the template file to work with
-    cp "$TEMPLATE_FILE" "$OUTPUT_FILE"
-
-    # Iterate over all environment variables
-    for VAR in $(compgen -v); do
-      echo "processing: $VAR: ${!VAR}"
-      # Check the operating system
-      if [[ "$OSTYPE" == "darwin"* ]]; then
-        # macOS uses BSD sed
-        sed -i '' "s|{{ $VAR }}|${!VAR}|g" "$OUTPUT_FILE"
-      else
-        # Linux uses GNU sed
-        sed -i "s|{{ $VAR }}|${!VAR}|g" "$OUTPUT_FILE"
-      fi
-    done
+    render_template "$TEMPLATE_FILE" "$OUTPUT_FILE"
 }
 
 deploy_synthoui() {
@@ -221,71 +192,70 @@ deploy_synthoui() {
     if [[ "$DRY_RUN" == "true" ]]; then
         helm --kubeconfig $KUBECONFIG install syntho-ui $RAY_CHARTS --values $VALUES_YAML --namespace syntho --dry-run
     else
-        helm --kubeconfig $KUBECONFIG install syntho-ui $RAY_CHARTS --values $VALUES_YAML --namespace syntho
+        helm --kubeconfig $KUBECONFIG upgrade --install syntho-ui $RAY_CHARTS --values $VALUES_YAML --namespace syntho
     fi
 }
 
 wait_for_synthoui_health() {
     if [[ "$DRY_RUN" == "true" ]]; then
         echo "DRY_RUN is enabled. Skipping actual health check and simulating success."
-        sleep 5
         return 0
     fi
 
     local POD_PREFIX=frontend-
-
-    is_pod_running() {
-        kubectl --kubeconfig $KUBECONFIG get pod -n syntho | grep "^$POD_PREFIX" | grep -q "Running"
-    }
+    local USE_PROBE_POD=false
+    if start_probe_pod; then
+        USE_PROBE_POD=true
+    fi
 
     is_frontend_healthy() {
         local POD_NAME
         POD_NAME=$(kubectl --kubeconfig $KUBECONFIG get pod -n syntho | grep "^$POD_PREFIX" | awk '{print $1}')
         content=""
 
-        if [ -n "$POD_NAME" ]; then
+        if [ -n "$POD_NAME" ] && [[ "$USE_PROBE_POD" == "true" ]]; then
+            # straight to the pod, its service only routes to it once the readiness probe passed
+            local POD_IP
+            POD_IP=$(kubectl --kubeconfig $KUBECONFIG get pod -n syntho "$POD_NAME" -o jsonpath='{.status.podIP}')
+            if [ -n "$POD_IP" ]; then
+                probe_http_status "http://$POD_IP:3000" | grep -qx 200
+                return
+            fi
+        elif [ -n "$POD_NAME" ]; then
             content=$(kubectl --kubeconfig $KUBECONFIG -n syntho exec -i $POD_NAME -- /bin/sh -c "wget -q --spider --server-response http://0.0.0.0:3000" 2>&1)
         fi
 
         echo "$content" | grep -q "HTTP/1.1 200 OK"
     }
 
-    while ! is_pod_running; do
-        echo "frontend not running yet"
-        sleep 5
-    done
-
-    echo "waiting before making request to frontend"
-    sleep 5
+    echo "waiting for frontend to be running"
+    wait_for_running_pod syntho "$POD_PREFIX" 600 || return 1
 
-    while ! is_frontend_healthy; do
-        echo "frontend not healthy yet"
-        sleep 5
-    done
+    echo "waiting for frontend to be healthy"
+    wait_for --timeout 600 --interval 1 --max-interval 5 --replaces 5 is_frontend_healthy
 }
 
 wait_local_nginx() {
     if [[ "$DRY_RUN" == "true" ]]; then
         echo "DRY_RUN is enabled. Skipping actual health check and simulating success."
-        sleep 5
         return 0
     fi
 
     is_200() {
         local INGRESS_CONTROLLER_SERVICE_NAME="syntho-ingress-nginx-controller"
         local INGRESS_CONTROLLER_NAMESPACE="syntho"
-        local DOMAIN="$DOMAIN"
 
-        kubectl run -i --tty --rm busybox-2 --image=$BUSYBOX_IMG_REPO:$BUSYBOX_IMG_TAG --restart=Never --namespace syntho -- /bin/sh -c "wget -O- \
-        --header=\"Host: $DOMAIN\" --server-response \
-        http://$INGRESS_CONTROLLER_SERVICE_NAME.$INGRESS_CONTROLLER_NAMESPACE.svc.cluster.local/login/ \
-        2>&1 | grep 'HTTP/' | awk '{print \$2}'" | grep -q 200
+        probe_http_status "http://$INGRESS_CONTROLLER_SERVICE_NAME.$INGRESS_CONTROLLER_NAMESPACE.svc.cluster.local/login/" \
+            "$DOMAIN" | grep -q 200
     }
 
-    while ! is_200; do
-        echo "ingress controller is not ready yet"
-        sleep 5
-    done
+    echo "starting the probe pod"
+    start_probe_pod || return 1
+
+    echo "waiting for ingress controller to be ready"
+    # the service doesn't route to the controller before its pod is ready
+    wait_for_ready_pod syntho syntho-ingress-nginx-controller 3600 || return 1
+    wait_for --timeout 3600 --interval 2 --max-interval 10 is_200 || return 1
     echo "yes"
 }
 
@@ -319,7 +289,6 @@ generate_image_pull_secrets_from_original() {
 
 prepare_for_trusted_registry() {
     local errors=""
-    sleep 2
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/prepare_for_trusted_registry.log"
 
@@ -335,7 +304,6 @@ prepare_for_trusted_registry() {
 
 deploy_ray_cluster() {
     local errors=""
-    sleep 2
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/deploy_ray_cluster.log"
 
@@ -399,8 +367,6 @@ wait_local_nginx_ingress_controller() {
 }
 
 all_logs() {
-    sleep 5
-
     NAMESPACE="syntho"
     OUTPUT_DIR="/tmp/syntho"
     LOGS_DIR="$SHARED/logs"
@@ -417,7 +383,7 @@ all_logs() {
         kubectl --kubeconfig $KUBECONFIG describe pod $POD -n $NAMESPACE > "$LOGS_DIR/$POD.describe"
     done
 
-    tar -czvf "$TARBALL" -C "$LOGS_DIR" .
+    compress_dir "$TARBALL" "$LOGS_DIR"
 }
 
 get_all_logs() {
@@ -442,12 +408,20 @@ post_deployment() {
     write_and_exit "$errors" "post_deployment"
 }
 
+is_ingress_tls_ready() {
+    local SECRET_NAME
+    SECRET_NAME=$(kubectl --kubeconfig "$KUBECONFIG" --namespace syntho get ingress frontend-ingress \
+        -o jsonpath='{.spec.tls[0].secretName}')
+
+    [ -n "$SECRET_NAME" ] && kubectl --kubeconfig "$KUBECONFIG" --namespace syntho get secret "$SECRET_NAME" >/dev/null 2>&1
+}
+
 annotate_ingress() {
     if [ -n "$INGRESS_ANNOTATION" ]; then
         echo "annotating ingress"
         kubectl --kubeconfig "$KUBECONFIG" --namespace syntho annotate ingress frontend-ingress "$INGRESS_ANNOTATION"
-        # just waiting random seconds for issuer to take necessary actions
-        sleep 30
+        # give the issuer up to 30 seconds to provision the TLS secret of the ingress
+        wait_for --timeout 30 --interval 1 --max-interval 5 --replaces 30 is_ingress_tls_ready || true
     else
         echo "not annotating ingress"
     fi
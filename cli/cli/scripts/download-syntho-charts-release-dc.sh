@@ -23,32 +23,25 @@ replace_version_in_images_env() {
     local DC_IMAGES_ENV_TEMPLATE_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/docker-compose/config/images.env.tpl"
     local DC_IMAGES_ENV_OUTPUT_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/docker-compose/config/images.env"
 
-    sed "s|{{ SYNTHO_STACK_VERSION }}|$VERSION|g" "$DC_IMAGES_ENV_TEMPLATE_FILE" > "$DC_IMAGES_ENV_OUTPUT_FILE"
+    SYNTHO_STACK_VERSION="$VERSION" render_template "$DC_IMAGES_ENV_TEMPLATE_FILE" "$DC_IMAGES_ENV_OUTPUT_FILE"
 
     DC_IMAGES_ENV_TEMPLATE_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/docker-compose/config/images-arm.env.tpl"
     DC_IMAGES_ENV_OUTPUT_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/docker-compose/config/images-arm.env"
 
-    sed "s|{{ SYNTHO_STACK_VERSION }}|$VERSION|g" "$DC_IMAGES_ENV_TEMPLATE_FILE" > "$DC_IMAGES_ENV_OUTPUT_FILE"
+    SYNTHO_STACK_VERSION="$VERSION" render_template "$DC_IMAGES_ENV_TEMPLATE_FILE" "$DC_IMAGES_ENV_OUTPUT_FILE"
 }
 
 download_release() {
     local errors=""
 
-    if ! command_exists "curl"; then
-        if ! curl -LJ "${CHARTS_RELEASE_ASSET_URL}" -o "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using curl. Make sure that the given version exists.\n"
-        fi
-    else
-        if ! wget "${CHARTS_RELEASE_ASSET_URL}" -O "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using wget. Make sure that the given version exists.\n"
-        fi
+    if ! fetch_release "$VERSION" "${CHARTS_RELEASE_ASSET_URL}" "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
+        errors+="Failed to download release. Make sure that the given version exists.\n"
     fi
 
     write_and_exit "$errors" "download_release"
 }
 
 extract_release() {
-    sleep 1
     local errors=""
 
     mkdir -p "${EXTRACT_LOCATION}/syntho-charts"
@@ -20,32 +20,25 @@ replace_version_in_images_env() {
     local HELM_IMAGES_ENV_TEMPLATE_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/helm/config/images.env.tpl"
     local HELM_IMAGES_ENV_OUTPUT_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/helm/config/images.env"
 
-    sed "s|{{ SYNTHO_STACK_VERSION }}|$VERSION|g" "$HELM_IMAGES_ENV_TEMPLATE_FILE" > "$HELM_IMAGES_ENV_OUTPUT_FILE"
+    SYNTHO_STACK_VERSION="$VERSION" render_template "$HELM_IMAGES_ENV_TEMPLATE_FILE" "$HELM_IMAGES_ENV_OUTPUT_FILE"
 
     HELM_IMAGES_ENV_TEMPLATE_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/helm/config/images-arm.env.tpl"
     HELM_IMAGES_ENV_OUTPUT_FILE="$EXTRACT_LOCATION/syntho-charts-${VERSION}/helm/config/images-arm.env"
 
-    sed "s|{{ SYNTHO_STACK_VERSION }}|$VERSION|g" "$HELM_IMAGES_ENV_TEMPLATE_FILE" > "$HELM_IMAGES_ENV_OUTPUT_FILE"
+    SYNTHO_STACK_VERSION="$VERSION" render_template "$HELM_IMAGES_ENV_TEMPLATE_FILE" "$HELM_IMAGES_ENV_OUTPUT_FILE"
 }
 
 download_release() {
     local errors=""
 
-    if ! command_exists "curl"; then
-        if ! curl -LJ "${CHARTS_RELEASE_ASSET_URL}" -o "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using curl. Make sure that the given version exists.\n"
-        fi
-    else
-        if ! wget "${CHARTS_RELEASE_ASSET_URL}" -O "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using wget. Make sure that the given version exists.\n"
-        fi
+    if ! fetch_release "$VERSION" "${CHARTS_RELEASE_ASSET_URL}" "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
+        errors+="Failed to download release. Make sure that the given version exists.\n"
     fi
 
     write_and_exit "$errors" "download_release"
 }
 
 extract_release() {
-    sleep 1
     local errors=""
 
     mkdir -p "${EXTRACT_LOCATION}/syntho-charts"
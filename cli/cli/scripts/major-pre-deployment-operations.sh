@@ -75,13 +75,14 @@ create_namespace_if_not_exists() {
 }
 
 create_secret() {
+    # applied rather than created, so a resumed deployment can run this again
     kubectl --kubeconfig $KUBECONFIG --namespace $NAMESPACE create secret docker-registry \
         $SECRET_NAME_FOR_IMAGE_REGISTRY --docker-server=$IMAGE_REGISTRY_SERVER \
-        --docker-username=$REGISTRY_USER --docker-password=$REGISTRY_PWD
+        --docker-username=$REGISTRY_USER --docker-password=$REGISTRY_PWD \
+        --dry-run=client -o yaml | kubectl --kubeconfig $KUBECONFIG --namespace $NAMESPACE apply -f -
 }
 
 create_namespace() {
-    sleep 1
     local errors=""
 
 
@@ -111,15 +112,11 @@ local_volume_provisioner() {
     local EXTRACT_LOCATION=${DEPLOYMENT_DIR}
     local NAMESPACE=syntho
 
-    if ! command_exists "curl"; then
-        curl -LJ "${RELEASE_URL}" -o "${TARBALL_DESTINATION}"
-    else
-        wget "${RELEASE_URL}" -O "${TARBALL_DESTINATION}"
-    fi
+    fetch_release "local-path-provisioner-${V_VERSION}" "${RELEASE_URL}" "${TARBALL_DESTINATION}"
 
     tar -xzvf "${TARBALL_DESTINATION}" -C "${EXTRACT_LOCATION}"
 
-    helm --kubeconfig $KUBECONFIG install syntho-local-path-storage \
+    helm --kubeconfig $KUBECONFIG upgrade --install syntho-local-path-storage \
         --namespace syntho --create-namespace \
         ${DEPLOYMENT_DIR}/local-path-provisioner-${VERSION}/deploy/chart/local-path-provisioner/
 }
@@ -18,7 +18,6 @@ docker_info() {
 }
 
 network_check() {
-    sleep 2
     local errors=""
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/network_check.log"
     echo "network_check has been started" >> $SYNTHO_CLI_PROCESS_LOGS
@@ -43,7 +42,6 @@ network_check() {
 
 
 developer_tools_check() {
-    sleep 2
     local errors=""
 
     # Check if curl or wget exists
@@ -97,7 +95,6 @@ developer_tools_check() {
 }
 
 docker_host_check() {
-    sleep 2
     local errors=""
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/docker_host_check.log"
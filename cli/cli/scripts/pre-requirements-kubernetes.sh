@@ -18,7 +18,6 @@ mkdir -p "$SYNTHO_CLI_PROCESS_DIR"
 
 
 network_check() {
-    sleep 2
     local errors=""
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/network_check.log"
     echo "network_check has been started" >> $SYNTHO_CLI_PROCESS_LOGS
@@ -42,7 +41,6 @@ network_check() {
 }
 
 developer_tools_check() {
-    sleep 2
     local errors=""
 
     # Check if curl or wget exists
@@ -79,7 +77,6 @@ developer_tools_check() {
 }
 
 kubernetes_cluster_check() {
-    sleep 2
     local errors=""
 
     SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/kubernetes_cluster_check.log"
@@ -129,7 +126,6 @@ EOF
 }
 
 check_if_configurations_can_be_skipped() {
-    sleep 2
     local errors=""
 
     source $DEPLOYMENT_DIR/.k8s-cluster-info.env --source-only
@@ -9,7 +9,6 @@ source $DEPLOYMENT_DIR/.env --source-only
 TRUSTED_REGISTRY="$TRUSTED_REGISTRY"
 VERSION="$VERSION"
 ARCH="$ARCH"
-DOCKER_CONFIG="$DOCKER_CONFIG"
 
 CHARTS_RELEASE_ASSET_URL=https://github.com/syntho-ai/syntho-charts/archive/refs/tags/${VERSION}.tar.gz
 TARBALL_DESTINATION=${DEPLOYMENT_DIR}/syntho-charts-${VERSION}.tar.gz
@@ -24,21 +23,14 @@ mkdir -p "$SYNTHO_CLI_PROCESS_DIR"
 download_release() {
     local errors=""
 
-    if ! command_exists "curl"; then
-        if ! curl -LJ "${CHARTS_RELEASE_ASSET_URL}" -o "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using curl. Make sure that the given version exists.\n"
-        fi
-    else
-        if ! wget "${CHARTS_RELEASE_ASSET_URL}" -O "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
-            errors+="Failed to download release using wget. Make sure that the given version exists.\n"
-        fi
+    if ! fetch_release "$VERSION" "${CHARTS_RELEASE_ASSET_URL}" "${TARBALL_DESTINATION}" >/dev/null 2>&1; then
+        errors+="Failed to download release. Make sure that the given version exists.\n"
     fi
 
     write_and_exit "$errors" "download_release"
 }
 
 extract_release() {
-    sleep 1
     local errors=""
 
 
@@ -53,11 +45,10 @@ extract_release() {
     write_and_exit "$errors" "extract_release"
 }
 
-pull_images_into_trusted_registry() {
-    sleep 1
+prepare_images_for_trusted_registry() {
     local errors=""
 
-    SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/pull_images_into_trusted_registry.log"
+    SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/prepare_images_for_trusted_registry.log"
 
     if ! prepare_final_versions >> $SYNTHO_CLI_PROCESS_LOGS 2>&1; then
         errors+="An unexpected error occured when preparing final image versions\n"
@@ -67,14 +58,9 @@ pull_images_into_trusted_registry() {
         errors+="An unexpected error occured when preparing trusted image versions\n"
     fi
 
-    if ! pull_images >> $SYNTHO_CLI_PROCESS_LOGS 2>&1; then
-        errors+="Pulling images into the trusted registry has been unexpectedly failed\n"
-    fi
-
-    write_and_exit "$errors" "pull_images_into_trusted_registry"
+    write_and_exit "$errors" "prepare_images_for_trusted_registry"
 }
 
-
 prepare_final_versions() {
     # Initially store all env keys in an array
     # shellcheck disable=SC2207
@@ -171,50 +157,9 @@ prepare_trusted_images() {
 }
 
 
-pull_images() {
-    # Temporary files
-    img_pair="${DEPLOYMENT_DIR}/.img_pair_tmp"
-
-    # Create/Empty file
-    > "$img_pair" true
-
-    # Source trusted image env file
-    source "${DEPLOYMENT_DIR}/.images-trusted.env"
-
-    # read file line by line
-    while IFS='=' read -r key value; do
-        if [[ $key == *_IMG_REPO ]]; then
-            base_key="${key%_IMG_REPO}"
-            original_tag=$(grep "${base_key}_IMG_TAG=" ${DEPLOYMENT_DIR}/.images-final.env | cut -d '=' -f2)
-            echo "$base_key $value $original_tag" >> $img_pair
-        fi
-    done < "${DEPLOYMENT_DIR}/.images-final.env"
-
-    # generate docker pull, tag and push commands
-    while read -r base_key repo original_tag; do
-        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker pull ${repo}:${original_tag}"
-        DOCKER_CONFIG=$DOCKER_CONFIG docker pull ${repo}:${original_tag}
-
-        trusted_repo_var="TRUSTED_${base_key}_IMG_REPO"
-        trusted_tag_var="TRUSTED_${base_key}_IMG_TAG"
-
-        trusted_repo=${!trusted_repo_var}
-        trusted_tag=${!trusted_tag_var}
-
-        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker tag ${repo}:${original_tag} ${trusted_repo}:${trusted_tag}"
-        DOCKER_CONFIG=$DOCKER_CONFIG docker tag ${repo}:${original_tag} ${trusted_repo}:${trusted_tag}
-
-        echo "DOCKER_CONFIG=$DOCKER_CONFIG docker push ${trusted_repo}:${trusted_tag}"
-        DOCKER_CONFIG=$DOCKER_CONFIG docker push ${trusted_repo}:${trusted_tag}
-
-    done < "$img_pair"
-
-    # Clean up temporary file
-    rm -f $img_pair
-}
-
-
 
 with_loading "Downloading the release: $VERSION" download_release
 with_loading "Extracting the release: $VERSION" extract_release
-with_loading "Pulling images into the trusted registry ($TRUSTED_REGISTRY)" pull_images_into_trusted_registry
+# the images are pulled, tagged and pushed by cli/utilities/prepull_images.py, from the
+# .images-final.env and .images-trusted.env files prepared here
+with_loading "Preparing the images for the trusted registry ($TRUSTED_REGISTRY)" prepare_images_for_trusted_registry
@@ -129,7 +129,10 @@ replace_versions_in_config_dir() {
 
     env_files=("images.env" "images-arm.env")
     for env_file in "${env_files[@]}"; do
-        if [ ! -e "$CONFIG_DIR/$env_file.bak" ]; then
+        if [ -e "$CONFIG_DIR/$env_file.tpl" ]; then
+            echo "rendering $env_file for version $NEW_VERSION"
+            SYNTHO_STACK_VERSION="$NEW_VERSION" render_template "$CONFIG_DIR/$env_file.tpl" "$CONFIG_DIR/$env_file"
+        elif [ ! -e "$CONFIG_DIR/$env_file.bak" ]; then
             echo "it is the first time $env_file is being updated for version $NEW_VERSION"
             sed -i.bak "s/${INITIAL_VERSION}/${NEW_VERSION}/g" "$CONFIG_DIR/$env_file"
         else
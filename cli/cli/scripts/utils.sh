@@ -4,6 +4,9 @@ DEPLOYMENT_DIR="$DEPLOYMENT_DIR"
 SHARED="$DEPLOYMENT_DIR/shared"
 SYNTHO_CLI_PROCESS_DIR="$SHARED/process"
 BACKGROUND_PIDS="$SHARED/background.pids"
+# the CLI passes its interpreter, steps are then supervised and drawn by cli.supervisor
+SYNTHO_CLI_PYTHON="$SYNTHO_CLI_PYTHON"
+SYNTHO_CLI_PYTHONPATH="$(cd "$(dirname "${BASH_SOURCE[0]}")/../.." && pwd)"
 if [[ $DEPLOYMENT_DIR != "" ]]; then
     mkdir -p "$SHARED"
 fi
@@ -30,14 +33,12 @@ NC='\033[0m' # No Color
 CLEARUP='\033[K'
 
 # Declare global variables
-animation_pid=""
-latest_elapsed_time=""
-start_time=""
+step_pid=""
 
 cleanup() {
     # This function is called when the script is interrupted (e.g., Ctrl+C).
-    if [ -n "$animation_pid" ]; then
-        kill "$animation_pid"  # Terminate the loading animation
+    if [ -n "$step_pid" ]; then
+        kill -- "-$step_pid" 2>/dev/null  # Terminate the running step's process group
     fi
 
     if [ -f "$BACKGROUND_PIDS" ]; then
@@ -58,63 +59,318 @@ cleanup() {
 # Set up the trap to call the cleanup function on Ctrl+C
 trap cleanup INT
 
-show_loading_animation() {
-    start_time=$(date +%s)
-    latest_elapsed_time="00:00:00"
+# Sources an env file of <prefix>NAME=value lines and exports each value of the file as
+# NAME, e.g. the TRUSTED_ images of the prepull-images utility
+source_without_prefix() {
+    local env_file="$1"
+    local prefix="$2"
+    local name
+
+    source "$env_file"
+    while IFS='=' read -r name _; do
+        if [[ $name == "$prefix"* ]]; then
+            export "${name#"$prefix"}=${!name}"
+        fi
+    done < "$env_file"
+}
 
-    local func_name="$2"
-    local indentation_level="${3:-1}"
-    local sleep_duration="0.5"
-    local spinner="/-\\|"
-    local spinner_length=${#spinner}
-    local spinner_index=0
+# Renders the {{ NAME }} placeholders of a template with the shell variables of the same
+# name, in a single pass. Placeholders of unset variables are left as they are.
+render_template() {
+    local template="$1"
+    local output="$2"
+    local rest name
+    local names=()
+
+    rest=$(<"$template")
+    while [[ $rest =~ \{\{\ ([A-Za-z_][A-Za-z0-9_]*)\ \}\} ]]; do
+        names+=("${BASH_REMATCH[1]}")
+        rest="${rest#*"${BASH_REMATCH[0]}"}"
+    done
 
-    local indentation=""
-    for ((i=1; i<=indentation_level; i++)); do
-        indentation+="\t"
+    if [ -n "$SYNTHO_CLI_PYTHON" ]; then
+        (
+            for name in "${names[@]}"; do
+                [ -n "${!name+x}" ] && export "${name?}"
+            done
+            PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.templates \
+                --template "$template" --output "$output" --cache-dir "$SHARED/templates"
+        )
+        return
+    fi
+
+    # without the CLI's interpreter, all placeholders are substituted by one sed run
+    local expressions=() value
+    for name in "${names[@]}"; do
+        if [ -n "${!name+x}" ]; then
+            value="${!name//\\/\\\\}"
+            value="${value//|/\\|}"
+            value="${value//&/\\&}"
+            expressions+=(-e "s|{{ $name }}|$value|g")
+        fi
     done
+    if [ ${#expressions[@]} -eq 0 ]; then
+        cp "$template" "$output"
+    else
+        sed "${expressions[@]}" "$template" > "$output"
+    fi
+}
 
-    # Determine the character based on the indentation level
-    local prefix=''
-    if [ $((indentation_level % 2)) -eq 1 ]; then
-        prefix='-'
+command_exists() {
+    type "$1" &> /dev/null
+}
+
+kubectl_pod_running() {
+    kubectl --kubeconfig "$KUBECONFIG" get pod -n "$1" | grep "^$2" | grep -q "Running"
+}
+
+# a pod is ready when all of its containers are, e.g. READY 1/1
+kubectl_pod_ready() {
+    kubectl --kubeconfig "$KUBECONFIG" get pod -n "$1" --no-headers | awk -v prefix="$2" '
+        index($1, prefix) == 1 && $3 == "Running" { split($2, count, "/"); if (count[1] == count[2]) ready = 1 }
+        END { exit !ready }'
+}
+
+# Waits through cli.readiness, which watches the resource and returns on its first ready
+# event. Returns 2 when it can't be used, e.g. without the CLI's interpreter.
+#
+# Usage: wait_with_readiness <pod-running|pod-ready|raycluster-ready> <namespace> <name> <timeout>
+wait_with_readiness() {
+    if [ -z "$SYNTHO_CLI_PYTHON" ]; then
+        return 2
+    fi
+
+    PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.readiness "$1" \
+        --kubeconfig "$KUBECONFIG" --namespace "$2" --name "$3" --timeout "$4"
+}
+
+# Waits until a pod whose name starts with <prefix> is running, polling with kubectl when
+# it can't be watched.
+#
+# Usage: wait_for_running_pod <namespace> <prefix> [<timeout>]
+wait_for_running_pod() {
+    local timeout="${3:-600}"
+    wait_with_readiness pod-running "$1" "$2" "$timeout"
+    local status=$?
+    if [ $status -ne 2 ]; then
+        return $status
+    fi
+
+    wait_for --timeout "$timeout" --interval 1 --max-interval 5 kubectl_pod_running "$1" "$2"
+}
+
+# Waits until a pod whose name starts with <prefix> is ready, like wait_for_running_pod
+#
+# Usage: wait_for_ready_pod <namespace> <prefix> [<timeout>]
+wait_for_ready_pod() {
+    local timeout="${3:-600}"
+    wait_with_readiness pod-ready "$1" "$2" "$timeout"
+    local status=$?
+    if [ $status -ne 2 ]; then
+        return $status
+    fi
+
+    wait_for --timeout "$timeout" --interval 1 --max-interval 5 kubectl_pod_ready "$1" "$2"
+}
+
+# One long-lived pod per deployment that the readiness checks fetch URLs from inside the
+# cluster with, instead of starting a pod per attempt. start_deployment and
+# cleanup-kubernetes.sh remove it again (k8s_deployment.PROBE_POD holds the same name).
+PROBE_POD="syntho-probe"
+PROBE_NAMESPACE="syntho"
+
+# Starts the probe pod unless it is already there. Returns 1 when it can't be started, e.g.
+# when its image can't be pulled.
+start_probe_pod() {
+    if ! kubectl --kubeconfig "$KUBECONFIG" --namespace "$PROBE_NAMESPACE" get pod "$PROBE_POD" &> /dev/null; then
+        kubectl --kubeconfig "$KUBECONFIG" --namespace "$PROBE_NAMESPACE" run "$PROBE_POD" \
+            --image="$BUSYBOX_IMG_REPO:$BUSYBOX_IMG_TAG" --restart=Never \
+            --labels="app.kubernetes.io/managed-by=syntho-cli" --command -- sleep 86400 || return 1
+    fi
+
+    wait_for_ready_pod "$PROBE_NAMESPACE" "$PROBE_POD" 120
+}
+
+stop_probe_pod() {
+    kubectl --kubeconfig "$KUBECONFIG" --namespace "$PROBE_NAMESPACE" delete pod "$PROBE_POD" \
+        --ignore-not-found --wait=false
+}
+
+# Prints the HTTP status codes of fetching <url> from the probe pod, one per response when
+# it gets redirected
+#
+# Usage: probe_http_status <url> [<host header>]
+probe_http_status() {
+    kubectl --kubeconfig "$KUBECONFIG" --namespace "$PROBE_NAMESPACE" exec "$PROBE_POD" -- \
+        wget -q -O /dev/null --server-response ${2:+--header "Host: $2"} "$1" 2>&1 | awk '/HTTP\// { print $2 }'
+}
+
+# Prints the body of <url> fetched from the probe pod
+probe_http_body() {
+    kubectl --kubeconfig "$KUBECONFIG" --namespace "$PROBE_NAMESPACE" exec "$PROBE_POD" -- wget -q -O- "$1"
+}
+
+# Prints the current time in seconds, with sub-second precision where the shell supports it
+now_seconds() {
+    if [ -n "$EPOCHREALTIME" ]; then
+        echo "${EPOCHREALTIME/,/.}"
     else
-        prefix='*'
+        date +%s
     fi
+}
+
+# Waits until a predicate command succeeds.
+#
+# Usage: wait_for [--timeout <s>] [--interval <s>] [--max-interval <s>] [--backoff <factor>]
+#                 [--replaces <s>] <command> [args...]
+#
+# The predicate runs immediately and then after every poll interval, which starts at
+# --interval and is multiplied by --backoff up to --max-interval. Returns 0 as soon as
+# the predicate succeeds, 1 once --timeout seconds have passed. --replaces is the fixed
+# delay this wait stands in for; what is left of it is reported as saved for the step.
+wait_for() {
+    local timeout=60
+    local interval=0.5
+    local max_interval=5
+    local backoff=2
+    local replaces=""
+
+    while [[ $# -gt 0 ]]; do
+        case "$1" in
+            --timeout) timeout="$2"; shift 2 ;;
+            --interval) interval="$2"; shift 2 ;;
+            --max-interval) max_interval="$2"; shift 2 ;;
+            --backoff) backoff="$2"; shift 2 ;;
+            --replaces) replaces="$2"; shift 2 ;;
+            *) break ;;
+        esac
+    done
 
-    echo -n -e "$indentation$prefix [00:00:00] $1 ${spinner:0:1}"
+    local started_at
+    started_at=$(now_seconds)
+    local deadline
+    deadline=$(awk -v s="$started_at" -v t="$timeout" 'BEGIN { printf "%.6f", s + t }')
 
+    local status=1
+    local now
     while true; do
-        elapsed_time=$(($(date +%s) - start_time))
-        echo "$elapsed_time" > "$SHARED/$func_name.elapsed"
+        if "$@"; then
+            status=0
+            break
+        fi
 
-        if [[ $(uname) == "Darwin" ]]; then
-            formatted_elapsed_time=$(date -u -r ${elapsed_time} +"%T")
-        else
-            formatted_elapsed_time=$(date -u -d @${elapsed_time} +"%T")
+        now=$(now_seconds)
+        if awk -v n="$now" -v d="$deadline" 'BEGIN { exit !(n >= d) }'; then
+            break
         fi
-        latest_elapsed_time="$formatted_elapsed_time"
-        spinner_char="${spinner:${spinner_index}:1}"
 
-        echo -n -e "\r$indentation$prefix [$latest_elapsed_time] $1 $spinner_char"
+        # never sleep past the deadline
+        sleep "$(awk -v n="$now" -v d="$deadline" -v i="$interval" 'BEGIN { r = d - n; print (r < i ? r : i) }')"
+        interval=$(awk -v i="$interval" -v b="$backoff" -v m="$max_interval" 'BEGIN { i = i * b; print (i > m ? m : i) }')
+    done
+
+    if [ -n "$replaces" ]; then
+        record_time_saved "$replaces" "$started_at"
+    fi
+
+    return $status
+}
+
+# Adds what is left of a replaced fixed delay to the time saved of the running step
+record_time_saved() {
+    local replaces="$1"
+    local started_at="$2"
+
+    if [ -z "$WAIT_STEP" ] || [ -z "$DEPLOYMENT_DIR" ]; then
+        return 0
+    fi
+
+    awk -v r="$replaces" -v s="$started_at" -v n="$(now_seconds)" \
+        'BEGIN { d = r - (n - s); printf "%.1f\n", (d > 0 ? d : 0) }' >> "$SHARED/$WAIT_STEP.saved"
+}
 
-        spinner_index=$(( (spinner_index + 1) % spinner_length ))
+# Archives the content of <source-dir> through cli.compression, which compresses on every
+# core. Without the CLI's interpreter it falls back to `tar -z` (gzip only).
+#
+# Usage: compress_dir <archive> <source-dir> [<gzip|zstd>] [<exclude-pattern>]
+compress_dir() {
+    local archive="$1"
+    local source_dir="$2"
+    local compression="${3:-gzip}"
+    local exclude="${4:-}"
+
+    if [ -n "$SYNTHO_CLI_PYTHON" ]; then
+        PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.compression \
+            tar --output "$archive" --source-dir "$source_dir" --compression "$compression" \
+            ${exclude:+--exclude "$exclude"}
+    elif [ "$compression" = "gzip" ]; then
+        tar ${exclude:+--exclude "$exclude"} -czvf "$archive" -C "$source_dir" .
+    else
+        echo "$compression compression needs the CLI's interpreter" >&2
+        return 1
+    fi
+}
 
-        sleep $sleep_duration
+# Extracts an archive of compress_dir, gzip or zstd.
+#
+# Usage: extract_archive <archive> <output-dir>
+extract_archive() {
+    if [ -n "$SYNTHO_CLI_PYTHON" ]; then
+        PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.compression \
+            extract --archive "$1" --output-dir "$2"
+    else
+        tar -xf "$1" -C "$2"
+    fi
+}
+
+# Fetches release tarballs through cli.release_cache, which downloads each version once per
+# host, resumes cut off downloads and checks them against their recorded sha256. Without the
+# CLI's interpreter they are downloaded with curl or wget.
+#
+# Usage: fetch_release <version> <url> <output> [<version> <url> <output> ...]
+fetch_release() {
+    if [ -n "$SYNTHO_CLI_PYTHON" ]; then
+        local args=()
+        while [ $# -ge 3 ]; do
+            args+=(--release "$1" "$2" "$3")
+            shift 3
+        done
+        PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.release_cache \
+            "${args[@]}"
+        return
+    fi
+
+    while [ $# -ge 3 ]; do
+        if command_exists "curl"; then
+            curl -fL "$2" -o "$3" || return 1
+        else
+            wget "$2" -O "$3" || return 1
+        fi
+        shift 3
     done
 }
 
-command_exists() {
-    type "$1" &> /dev/null
+is_process_finished() {
+    ! kill -0 "$1" 2>/dev/null
 }
 
 do_nothing() {
-    sleep 1
     errors=""
     echo "do nothing" >/dev/null 2>&1
     write_and_exit "$errors" "do_nothing"
 }
 
+# Prints the outcome of a step when it isn't supervised by cli.supervisor, line by line
+print_step_outcome() {
+    local prefix="$1"
+    local badge="$2"
+    local step_name="$3"
+    local started_at="$4"
+    local suffix="$5"
+
+    echo -e "$prefix [$badge] $step_name$suffix (took $(( SECONDS - started_at ))s)"
+}
+
 with_loading() {
     local step_name="$1"
     local function_to_run="$2"
@@ -122,7 +378,6 @@ with_loading() {
     local timeout_callback_function="$4"
     local indentation_level="${5:-1}"
     local errors=""
-    local elapsed_location="$SHARED/$function_to_run.elapsed"
 
     local indentation=""
     for ((i=1; i<=indentation_level; i++)); do
@@ -137,74 +392,81 @@ with_loading() {
         prefix='*'
     fi
 
-    show_loading_animation "$step_name" "$function_to_run" "$indentation_level" &
-    animation_pid=$!
-
-    # Run the command in the background
-    $function_to_run 2>&1 &
+    local errors_location="$DEPLOYMENT_DIR/errors/$function_to_run"
+    local status_location="$SHARED/$function_to_run.status"
+    local saved_location="$SHARED/$function_to_run.saved"
+    local process_logs_location="$SYNTHO_CLI_PROCESS_DIR/$function_to_run.log"
+    rm -f "$errors_location" "$status_location" "$saved_location"
+
+    # Run the command in the background, in its own process group so that it can be
+    # terminated as a whole. Its exit code is renamed into place once it exits.
+    set -m
+    {
+        trap 'echo $? > "$status_location.tmp" && mv "$status_location.tmp" "$status_location"' EXIT
+        WAIT_STEP="$function_to_run" $function_to_run
+    } 2>&1 &
     # Get the process ID
     pid=$!
-
-    # Check if the process is still running
-    local elapsed=0
-    local timedout="false"
-    while ps -p $pid > /dev/null; do
-        sleep 1
-
-        tmp_elapsed=$(<"$elapsed_location")
-        # Check if tmp_elapsed is an integer
-        if [[ "$tmp_elapsed" =~ ^[0-9]+$ ]]; then
-            elapsed=$tmp_elapsed
-        fi
-        if [ "$elapsed" -gt "$ttl" ]; then
-            timedout="true"
-            # Terminate the process
-            kill $pid
-            wait $pid 2>/dev/null
-            errors+="Process couldn't be finalized in a defined TTL\n"
-            break
-        fi
-    done
-
-    if [[ $timedout == "false" ]]; then
-        wait $pid
-        local exit_status=$?
-
-        if [[ $exit_status -ne 0 ]]; then
-            errors=$(cat $DEPLOYMENT_DIR/errors/$function_to_run)
+    set +m
+    step_pid=$pid
+
+    local outcome
+    if [ -n "$SYNTHO_CLI_PYTHON" ]; then
+        # Draws the step and waits for it with a real timeout
+        PYTHONPATH="$SYNTHO_CLI_PYTHONPATH${PYTHONPATH:+:$PYTHONPATH}" "$SYNTHO_CLI_PYTHON" -m cli.supervisor \
+            --pid "$pid" --ttl "$ttl" --title "$step_name" --indentation-level "$indentation_level" \
+            --status "$status_location" --saved "$saved_location" --process-logs "$process_logs_location"
+        outcome=$?
+    else
+        local started_at=$SECONDS
+        echo -e "$indentation$prefix [started] $step_name"
+        # Wait for the process to finish, detecting its end within a fraction of a second
+        if wait_for --timeout "$ttl" --interval 0.1 --max-interval 1 is_process_finished $pid; then
+            outcome=0
+        else
+            outcome=124
+            # Terminate the process group
+            kill -- "-$pid" 2>/dev/null
         fi
     fi
 
-    # Terminate the loading animation
-    kill $animation_pid
-    wait $animation_pid 2>/dev/null
+    wait $pid 2>/dev/null
+    local exit_status=$?
+    step_pid=""
 
-    if [ -n "$errors" ]; then
-        if [[ $timedout == "true" ]];then
-            echo -e "\r$indentation$prefix [${BOLD_WHITE_ON_ORANGE}timeout${NC}] $step_name $CLEARUP"
+    if [[ $outcome -eq 124 ]]; then
+        errors+="Process couldn't be finalized in a defined TTL\n"
+    elif [[ $exit_status -ne 0 ]]; then
+        errors=$(cat "$errors_location" 2>/dev/null)
+        errors="${errors:-"Process exited with status $exit_status"}"
+    fi
 
-            # Check if a timeout callback function is provided
-            if [ -n "$timeout_callback_function" ]; then
-                # Call the custom timeout callback function
-                $timeout_callback_function
-            fi
-        else
-            SYNTHO_CLI_PROCESS_LOGS="$SYNTHO_CLI_PROCESS_DIR/$function_to_run.log"
-            PROCESS_LOGS_MESSAGE_SUFFIX=""
-            if [ -f "$SYNTHO_CLI_PROCESS_LOGS" ]; then
+    if [ -z "$SYNTHO_CLI_PYTHON" ]; then
+        if [[ $outcome -eq 124 ]]; then
+            print_step_outcome "$indentation$prefix" "timeout" "$step_name" "$started_at"
+        elif [ -n "$errors" ]; then
+            # the same pointer to the process logs as cli.supervisor's
+            local process_logs_suffix=""
+            if [ -f "$process_logs_location" ]; then
                 mkdir -p /tmp/syntho
-                cp "$SYNTHO_CLI_PROCESS_LOGS" /tmp/syntho/.
-                PROCESS_LOGS_MESSAGE_SUFFIX=" (More detail can be found here: /tmp/syntho/$function_to_run.log)"
+                cp "$process_logs_location" /tmp/syntho/.
+                process_logs_suffix=" (More detail can be found here: /tmp/syntho/$function_to_run.log)"
             fi
+            print_step_outcome "$indentation$prefix" "failed" "$step_name" "$started_at" "$process_logs_suffix"
+        else
+            print_step_outcome "$indentation$prefix" "done" "$step_name" "$started_at"
+        fi
+    fi
 
-            echo -e "\r$indentation$prefix [${BOLD_WHITE_ON_RED}failed${NC}] $step_name$PROCESS_LOGS_MESSAGE_SUFFIX $CLEARUP"
+    if [ -n "$errors" ]; then
+        if [[ $outcome -eq 124 ]] && [ -n "$timeout_callback_function" ]; then
+            # Call the custom timeout callback function
+            $timeout_callback_function
         fi
 
         echo -e "\n${RED}Errors:${NC}"
         echo -e "$errors\n"
         exit 1
-    else
-        echo -e "\r$indentation$prefix [${BOLD_WHITE_ON_GREEN}done${NC}] $step_name $CLEARUP"
     fi
 }
 
@@ -214,7 +476,9 @@ write_and_exit() {
     local func_name="$2"
     mkdir -p $DEPLOYMENT_DIR/errors
     if [[ $errors != "" ]]; then
-        echo $errors > $DEPLOYMENT_DIR/errors/$func_name
+        # renamed into place, so the errors are never read half-written
+        echo $errors > "$DEPLOYMENT_DIR/errors/$func_name.tmp"
+        mv "$DEPLOYMENT_DIR/errors/$func_name.tmp" "$DEPLOYMENT_DIR/errors/$func_name"
         exit 1
     fi
     exit 0
@@ -0,0 +1,613 @@
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import datetime
+from typing import Dict, List, NoReturn, Optional, Tuple
+
+import yaml
+
+from cli.telemetry import read_script_timings
+from cli.utils import deployments_lock, state_transaction, thread_safe
+
+STATE_BACKEND_ENV = "SYNTHO_CLI_STATE_BACKEND"
+DEFAULT_STATE_BACKEND = "sqlite"
+
+JOURNAL_FILE = "state.journal"
+SNAPSHOT_FILE = "state.snapshot.json"
+JOURNAL_COMPACTION_THRESHOLD = 64 * 1024
+HISTORY_DIR = ".history"
+
+# state file path -> (stat key, parsed deployments state), see `StateBackend.get_deployments_state`
+_STATE_CACHE = {}
+# journal path -> ((journal stat key, snapshot stat key), journal state), see `DeploymentJournal.read`
+_JOURNAL_CACHE = {}
+
+
+def empty_deployments_state() -> Dict:
+    return {
+        "active_deployment_id": None,
+        "deployments": [],
+    }
+
+
+class DeploymentJournal:
+    """
+    Append-only log of the status transitions of one deployment.
+
+    Every transition is one JSON line in `<deployment_dir>/state.journal` with its
+    timestamp, step, the seconds since the previous transition and the exit code of
+    the script that caused it. `compact` folds the journal into
+    `state.snapshot.json`; entries carry a sequence number, so entries that are
+    already part of the snapshot are skipped if a compaction gets interrupted.
+
+    Reads hold the deployment's lock shared and writes hold it exclusive, so
+    deployments never wait on each other.
+    """
+
+    def __init__(self, deployment_dir: str):
+        self.deployment_dir = deployment_dir
+        self.deployments_dir, self.deployment_id = os.path.split(deployment_dir.rstrip("/"))
+
+    @property
+    def journal_path(self) -> str:
+        return f"{self.deployment_dir}/{JOURNAL_FILE}"
+
+    @property
+    def snapshot_path(self) -> str:
+        return f"{self.deployment_dir}/{SNAPSHOT_FILE}"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.journal_path) or os.path.exists(self.snapshot_path)
+
+    def _lock(self, shared: bool = False):
+        return deployments_lock(self.deployments_dir, shared=shared, deployment_id=self.deployment_id)
+
+    @contextmanager
+    def _locked_journal(self):
+        with self._lock(), open(self.journal_path, "a+b") as journal:
+            yield journal
+
+    def append(self, step: str, exitcode: Optional[int] = None, finished_at: Optional[str] = None) -> int:
+        """Appends a transition and returns the new size of the journal in bytes."""
+        with self._locked_journal() as journal:
+            last_entry = self._last_entry(journal) or self._read_snapshot()["last_entry"]
+            now = datetime.utcnow()
+            entry = {
+                "seq": last_entry["seq"] + 1 if last_entry else 1,
+                "timestamp": now.isoformat(),
+                "step": step,
+                "duration": (
+                    round((now - datetime.fromisoformat(last_entry["timestamp"])).total_seconds(), 3)
+                    if last_entry
+                    else 0.0
+                ),
+                "exitcode": exitcode,
+            }
+            if finished_at:
+                entry["finished_at"] = finished_at
+
+            journal.write(f"{json.dumps(entry)}\n".encode())
+            journal.flush()
+            return journal.tell()
+
+    @staticmethod
+    def _last_entry(journal) -> Optional[Dict]:
+        journal.seek(0, os.SEEK_END)
+        size = journal.tell()
+        journal.seek(max(0, size - 4096))
+        for line in reversed(journal.read().splitlines()):
+            try:
+                return json.loads(line)
+            except ValueError:
+                # a partially written line of an interrupted append
+                continue
+
+    def _read_snapshot(self) -> Dict:
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as file:
+                return json.load(file)
+
+        return {"status": None, "finished_at": None, "last_entry": None, "timeline": []}
+
+    def _replay(self, journal_state: Optional[Dict] = None, offset: int = 0) -> Tuple[Dict, int]:
+        """
+        Applies the journal from `offset` on top of `journal_state` (the snapshot by
+        default). Returns the new state and the offset up to which the journal was read.
+        """
+        if journal_state is None:
+            journal_state, offset = self._read_snapshot(), 0
+
+        last_seq = journal_state["last_entry"]["seq"] if journal_state["last_entry"] else 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as journal:
+                journal.seek(offset)
+                data = journal.read()
+
+            # a line without its newline is still being written
+            data = data[: data.rfind(b"\n") + 1]
+            offset += len(data)
+            for line in data.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["seq"] <= last_seq:
+                    continue
+
+                journal_state["timeline"].append(entry)
+                journal_state["status"] = entry["step"]
+                journal_state["finished_at"] = entry.get("finished_at", journal_state["finished_at"])
+                journal_state["last_entry"] = entry
+                last_seq = entry["seq"]
+
+        return journal_state, offset
+
+    def read(self) -> Optional[Dict]:
+        """
+        Returns the current status, finished_at and full timeline, or None when the
+        deployment has no journal yet. Only the part of the journal appended since the
+        previous read in this process gets parsed.
+        """
+        journal_state = self._read_cached()
+        return deepcopy(journal_state) if journal_state else None
+
+    def current(self) -> Optional[Dict]:
+        """Like `read`, without the timeline."""
+        journal_state = self._read_cached()
+        if not journal_state:
+            return None
+
+        return {"status": journal_state["status"], "finished_at": journal_state["finished_at"]}
+
+    def _read_cached(self) -> Optional[Dict]:
+        if not self.exists():
+            return None
+
+        with self._lock(shared=True):
+            snapshot_key = state_file_key(self.snapshot_path)
+            journal_key = state_file_key(self.journal_path)
+            # (snapshot stat key, journal inode, parsed journal bytes, journal state)
+            cached = _JOURNAL_CACHE.get(self.journal_path)
+            if (
+                cached is not None
+                and journal_key is not None
+                and cached[0] == snapshot_key
+                and cached[1] == journal_key[0]
+                and cached[2] <= journal_key[2]
+            ):
+                if cached[2] == journal_key[2]:
+                    return cached[3]
+
+                journal_state, offset = self._replay(cached[3], cached[2])
+            else:
+                journal_state, offset = self._replay()
+
+        _JOURNAL_CACHE[self.journal_path] = (
+            snapshot_key,
+            journal_key[0] if journal_key else None,
+            offset,
+            journal_state,
+        )
+        return journal_state
+
+    def compact(self) -> Optional[Dict]:
+        if not self.exists():
+            return None
+
+        with self._locked_journal() as journal:
+            journal_state, _ = self._replay()
+            tmp_snapshot_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_snapshot_path, "w") as file:
+                json.dump(journal_state, file)
+            os.replace(tmp_snapshot_path, self.snapshot_path)
+            journal.truncate(0)
+
+        return journal_state
+
+
+class StateBackend(ABC):
+    """
+    Storage for the deployments index of one deployment tooling (k8s or dc).
+
+    The index is a list of deployment records plus the id of the active
+    deployment. `get_deployments_state` and `update_deployments_state` keep the
+    historical whole-state shape; the other methods touch a single record.
+    """
+
+    def __init__(self, deployments_dir: str, tooling: str):
+        self.deployments_dir = deployments_dir
+        self.tooling = tooling
+
+    @property
+    @abstractmethod
+    def path(self) -> str:
+        pass
+
+    @abstractmethod
+    def _load_deployments_state(self) -> Dict:
+        pass
+
+    def _get_index(self) -> Dict:
+        """
+        Returns the parsed index, served from a process-local cache while the state
+        file keeps the same inode, mtime and size. The result must not be mutated.
+        """
+        key = self._state_file_key()
+        cached = _STATE_CACHE.get(self.path)
+        if key is not None and cached is not None and cached[0] == key:
+            return cached[1]
+
+        # the key is taken before loading, so a concurrent change can only cause an extra reload
+        deployments_state = self._load_deployments_state()
+        if key is not None:
+            _STATE_CACHE[self.path] = (key, deepcopy(deployments_state))
+
+        return deployments_state
+
+    def _with_journal(self, deployment: Dict) -> Dict:
+        # the journal of a deployment is ahead of the index until it gets compacted
+        deployment = deepcopy(deployment)
+        journal_state = self.journal(deployment["id"]).current()
+        if journal_state and journal_state["status"]:
+            deployment["status"] = journal_state["status"]
+            deployment["finished_at"] = journal_state["finished_at"] or deployment.get("finished_at")
+
+        return deployment
+
+    def get_deployments_state(self) -> Dict:
+        index = self._get_index()
+        return {
+            "active_deployment_id": index["active_deployment_id"],
+            "deployments": [self._with_journal(deployment) for deployment in index["deployments"]],
+        }
+
+    def _remember_deployments_state(self, deployments_state: Dict) -> NoReturn:
+        """Refreshes the cache after a write, must be called while the write is still exclusive."""
+        key = self._state_file_key()
+        if key is not None:
+            _STATE_CACHE[self.path] = (key, deepcopy(deployments_state))
+
+    def _state_file_key(self) -> Optional[Tuple]:
+        return state_file_key(self.path)
+
+    def _forget_deployments_state(self) -> NoReturn:
+        _STATE_CACHE.pop(self.path, None)
+
+    @abstractmethod
+    def update_deployments_state(self, deployments_state: Dict) -> NoReturn:
+        pass
+
+    def get_deployment(self, deployment_id: str) -> Optional[Dict]:
+        for deployment in self._get_index()["deployments"]:
+            if deployment["id"] == deployment_id:
+                return self._with_journal(deployment)
+
+    def get_deployments(self) -> List[Dict]:
+        return self.get_deployments_state()["deployments"]
+
+    def get_active_deployment_id(self) -> Optional[str]:
+        return self._get_index()["active_deployment_id"]
+
+    @abstractmethod
+    def add_deployment(self, deployment: Dict) -> NoReturn:
+        """Appends a deployment record and makes it the active deployment."""
+
+    def journal(self, deployment_id: str) -> DeploymentJournal:
+        return DeploymentJournal(f"{self.deployments_dir}/{deployment_id}")
+
+    def record_transition(
+        self, deployment_id: str, status: str, exitcode: Optional[int] = None, finished_at: Optional[str] = None
+    ) -> NoReturn:
+        """Appends a status transition to the deployment's journal, compacting it once it grows too big."""
+        journal = self.journal(deployment_id)
+        if not os.path.isdir(journal.deployment_dir):
+            fields = {"status": status}
+            if finished_at:
+                fields["finished_at"] = finished_at
+            self.update_deployment(deployment_id, **fields)
+            return
+
+        journal_size = journal.append(status, exitcode=exitcode, finished_at=finished_at)
+        if journal_size > JOURNAL_COMPACTION_THRESHOLD:
+            self.compact_deployment(deployment_id)
+
+    def compact_deployment(self, deployment_id: str) -> Optional[Dict]:
+        """Folds the deployment's journal into its snapshot and writes the current status to the index."""
+        journal_state = self.journal(deployment_id).compact()
+        if journal_state and journal_state["status"]:
+            fields = {"status": journal_state["status"]}
+            if journal_state["finished_at"]:
+                fields["finished_at"] = journal_state["finished_at"]
+            self.update_deployment(deployment_id, **fields)
+
+        return journal_state
+
+    def get_deployment_timeline(self, deployment_id: str) -> List[Dict]:
+        journal_state = self.journal(deployment_id).read()
+        return journal_state["timeline"] if journal_state else []
+
+    def get_script_timings(self, deployment_id: str) -> List[Dict]:
+        """Wall time, CPU time and peak RSS of every script the deployment ran, in the order they finished."""
+        return read_script_timings(f"{self.deployments_dir}/{deployment_id}")
+
+    def archive_deployment(self, deployment_id: str) -> Optional[str]:
+        """
+        Keeps the record and the timeline of a deployment under `.history` before
+        its directory gets removed. Returns the path of the archive.
+        """
+        deployment = self.get_deployment(deployment_id)
+        if deployment is None:
+            return None
+
+        journal_state = self.compact_deployment(deployment_id)
+        history_dir = f"{self.deployments_dir}/{HISTORY_DIR}"
+        if not os.path.exists(history_dir):
+            os.makedirs(history_dir)
+
+        archive_path = f"{history_dir}/{deployment_id}-{int(time.time())}.json"
+        with open(archive_path, "w") as file:
+            json.dump(
+                {
+                    "deployment": self.get_deployment(deployment_id),
+                    "timeline": journal_state["timeline"] if journal_state else [],
+                    "script_timings": self.get_script_timings(deployment_id),
+                },
+                file,
+            )
+
+        return archive_path
+
+    @abstractmethod
+    def update_deployment(self, deployment_id: str, **fields) -> NoReturn:
+        pass
+
+    @abstractmethod
+    def remove_deployment(self, deployment_id: str) -> NoReturn:
+        """Removes a deployment record and activates the most recent remaining one."""
+
+
+class YamlStateBackend(StateBackend):
+    """
+    The original `<tooling>-deployment-state.yaml` file, rewritten as a whole on every change.
+
+    Every change is a single `state_transaction`: one lock, one parse and one write.
+    """
+
+    @property
+    def path(self) -> str:
+        return yaml_state_path(self.deployments_dir, self.tooling)
+
+    def transaction(self):
+        return state_transaction(
+            self.deployments_dir,
+            os.path.basename(self.path),
+            default=empty_deployments_state,
+            on_commit=self._remember_deployments_state,
+        )
+
+    def _load_deployments_state(self) -> Dict:
+        return _read_yaml_state(self.deployments_dir, self.path)
+
+    def update_deployments_state(self, deployments_state: Dict) -> NoReturn:
+        with self.transaction() as state:
+            state.clear()
+            state.update(deployments_state)
+
+    def add_deployment(self, deployment: Dict) -> NoReturn:
+        with self.transaction() as deployments_state:
+            deployments_state["deployments"].append(deployment)
+            deployments_state["active_deployment_id"] = deployment["id"]
+
+    def update_deployment(self, deployment_id: str, **fields) -> NoReturn:
+        with self.transaction() as deployments_state:
+            for deployment in deployments_state["deployments"]:
+                if deployment["id"] == deployment_id:
+                    deployment.update(fields)
+
+    def remove_deployment(self, deployment_id: str) -> NoReturn:
+        with self.transaction() as deployments_state:
+            deployments = [d for d in deployments_state["deployments"] if d["id"] != deployment_id]
+            deployments_state["deployments"] = deployments
+            deployments_state["active_deployment_id"] = deployments[-1]["id"] if deployments else None
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    One row per deployment in `<tooling>-deployment-state.db`, indexed by id.
+
+    Every change runs in its own transaction and only touches the affected row. On
+    first use an existing YAML state file is imported once; the YAML file itself is
+    left in place so older CLI versions keep working until they are upgraded.
+    """
+
+    SCHEMA = [
+        (
+            "CREATE TABLE IF NOT EXISTS deployments ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, data TEXT NOT NULL)"
+        ),
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    ]
+
+    def __init__(self, deployments_dir: str, tooling: str):
+        super().__init__(deployments_dir, tooling)
+        self._initialized = False
+
+    @property
+    def path(self) -> str:
+        return f"{self.deployments_dir}/{self.tooling}-deployment-state.db"
+
+    @contextmanager
+    def transaction(self, write: bool = True):
+        if not os.path.exists(self.deployments_dir):
+            os.makedirs(self.deployments_dir)
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            # a write lock is taken upfront so that read-modify-write cycles can't interleave
+            connection.execute("BEGIN IMMEDIATE" if write or not self._initialized else "BEGIN")
+            try:
+                if not self._initialized:
+                    self._initialize(connection)
+                yield connection
+                if write:
+                    change_counter = self._change_counter()
+                    deployments_state = self._read_all(connection)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+        if write:
+            # the lock is gone after COMMIT, so the new state is only cached when the
+            # change counter proves that no other process has committed since
+            key = self._state_file_key()
+            if key is not None and key[-1] == change_counter + 1:
+                _STATE_CACHE[self.path] = (key, deepcopy(deployments_state))
+            else:
+                self._forget_deployments_state()
+
+    def _change_counter(self) -> int:
+        with open(self.path, "rb") as file:
+            file.seek(24)
+            return int.from_bytes(file.read(4), "big")
+
+    def _state_file_key(self) -> Optional[Tuple]:
+        key = state_file_key(self.path)
+        if key is None:
+            return None
+
+        # pages are rewritten in place, so the size rarely changes; the header's change
+        # counter is bumped on every commit and covers writes within one mtime tick
+        return key + (self._change_counter(),)
+
+    def _initialize(self, connection: sqlite3.Connection) -> NoReturn:
+        for statement in self.SCHEMA:
+            connection.execute(statement)
+        migrated = connection.execute("SELECT value FROM meta WHERE key = 'migrated_from_yaml'").fetchone()
+        if migrated is None:
+            yaml_path = yaml_state_path(self.deployments_dir, self.tooling)
+            if os.path.exists(yaml_path):
+                deployments_state = _read_yaml_state(self.deployments_dir, yaml_path)
+                self._replace_all(connection, deployments_state)
+            connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_yaml', ?)",
+                (yaml_path if os.path.exists(yaml_path) else "",),
+            )
+        self._initialized = True
+
+    def _replace_all(self, connection: sqlite3.Connection, deployments_state: Dict) -> NoReturn:
+        connection.execute("DELETE FROM deployments")
+        for deployment in deployments_state.get("deployments") or []:
+            connection.execute(
+                "INSERT OR REPLACE INTO deployments (id, data) VALUES (?, ?)",
+                (deployment["id"], json.dumps(deployment)),
+            )
+        self._set_active(connection, deployments_state.get("active_deployment_id"))
+
+    @staticmethod
+    def _set_active(connection: sqlite3.Connection, deployment_id: Optional[str]) -> NoReturn:
+        connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('active_deployment_id', ?)",
+            (deployment_id,),
+        )
+
+    @staticmethod
+    def _get_active(connection: sqlite3.Connection) -> Optional[str]:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'active_deployment_id'").fetchone()
+        return row[0] if row else None
+
+    def _read_all(self, connection: sqlite3.Connection) -> Dict:
+        rows = connection.execute("SELECT data FROM deployments ORDER BY seq").fetchall()
+        return {
+            "active_deployment_id": self._get_active(connection),
+            "deployments": [json.loads(data) for (data,) in rows],
+        }
+
+    def _load_deployments_state(self) -> Dict:
+        with self.transaction(write=False) as connection:
+            return self._read_all(connection)
+
+    def update_deployments_state(self, deployments_state: Dict) -> NoReturn:
+        with self.transaction() as connection:
+            self._replace_all(connection, deployments_state)
+
+    def add_deployment(self, deployment: Dict) -> NoReturn:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM deployments WHERE id = ?", (deployment["id"],))
+            connection.execute(
+                "INSERT INTO deployments (id, data) VALUES (?, ?)",
+                (deployment["id"], json.dumps(deployment)),
+            )
+            self._set_active(connection, deployment["id"])
+
+    def update_deployment(self, deployment_id: str, **fields) -> NoReturn:
+        with self.transaction() as connection:
+            row = connection.execute("SELECT data FROM deployments WHERE id = ?", (deployment_id,)).fetchone()
+            if row is None:
+                return
+
+            deployment = json.loads(row[0])
+            deployment.update(fields)
+            connection.execute(
+                "UPDATE deployments SET data = ? WHERE id = ?",
+                (json.dumps(deployment), deployment_id),
+            )
+
+    def remove_deployment(self, deployment_id: str) -> NoReturn:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM deployments WHERE id = ?", (deployment_id,))
+            row = connection.execute("SELECT id FROM deployments ORDER BY seq DESC LIMIT 1").fetchone()
+            self._set_active(connection, row[0] if row else None)
+
+
+STATE_BACKENDS = {
+    "sqlite": SqliteStateBackend,
+    "yaml": YamlStateBackend,
+}
+_STATE_BACKEND_INSTANCES = {}
+
+
+def get_state_backend(deployments_dir: str, tooling: str) -> StateBackend:
+    backend_name = os.environ.get(STATE_BACKEND_ENV, DEFAULT_STATE_BACKEND)
+    backend_cls = STATE_BACKENDS.get(backend_name)
+    if backend_cls is None:
+        raise ValueError(
+            f"Unknown state backend ({backend_name}) in {STATE_BACKEND_ENV}. "
+            f"Supported backends: {', '.join(STATE_BACKENDS)}"
+        )
+
+    key = (backend_name, deployments_dir, tooling)
+    if key not in _STATE_BACKEND_INSTANCES:
+        _STATE_BACKEND_INSTANCES[key] = backend_cls(deployments_dir, tooling)
+
+    return _STATE_BACKEND_INSTANCES[key]
+
+
+def state_file_key(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def yaml_state_path(deployments_dir: str, tooling: str) -> str:
+    return f"{deployments_dir}/{tooling}-deployment-state.yaml"
+
+
+@thread_safe(shared=True)
+def _read_yaml_state(deployments_dir: str, path: str) -> Dict:
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            deployments_state = yaml.safe_load(file)
+            if deployments_state:
+                return deployments_state
+
+    return empty_deployments_state()
@@ -0,0 +1,195 @@
+"""
+Supervises and draws a step that `with_loading` (scripts/utils.sh) started in its own
+process group.
+
+    python -m cli.supervisor --pid <pid> --ttl <seconds> --title <title> [--indentation-level <n>]
+                             [--status <file>] [--saved <file>] [--process-logs <file>]
+
+Waits for the step to end without polling, using a pidfd where the platform has one, and
+redraws its progress in between. When the TTL expires the step's whole process group is
+terminated (and killed after a grace period). The step reports its exit code through the
+status file; the exit code of the supervisor is the outcome: 0 done, 1 failed,
+TIMEOUT_EXITCODE or INTERRUPTED_EXITCODE.
+"""
+
+import argparse
+import os
+import select
+import shutil
+import signal
+import sys
+import time
+from typing import Callable, NoReturn, Optional
+
+from cli.progress import TICK_INTERVAL, Badge, StepProgress
+
+FAILED_EXITCODE = 1
+TIMEOUT_EXITCODE = 124
+INTERRUPTED_EXITCODE = 130
+KILL_GRACE_PERIOD = 5
+# used where pidfds aren't available, e.g. on macOS
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+# failed steps' process logs are copied here, so they outlive the deployment directory
+PROCESS_LOGS_COPY_DIR = "/tmp/syntho"
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return not is_zombie(pid)
+
+
+def is_zombie(pid: int) -> bool:
+    # a finished step stays a zombie until the shell that started it waits for it
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            return file.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except (FileNotFoundError, IndexError):
+        return False
+
+
+def wait_for_exit(pid: int, timeout: float, on_tick: Callable[[], None] = None) -> bool:
+    """Returns whether the process ended within 'timeout' seconds, calling 'on_tick' every TICK_INTERVAL"""
+    deadline = time.monotonic() + timeout
+    tick_interval = TICK_INTERVAL if on_tick else timeout
+
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pidfd = None
+
+    if pidfd is not None:
+        try:
+            # the pidfd gets readable once the process terminated
+            poller = select.poll()
+            poller.register(pidfd, select.POLLIN)
+            while True:
+                remaining = deadline - time.monotonic()
+                if poller.poll(max(min(tick_interval, remaining), 0) * 1000):
+                    return True
+                if remaining <= tick_interval:
+                    return False
+                if on_tick:
+                    on_tick()
+        finally:
+            os.close(pidfd)
+
+    interval = POLL_INTERVAL
+    next_tick = time.monotonic() + tick_interval
+    while is_running(pid):
+        now = time.monotonic()
+        if now >= deadline:
+            return False
+        if on_tick and now >= next_tick:
+            on_tick()
+            next_tick = now + tick_interval
+        time.sleep(min(interval, deadline - now, max(next_tick - now, 0)))
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    return True
+
+
+def kill_group(pgid: int, grace_period: float = KILL_GRACE_PERIOD) -> NoReturn:
+    """Terminates a process group, killing it when its leader is still there after 'grace_period'"""
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    if not wait_for_exit(pgid, grace_period):
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def read_exitcode(status_path: Optional[str]) -> Optional[int]:
+    # the step renames the status file into place, it is never seen half-written
+    if not status_path or not os.path.exists(status_path):
+        return None
+
+    with open(status_path, "r") as file:
+        try:
+            return int(file.read().strip())
+        except ValueError:
+            return None
+
+
+def get_saved_suffix(saved_path: Optional[str]) -> str:
+    if not saved_path or not os.path.exists(saved_path):
+        return ""
+
+    with open(saved_path, "r") as file:
+        saved = sum(float(line) for line in file if line.strip())
+    if round(saved, 1) == 0:
+        return ""
+
+    return f" ({saved:.1f}s saved by waiting on readiness)"
+
+
+def get_process_logs_suffix(process_logs_path: Optional[str]) -> str:
+    if not process_logs_path or not os.path.exists(process_logs_path):
+        return ""
+
+    os.makedirs(PROCESS_LOGS_COPY_DIR, exist_ok=True)
+    shutil.copy(process_logs_path, PROCESS_LOGS_COPY_DIR)
+    copy_path = os.path.join(PROCESS_LOGS_COPY_DIR, os.path.basename(process_logs_path))
+    return f" (More detail can be found here: {copy_path})"
+
+
+def supervise(
+    pid: int,
+    ttl: float,
+    progress: StepProgress,
+    status_path: Optional[str] = None,
+    saved_path: Optional[str] = None,
+    process_logs_path: Optional[str] = None,
+) -> int:
+    progress.start()
+    try:
+        finished = wait_for_exit(pid, ttl, on_tick=progress.tick)
+    except KeyboardInterrupt:
+        kill_group(pid)
+        progress.interrupt()
+        return INTERRUPTED_EXITCODE
+
+    if not finished:
+        kill_group(pid)
+        progress.finish(Badge.TIMEOUT)
+        return TIMEOUT_EXITCODE
+
+    if read_exitcode(status_path) != 0:
+        progress.finish(Badge.FAILED, get_process_logs_suffix(process_logs_path))
+        return FAILED_EXITCODE
+
+    progress.finish(Badge.DONE, get_saved_suffix(saved_path))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Supervises a step started by with_loading")
+    parser.add_argument("--pid", type=int, required=True, help="The step's pid, which is also its process group id")
+    parser.add_argument("--ttl", type=float, required=True, help="Seconds after which the step is killed")
+    parser.add_argument("--title", required=True, help="The step's name as it is shown")
+    parser.add_argument("--indentation-level", type=int, default=1)
+    parser.add_argument("--status", help="The file the step reports its exit code into")
+    parser.add_argument("--saved", help="The file the step reports the time it saved into")
+    parser.add_argument("--process-logs", help="The step's process logs, pointed to when it failed")
+    args = parser.parse_args(argv)
+
+    progress = StepProgress(args.title, indentation_level=args.indentation_level)
+    return supervise(args.pid, args.ttl, progress, args.status, args.saved, args.process_logs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 from importlib import metadata
@@ -10,7 +11,9 @@ import yaml
 from cli import dc_deployment as dc_deployment_manager
 from cli import k8s_deployment as k8s_deployment_manager
 from cli import utils
+from cli.compression import COMPRESSIONS, DEFAULT_COMPRESSION, get_available_compressions
 from cli.releases import get_releases
+from cli.telemetry import format_timings_table
 from cli.utilities import offline_ops as offline_ops_manager
 from cli.utilities import prepull_images as prepull_images_manager
 
@@ -58,6 +61,14 @@ def validate_docker_config(ctx, param, value):
     return value
 
 
+def validate_compression(ctx, param, value):
+    if value not in get_available_compressions():
+        raise click.BadParameter(
+            f"{value} compression isn't available here, please install it with `pip install \"syntho-cli[zstd]\"`"
+        )
+    return value
+
+
 def validate_trusted_registry(ctx, param, value):
     if value:
         prepull_images_file_dir = prepull_images_manager.generate_prepull_images_dir(scripts_dir)
@@ -242,6 +253,27 @@ def list_releases():
         click.echo("-" * 40)
 
 
+def show_timings(deployment_manager, deployment_id: str, json_path: Optional[str]):
+    deployment = deployment_manager.get_deployment(scripts_dir, deployment_id)
+    timings = deployment_manager.get_script_timings(scripts_dir, deployment_id)
+    if not timings:
+        click.echo(f"There are no timings recorded for the deployment ({deployment_id}) yet")
+    else:
+        click.echo(format_timings_table(timings))
+
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(
+                {
+                    "deployment_id": deployment_id,
+                    "version": deployment.get("version") if deployment else None,
+                    "script_timings": timings,
+                },
+                file,
+                indent=2,
+            )
+
+
 @k8s.command(name="deployment", help="Deploys the Syntho Stack into the given cluster")
 @click.option(
     "--license-key",
@@ -305,6 +337,15 @@ def list_releases():
         "with their associated values.yaml are generated successfully"
     ),
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    help=(
+        "Resumes an unfinished deployment from its first incomplete step, reusing the downloaded "
+        "release and the answered configuration. The given options replace the unfinished run's, "
+        "and the configuration step runs again when they change"
+    ),
+)
 def k8s_deployment(
     license_key: str,
     registry_user: str,
@@ -315,6 +356,7 @@ def k8s_deployment(
     skip_configuration: bool,
     use_trusted_registry: bool,
     dry_run: bool,
+    resume: bool,
 ):
     try:
         validate_input_params(
@@ -359,6 +401,7 @@ def k8s_deployment(
         use_trusted_registry,
         get_version("syntho-cli"),
         dry_run,
+        resume,
     )
 
     if result.succeeded:
@@ -395,6 +438,15 @@ def k8s_deployment(
         )
     else:
         deployment_failed_text = click.style(f"Error deploying to kubernetes: {result.error}", fg="red")
+        if k8s_deployment_manager.is_resumable(scripts_dir, result.deployment_id):
+            resume_text = click.style(
+                "The deployment is kept. Please fix the issue and rerun the same command with `--resume`, "
+                f"or run `syntho-cli k8s destroy --deployment-id {result.deployment_id}` to start over",
+                fg="red",
+            )
+            click.echo(f"\n\n{deployment_failed_text}\n{resume_text}", err=True)
+            sys.exit(1)
+
         cleaningthingsup_text = click.style("Cleaning things up", fg="red")
         click.echo(f"\n\n{deployment_failed_text} - {cleaningthingsup_text}", err=True)
         is_destroyed = k8s_deployment_manager.cleanup(scripts_dir, result.deployment_id, result.deployment_status)
@@ -512,6 +564,26 @@ def k8s_deployment_status(deployment_id: str):
         click.echo(as_yaml)
 
 
+@k8s.command(name="timings", help="Shows how long each script of the given deployment took and what it used")
+@click.option(
+    "--deployment-id",
+    type=str,
+    help="Specify the deployment id",
+    required=False,
+    default="",
+    callback=validate_k8s_deployment_id,
+)
+@click.option(
+    "--json",
+    "json_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also export the timings as JSON into the given file, e.g. to compare releases",
+    required=False,
+)
+def k8s_timings(deployment_id: str, json_path: Optional[str]):
+    show_timings(k8s_deployment_manager, deployment_id, json_path)
+
+
 @k8s.command(name="destroy", help="Destroys a deployment and its components")
 @click.option(
     "--deployment-id",
@@ -644,6 +716,15 @@ def k8s_logs(deployment_id: str, n: int, f: bool):
         "that compose config are generated successfully"
     ),
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    help=(
+        "Resumes an unfinished deployment from its first incomplete step, reusing the downloaded "
+        "release and the answered configuration. The given options replace the unfinished run's, "
+        "and the configuration step runs again when they change"
+    ),
+)
 def dc_deployment(
     license_key: str,
     registry_user: str,
@@ -656,6 +737,7 @@ def dc_deployment(
     use_trusted_registry: bool,
     use_offline_registry: bool,
     dry_run: bool,
+    resume: bool,
 ):
     try:
         validate_input_params(
@@ -701,6 +783,7 @@ def dc_deployment(
         use_offline_registry,
         get_version("syntho-cli"),
         dry_run,
+        resume,
     )
 
     if result.succeeded:
@@ -737,6 +820,15 @@ def dc_deployment(
         )
     else:
         deployment_failed_text = click.style(f"Error deploying to docker compose: {result.error}", fg="red")
+        if dc_deployment_manager.is_resumable(scripts_dir, result.deployment_id):
+            resume_text = click.style(
+                "The deployment is kept. Please fix the issue and rerun the same command with `--resume`, "
+                f"or run `syntho-cli dc destroy --deployment-id {result.deployment_id}` to start over",
+                fg="red",
+            )
+            click.echo(f"\n\n{deployment_failed_text}\n{resume_text}", err=True)
+            sys.exit(1)
+
         cleaningthingsup_text = click.style("Cleaning things up", fg="red")
         click.echo(f"\n\n{deployment_failed_text} - {cleaningthingsup_text}", err=True)
         is_destroyed = dc_deployment_manager.cleanup(scripts_dir, result.deployment_id, result.deployment_status)
@@ -863,6 +955,26 @@ def dc_deployment_status(deployment_id: str):
         click.echo(as_yaml)
 
 
+@dc.command(name="timings", help="Shows how long each script of the given deployment took and what it used")
+@click.option(
+    "--deployment-id",
+    type=str,
+    help="Specify the deployment id",
+    required=False,
+    default="",
+    callback=validate_dc_deployment_id,
+)
+@click.option(
+    "--json",
+    "json_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also export the timings as JSON into the given file, e.g. to compare releases",
+    required=False,
+)
+def dc_timings(deployment_id: str, json_path: Optional[str]):
+    show_timings(dc_deployment_manager, deployment_id, json_path)
+
+
 @dc.command(name="destroy", help="Destroys a deployment and its components")
 @click.option(
     "--deployment-id",
@@ -954,8 +1066,20 @@ def dc_logs(deployment_id: str, n: int, f: bool):
     required=False,
     callback=validate_docker_config,
 )
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    help=f"Specify how many images are pulled and pushed at once. Default: {prepull_images_manager.MIRROR_CONCURRENCY}",
+    default=prepull_images_manager.MIRROR_CONCURRENCY,
+    required=False,
+)
 def prepull_images(
-    trusted_registry: str, syntho_registry_user: str, syntho_registry_pwd: str, version: str, docker_config: str
+    trusted_registry: str,
+    syntho_registry_user: str,
+    syntho_registry_pwd: str,
+    version: str,
+    docker_config: str,
+    concurrency: int,
 ):
     arch = utils.get_architecture()
     if not utils.is_arch_supported(arch):
@@ -981,6 +1105,7 @@ def prepull_images(
         syntho_registry_user,
         syntho_registry_pwd,
         docker_config,
+        concurrency,
     )
     if not result:
         pull_failed_text = click.style(f"Error pulling images. Error: {err}\n", fg="red")
@@ -1032,7 +1157,35 @@ def prepull_images(
     required=False,
     callback=validate_docker_config,
 )
-def activate_offline_mode(syntho_registry_user: str, syntho_registry_pwd: str, version: str, docker_config: str):
+@click.option(
+    "--since",
+    type=str,
+    help=(
+        "Specify a version that offline mode was activated for before, to also make an archive "
+        "of only what is new since that version - 'syntho-cli utilities import-offline-delta --help'"
+    ),
+    default=None,
+    required=False,
+)
+@click.option(
+    "--compression",
+    type=click.Choice(COMPRESSIONS),
+    help=(
+        "Specify the compression of the offline archive, on every core of this host. "
+        "zstd needs the zstd extra, `pip install \"syntho-cli[zstd]\"`. Default: gzip"
+    ),
+    default=DEFAULT_COMPRESSION,
+    required=False,
+    callback=validate_compression,
+)
+def activate_offline_mode(
+    syntho_registry_user: str,
+    syntho_registry_pwd: str,
+    version: str,
+    docker_config: str,
+    since: Optional[str],
+    compression: str,
+):
     arch = utils.get_architecture()
     if not utils.is_arch_supported(arch):
         raise click.ClickException(f"Unsupported architecture: {arch}. Only AMD/ARM is supported.")
@@ -1056,6 +1209,8 @@ def activate_offline_mode(syntho_registry_user: str, syntho_registry_pwd: str, v
         syntho_registry_user,
         syntho_registry_pwd,
         docker_config,
+        since,
+        compression,
     )
     if not result:
         failed_text = click.style(f"Error activating offline mode. Error: {err}\n", fg="red")
@@ -1073,6 +1228,78 @@ def activate_offline_mode(syntho_registry_user: str, syntho_registry_pwd: str, v
             bold=True,
         )
         click.echo("\n" f"{successful_text}\n\n" f"{extra_info_text1}\n")
+        if since:
+            delta_archive_path = offline_ops_manager.generate_offline_delta_archive_path(
+                scripts_dir, since, version, compression
+            )
+            extra_info_text2 = click.style(
+                f"Delta since {since}: {delta_archive_path} - syntho-cli utilities import-offline-delta --help",
+                fg="white",
+                bold=True,
+            )
+            click.echo(f"{extra_info_text2}\n")
+
+
+@utilities.command(
+    name="import-offline-delta",
+    help=(
+        "Imports a delta archive made with 'activate-offline-mode --since <version>' onto the offline "
+        "registry of that version"
+    ),
+)
+@click.option(
+    "--archive",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Specify the path of the delta archive",
+    required=True,
+)
+def import_offline_delta(archive: str):
+    result, err = offline_ops_manager.import_offline_delta(scripts_dir, archive)
+    if not result:
+        failed_text = click.style(f"Error importing the offline delta. Error: {err}\n", fg="red")
+        click.echo(f"\n\n{failed_text}", err=True)
+    else:
+        successful_text = click.style(
+            "The delta has been imported onto the offline registry. See helpful commands below.",
+            fg="white",
+            bold=True,
+        )
+        extra_info_text1 = click.style(
+            "Docker compose deployment from an offline registry: syntho-cli dc deployment --help",
+            fg="white",
+            bold=True,
+        )
+        click.echo("\n" f"{successful_text}\n\n" f"{extra_info_text1}\n")
+
+
+@utilities.command(name="status", help="Shows the status of a utility and what its last run recorded")
+@click.option(
+    "--utility-name",
+    type=str,
+    help="Specify the utility name. Eg. activate-offline-mode",
+    required=False,
+    default="",
+    callback=validate_utility_name,
+)
+def utility_status(utility_name: str):
+    exists = utils.utility_exists(scripts_dir, utility_name)
+    if not exists:
+        not_found_text = click.style(f"Active or existing process ({utility_name}) couldn't not be found\n", fg="red")
+        click.echo(f"\n\n{not_found_text}", err=True)
+        return
+
+    if utility_name == "activate-offline-mode":
+        # the packaging records the size of the archive and the peak scratch disk use
+        status = {
+            "status": offline_ops_manager.get_status(scripts_dir),
+            "packaging": offline_ops_manager.get_packaging(scripts_dir),
+        }
+    else:
+        status = {
+            "status": prepull_images_manager.get_status(scripts_dir),
+            "images": prepull_images_manager.get_image_progress(scripts_dir),
+        }
+    click.echo(yaml.dump(status, default_flow_style=False))
 
 
 @utilities.command(name="logs", help="Show background process logs (it can be used for troubleshooting purposes)")
@@ -0,0 +1,122 @@
+import json
+import os
+import platform
+import subprocess
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, NoReturn, Tuple
+
+TIMINGS_FILE = "state.timings"
+
+# wall/user/sys in seconds, max_rss_kb is the peak resident set size of the largest process
+# of the script's process tree
+ScriptTiming = namedtuple(
+    "ScriptTiming",
+    [
+        "script",
+        "started_at",
+        "wall",
+        "user",
+        "sys",
+        "max_rss_kb",
+        "exitcode",
+    ],
+)
+
+
+class ScriptClock:
+    """Measures one script run, started right before the process gets launched."""
+
+    def __init__(self, script_name: str):
+        self.script_name = script_name
+        self.started_at = datetime.utcnow().isoformat()
+        self._started = time.monotonic()
+
+    def wait(self, proc: subprocess.Popen) -> Tuple[int, ScriptTiming]:
+        """
+        Reaps 'proc' with wait4, which reports the CPU time and peak RSS of the script and
+        of every descendant it waited for, unlike getrusage deltas that mix up the scripts
+        of concurrent steps. Returns the exit code and the timing.
+        """
+        _, status, rusage = os.wait4(proc.pid, 0)
+        # tells Popen the process is gone, it must not be waited for again
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        max_rss = rusage.ru_maxrss // 1024 if platform.system() == "Darwin" else rusage.ru_maxrss
+        return proc.returncode, ScriptTiming(
+            script=self.script_name,
+            started_at=self.started_at,
+            wall=round(time.monotonic() - self._started, 3),
+            user=round(rusage.ru_utime, 3),
+            sys=round(rusage.ru_stime, 3),
+            max_rss_kb=max_rss,
+            exitcode=proc.returncode,
+        )
+
+
+def timings_path(deployment_dir: str) -> str:
+    return f"{deployment_dir}/{TIMINGS_FILE}"
+
+
+def record_script_timing(deployment_dir: str, timing: ScriptTiming) -> NoReturn:
+    """
+    Appends the timing as one JSON line next to the deployment's state journal. Each line
+    is a single small O_APPEND write, so the scripts of concurrent steps don't need a lock.
+    """
+    if not os.path.isdir(deployment_dir):
+        return
+
+    with open(timings_path(deployment_dir), "a") as file:
+        file.write(f"{json.dumps(timing._asdict())}\n")
+
+
+def read_script_timings(deployment_dir: str) -> List[Dict]:
+    path = timings_path(deployment_dir)
+    if not os.path.exists(path):
+        return []
+
+    timings = []
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                timings.append(json.loads(line))
+            except ValueError:
+                # a partially written line of an interrupted run
+                continue
+
+    return timings
+
+
+def format_timings_table(timings: List[Dict]) -> str:
+    if not timings:
+        return ""
+
+    header = ("SCRIPT", "STARTED AT", "WALL", "USER", "SYS", "PEAK RSS", "EXIT")
+    rows = [header]
+    for timing in timings:
+        rows.append(
+            (
+                timing["script"],
+                timing["started_at"].split(".")[0],
+                f"{timing['wall']:.1f}s",
+                f"{timing['user']:.1f}s",
+                f"{timing['sys']:.1f}s",
+                format_kb(timing["max_rss_kb"]),
+                str(timing["exitcode"]),
+            )
+        )
+
+    total_wall = sum(timing["wall"] for timing in timings)
+    total_cpu = sum(timing["user"] + timing["sys"] for timing in timings)
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths, strict=True)).rstrip() for row in rows]
+    lines.append(f"\n{len(timings)} scripts, {total_wall:.1f}s wall, {total_cpu:.1f}s CPU in total")
+    return "\n".join(lines)
+
+
+def format_kb(kb: int) -> str:
+    if kb >= 1024 * 1024:
+        return f"{kb / 1024 / 1024:.1f}GiB"
+    if kb >= 1024:
+        return f"{kb / 1024:.1f}MiB"
+    return f"{kb}KiB"
@@ -0,0 +1,124 @@
+"""
+Renders the `{{ NAME }}` placeholders of the release's templates, e.g. values.yaml.tpl and
+images.env.tpl, which `render_template` (scripts/utils.sh) calls into.
+
+    python -m cli.templates --template <file> --output <file> [--cache-dir <dir>] [--strict]
+
+Values are taken from the environment. Each template is rendered in a single pass, so a
+value that itself looks like a placeholder is never substituted again. Placeholders without
+a value are left as they are and reported on stderr, with --strict they fail the render.
+
+Rendered output is cached under a key that hashes the template together with the values
+of the placeholders it uses, so rendering an unchanged template again doesn't touch it.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+from collections import namedtuple
+from typing import List, Mapping, Optional
+
+# the exact syntax the templates use, so that Helm's own `{{ .Values.x }}` stays untouched
+PLACEHOLDER = re.compile(r"\{\{ ([A-Za-z_][A-Za-z0-9_]*) \}\}")
+UNRESOLVED_EXITCODE = 3
+
+RenderResult = namedtuple("RenderResult", ["text", "unresolved", "cached"])
+
+
+def get_placeholders(template: str) -> List[str]:
+    return sorted(set(PLACEHOLDER.findall(template)))
+
+
+def render(template: str, values: Mapping[str, str]) -> RenderResult:
+    unresolved = set()
+
+    def substitute(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in values:
+            unresolved.add(name)
+            return match.group(0)
+        return values[name]
+
+    return RenderResult(text=PLACEHOLDER.sub(substitute, template), unresolved=sorted(unresolved), cached=False)
+
+
+def get_cache_key(template: str, values: Mapping[str, str]) -> str:
+    digest = hashlib.sha256(template.encode())
+    for name in get_placeholders(template):
+        # a missing value and an empty one render differently
+        value = values.get(name)
+        digest.update(f"\0{name}\0{'' if value is None else '=' + value}".encode())
+    return digest.hexdigest()
+
+
+def write_file(path: str, content: str) -> bool:
+    # cli.utils.write_if_changed, without importing cli.utils into every render
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            if file.read() == content:
+                return False
+
+    file_dir, file_name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=file_dir or ".", prefix=f".{file_name}.")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return True
+
+
+def render_file(
+    template_path: str,
+    output_path: str,
+    values: Mapping[str, str],
+    cache_dir: Optional[str] = None,
+) -> RenderResult:
+    """Renders 'template_path' into 'output_path', which is only rewritten when its content changes"""
+    with open(template_path, "r") as file:
+        template = file.read()
+
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, get_cache_key(template, values))
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as file:
+                text = file.read()
+            write_file(output_path, text)
+            unresolved = [name for name in get_placeholders(template) if name not in values]
+            return RenderResult(text=text, unresolved=unresolved, cached=True)
+
+    result = render(template, values)
+    write_file(output_path, result.text)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_file(cache_path, result.text)
+
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Renders the {{ NAME }} placeholders of a template")
+    parser.add_argument("--template", required=True, help="The template to render")
+    parser.add_argument("--output", required=True, help="The file the rendered template is written to")
+    parser.add_argument("--cache-dir", help="The directory rendered templates are cached in")
+    parser.add_argument("--strict", action="store_true", help="Fail when a placeholder has no value")
+    args = parser.parse_args(argv)
+
+    result = render_file(args.template, args.output, os.environ, args.cache_dir)
+    if result.unresolved:
+        print(f"Unresolved placeholders in {args.template}: {', '.join(result.unresolved)}", file=sys.stderr)
+        if args.strict:
+            return UNRESOLVED_EXITCODE
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,52 @@
+import json
 import os
-import shutil
+import re
+import subprocess
+import tarfile
 import time
+from typing import Dict
 
 import click
 
+from cli.compression import (
+    COMPRESSIONS,
+    DEFAULT_COMPRESSION,
+    CompressionUnavailable,
+    detect_compression,
+    get_archive_extension,
+    open_tar_reader,
+    open_tar_writer,
+)
+from cli.layer_store import BUNDLE_MANIFEST, LayerStore, apply_delta_bundle, get_blob_relpath, make_delta_bundle
+from cli.offline_bundle import (
+    REGISTRY_CONTAINER,
+    REGISTRY_IMAGE,
+    REGISTRY_STORAGE,
+    add_json,
+    docker_output,
+    write_offline_archive,
+)
+from cli.progress import TICK_INTERVAL, Badge, StepProgress
 from cli.utils import (
     acquire,
-    check_acquired,
+    clear_dir,
+    echo_line,
     find_available_port,
     generate_utilities_dir,
     make_utilities_dir,
+    read_env_bundle,
     release,
     run_script,
     set_status,
+    stream_script,
     with_working_directory,
+    write_env_bundle,
+    write_if_changed,
 )
 
+# the offline registry the images of an images env file are pulled from, localhost:<port>
+OFFLINE_REGISTRY_SERVER = re.compile(r"^OFFLINE_IMAGE_REGISTRY_SERVER=(?P<registry>.+)$", re.MULTILINE)
+
 
 def create_offline_registry(
     scripts_dir,
@@ -24,22 +55,27 @@ def create_offline_registry(
     syntho_registry_user,
     syntho_registry_pwd,
     docker_config_json_path,
+    since=None,
+    compression=DEFAULT_COMPRESSION,
 ):
     make_utilities_dir(scripts_dir)
     offline_registry_dir = generate_offline_registry_dir(scripts_dir)
-    acquired = check_acquired(offline_registry_dir)
-    if acquired:
+    acquired = acquire(offline_registry_dir)
+    if not acquired:
         return False, (
             "There is an active activate-offline-mode process, "
             "please wait until it is done, or terminate the existing process"
         )
 
+    if since and not LayerStore(generate_layer_store_dir(scripts_dir)).get_recorded_bundle(since, arch):
+        release(offline_registry_dir)
+        return False, f"There is no offline bundle of {since} made here to make a delta from, activate it first"
+
     make_offline_registry_dir(scripts_dir)
-    acquire(offline_registry_dir)
-    time.sleep(2)
 
     available_port = find_available_port(5020, 5050)
     if not available_port:
+        release(offline_registry_dir)
         return False, "There is no available port between 5000-5050"
 
     env_file_path = make_env_file(
@@ -49,6 +85,7 @@ def create_offline_registry(
         syntho_registry_user,
         syntho_registry_pwd,
         available_port,
+        compression,
     )
 
     # step 1 authenticating with syntho registry
@@ -79,7 +116,7 @@ def create_offline_registry(
 
     # step 4 packaging
     set_status(offline_registry_dir, "packaging")
-    result = package_syntho_registry(scripts_dir, env_file_path)
+    result = package_syntho_registry(scripts_dir, env_file_path, since)
     if not result:
         release(offline_registry_dir)
         return False, "Packaging Syntho registry has been failed, please retry"
@@ -95,20 +132,41 @@ def generate_offline_registry_dir(scripts_dir):
     return f"{generate_utilities_dir(scripts_dir)}/activate-offline-mode"
 
 
-def generate_offline_registry_archive_path(scripts_dir):
-    return f"{generate_utilities_dir(scripts_dir)}/activate-offline-mode.tar.gz"
+def generate_offline_registry_archive_path(scripts_dir, compression=None):
+    """The archive of 'compression', or the one activate-offline-mode made when it isn't given"""
+    archive_path = f"{generate_utilities_dir(scripts_dir)}/activate-offline-mode"
+    if compression is None:
+        compression = next(
+            (
+                compression
+                for compression in COMPRESSIONS
+                if os.path.isfile(f"{archive_path}{get_archive_extension(compression)}")
+            ),
+            DEFAULT_COMPRESSION,
+        )
+    return f"{archive_path}{get_archive_extension(compression)}"
+
+
+def generate_offline_delta_archive_path(scripts_dir, since, version, compression=DEFAULT_COMPRESSION):
+    return (
+        f"{generate_utilities_dir(scripts_dir)}/activate-offline-mode-{since}-to-{version}"
+        f"{get_archive_extension(compression)}"
+    )
+
+
+def generate_layer_store_dir(scripts_dir):
+    # outside of the offline registry dir, which is cleared for every version
+    return f"{generate_utilities_dir(scripts_dir)}/layer-store"
 
 
 def make_offline_registry_dir(scripts_dir):
     offline_registry_dir = generate_offline_registry_dir(scripts_dir)
-    if os.path.exists(offline_registry_dir):
-        shutil.rmtree(offline_registry_dir)
-
-    offline_registry_archive = generate_offline_registry_archive_path(scripts_dir)
-    if os.path.isfile(offline_registry_archive):
-        os.remove(offline_registry_archive)
+    clear_dir(offline_registry_dir)
 
-    os.makedirs(offline_registry_dir)
+    for compression in COMPRESSIONS:
+        offline_registry_archive = generate_offline_registry_archive_path(scripts_dir, compression)
+        if os.path.isfile(offline_registry_archive):
+            os.remove(offline_registry_archive)
 
 
 def make_env_file(
@@ -118,6 +176,7 @@ def make_env_file(
     syntho_registry_user,
     syntho_registry_pwd,
     available_port,
+    compression=DEFAULT_COMPRESSION,
 ):
     offline_registry = f"localhost:{available_port}"
     env = {
@@ -128,14 +187,10 @@ def make_env_file(
         "VERSION": version,
         "AVAILABLE_PORT": available_port,
         "OFFLINE_REGISTRY": offline_registry,
+        "COMPRESSION": compression,
     }
     env_file_path = f"{offline_registry_dir}/.env"
-    with open(env_file_path, "w") as file:
-        for key, value in env.items():
-            if value:
-                file.write(f"{key}={value}\n")
-            else:
-                file.write(f"{key}=\n")
+    write_env_bundle(env_file_path, env)
     return env_file_path
 
 
@@ -168,10 +223,13 @@ def create_offline_image_registry(scripts_dir, env_file_path, docker_config_json
     if not os.path.exists(docker_config):
         return False, f"There is no docker config found in this path: {docker_config_json_path}"
 
-    result = run_script(
+    # the script pulls and pushes every image, its output is passed through as it arrives
+    # rather than held in memory
+    result = stream_script(
         scripts_dir,
         offline_registry_dir,
         "create-offline-registry.sh",
+        on_line=echo_line,
         **{
             "DOCKER_CONFIG": docker_config,
         },
@@ -179,18 +237,227 @@ def create_offline_image_registry(scripts_dir, env_file_path, docker_config_json
     return result.exitcode == 0, None
 
 
-@with_working_directory
-def package_syntho_registry(scripts_dir, env_file_path):
+def package_syntho_registry(scripts_dir, env_file_path, since=None):
+    """
+    Streams the storage and the image of the offline registry container straight into the
+    offline archive, and removes the container. Peak scratch disk use is recorded in status.json.
+    """
     click.echo("Step 4: Packaging the registry;")
+    env = read_env_bundle(env_file_path)
     offline_registry_dir = generate_offline_registry_dir(scripts_dir)
-    os.chdir(offline_registry_dir)
-    archive_file_name = generate_offline_registry_archive_path(scripts_dir)
-
-    result = run_script(
-        scripts_dir, offline_registry_dir, "package-offline-registry.sh", **{"ARCHIVE_FILE_NAME": archive_file_name}
+    compression = env.get("COMPRESSION", DEFAULT_COMPRESSION)
+    archive_path = generate_offline_registry_archive_path(scripts_dir, compression)
+    store = LayerStore(generate_layer_store_dir(scripts_dir))
+    log_path = f"{offline_registry_dir}/shared/process/package_registry.log"
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    progress = StepProgress("Packaging the offline registry")
+    progress.start()
+    started_at = time.monotonic()
+    with open(log_path, "a") as log:
+        try:
+            with (
+                docker_output("cp", f"{REGISTRY_CONTAINER}:{REGISTRY_STORAGE}", "-", log=log) as registry_stream,
+                docker_output("save", REGISTRY_IMAGE, log=log) as image_stream,
+            ):
+                result = write_offline_archive(
+                    archive_path,
+                    store,
+                    env.get("VERSION"),
+                    env.get("ARCH"),
+                    registry_stream,
+                    image_stream,
+                    compression,
+                    scratch_dir=offline_registry_dir,
+                    on_read=make_progress_callback(progress),
+                )
+            store.record_bundle(result.bundle)
+        except (OSError, ValueError, tarfile.TarError, subprocess.CalledProcessError, CompressionUnavailable) as exc:
+            progress.finish(Badge.FAILED)
+            click.echo(f"The offline registry couldn't be packaged: {exc}", err=True)
+            return False
+        finally:
+            subprocess.run(["docker", "rm", "-f", REGISTRY_CONTAINER], stdout=log, stderr=log)
+
+    record_packaging(
+        offline_registry_dir,
+        {
+            "archive": archive_path,
+            "archive_bytes": os.path.getsize(archive_path),
+            "archived_bytes": result.archived_bytes,
+            "blobs": len(result.bundle["blobs"]),
+            "stored_blobs": result.stored_blobs,
+            "peak_scratch_bytes": result.peak_scratch_bytes,
+            "seconds": round(time.monotonic() - started_at, 1),
+        },
     )
+    progress.finish(Badge.DONE, f", peak scratch disk use: {format_size(result.peak_scratch_bytes)}")
 
-    return result.exitcode == 0
+    if since:
+        return make_delta_archive(scripts_dir, env_file_path, since)
+    return True
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def make_progress_callback(progress):
+    """Counts the bytes read in the title of the step, and redraws it every tick"""
+    read = 0
+    ticked_at = time.monotonic()
+
+    def on_read(size):
+        nonlocal read, ticked_at
+        read += size
+        if time.monotonic() - ticked_at >= TICK_INTERVAL:
+            ticked_at = time.monotonic()
+            progress.title = f"Packaging the offline registry ({format_size(read)})"
+            progress.tick()
+
+    return on_read
+
+
+def record_packaging(offline_registry_dir, packaging):
+    """Records what the packaging wrote next to the status of the utility, in 'status.json'"""
+    write_if_changed(f"{offline_registry_dir}/status.json", json.dumps({"packaging": packaging}, indent=2))
+
+
+def get_packaging(scripts_dir) -> Dict:
+    """What the last packaging wrote, its peak scratch disk use included"""
+    status_file_path = f"{generate_offline_registry_dir(scripts_dir)}/status.json"
+    if not os.path.exists(status_file_path):
+        return {}
+
+    with open(status_file_path, "r") as file:
+        return json.load(file).get("packaging", {})
+
+
+def get_member_name(member):
+    # the archives are made of `.`, their members are named like ./bundle.json
+    return member.name[2:] if member.name.startswith("./") else member.name
+
+
+def make_delta_archive(scripts_dir, env_file_path, since):
+    """
+    Archives the blobs of the bundle that the bundle of 'since' didn't have, with the images
+    env file of the version, for import_offline_delta to apply onto the bundle of 'since'
+    """
+    env = read_env_bundle(env_file_path)
+    offline_registry_dir = generate_offline_registry_dir(scripts_dir)
+    store = LayerStore(generate_layer_store_dir(scripts_dir))
+    compression = env.get("COMPRESSION", DEFAULT_COMPRESSION)
+    archive_path = generate_offline_delta_archive_path(scripts_dir, since, env.get("VERSION"), compression)
+    try:
+        bundle = store.get_recorded_bundle(env.get("VERSION"), env.get("ARCH"))
+        delta = make_delta_bundle(bundle, store.get_recorded_bundle(since, env.get("ARCH")))
+        with open_tar_writer(f"{archive_path}.tmp", compression) as tar:
+            add_json(tar, f"./{BUNDLE_MANIFEST}", delta)
+            for digest in delta["blobs"]:
+                tar.add(store.get_path(digest), arcname=f"./{get_blob_relpath(digest)}")
+            tar.add(f"{offline_registry_dir}/.images-offline.env", arcname="./.images-offline.env")
+        os.replace(f"{archive_path}.tmp", archive_path)
+    except (OSError, ValueError, TypeError, tarfile.TarError, CompressionUnavailable) as exc:
+        click.echo(f"The delta archive couldn't be made: {exc}", err=True)
+        return False
+
+    click.echo(f"Delta since {since}: {len(delta['blobs'])} of {len(bundle['blobs'])} blobs, {archive_path}")
+    return True
+
+
+def read_archive_bundle(archive_path):
+    with open_tar_reader(archive_path) as tar:
+        for member in tar:
+            if get_member_name(member) == BUNDLE_MANIFEST:
+                return json.load(tar.extractfile(member))
+    raise ValueError(f"There is no {BUNDLE_MANIFEST} in {archive_path}")
+
+
+def import_offline_delta(scripts_dir, delta_archive_path):
+    """
+    Layers a delta archive onto the offline registry archive of its base version: the blobs
+    the new version still uses are kept, the new ones are added, and the images env file is
+    replaced. Returns whether it succeeded and the error otherwise.
+    """
+    offline_registry_dir = generate_offline_registry_dir(scripts_dir)
+    archive_path = generate_offline_registry_archive_path(scripts_dir)
+    if get_status(scripts_dir) != "completed" or not os.path.isfile(archive_path):
+        return False, "There is no offline registry to import the delta into, please activate offline mode first"
+
+    acquired = acquire(offline_registry_dir)
+    if not acquired:
+        return False, (
+            "There is an active activate-offline-mode process, "
+            "please wait until it is done, or terminate the existing process"
+        )
+
+    env_file_path = f"{offline_registry_dir}/.env"
+    env = read_env_bundle(env_file_path)
+    images_env_path = f"{offline_registry_dir}/.images-offline.env"
+    try:
+        # both archives are read as streams, the delta starts with its bundle.json
+        with open_tar_reader(delta_archive_path) as delta_tar:
+            delta_members = iter(delta_tar)
+            member = next(delta_members, None)
+            if member is None or get_member_name(member) != BUNDLE_MANIFEST:
+                raise ValueError(f"{delta_archive_path} isn't a delta archive, it doesn't start with {BUNDLE_MANIFEST}")
+            delta = json.load(delta_tar.extractfile(member))
+            bundle = apply_delta_bundle(read_archive_bundle(archive_path), delta)
+
+            with open_tar_writer(f"{archive_path}.tmp", detect_compression(archive_path)) as tar:
+                with open_tar_reader(archive_path) as base_tar:
+                    for member in base_tar:
+                        name = get_member_name(member)
+                        if name == BUNDLE_MANIFEST:
+                            continue
+                        if name.startswith("blobs/") and member.isfile():
+                            # blobs/sha256/<hex>, the ones the new version doesn't use are dropped
+                            digest = ":".join(name.split("/")[1:])
+                            if digest not in bundle["blobs"] or digest in delta["blobs"]:
+                                continue
+                        tar.addfile(member, base_tar.extractfile(member) if member.isfile() else None)
+
+                added = set()
+                for member in delta_members:
+                    name = get_member_name(member)
+                    if name.startswith("blobs/") and member.isfile():
+                        tar.addfile(member, delta_tar.extractfile(member))
+                        added.add(":".join(name.split("/")[1:]))
+                    elif name == ".images-offline.env":
+                        # the delta may have been made with the offline registry on another port
+                        images_env = delta_tar.extractfile(member).read().decode()
+                        with open(f"{images_env_path}.tmp", "w") as file:
+                            file.write(rebase_images_env(images_env, env.get("OFFLINE_REGISTRY")))
+                if delta["blobs"].keys() - added:
+                    raise ValueError(f"{delta_archive_path} is missing blobs of its {BUNDLE_MANIFEST}")
+                add_json(tar, f"./{BUNDLE_MANIFEST}", bundle)
+
+        os.replace(f"{images_env_path}.tmp", images_env_path)
+        os.replace(f"{archive_path}.tmp", archive_path)
+    except (OSError, ValueError, KeyError, tarfile.TarError, CompressionUnavailable) as exc:
+        for path in (f"{archive_path}.tmp", f"{images_env_path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+        release(offline_registry_dir)
+        return False, f"The delta couldn't be imported: {exc}"
+
+    write_env_bundle(env_file_path, {**env, "VERSION": bundle["version"]})
+
+    release(offline_registry_dir)
+    return True, None
+
+
+def rebase_images_env(images_env: str, offline_registry: str) -> str:
+    """Points the images of an images env file at 'offline_registry', the one of this host"""
+    match = OFFLINE_REGISTRY_SERVER.search(images_env)
+    if not match or not offline_registry or match["registry"] == offline_registry:
+        return images_env
+    # e.g. OFFLINE_..._REPO=localhost:5001/syntho-core-api, but not localhost:50010/...
+    return re.sub(rf"(?<==){re.escape(match['registry'])}(?=/|$)", offline_registry, images_env, flags=re.MULTILINE)
 
 
 def get_status(scripts_dir):
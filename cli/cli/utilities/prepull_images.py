@@ -1,18 +1,45 @@
+import json
 import os
-import shutil
+import subprocess
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NoReturn
 
 import click
 
+from cli.progress import TICK_INTERVAL, Badge, StepProgress
+from cli.registry import ImageCopier, RegistryError, RegistryUnavailable, get_syntho_credentials
 from cli.utils import (
     acquire,
-    check_acquired,
+    clear_dir,
     generate_utilities_dir,
     make_utilities_dir,
     release,
     run_script,
     set_status,
     with_working_directory,
+    write_env_bundle,
+    write_if_changed,
+)
+
+MIRROR_CONCURRENCY = 4
+MIRROR_ATTEMPTS = 3
+# seconds before the first retry of an image, doubled for every next one
+RETRY_BACKOFF = 5
+PLATFORMS = {"amd": "amd64", "arm": "arm64"}
+
+# an image to pull from the Syntho registry and push to the trusted one as 'target', 'size'
+# is the compressed size of its layers, 0 when it's unknown
+MirrorJob = namedtuple("MirrorJob", ["name", "source", "target", "size"], defaults=(0,))
+
+MirrorResult = namedtuple(
+    "MirrorResult",
+    [
+        "succeeded",
+        "failed_images",
+    ],
 )
 
 
@@ -24,19 +51,18 @@ def start(
     syntho_registry_user,
     syntho_registry_pwd,
     docker_config_json_path,
+    concurrency=MIRROR_CONCURRENCY,
 ):
     make_utilities_dir(scripts_dir)
     prepull_images_file_dir = generate_prepull_images_dir(scripts_dir)
-    acquired = check_acquired(prepull_images_file_dir)
-    if acquired:
+    acquired = acquire(prepull_images_file_dir)
+    if not acquired:
         return False, (
             "There is an active prepull-images process, "
             "please wait until it is done, or terminate the existing process"
         )
 
     make_prepull_images_dir(scripts_dir)
-    acquire(prepull_images_file_dir)
-    time.sleep(2)
 
     env_file_path = make_env_file(
         prepull_images_file_dir,
@@ -63,7 +89,7 @@ def start(
 
     # step 3 pulling images
     set_status(prepull_images_file_dir, "pulling")
-    result, err = pull(scripts_dir, env_file_path, docker_config_json_path)
+    result, err = pull(scripts_dir, env_file_path, docker_config_json_path, arch, concurrency)
     if not result:
         release(prepull_images_file_dir)
         return False, "Pulling images has been failed, please retry" if not err else err
@@ -84,10 +110,7 @@ def start(
 
 def make_prepull_images_dir(scripts_dir):
     prepull_images_file_dir = generate_prepull_images_dir(scripts_dir)
-    if os.path.exists(prepull_images_file_dir):
-        shutil.rmtree(prepull_images_file_dir)
-
-    os.makedirs(prepull_images_file_dir)
+    clear_dir(prepull_images_file_dir)
 
 
 def make_env_file(
@@ -107,12 +130,7 @@ def make_env_file(
         "VERSION": version,
     }
     env_file_path = f"{prepull_images_file_dir}/.env"
-    with open(env_file_path, "w") as file:
-        for key, value in env.items():
-            if value:
-                file.write(f"{key}={value}\n")
-            else:
-                file.write(f"{key}=\n")
+    write_env_bundle(env_file_path, env)
     return env_file_path
 
 
@@ -153,7 +171,7 @@ def authenticate_syntho_registry(scripts_dir, env_file_path):
     return result.exitcode == 0
 
 
-def pull(scripts_dir, env_file_path, docker_config_json_path):
+def pull(scripts_dir, env_file_path, docker_config_json_path, arch, concurrency=MIRROR_CONCURRENCY):
     click.echo("Step 3: Pulling Images Into Trusted Registry;")
 
     docker_config_json_path = os.path.expanduser(docker_config_json_path)
@@ -161,8 +179,248 @@ def pull(scripts_dir, env_file_path, docker_config_json_path):
     if not os.path.exists(docker_config):
         return False, f"There is no docker config found in this path: {docker_config_json_path}"
     prepull_images_dir = generate_prepull_images_dir(scripts_dir)
-    result = run_script(scripts_dir, prepull_images_dir, "prepull-images.sh", **{"DOCKER_CONFIG": docker_config})
-    return result.exitcode == 0, None
+    result = run_script(scripts_dir, prepull_images_dir, "prepull-images.sh")
+    if result.exitcode != 0:
+        return False, None
+
+    jobs = get_mirror_jobs(prepull_images_dir)
+    # the images are copied straight from registry to registry where it can be done without docker
+    copier = ImageCopier(get_syntho_credentials(env_file_path), docker_config, arch)
+    progress = StepProgress("Pulling images into the trusted registry")
+    progress.start()
+    try:
+        result = mirror_images(
+            jobs,
+            docker_config,
+            arch,
+            concurrency,
+            log_path=f"{prepull_images_dir}/shared/process/pull_images_into_trusted_registry.log",
+            on_progress=lambda images: record_image_progress(prepull_images_dir, images, progress),
+            on_tick=progress.tick,
+            copier=copier,
+        )
+    finally:
+        copier.close()
+    progress.finish(Badge.DONE if result.succeeded else Badge.FAILED)
+    if not result.succeeded:
+        return False, f"Pulling these images has been failed, please retry: {', '.join(result.failed_images)}"
+    return True, None
+
+
+def read_env_file(env_file_path: str) -> Dict[str, str]:
+    """The `NAME=value` lines of an images env file the script prepared"""
+    env = {}
+    with open(env_file_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            name, value = line.split("=", 1)
+            env[name] = value
+    return env
+
+
+def get_mirror_jobs(prepull_images_dir: str) -> List[MirrorJob]:
+    """The images of .images-final.env paired with where .images-trusted.env puts them"""
+    images = read_env_file(f"{prepull_images_dir}/.images-final.env")
+    trusted_images = read_env_file(f"{prepull_images_dir}/.images-trusted.env")
+
+    jobs = []
+    for key, repo in images.items():
+        if not key.endswith("_IMG_REPO"):
+            continue
+        name = key[: -len("_IMG_REPO")]
+        tag = images.get(f"{name}_IMG_TAG", "")
+        trusted_repo = trusted_images[f"TRUSTED_{name}_IMG_REPO"]
+        trusted_tag = trusted_images[f"TRUSTED_{name}_IMG_TAG"]
+        jobs.append(MirrorJob(name, f"{repo}:{tag}", f"{trusted_repo}:{trusted_tag}"))
+    return jobs
+
+
+def run_docker(args: List[str], docker_config: str, log: Callable[[str], NoReturn]) -> subprocess.CompletedProcess:
+    log(f"DOCKER_CONFIG={docker_config} docker {' '.join(args)}\n")
+    result = subprocess.run(
+        ["docker", *args],
+        env={**os.environ, "DOCKER_CONFIG": docker_config},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    log(result.stdout)
+    return result
+
+
+def get_image_size(
+    image: str, docker_config: str, arch: str, log: Callable[[str], NoReturn], copier: ImageCopier = None
+) -> int:
+    """
+    The compressed size of the image's layers for 'arch' from its manifest in the registry,
+    without pulling it. 0 when the manifest can't be read.
+    """
+    if copier is not None:
+        try:
+            return copier.get_size(image)
+        except (RegistryUnavailable, RegistryError) as exc:
+            log(f"The size of {image} is read with docker instead: {exc}\n")
+
+    result = run_docker(["manifest", "inspect", "--verbose", image], docker_config, log)
+    if result.returncode != 0:
+        return 0
+    try:
+        manifests = json.loads(result.stdout)
+    except ValueError:
+        return 0
+
+    # a list of one entry per platform for multi-platform images
+    if isinstance(manifests, dict):
+        manifests = [manifests]
+    platform = PLATFORMS.get(arch, arch)
+    for manifest in manifests:
+        descriptor_platform = manifest.get("Descriptor", {}).get("platform", {})
+        if descriptor_platform and descriptor_platform.get("architecture") != platform:
+            continue
+        image_manifest = manifest.get("SchemaV2Manifest") or manifest.get("OCIManifest") or {}
+        layers = [image_manifest.get("config", {}), *image_manifest.get("layers", [])]
+        return sum(layer.get("size", 0) for layer in layers)
+    return 0
+
+
+def mirror_image(
+    job: MirrorJob,
+    docker_config: str,
+    attempts: int,
+    backoff: float,
+    log: Callable[[str], NoReturn],
+    on_state: Callable[[str, int], NoReturn],
+    copier: ImageCopier = None,
+) -> bool:
+    """
+    Copies one image from registry to registry with 'copier', or pulls, tags and pushes it
+    with docker when the copier can't be used for it. A failed copy or docker command is
+    retried with backoff, docker commands from the one that failed, up to 'attempts' times.
+    """
+    commands = [
+        ("pulling", ["pull", job.source]),
+        ("tagging", ["tag", job.source, job.target]),
+        ("pushing", ["push", job.target]),
+    ]
+    done = 0
+    for attempt in range(1, attempts + 1):
+        if copier is not None:
+            on_state("copying", attempt)
+            try:
+                result = copier.copy(job.source, job.target)
+            except RegistryUnavailable as exc:
+                log(f"{job.source} is pulled with docker instead: {exc}\n")
+                copier = None
+            except RegistryError as exc:
+                log(f"Copying {job.source} to {job.target} failed: {exc}\n")
+            else:
+                log(
+                    f"Copied {job.source} to {job.target}: {result.copied_blobs} blobs copied, "
+                    f"{result.mounted_blobs} mounted, {result.skipped_blobs} already there\n"
+                )
+                return True
+
+        if copier is None:
+            while done < len(commands):
+                state, args = commands[done]
+                on_state(state, attempt)
+                if run_docker(args, docker_config, log).returncode != 0:
+                    break
+                done += 1
+            else:
+                return True
+
+        if attempt < attempts:
+            on_state("retrying", attempt)
+            time.sleep(backoff * 2 ** (attempt - 1))
+    return False
+
+
+def mirror_images(
+    jobs: List[MirrorJob],
+    docker_config: str,
+    arch: str,
+    concurrency: int = MIRROR_CONCURRENCY,
+    attempts: int = MIRROR_ATTEMPTS,
+    backoff: float = RETRY_BACKOFF,
+    log_path: str = None,
+    on_progress: Callable[[Dict[str, Dict]], NoReturn] = None,
+    on_tick: Callable[[], NoReturn] = None,
+    copier: ImageCopier = None,
+) -> MirrorResult:
+    """
+    Mirrors the images with up to 'concurrency' of them at a time, the largest first so the
+    longest transfers don't end up last. Without a 'copier' every image goes through docker.
+    'on_progress' gets the state of every image whenever one changes.
+    """
+    lock = threading.Lock()
+    images = {job.name: {"image": job.source, "target": job.target, "state": "queued", "attempt": 0} for job in jobs}
+
+    def log(text):
+        if log_path and text:
+            with lock, open(log_path, "a") as file:
+                file.write(text)
+
+    def set_state(name, **state):
+        # progress is reported under the lock too, so an older state never lands after a newer one
+        with lock:
+            images[name].update(state)
+            if on_progress:
+                on_progress({image_name: dict(image) for image_name, image in images.items()})
+
+    def run(job):
+        succeeded = mirror_image(
+            job,
+            docker_config,
+            attempts,
+            backoff,
+            log,
+            lambda state, attempt: set_state(job.name, state=state, attempt=attempt),
+            copier,
+        )
+        set_state(job.name, state="mirrored" if succeeded else "failed")
+        return succeeded
+
+    if log_path:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        sizes = executor.map(lambda job: get_image_size(job.source, docker_config, arch, log, copier), jobs)
+        jobs = [job._replace(size=size) for job, size in zip(jobs, sizes, strict=True)]
+        for job in jobs:
+            set_state(job.name, size=job.size)
+
+        # sorted() is stable, the images of an unknown size keep their order
+        pending = {executor.submit(run, job) for job in sorted(jobs, key=lambda job: job.size, reverse=True)}
+        while pending:
+            _, pending = wait(pending, timeout=TICK_INTERVAL, return_when=FIRST_COMPLETED)
+            if on_tick:
+                on_tick()
+
+    failed_images = [name for name, image in images.items() if image["state"] != "mirrored"]
+    return MirrorResult(not failed_images, failed_images)
+
+
+def record_image_progress(prepull_images_dir: str, images: Dict[str, Dict], progress: StepProgress) -> NoReturn:
+    """
+    Records the state of every image next to the status of the utility, in 'status.json',
+    and counts the mirrored ones in the title of the step.
+    """
+    mirrored = sum(1 for image in images.values() if image["state"] == "mirrored")
+    progress.title = f"Pulling images into the trusted registry ({mirrored}/{len(images)})"
+    write_if_changed(f"{prepull_images_dir}/status.json", json.dumps({"images": images}, indent=2))
+
+
+def get_image_progress(scripts_dir) -> Dict[str, Dict]:
+    """The state of every image of the last pull, by the name of its images env key"""
+    status_file_path = f"{generate_prepull_images_dir(scripts_dir)}/status.json"
+    if not os.path.exists(status_file_path):
+        return {}
+
+    with open(status_file_path, "r") as file:
+        return json.load(file).get("images", {})
 
 
 @with_working_directory
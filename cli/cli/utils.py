@@ -1,23 +1,40 @@
 import fcntl
 import glob
+import json
 import os
 import platform
+import re
+import selectors
+import shlex
+import shutil
 import socket
 import subprocess
-import tarfile
+import sys
+import tempfile
 import threading
 import time
-from collections import namedtuple
+from collections import deque, namedtuple
+from contextlib import contextmanager
 from enum import Enum
-from functools import wraps
+from functools import partial, wraps
 from queue import Empty, Queue
+from typing import Any, Callable, Dict, NoReturn, Optional
 
+import yaml
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from cli.compression import DEFAULT_COMPRESSION, open_tar_writer
+from cli.lease import LEASE_FILE, acquire_lease, is_lease_alive, release_lease
+from cli.telemetry import ScriptClock, record_script_timing
+
 # Sentinel object
 END_OF_OUTPUT = object()
 CURSOR_TRACKER = {}
+# lines of a streamed script kept for error reporting, and the longest line kept in memory
+OUTPUT_TAIL_SIZE = 200
+MAX_LINE_LENGTH = 64 * 1024
+LINE_END = re.compile(rb"[\r\n]")
 
 
 def reset_cursor_tracker(deployment_id_or_process_name):
@@ -29,27 +46,89 @@ def is_arch_supported(arch: str) -> bool:
     return arch in ["amd", "arm"]
 
 
-def thread_safe(func):
+LOCKS_DIR = ".locks"
+
+
+@contextmanager
+def deployments_lock(deployments_dir: str, shared: bool = False, deployment_id: str = None):
+    """
+    File lock on the index of deployments (`<deployments_dir>/.lock`) or, when a
+    deployment_id is given, on that deployment only (`<deployments_dir>/.locks/<id>.lock`).
+    Readers take it shared, writers exclusive.
+    """
+    # Construct the lock file path
+    if deployment_id is None:
+        lock_dir = deployments_dir
+        lock_file_path = os.path.join(deployments_dir, ".lock")
+    else:
+        lock_dir = os.path.join(deployments_dir, LOCKS_DIR)
+        lock_file_path = os.path.join(lock_dir, f"{deployment_id}.lock")
+
+    if not os.path.exists(lock_file_path):
+        if not os.path.exists(lock_dir):
+            os.makedirs(lock_dir, exist_ok=True)
+
+    # Acquire the file-based lock
+    with open(lock_file_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def thread_safe(func=None, *, shared: bool = False):
+    if func is None:
+        return partial(thread_safe, shared=shared)
+
+    @wraps(func)
     def wrapper(*args, **kwargs):
         deployments_dir = args[0] if args else kwargs.get("deployments_dir", "/tmp")
 
-        # Construct the lock file path
-        lock_file_path = os.path.join(deployments_dir, ".lock")
-        if not os.path.exists(lock_file_path):
-            if not os.path.exists(deployments_dir):
-                os.makedirs(deployments_dir)
-
-        # Acquire the file-based lock
-        with open(lock_file_path, "w") as lock:
-            fcntl.flock(lock, fcntl.LOCK_EX)
-            try:
-                return func(*args, **kwargs)
-            finally:
-                fcntl.flock(lock, fcntl.LOCK_UN)
+        with deployments_lock(deployments_dir, shared=shared):
+            return func(*args, **kwargs)
 
     return wrapper
 
 
+@contextmanager
+def state_transaction(
+    deployments_dir: str,
+    state_file: str,
+    default: Callable[[], Any] = dict,
+    on_commit: Callable[[Any], None] = None,
+):
+    """
+    Read-modify-write of a YAML state file under a single exclusive lock.
+
+    The file is parsed once on entry and the yielded object is written back once,
+    atomically, when the block exits without an exception. Functions decorated
+    with `thread_safe` on the same deployments_dir must not be called inside the
+    block, they would wait for the lock held here. `on_commit` is called with the
+    written state while the lock is still held.
+    """
+    state_file_path = os.path.join(deployments_dir, state_file)
+
+    with deployments_lock(deployments_dir):
+        state = None
+        if os.path.exists(state_file_path):
+            with open(state_file_path, "r") as file:
+                state = yaml.safe_load(file)
+
+        if not state:
+            state = default()
+
+        yield state
+
+        tmp_file_path = f"{state_file_path}.tmp"
+        with open(tmp_file_path, "w") as file:
+            yaml.dump(state, file, default_flow_style=False)
+        os.replace(tmp_file_path, state_file_path)
+
+        if on_commit:
+            on_commit(state)
+
+
 def with_working_directory(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -87,6 +166,122 @@ SubprocessResult = namedtuple(
 )
 
 
+# `end` is the terminator the line had on the wire: "\n", "\r" (progress redraws) or "" when
+# the output ended without one or the line was cut at MAX_LINE_LENGTH
+ScriptLine = namedtuple("ScriptLine", ["stream", "text", "end"])
+
+StreamResult = namedtuple(
+    "StreamResult",
+    [
+        "succeeded",
+        "output",
+        "exitcode",
+        "tail",
+    ],
+)
+
+
+WaitResult = namedtuple(
+    "WaitResult",
+    [
+        "succeeded",
+        "elapsed",
+        "attempts",
+    ],
+)
+
+
+def wait_until(
+    predicate: Callable[[], Any],
+    timeout: float,
+    interval: float = 0.1,
+    backoff: float = 2.0,
+    max_interval: float = 5.0,
+) -> WaitResult:
+    """
+    Polls `predicate` until it returns a truthy value or `timeout` seconds pass.
+
+    The predicate runs immediately and then after every poll interval, which starts
+    at `interval` and is multiplied by `backoff` up to `max_interval`. The last
+    sleep is cut short so the deadline is never overshot.
+    """
+    started_at = time.monotonic()
+    deadline = started_at + timeout
+    attempts = 0
+    while True:
+        attempts += 1
+        if predicate():
+            return WaitResult(succeeded=True, elapsed=time.monotonic() - started_at, attempts=attempts)
+
+        now = time.monotonic()
+        if now >= deadline:
+            return WaitResult(succeeded=False, elapsed=now - started_at, attempts=attempts)
+
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * backoff, max_interval)
+
+
+def remove_dir(path: str) -> bool:
+    """Removes a directory tree, returns whether it is gone."""
+    shutil.rmtree(path, ignore_errors=True)
+    return not os.path.exists(path)
+
+
+ENV_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """
+    Atomically replaces the file with 'content' unless it already holds exactly that,
+    returns whether it was written. New files are only readable by the owner.
+    """
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            if file.read() == content:
+                return False
+
+    file_dir, file_name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=file_dir or ".", prefix=f".{file_name}.")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return True
+
+
+def write_env_bundle(path: str, env: Dict[str, Optional[Any]]) -> bool:
+    """
+    Writes env vars for the scripts: 'path' holds quoted `NAME='value'` lines that a script
+    sources at once, values with `=`, spaces, quotes or newlines included, and '<path>.json'
+    holds the same values for anything that isn't a shell. The names aren't exported, so
+    e.g. DOCKER_CONFIG only reaches the commands a script hands it to. None is written as
+    an empty value. Returns whether either file changed.
+    """
+    values = {}
+    for name, value in env.items():
+        if not ENV_NAME.match(name):
+            raise ValueError(f"Invalid env var name: {name!r}")
+        values[name] = "" if value is None else str(value)
+
+    assignments = "".join(f"{name}={shlex.quote(value)}\n" for name, value in values.items())
+    shell_changed = write_if_changed(path, assignments)
+    json_changed = write_if_changed(f"{path}.json", json.dumps(values, indent=2) + "\n")
+    return shell_changed or json_changed
+
+
+def read_env_bundle(path: str) -> Dict[str, str]:
+    """The values of an env bundle written by write_env_bundle, empty when there is none"""
+    if not os.path.exists(f"{path}.json"):
+        return {}
+
+    with open(f"{path}.json", "r") as file:
+        return json.load(file)
+
+
 def get_deployments_dir(scripts_dir: str) -> str:
     deployments_dir = f"{scripts_dir}/deployments"
     if not os.path.exists(deployments_dir):
@@ -101,33 +296,189 @@ class CleanUpLevel(Enum):
     NA = "not-applicable"
 
 
-def run_script(
-    scripts_dir: str, deployment_dir: str, script_name: str, capture_output: bool = False, **extra_env
-) -> SubprocessResult:
+def script_env(deployment_dir: str, **extra_env) -> Dict[str, str]:
     env = {
         "DEPLOYMENT_DIR": deployment_dir,
         "PATH": os.environ.get("PATH", ""),
+        # runs the supervisor of with_loading steps
+        "SYNTHO_CLI_PYTHON": sys.executable,
     }
     env.update(**extra_env)
+    return env
+
+
+def run_script(
+    scripts_dir: str,
+    deployment_dir: str,
+    script_name: str,
+    capture_output: bool = False,
+    output_path: str = None,
+    **extra_env,
+) -> SubprocessResult:
+    """
+    Runs a script and records its wall time, CPU time and peak RSS into the deployment's
+    state. With 'capture_output' stdout is returned and stderr is returned on failure;
+    with 'output_path' both go to that file.
+    """
+    env = script_env(deployment_dir, **extra_env)
     script_path = os.path.join(scripts_dir, script_name)
 
+    clock = ScriptClock(script_name)
+    output_file = None
     try:
         if capture_output:
-            res = subprocess.run([script_path], check=True, shell=False, env=env, capture_output=True, text=True)
+            proc = subprocess.Popen([script_path], shell=False, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        elif output_path:
+            # the output is shown later, e.g. by a step that ran in the background
+            output_file = open(output_path, "w")
+            proc = subprocess.Popen([script_path], shell=False, env=env, stdout=output_file, stderr=subprocess.STDOUT)
         else:
-            res = subprocess.run([script_path], check=True, shell=False, env=env)
+            proc = subprocess.Popen([script_path], shell=False, env=env)
+    except Exception:
+        if output_file:
+            output_file.close()
+        return SubprocessResult(succeeded=False, output="", exitcode=1)
 
-        return SubprocessResult(
-            succeeded=True,
-            output=res.stdout.strip() if res.stdout else "",
-            exitcode=res.returncode,
-        )
-    except subprocess.CalledProcessError as e:
-        return SubprocessResult(succeeded=False, output=e.stderr, exitcode=e.returncode)
+    try:
+        output = read_pipes(proc) if capture_output else {}
+        exitcode, timing = clock.wait(proc)
     except KeyboardInterrupt:
+        kill_and_wait(proc)
         return SubprocessResult(succeeded=False, output="", exitcode=1)
     except Exception:
+        kill_and_wait(proc)
         return SubprocessResult(succeeded=False, output="", exitcode=1)
+    finally:
+        if output_file:
+            output_file.close()
+
+    record_script_timing(deployment_dir, timing)
+    if exitcode != 0:
+        return SubprocessResult(succeeded=False, output=output.get("stderr"), exitcode=exitcode)
+
+    return SubprocessResult(succeeded=True, output=output.get("stdout", "").strip(), exitcode=exitcode)
+
+
+def kill_and_wait(proc: subprocess.Popen) -> NoReturn:
+    if proc.returncode is None:
+        proc.kill()
+        proc.wait()
+
+
+def read_chunks(proc: subprocess.Popen):
+    """Yields (stream name, bytes) from the stdout and stderr of 'proc' as they arrive, b"" at the end of each"""
+    selector = selectors.DefaultSelector()
+    for name, stream in (("stdout", proc.stdout), ("stderr", proc.stderr)):
+        selector.register(stream, selectors.EVENT_READ, name)
+
+    try:
+        while selector.get_map():
+            for key, _ in selector.select():
+                chunk = os.read(key.fileobj.fileno(), 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                yield key.data, chunk
+    finally:
+        selector.close()
+
+
+def read_pipes(proc: subprocess.Popen) -> Dict[str, str]:
+    """Reads stdout and stderr of 'proc' to their end without waiting for it, unlike communicate()"""
+    output = {"stdout": b"", "stderr": b""}
+    for name, chunk in read_chunks(proc):
+        output[name] += chunk
+    return {name: data.decode(errors="replace") for name, data in output.items()}
+
+
+def split_lines(buffer: bytes, final: bool = False):
+    """Splits complete lines off 'buffer', returns them with what is left of it"""
+    lines = []
+    start = 0
+    for match in LINE_END.finditer(buffer):
+        lines.append((buffer[start : match.start()], match.group().decode()))
+        start = match.end()
+    rest = buffer[start:]
+    while len(rest) > MAX_LINE_LENGTH:
+        lines.append((rest[:MAX_LINE_LENGTH], ""))
+        rest = rest[MAX_LINE_LENGTH:]
+    if final and rest:
+        lines.append((rest, ""))
+        rest = b""
+    return lines, rest
+
+
+def read_script_lines(proc: subprocess.Popen):
+    """Yields ScriptLines from the stdout and stderr of 'proc' as they arrive"""
+    buffers = {"stdout": b"", "stderr": b""}
+    for name, chunk in read_chunks(proc):
+        lines, buffers[name] = split_lines(buffers[name] + chunk, final=not chunk)
+        for text, end in lines:
+            yield ScriptLine(stream=name, text=text.decode(errors="replace"), end=end)
+
+
+def stream_script(
+    scripts_dir: str,
+    deployment_dir: str,
+    script_name: str,
+    on_line: Callable[[ScriptLine], Any] = None,
+    tail_size: int = OUTPUT_TAIL_SIZE,
+    collect_output: bool = False,
+    **extra_env,
+) -> StreamResult:
+    """
+    Runs a script like run_script, handing each stdout/stderr line to 'on_line' as it arrives.
+    'tail' holds the last 'tail_size' lines of both streams, e.g. for error reporting. 'output'
+    holds the last 'tail_size' lines of stdout too, unless 'collect_output' is set: callers
+    using the output as a value, e.g. a kubectl listing, get all of it then.
+    """
+    env = script_env(deployment_dir, **extra_env)
+    script_path = os.path.join(scripts_dir, script_name)
+
+    stdout = [] if collect_output else deque(maxlen=tail_size)
+    both = deque(maxlen=tail_size)
+
+    def result(exitcode):
+        return StreamResult(
+            succeeded=exitcode == 0,
+            output="".join(line.text + line.end for line in stdout).strip(),
+            exitcode=exitcode,
+            tail=[line.text for line in both],
+        )
+
+    clock = ScriptClock(script_name)
+    try:
+        proc = subprocess.Popen([script_path], shell=False, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception:
+        return result(1)
+
+    try:
+        for line in read_script_lines(proc):
+            if line.stream == "stdout":
+                stdout.append(line)
+            both.append(line)
+            if on_line:
+                on_line(line)
+        exitcode, timing = clock.wait(proc)
+    except KeyboardInterrupt:
+        kill_and_wait(proc)
+        return result(1)
+    except Exception:
+        kill_and_wait(proc)
+        return result(1)
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+
+    record_script_timing(deployment_dir, timing)
+    return result(exitcode)
+
+
+def echo_line(line: ScriptLine) -> NoReturn:
+    """An on_line callback passing the line through to the terminal as the script wrote it"""
+    stream = sys.stdout if line.stream == "stdout" else sys.stderr
+    stream.write(line.text + line.end)
+    stream.flush()
 
 
 def tail(f, lines, follow, deployment_id_or_process_name):
@@ -292,21 +643,32 @@ def generate_utilities_dir(scripts_dir):
 
 
 def check_acquired(file_dir):
-    path = f"{file_dir}/.lock"
-    if os.path.exists(path):
-        return True
-    return False
+    return is_lease_alive(file_dir)
 
 
 def acquire(file_dir):
-    path = f"{file_dir}/.lock"
-    with open(path, "a") as _:
-        pass
+    return acquire_lease(file_dir)
 
 
 def release(file_dir):
-    path = f"{file_dir}/.lock"
-    os.remove(path)
+    release_lease(file_dir)
+
+
+def clear_dir(file_dir):
+    """Empties file_dir, keeping the lease of the running job."""
+    if not os.path.exists(file_dir):
+        os.makedirs(file_dir)
+        return
+
+    for name in os.listdir(file_dir):
+        if name == LEASE_FILE:
+            continue
+
+        path = os.path.join(file_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
 
 
 def set_status(file_dir, status):
@@ -328,8 +690,8 @@ def find_available_port(start_port, end_port, host="localhost"):
     return None
 
 
-def make_tarfile(output_filename, source_dir):
-    with tarfile.open(output_filename, "w:gz") as tar:
+def make_tarfile(output_filename, source_dir, compression=DEFAULT_COMPRESSION):
+    with open_tar_writer(output_filename, compression) as tar:
         tar.add(source_dir, arcname=os.path.basename(source_dir))
 
 
@@ -0,0 +1,38 @@
+import pytest
+
+from tests.fake_kube_api import FakeKubeAPI
+from tests.fake_registry import FakeRegistry
+from tests.fake_release_server import FakeReleaseServer
+
+
+@pytest.fixture
+def fake_kube_api(tmpdir):
+    api = FakeKubeAPI()
+    api.kubeconfig_path = api.write_kubeconfig(str(tmpdir.join("kubeconfig")))
+    api.start()
+    yield api
+    api.stop()
+
+
+@pytest.fixture
+def fake_registry():
+    """Starts fake registries, e.g. `fake_registry(users={"user": "pwd"})`"""
+    registries = []
+
+    def start(**kwargs):
+        registry = FakeRegistry(**kwargs)
+        registry.start()
+        registries.append(registry)
+        return registry
+
+    yield start
+    for registry in registries:
+        registry.stop()
+
+
+@pytest.fixture
+def fake_release_server():
+    server = FakeReleaseServer()
+    server.start()
+    yield server
+    server.stop()
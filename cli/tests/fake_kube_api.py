@@ -0,0 +1,145 @@
+"""
+A local stand-in for the Kubernetes API server: serves the objects it's given as JSON over
+plain HTTP/1.1 with keep-alive, streams their updates to watches, and counts the connections
+and requests it gets.
+"""
+
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import yaml
+
+from cli.kubernetes import RESOURCES
+
+
+class FakeKubeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.api.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        api.requests.append(self.path)
+
+        if url.path in api.objects:
+            self.send_json(200, api.objects[url.path])
+            return
+
+        if url.path.rsplit("/", 1)[-1] not in RESOURCES:
+            self.send_json(404, {"kind": "Status", "reason": "NotFound", "code": 404})
+            return
+
+        items = [obj for path, obj in api.objects.items() if path.rsplit("/", 1)[0] == url.path]
+        query = parse_qs(url.query)
+        if query.get("watch") == ["1"]:
+            self.send_watch(url.path, int(query.get("timeoutSeconds", ["60"])[0]))
+            return
+
+        selector = query.get("labelSelector", [""])[0]
+        if selector:
+            key, value = selector.split("=", 1)
+            items = [item for item in items if item.get("metadata", {}).get("labels", {}).get(key) == value]
+        self.send_json(200, {"kind": "List", "metadata": {"resourceVersion": str(api.version)}, "items": items})
+
+    def do_DELETE(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        api.requests.append(f"DELETE {self.path}")
+
+        if api.objects.pop(url.path, None) is None:
+            self.send_json(404, {"kind": "Status", "reason": "NotFound", "code": 404})
+        else:
+            self.send_json(200, {"kind": "Status", "status": "Success"})
+
+    def send_watch(self, collection, timeout):
+        api = self.server.api
+        if not api.watch_supported:
+            self.send_json(405, {"kind": "Status", "reason": "MethodNotAllowed", "code": 405})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                event_collection, event = api.events.get(timeout=min(remaining, 0.1))
+            except queue.Empty:
+                continue
+            if event_collection == collection:
+                data = json.dumps(event).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeKubeAPI:
+    def __init__(self):
+        self.objects = {}
+        self.version = 1
+        self.events = queue.Queue()
+        self.watch_supported = True
+        self.requests = []
+        self.connections = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeKubeAPIHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def add(self, collection, name, obj=None):
+        """Serves 'obj' at <collection>/<name>, e.g. /api/v1/namespaces/syntho/pods/<name>"""
+        obj = obj or {}
+        obj.setdefault("metadata", {})["name"] = name
+        self.objects[f"{collection}/{name}"] = obj
+
+    def update(self, collection, name, obj):
+        """Replaces the object and sends the change to the watch of its collection"""
+        self.add(collection, name, obj)
+        self.version += 1
+        self.events.put((collection, {"type": "MODIFIED", "object": obj}))
+
+    def write_kubeconfig(self, path, user=None):
+        with open(path, "w") as file:
+            yaml.safe_dump(
+                {
+                    "apiVersion": "v1",
+                    "kind": "Config",
+                    "current-context": "fake",
+                    "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}],
+                    "clusters": [{"name": "fake", "cluster": {"server": self.url}}],
+                    "users": [{"name": "fake", "user": user or {"token": "fake-token"}}],
+                },
+                file,
+            )
+        return path
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,221 @@
+"""
+A local stand-in for a `registry:2`-style image registry: serves and receives manifests and
+blobs over plain HTTP/1.1 with keep-alive, mounts blobs across repositories, optionally asks
+for bearer tokens, and logs the requests it gets.
+"""
+
+import base64
+import hashlib
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+INDEX_TYPE = "application/vnd.docker.distribution.manifest.list.v2+json"
+
+ROUTE = re.compile(r"^/v2/(?P<repository>.+)/(?P<kind>manifests|blobs|blobs/uploads)/(?P<reference>[^/]*)$")
+
+
+def get_digest(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request("HEAD")
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def handle_request(self, method):
+        registry = self.server.registry
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        registry.requests.append(f"{method} {url.path}")
+
+        if url.path == "/token":
+            self.send_token(query)
+            return
+        if registry.users and self.headers.get("Authorization") not in registry.tokens:
+            self.send_json(
+                401,
+                {"errors": [{"code": "UNAUTHORIZED"}]},
+                {"WWW-Authenticate": f'Bearer realm="{registry.url}/token",service="fake-registry"'},
+            )
+            return
+
+        route = ROUTE.match(url.path)
+        if url.path == "/v2/":
+            self.send_json(200, {})
+        elif not route:
+            self.send_json(404, {"errors": [{"code": "NOT_FOUND"}]})
+        elif route["kind"] == "manifests":
+            self.handle_manifest(method, route["repository"], route["reference"], body)
+        elif route["kind"] == "blobs":
+            self.handle_blob(method, route["repository"], route["reference"])
+        else:
+            self.handle_upload(method, route["repository"], route["reference"], query, body)
+
+    def handle_manifest(self, method, repository, reference, body):
+        registry = self.server.registry
+        if method == "PUT":
+            digest = get_digest(body)
+            manifest = (self.headers["Content-Type"], body)
+            registry.manifests[(repository, reference)] = registry.manifests[(repository, digest)] = manifest
+            self.send_json(201, {}, {"Docker-Content-Digest": digest})
+            return
+
+        if (repository, reference) not in registry.manifests:
+            self.send_json(404, {"errors": [{"code": "MANIFEST_UNKNOWN"}]})
+            return
+        media_type, data = registry.manifests[(repository, reference)]
+        self.send_data(method, data, {"Content-Type": media_type, "Docker-Content-Digest": get_digest(data)})
+
+    def handle_blob(self, method, repository, digest):
+        registry = self.server.registry
+        if digest not in registry.links.get(repository, set()):
+            self.send_json(404, {"errors": [{"code": "BLOB_UNKNOWN"}]})
+            return
+        self.send_data(method, registry.blobs[digest], {"Content-Type": "application/octet-stream"})
+
+    def handle_upload(self, method, repository, upload_id, query, body):
+        registry = self.server.registry
+        if method == "POST":
+            digest, from_repository = query.get("mount", [None])[0], query.get("from", [None])[0]
+            if registry.mount_supported and digest in registry.links.get(from_repository, set()):
+                registry.links.setdefault(repository, set()).add(digest)
+                self.send_json(201, {}, {"Location": f"/v2/{repository}/blobs/{digest}"})
+                return
+            upload_id = str(uuid.uuid4())
+            registry.uploads[upload_id] = repository
+            self.send_json(202, {}, {"Location": f"/v2/{repository}/blobs/uploads/{upload_id}?_state=fake"})
+            return
+
+        digest = query.get("digest", [None])[0]
+        if registry.uploads.pop(upload_id, None) != repository or digest != get_digest(body):
+            self.send_json(400, {"errors": [{"code": "DIGEST_INVALID"}]})
+            return
+        registry.blobs[digest] = body
+        registry.received_bytes += len(body)
+        registry.links.setdefault(repository, set()).add(digest)
+        self.send_json(201, {}, {"Location": f"/v2/{repository}/blobs/{digest}"})
+
+    def send_token(self, query):
+        registry = self.server.registry
+        authorization = self.headers.get("Authorization", "")
+        user_pass = base64.b64decode(authorization[len("Basic ") :]).decode() if authorization else ""
+        if user_pass.partition(":")[::2] not in registry.users.items():
+            self.send_json(401, {"errors": [{"code": "UNAUTHORIZED"}]})
+            return
+        token = str(uuid.uuid4())
+        registry.tokens.add(f"Bearer {token}")
+        registry.scopes.append(query.get("scope", []))
+        self.send_json(200, {"token": token})
+
+    def send_data(self, method, data, headers):
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if method == "GET":
+            self.wfile.write(data)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+
+class FakeRegistry:
+    def __init__(self, users=None, mount_supported=True):
+        self.users = users or {}
+        self.mount_supported = mount_supported
+        self.blobs = {}
+        self.links = {}
+        self.manifests = {}
+        self.uploads = {}
+        self.tokens = set()
+        self.scopes = []
+        self.requests = []
+        self.received_bytes = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRegistryHandler)
+        self._server.daemon_threads = True
+        self._server.registry = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def url(self):
+        return f"http://{self.host}"
+
+    def add_blob(self, repository, data):
+        digest = get_digest(data)
+        self.blobs[digest] = data
+        self.links.setdefault(repository, set()).add(digest)
+        return {"mediaType": "application/octet-stream", "digest": digest, "size": len(data)}
+
+    def add_image(self, repository, tag, layers, architecture="amd64"):
+        """Serves an image of the given layer contents, returns its manifest"""
+        config = self.add_blob(repository, json.dumps({"architecture": architecture}).encode())
+        manifest = json.dumps(
+            {
+                "schemaVersion": 2,
+                "mediaType": MANIFEST_TYPE,
+                "config": config,
+                "layers": [self.add_blob(repository, layer) for layer in layers],
+            }
+        ).encode()
+        self.manifests[(repository, tag)] = self.manifests[(repository, get_digest(manifest))] = (
+            MANIFEST_TYPE,
+            manifest,
+        )
+        return manifest
+
+    def add_index(self, repository, tag, images):
+        """Serves a multi-platform image of {architecture: layers}"""
+        manifests = []
+        for architecture, layers in images.items():
+            manifest = self.add_image(repository, f"{tag}-{architecture}", layers, architecture)
+            manifests.append(
+                {
+                    "mediaType": MANIFEST_TYPE,
+                    "digest": get_digest(manifest),
+                    "size": len(manifest),
+                    "platform": {"os": "linux", "architecture": architecture},
+                }
+            )
+        index = json.dumps({"schemaVersion": 2, "mediaType": INDEX_TYPE, "manifests": manifests}).encode()
+        self.manifests[(repository, tag)] = (INDEX_TYPE, index)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
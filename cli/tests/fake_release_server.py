@@ -0,0 +1,100 @@
+"""
+A local stand-in for GitHub's release downloads: serves files over plain HTTP/1.1 with
+keep-alive, answers Range and If-Range requests, can cut a response off halfway, and logs
+the requests it gets and the connections they came over.
+"""
+
+import hashlib
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE = re.compile(r"^bytes=(?P<start>\d+)-$")
+
+
+def get_etag(data):
+    return f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+
+
+class FakeReleaseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.releases.lock:
+            self.server.releases.connections += 1
+
+    def do_GET(self):
+        releases = self.server.releases
+        releases.requests.append((self.path, self.headers.get("Range")))
+        data = releases.files.get(self.path)
+        if data is None:
+            self.send_data(404, b"Not Found", {})
+            return
+
+        start = 0
+        requested_range = RANGE.match(self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if requested_range and (not if_range or if_range == get_etag(data)):
+            start = int(requested_range["start"])
+            if start >= len(data):
+                self.send_data(416, b"", {"Content-Range": f"bytes */{len(data)}"})
+                return
+        headers = {"ETag": get_etag(data)}
+        if start:
+            headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+
+        cut_off = releases.cut_offs.pop(self.path, None)
+        if cut_off is not None:
+            # the whole length is announced, and the connection is dropped halfway
+            self.send_response(206 if start else 200)
+            for key, value in {**headers, "Content-Length": str(len(data) - start)}.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data[start : start + cut_off])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.send_data(206 if start else 200, data[start:], headers)
+
+    def send_data(self, status, data, headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeReleaseServer:
+    def __init__(self):
+        self.files = {}
+        # path -> bytes to send of the next response before the connection is dropped
+        self.cut_offs = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeReleaseHandler)
+        self._server.daemon_threads = True
+        self._server.releases = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def add_release(self, version, data, name=None):
+        path = f"/syntho-ai/deployment-tools/releases/download/{version}/{name or f'syntho-{version}.tar.gz'}"
+        self.files[path] = data
+        return f"{self.url}{path}"
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
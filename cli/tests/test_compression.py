@@ -0,0 +1,157 @@
+import gzip
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import zlib
+
+import pytest
+
+from cli import compression
+from cli.compression import (
+    GZIP,
+    ZSTD,
+    CompressionUnavailable,
+    ParallelGzipWriter,
+    archive_dir,
+    detect_compression,
+    extract_archive,
+    open_tar_reader,
+    open_writer,
+)
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli", "scripts")
+
+
+def count_members(data):
+    members = 0
+    while data:
+        decompressor = zlib.decompressobj(31)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        members += 1
+    return members
+
+
+def write_tree(root):
+    files = {
+        "bundle.json": b"{}",
+        "blobs/sha256/aa": os.urandom(300 * 1024),
+        "blobs/sha256/bb": b"layer" * 100000,
+        "shared/process/package_registry.log": b"log",
+    }
+    for name, data in files.items():
+        os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+        with open(os.path.join(root, name), "wb") as file:
+            file.write(data)
+    return files
+
+
+def test_parallel_gzip_members():
+    data = os.urandom(200 * 1024) + b"syntho" * 200000
+    output = io.BytesIO()
+    writer = ParallelGzipWriter(output, workers=4, block_size=64 * 1024)
+    for offset in range(0, len(data), 10000):
+        writer.write(data[offset : offset + 10000])
+    writer.close()
+
+    # every block is a member of its own, in order
+    assert count_members(output.getvalue()) == -(-len(data) // (64 * 1024))
+    assert gzip.decompress(output.getvalue()) == data
+    assert (writer.bytes_in, writer.bytes_out) == (len(data), len(output.getvalue()))
+
+    empty = io.BytesIO()
+    ParallelGzipWriter(empty).close()
+    assert gzip.decompress(empty.getvalue()) == b""
+
+
+def test_archive_dir_round_trip(tmpdir, monkeypatch):
+    # small blocks, so the archive is many members
+    monkeypatch.setattr(compression, "BLOCK_SIZE", 32 * 1024)
+    source_dir = str(tmpdir.mkdir("source"))
+    files = write_tree(source_dir)
+    archive = str(tmpdir.join("archive.tar.gz"))
+
+    archive_dir(archive, source_dir, GZIP, workers=3, excludes=["./shared/process/*.log"])
+
+    assert detect_compression(archive) == GZIP
+    with open(archive, "rb") as file:
+        assert count_members(file.read()) > 1
+    with open_tar_reader(archive) as tar:
+        assert "./blobs/sha256/bb" in [member.name for member in tar]
+
+    output_dir = str(tmpdir.join("output"))
+    extract_archive(archive, output_dir)
+    for name, data in files.items():
+        path = os.path.join(output_dir, name)
+        if name.endswith(".log"):
+            assert not os.path.exists(path)
+        else:
+            with open(path, "rb") as file:
+                assert file.read() == data
+
+
+@pytest.mark.skipif(compression.zstandard is not None, reason="zstandard is installed")
+def test_zstd_unavailable():
+    with pytest.raises(CompressionUnavailable):
+        open_writer(io.BytesIO(), ZSTD)
+    assert compression.get_available_compressions() == [GZIP]
+
+
+@pytest.mark.skipif(compression.zstandard is None, reason="zstandard isn't installed")
+def test_zstd_round_trip(tmpdir):
+    source_dir = str(tmpdir.mkdir("source"))
+    files = write_tree(source_dir)
+    archive = str(tmpdir.join("archive.tar.zst"))
+
+    archive_dir(archive, source_dir, ZSTD)
+    extract_archive(archive, str(tmpdir.join("output")))
+
+    assert detect_compression(archive) == ZSTD
+    with open(str(tmpdir.join("output", "blobs", "sha256", "bb")), "rb") as file:
+        assert file.read() == files["blobs/sha256/bb"]
+
+
+def test_compress_dir_script(tmpdir):
+    source_dir = str(tmpdir.mkdir("source"))
+    files = write_tree(source_dir)
+    archive = str(tmpdir.join("archive.tar.gz"))
+    script = (
+        f'source "{SCRIPTS_DIR}/utils.sh" --source-only\n'
+        f'compress_dir "{archive}" "{source_dir}" gzip "./shared/process/*.log" || exit 1\n'
+        f'mkdir -p "{tmpdir}/output" && extract_archive "{archive}" "{tmpdir}/output"\n'
+    )
+
+    for env in ({"SYNTHO_CLI_PYTHON": sys.executable}, {}):
+        subprocess.run(["bash", "-c", script], env={"PATH": os.environ["PATH"], **env}, check=True)
+
+        with open(str(tmpdir.join("output", "blobs", "sha256", "aa")), "rb") as file:
+            assert file.read() == files["blobs/sha256/aa"]
+        assert not os.path.exists(str(tmpdir.join("output", "shared", "process", "package_registry.log")))
+
+
+@pytest.mark.parametrize("name, linkname", [("../evil", None), ("/tmp/evil", None), ("link", "../../etc/passwd")])
+def test_extract_archive_without_filters(tmpdir, monkeypatch, name, linkname):
+    # Python 3.11.0-3.11.3 has no extraction filters
+    monkeypatch.delattr(tarfile, "data_filter")
+    source_dir = str(tmpdir.mkdir("source"))
+    files = write_tree(source_dir)
+    archive = str(tmpdir.join("archive.tar.gz"))
+    archive_dir(archive, source_dir)
+
+    extract_archive(archive, str(tmpdir.join("output")))
+    with open(str(tmpdir.join("output", "blobs", "sha256", "bb")), "rb") as file:
+        assert file.read() == files["blobs/sha256/bb"]
+
+    with tarfile.open(archive, "w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        if linkname:
+            info.type, info.linkname = tarfile.SYMTYPE, linkname
+            tar.addfile(info)
+        else:
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+    with pytest.raises(tarfile.TarError, match="outside"):
+        extract_archive(archive, str(tmpdir.join("unsafe")))
+    assert not os.path.lexists(str(tmpdir.join("evil"))) and not os.path.lexists("/tmp/evil")
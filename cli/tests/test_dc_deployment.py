@@ -0,0 +1,145 @@
+import os
+from unittest import mock
+
+import pytest
+import yaml
+
+from cli import dc_deployment
+from cli.dc_deployment import DeploymentStatus, DeploymentStep
+from cli.utils import SubprocessResult, read_env_bundle
+
+VERSION = "1.0.0"
+DOCKER_HOST = "unix:///var/run/docker.sock"
+QUESTIONS = {
+    "entrypoint": "domain",
+    "questions": [],
+    "envs_configuration": [
+        {"scope": ".config.env", "envs": [{"name": "DOMAIN", "default": "localhost"}]},
+        {"scope": ".resources.env", "envs": [{"name": "RAY_HEAD_CPU_REQUESTS", "default": 1}]},
+    ],
+}
+
+
+@pytest.fixture
+def scripts_dir(tmpdir):
+    scripts_dir = str(tmpdir)
+    os.makedirs(f"{scripts_dir}/deployments")
+    return scripts_dir
+
+
+def make_release(deployment_dir):
+    questions_dir = f"{deployment_dir}/syntho-charts-{VERSION}/dynamic-configuration/src"
+    os.makedirs(questions_dir, exist_ok=True)
+    with open(f"{questions_dir}/dc_questions.yaml", "w") as file:
+        yaml.dump(QUESTIONS, file)
+    open(f"{deployment_dir}/.images.env", "w").close()
+
+
+def start(scripts_dir, resume=False, registry_pwd="p"):
+    return dc_deployment.start(
+        scripts_dir,
+        "license",
+        "u",
+        registry_pwd,
+        DOCKER_HOST,
+        "",
+        "amd",
+        VERSION,
+        f"{scripts_dir}/missing-docker-config.json",
+        True,
+        False,
+        False,
+        "2.0.0",
+        False,
+        resume,
+    )
+
+
+def use_fake_scripts(scripts, failing_scripts):
+    def run_script(scripts_dir, deployment_dir, script_name, output_path=None, **kwargs):
+        scripts.append(script_name)
+        if output_path:
+            with open(output_path, "w") as file:
+                file.write(f"{script_name} output\n")
+        if script_name == "download-syntho-charts-release-dc.sh":
+            make_release(deployment_dir)
+        succeeded = script_name not in failing_scripts
+        return SubprocessResult(succeeded=succeeded, output="", exitcode=0 if succeeded else 1)
+
+    return mock.patch("cli.dc_deployment.run_script", side_effect=run_script)
+
+
+def test_resume_continues_from_the_failed_step(scripts_dir):
+    scripts = []
+    failing_scripts = {"deploy-ray-and-syntho-stack-dc.sh"}
+
+    with (
+        use_fake_scripts(scripts, failing_scripts),
+        mock.patch("cli.dc_deployment.proceed_with_questions") as mock_questions,
+    ):
+        result = start(scripts_dir)
+        assert not result.succeeded
+        assert result.deployment_status == DeploymentStatus.DEPLOYMENT_FAILED
+
+        deployment_id = result.deployment_id
+        assert dc_deployment.is_resumable(scripts_dir, deployment_id)
+
+        # without --resume the deployment is reported as unfinished
+        assert start(scripts_dir).error == "Deployment remained unfinished"
+
+        scripts.clear()
+        failing_scripts.clear()
+        result = start(scripts_dir, resume=True)
+
+    assert result.succeeded
+    assert scripts == ["deploy-ray-and-syntho-stack-dc.sh"]
+    mock_questions.assert_not_called()
+    deployment = dc_deployment.get_deployment(scripts_dir, deployment_id)
+    assert deployment["status"] == DeploymentStatus.COMPLETED.get()
+    assert deployment["last_succeeded_step"] == DeploymentStep.DEPLOYMENT.value
+
+
+def test_resume_with_changed_options_runs_the_configuration_again(scripts_dir):
+    scripts = []
+    failing_scripts = {"deploy-ray-and-syntho-stack-dc.sh"}
+
+    with use_fake_scripts(scripts, failing_scripts):
+        deployment_id = start(scripts_dir).deployment_id
+
+        scripts.clear()
+        failing_scripts.clear()
+        result = start(scripts_dir, resume=True, registry_pwd="fixed")
+
+    assert result.succeeded
+    assert scripts == ["configuration-questions-dc.sh", "deploy-ray-and-syntho-stack-dc.sh"]
+    deployment_dir = f"{scripts_dir}/deployments/{deployment_id}"
+    assert read_env_bundle(f"{deployment_dir}/.env")["REGISTRY_PWD"] == "fixed"
+
+
+def test_resume_step_falls_back_when_artifacts_are_gone(scripts_dir):
+    deployments_dir = f"{scripts_dir}/deployments"
+    deployment_id = "dc-1"
+    deployment_dir = f"{deployments_dir}/{deployment_id}"
+    with mock.patch("cli.dc_deployment.os.chdir"):
+        dc_deployment.initialize_deployment(
+            deployment_id, deployment_dir, deployments_dir, VERSION, DOCKER_HOST, False, False
+        )
+
+    assert dc_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.PRE_REQUIREMENTS_CHECK
+    assert not dc_deployment.is_resumable(scripts_dir, deployment_id)
+
+    make_release(deployment_dir)
+    for env_configuration in QUESTIONS["envs_configuration"]:
+        open(f"{deployment_dir}/{env_configuration['scope']}", "w").close()
+    dc_deployment.set_step_succeeded(deployment_id, deployments_dir, DeploymentStep.CONFIGURATION)
+    assert dc_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.DEPLOYMENT
+    assert dc_deployment.is_resumable(scripts_dir, deployment_id)
+
+    # the answers are gone, the configuration has to be asked again
+    os.remove(f"{deployment_dir}/.resources.env")
+    assert dc_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.CONFIGURATION
+    assert not dc_deployment.is_resumable(scripts_dir, deployment_id)
+
+    # and so does the release
+    os.remove(f"{deployment_dir}/.images.env")
+    assert dc_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.DOWNLOAD_RELEASE
@@ -130,16 +130,20 @@ class TestDumpEnvs(TestCase):
         self.deployment_dir = "/path/to/deployment_dir"
 
     @mock.patch("cli.dynamic_configuration.core.make_exposed_mapping")
-    @mock.patch("builtins.open", new_callable=mock.mock_open)
-    def test_dump_envs(self, mock_open, mock_make_exposed_mapping):
+    @mock.patch("cli.dynamic_configuration.core.write_env_bundle")
+    def test_dump_envs(self, mock_write_env_bundle, mock_make_exposed_mapping):
         mock_make_exposed_mapping.side_effect = lambda x: {item["name"]: item["value"] for item in x}
 
         dump_envs(self.all_envs, self.deployment_dir)
 
         mock_make_exposed_mapping.assert_any_call(self.all_envs[".config.env"])
         mock_make_exposed_mapping.assert_any_call(self.all_envs[".pre.deployment.ops.env"])
-        mock_open.assert_any_call(f"{self.deployment_dir}/.config.env", "w")
-        mock_open.assert_any_call(f"{self.deployment_dir}/.pre.deployment.ops.env", "w")
+        mock_write_env_bundle.assert_any_call(
+            f"{self.deployment_dir}/.config.env", {"ENV1": "default1", "ENV2": "default2"}
+        )
+        mock_write_env_bundle.assert_any_call(
+            f"{self.deployment_dir}/.pre.deployment.ops.env", {"ENV3": "default3", "ENV4": "default4"}
+        )
 
 
 class TestProceedWithQuestions(TestCase):
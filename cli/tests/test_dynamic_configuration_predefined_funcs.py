@@ -9,7 +9,7 @@ from cli.dynamic_configuration.predefined_funcs import (
     regex,
     returnasis,
 )
-from cli.utils import SubprocessResult
+from cli.utils import StreamResult
 
 
 class TestRegex(TestCase):
@@ -126,20 +126,20 @@ class TestDivide(TestCase):
 
 def test_kubectlget():
     with (
-        mock.patch("cli.dynamic_configuration.predefined_funcs.run_script") as mock_run_script,
+        mock.patch("cli.dynamic_configuration.predefined_funcs.stream_script") as mock_stream_script,
     ):
-        mock_run_script.return_value = SubprocessResult(succeeded=True, output="local-path", exitcode=0)
+        mock_stream_script.return_value = StreamResult(succeeded=True, output="local-path", exitcode=0, tail=[])
         deployment_dir = "foo/bar/scripts/deployments/a-deployment-id"
         args = ["get", "pv", "-l", "pv-label-key=mylabel", "-o", 'jsonpath="{.items[*].spec.storageClassName}"']
         value = kubectlget(deployment_dir, *args)
 
         assert value == "local-path"
 
-        mock_run_script.assert_called_with(
+        mock_stream_script.assert_called_with(
             "foo/bar/scripts",
             "foo/bar/scripts/deployments/a-deployment-id",
             "kubectlget.sh",
-            capture_output=True,
+            collect_output=True,
             **{"PARAMS": 'get pv -l pv-label-key=mylabel -o jsonpath="{.items[*].spec.storageClassName}"'},
         )
 
@@ -0,0 +1,142 @@
+import os
+from unittest import mock
+
+import pytest
+import yaml
+
+from cli import k8s_deployment
+from cli.k8s_deployment import DeploymentStatus, DeploymentStep
+from cli.utils import SubprocessResult, read_env_bundle, write_env_bundle
+
+VERSION = "1.0.0"
+QUESTIONS = {
+    "entrypoint": "domain",
+    "questions": [],
+    "envs_configuration": [
+        {"scope": ".config.env", "envs": [{"name": "DOMAIN", "default": "localhost"}]},
+        {"scope": ".resources.env", "envs": [{"name": "RAY_HEAD_CPU_REQUESTS", "default": 1}]},
+    ],
+}
+
+
+@pytest.fixture
+def scripts_dir(tmpdir):
+    scripts_dir = str(tmpdir)
+    os.makedirs(f"{scripts_dir}/deployments")
+    return scripts_dir
+
+
+def make_release(deployment_dir):
+    questions_dir = f"{deployment_dir}/syntho-charts-{VERSION}/dynamic-configuration/src"
+    os.makedirs(questions_dir)
+    with open(f"{questions_dir}/k8s_questions.yaml", "w") as file:
+        yaml.dump(QUESTIONS, file)
+    open(f"{deployment_dir}/.images.env", "w").close()
+
+
+def start(scripts_dir, resume=False, registry_pwd="p"):
+    return k8s_deployment.start(
+        scripts_dir, "license", "u", registry_pwd, "kubeconfig", "amd", VERSION, "", True, False, "2.0.0", False, resume
+    )
+
+
+def use_fake_scripts(scripts, failing_scripts):
+    def run_script(scripts_dir, deployment_dir, script_name, output_path=None, **kwargs):
+        scripts.append(script_name)
+        if output_path:
+            with open(output_path, "w") as file:
+                file.write(f"{script_name} output\n")
+        if script_name == "download-syntho-charts-release.sh":
+            make_release(deployment_dir)
+        succeeded = script_name not in failing_scripts
+        return SubprocessResult(succeeded=succeeded, output="cluster", exitcode=0 if succeeded else 1)
+
+    return mock.patch("cli.k8s_deployment.run_script", side_effect=run_script)
+
+
+def test_resume_continues_from_the_failed_step(scripts_dir):
+    scripts = []
+    failing_scripts = {"deploy-ray-and-syntho-stack.sh"}
+
+    with (
+        use_fake_scripts(scripts, failing_scripts),
+        mock.patch("cli.k8s_deployment.proceed_with_questions") as mock_questions,
+    ):
+        result = start(scripts_dir)
+        assert not result.succeeded
+        assert result.deployment_status == DeploymentStatus.SYNTHO_UI_DEPLOYMENT_FAILED
+
+        deployment_id = result.deployment_id
+        assert k8s_deployment.is_resumable(scripts_dir, deployment_id)
+
+        # without --resume the deployment is reported as unfinished
+        assert start(scripts_dir).error == "Deployment remained unfinished"
+
+        scripts.clear()
+        failing_scripts.clear()
+        result = start(scripts_dir, resume=True)
+
+    assert result.succeeded
+    assert scripts == ["deploy-ray-and-syntho-stack.sh"]
+    mock_questions.assert_not_called()
+    deployment = k8s_deployment.get_deployment(scripts_dir, deployment_id)
+    assert deployment["status"] == DeploymentStatus.COMPLETED.get()
+    assert deployment["last_succeeded_step"] == DeploymentStep.DEPLOYMENT.value
+
+
+def test_resume_with_changed_options_runs_the_configuration_again(scripts_dir):
+    scripts = []
+    failing_scripts = {"deploy-ray-and-syntho-stack.sh"}
+
+    with use_fake_scripts(scripts, failing_scripts):
+        deployment_id = start(scripts_dir).deployment_id
+
+        scripts.clear()
+        failing_scripts.clear()
+        result = start(scripts_dir, resume=True, registry_pwd="fixed")
+
+    assert result.succeeded
+    assert scripts == [
+        "configuration-questions.sh",
+        "major-pre-deployment-operations.sh",
+        "deploy-ray-and-syntho-stack.sh",
+    ]
+    deployment_dir = f"{scripts_dir}/deployments/{deployment_id}"
+    assert read_env_bundle(f"{deployment_dir}/.env")["REGISTRY_PWD"] == "fixed"
+
+
+def test_resume_step_falls_back_when_artifacts_are_gone(scripts_dir):
+    deployments_dir = f"{scripts_dir}/deployments"
+    deployment_id = "k8s-1"
+    deployment_dir = f"{deployments_dir}/{deployment_id}"
+    with mock.patch("cli.k8s_deployment.os.chdir"):
+        k8s_deployment.initialize_deployment(deployment_id, deployment_dir, deployments_dir, VERSION)
+
+    assert k8s_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.PRE_REQUIREMENTS_CHECK
+
+    make_release(deployment_dir)
+    for env_configuration in QUESTIONS["envs_configuration"]:
+        open(f"{deployment_dir}/{env_configuration['scope']}", "w").close()
+    k8s_deployment.set_step_succeeded(deployment_id, deployments_dir, DeploymentStep.MAJOR_PRE_DEPLOYMENT_OPERATIONS)
+    assert k8s_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.DEPLOYMENT
+
+    # the answers are gone, the configuration has to be asked again
+    os.remove(f"{deployment_dir}/.resources.env")
+    assert k8s_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.CONFIGURATION
+    assert not k8s_deployment.is_resumable(scripts_dir, deployment_id)
+
+    # and so does the release
+    os.remove(f"{deployment_dir}/.images.env")
+    assert k8s_deployment.get_resume_step(deployments_dir, deployment_id) == DeploymentStep.DOWNLOAD_RELEASE
+
+
+def test_stop_probe_pod(fake_kube_api, tmpdir):
+    deployment_dir = str(tmpdir)
+    assert not k8s_deployment.stop_probe_pod(deployment_dir)
+
+    write_env_bundle(f"{deployment_dir}/.env", {"KUBECONFIG": fake_kube_api.kubeconfig_path})
+    fake_kube_api.add("/api/v1/namespaces/syntho/pods", k8s_deployment.PROBE_POD)
+
+    assert k8s_deployment.stop_probe_pod(deployment_dir)
+    assert fake_kube_api.requests == ["DELETE /api/v1/namespaces/syntho/pods/syntho-probe?gracePeriodSeconds=0"]
+    assert not k8s_deployment.stop_probe_pod(deployment_dir)
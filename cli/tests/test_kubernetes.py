@@ -0,0 +1,131 @@
+import os
+import warnings
+
+import pytest
+import yaml
+from urllib3.exceptions import InsecureRequestWarning
+
+from cli import kubernetes
+from cli.dynamic_configuration.predefined_funcs import kubectlget
+from cli.kubernetes import (
+    KubeClient,
+    KubernetesUnavailable,
+    get_client,
+    kubectl_get,
+    parse_get_params,
+    select_path,
+)
+from cli.utils import write_env_bundle
+
+
+def add_pv(api, name, label, storage_class):
+    api.add(
+        "/api/v1/persistentvolumes",
+        name,
+        {"metadata": {"labels": {"pv-label-key": label}}, "spec": {"storageClassName": storage_class}},
+    )
+
+
+def test_parse_get_params():
+    query = parse_get_params("pv -l pv-label-key=data -o json | jq -r '.items[].spec.storageClassName'")
+    assert query.resource == "pv"
+    assert query.label_selector == "pv-label-key=data"
+    assert query.path == ".items[].spec.storageClassName"
+
+    query = parse_get_params('get pv -o jsonpath="{.items[*].spec.storageClassName}"')
+    assert (query.output, query.path) == ("jsonpath", ".items[*].spec.storageClassName")
+
+    assert parse_get_params("storageclass local-path").name == "local-path"
+    # left to kubectl
+    assert parse_get_params("deployments") is None
+    assert parse_get_params("pv -o wide") is None
+    assert parse_get_params("pv -o json | jq '.items | length'") is None
+
+
+def test_select_path():
+    obj = {"items": [{"spec": {"a": "x"}}, {"spec": {"a": "y"}}, {"spec": {}}]}
+
+    assert select_path(obj, ".items[].spec.a") == ["x", "y", None]
+    assert select_path(obj, ".items[1].spec.a") == ["y"]
+    assert select_path(obj, ".items | length") is None
+
+
+def test_kubectl_get(fake_kube_api):
+    add_pv(fake_kube_api, "pv-1", "data", "local-path")
+    add_pv(fake_kube_api, "pv-2", "other", "nfs")
+    fake_kube_api.add("/apis/storage.k8s.io/v1/storageclasses", "local-path")
+    kubeconfig = fake_kube_api.kubeconfig_path
+
+    assert kubectl_get(kubeconfig, "pv -l pv-label-key=data -o json | jq -r '.items[].spec.storageClassName'") == (
+        "local-path"
+    )
+    assert kubectl_get(kubeconfig, "pv -l pv-label-key=none -o json | jq -r '.items[].spec.storageClassName'") == ""
+    assert kubectl_get(kubeconfig, 'pv -o jsonpath="{.items[*].spec.storageClassName}"') == "local-path nfs"
+    assert kubectl_get(kubeconfig, "storageclass local-path") == "local-path"
+    assert kubectl_get(kubeconfig, "storageclass missing") == ""
+    assert kubectl_get(kubeconfig, "deployments") is None
+
+    # every query went over the same kept-alive connection
+    assert len(fake_kube_api.requests) == 5
+    assert fake_kube_api.connections == 1
+
+
+def test_client_pool(fake_kube_api, tmpdir):
+    kubeconfig = fake_kube_api.kubeconfig_path
+    client = get_client(kubeconfig)
+    assert get_client(kubeconfig) is client
+
+    # a changed kubeconfig gets a new client, which replaces the old one
+    os.utime(kubeconfig, ns=(0, 0))
+    new_client = get_client(kubeconfig)
+    assert new_client is not client
+    assert kubernetes._clients[os.path.realpath(kubeconfig)] == (0, new_client)
+    assert not os.path.exists(client._files_dir)
+
+
+def test_client_skipping_tls_verify_only_silences_its_own_warnings(tmpdir):
+    kubeconfig = str(tmpdir.join("kubeconfig"))
+    with open(kubeconfig, "w") as file:
+        yaml.safe_dump(
+            {
+                "current-context": "insecure",
+                "contexts": [{"name": "insecure", "context": {"cluster": "insecure"}}],
+                "clusters": [
+                    {
+                        "name": "insecure",
+                        "cluster": {"server": "https://kube.example:6443", "insecure-skip-tls-verify": True},
+                    }
+                ],
+            },
+            file,
+        )
+
+    with warnings.catch_warnings(record=True) as caught:
+        client = KubeClient(kubeconfig)
+        client.close()
+        for host in ("kube.example", "registry.example"):
+            message = f"Unverified HTTPS request is being made to host '{host}'."
+            warnings.warn(message, InsecureRequestWarning, stacklevel=1)
+
+    assert [str(warning.message) for warning in caught] == [
+        "Unverified HTTPS request is being made to host 'registry.example'."
+    ]
+
+
+def test_client_needs_kubectl(fake_kube_api, tmpdir):
+    kubeconfig = fake_kube_api.write_kubeconfig(
+        str(tmpdir.join("exec-kubeconfig")), user={"exec": {"command": "aws", "args": ["eks", "get-token"]}}
+    )
+
+    with pytest.raises(KubernetesUnavailable):
+        KubeClient(kubeconfig)
+    assert kubectl_get(kubeconfig, "storageclass local-path") is None
+
+
+def test_kubectlget_in_process(fake_kube_api, tmpdir):
+    fake_kube_api.add("/apis/networking.k8s.io/v1/ingressclasses", "nginx")
+    deployment_dir = str(tmpdir.mkdir("scripts").mkdir("deployments").mkdir("a-deployment-id"))
+    write_env_bundle(f"{deployment_dir}/.env", {"KUBECONFIG": fake_kube_api.kubeconfig_path})
+
+    assert kubectlget(deployment_dir, "ingressclass", "nginx") == "nginx"
+    assert kubectlget(deployment_dir, "ingressclass", "traefik") == ""
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import tarfile
+
+import pytest
+
+from cli.layer_store import (
+    LayerStore,
+    apply_delta_bundle,
+    get_repositories,
+    ingest_registry,
+    make_delta_bundle,
+    read_bundle,
+    restore_registry,
+    write_bundle,
+)
+from cli.utilities.offline_ops import (
+    generate_offline_delta_archive_path,
+    generate_offline_registry_archive_path,
+    import_offline_delta,
+    make_delta_archive,
+    package_syntho_registry,
+    read_archive_bundle,
+    rebase_images_env,
+)
+from cli.utils import read_env_bundle, set_status, write_env_bundle
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+
+
+def get_digest(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def write_blob(registry_dir, repository, data, kind="_layers"):
+    digest = get_digest(data)
+    hex_digest = digest.split(":")[1]
+    v2 = os.path.join(registry_dir, "docker", "registry", "v2")
+    write_file(os.path.join(v2, "blobs", "sha256", hex_digest[:2], hex_digest, "data"), data)
+    link_dir = "_manifests/revisions" if kind == "_manifests" else kind
+    write_file(os.path.join(v2, "repositories", repository, link_dir, "sha256", hex_digest, "link"), digest.encode())
+    return {"mediaType": "application/octet-stream", "digest": digest, "size": len(data)}
+
+
+def write_registry(registry_dir, images):
+    """Writes the storage of a registry:2 holding {(repository, tag): [layer contents]}"""
+    for (repository, tag), layers in images.items():
+        config = write_blob(registry_dir, repository, json.dumps({"architecture": "amd64"}).encode())
+        manifest = json.dumps(
+            {
+                "schemaVersion": 2,
+                "mediaType": MANIFEST_TYPE,
+                "config": config,
+                "layers": [write_blob(registry_dir, repository, layer) for layer in layers],
+            }
+        ).encode()
+        digest = write_blob(registry_dir, repository, manifest, "_manifests")["digest"]
+        tag_dir = os.path.join(registry_dir, "docker", "registry", "v2", "repositories", repository, "_manifests")
+        write_file(os.path.join(tag_dir, "tags", tag, "current", "link"), digest.encode())
+        write_file(os.path.join(tag_dir, "tags", tag, "index", "sha256", digest.split(":")[1], "link"), digest.encode())
+
+
+def list_files(root):
+    files = {}
+    for path, _, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(path, name), "rb") as file:
+                files[os.path.relpath(os.path.join(path, name), root)] = file.read()
+    return files
+
+
+def test_bundle_round_trip(tmpdir):
+    registry_dir = str(tmpdir.join("registry"))
+    write_registry(
+        registry_dir,
+        {
+            ("syntho-core-api", "1.0.0"): [b"base", b"api"],
+            ("syntho-core-backend", "1.0.0"): [b"base", b"backend"],
+            ("syntho/ray", "2.9"): [b"ray"],
+        },
+    )
+    store = LayerStore(str(tmpdir.join("store")))
+    bundle_dir = str(tmpdir.join("bundle"))
+
+    repositories = ingest_registry(registry_dir, store)
+    bundle = write_bundle(bundle_dir, store, repositories, "1.0.0", "amd")
+
+    assert get_repositories(registry_dir) == ["syntho-core-api", "syntho-core-backend", "syntho/ray"]
+    # base and the config are shared, they are bundled once
+    assert len(bundle["blobs"]) == 3 + 2 + 2 + 1
+    assert len(os.listdir(os.path.join(bundle_dir, "blobs", "sha256"))) == len(bundle["blobs"])
+    assert read_bundle(bundle_dir)["repositories"]["syntho/ray"]["tags"] == {
+        "2.9": repositories["syntho/ray"]["tags"]["2.9"]
+    }
+
+    restored_dir = str(tmpdir.join("restored"))
+    restore_registry(bundle_dir, restored_dir)
+    assert list_files(restored_dir) == list_files(registry_dir)
+
+
+def test_layer_store_across_versions(tmpdir):
+    store = LayerStore(str(tmpdir.join("store")))
+    for version, layers in (("1.0.0", [b"base", b"api-1"]), ("1.1.0", [b"base", b"api-2"])):
+        registry_dir = str(tmpdir.join(f"registry-{version}"))
+        write_registry(registry_dir, {("syntho-core-api", version): layers})
+        ingest_registry(registry_dir, store)
+
+    # the config and base are stored once for both versions
+    assert len(os.listdir(os.path.join(store.root, "blobs", "sha256"))) == 2 + 2 + 2
+
+
+def test_delta_bundle(tmpdir):
+    store = LayerStore(str(tmpdir.join("store")))
+    bundles = {}
+    for version, layers in (("1.0.0", [b"base", b"api-1", b"old"]), ("1.1.0", [b"base", b"api-2"])):
+        registry_dir = str(tmpdir.join(f"registry-{version}"))
+        write_registry(registry_dir, {("syntho-core-api", version): layers})
+        bundle_dir = str(tmpdir.join(f"bundle-{version}"))
+        bundles[version] = write_bundle(bundle_dir, store, ingest_registry(registry_dir, store), version, "amd")
+
+    delta = make_delta_bundle(bundles["1.1.0"], bundles["1.0.0"])
+
+    # base and the config are in 1.0.0 already
+    assert delta["base_version"] == "1.0.0"
+    assert sorted(delta["blobs"]) == sorted(
+        [get_digest(b"api-2"), *delta["repositories"]["syntho-core-api"]["manifests"]]
+    )
+    # the blobs that only 1.0.0 used are dropped
+    assert apply_delta_bundle(bundles["1.0.0"], delta) == bundles["1.1.0"]
+    with pytest.raises(ValueError):
+        apply_delta_bundle(bundles["1.1.0"], delta)
+    with pytest.raises(ValueError):
+        make_delta_bundle(bundles["1.1.0"], {**bundles["1.0.0"], "arch": "arm"})
+
+
+def test_restore_delta_needs_base(tmpdir):
+    store = LayerStore(str(tmpdir.join("store")))
+    bundles = {}
+    for version, layers in (("1.0.0", [b"base"]), ("1.1.0", [b"base", b"api"])):
+        registry_dir = str(tmpdir.join(f"registry-{version}"))
+        write_registry(registry_dir, {("syntho-core-api", version): layers})
+        bundles[version] = ingest_registry(registry_dir, store)
+
+    base = write_bundle(str(tmpdir.join("base")), store, bundles["1.0.0"], "1.0.0", "amd")
+    full = write_bundle(str(tmpdir.join("full")), store, bundles["1.1.0"], "1.1.0", "amd")
+    delta = make_delta_bundle(full, base)
+    delta_dir = str(tmpdir.join("delta"))
+    for digest in delta["blobs"]:
+        with open(store.get_path(digest), "rb") as file:
+            write_file(os.path.join(delta_dir, "blobs", "sha256", digest.split(":")[1]), file.read())
+    write_file(os.path.join(delta_dir, "bundle.json"), json.dumps(delta).encode())
+
+    with pytest.raises(ValueError, match="1.0.0"):
+        restore_registry(delta_dir, str(tmpdir.join("empty")))
+
+    registry_dir = str(tmpdir.join("restored"))
+    restore_registry(str(tmpdir.join("base")), registry_dir)
+    restore_registry(delta_dir, registry_dir)
+    # layered onto 1.0.0, which is still there
+    assert list_files(registry_dir) == {
+        **list_files(str(tmpdir.join("registry-1.0.0"))),
+        **list_files(str(tmpdir.join("registry-1.1.0"))),
+    }
+
+
+# streams the storage of the registry in $REGISTRY_STORAGE as `docker cp` does
+FAKE_DOCKER = """#!/bin/bash
+echo "$*" >> "$DOCKER_CALLS"
+if [[ "$1" == "cp" ]]; then
+    tar -cf - -C "$REGISTRY_STORAGE" registry
+elif [[ "$1" == "save" ]]; then
+    printf "registry:2"
+fi
+"""
+
+
+def use_fake_docker(tmpdir, monkeypatch, images):
+    """Serves a registry container holding {(repository, tag): [layer contents]}, returns the docker calls file"""
+    storage = tmpdir.mkdir(f"storage-{len(tmpdir.listdir())}")
+    write_registry(str(storage.join("registry")), images)
+    docker = storage.mkdir("bin").join("docker")
+    docker.write(FAKE_DOCKER)
+    os.chmod(str(docker), 0o755)
+    monkeypatch.setenv("PATH", f"{docker.dirname}:{os.environ['PATH']}")
+    monkeypatch.setenv("REGISTRY_STORAGE", str(storage))
+    monkeypatch.setenv("DOCKER_CALLS", str(tmpdir.join("calls")))
+    return tmpdir.join("calls")
+
+
+def make_images_env(version, port):
+    registry = f"localhost:{port}"
+    return (
+        f"OFFLINE_IMAGE_REGISTRY_SERVER={registry}\n"
+        f"OFFLINE_CORE_IMG_REPO={registry}/syntho-core-api\n"
+        f"OFFLINE_CORE_IMG_TAG={version}\n"
+    )
+
+
+def activate_offline_mode(tmpdir, monkeypatch, scripts_dir, version, layers, port=5000):
+    """Does the packaging step of activate-offline-mode for a version"""
+    offline_registry_dir = os.path.join(scripts_dir, "utilities", "activate-offline-mode")
+    os.makedirs(offline_registry_dir, exist_ok=True)
+    env_file_path = os.path.join(offline_registry_dir, ".env")
+    env = {"VERSION": version, "ARCH": "amd", "AVAILABLE_PORT": port, "OFFLINE_REGISTRY": f"localhost:{port}"}
+    write_env_bundle(env_file_path, env)
+    write_file(os.path.join(offline_registry_dir, ".images-offline.env"), make_images_env(version, port).encode())
+    use_fake_docker(tmpdir, monkeypatch, {("syntho-core-api", version): layers})
+
+    assert package_syntho_registry(scripts_dir, env_file_path)
+    set_status(offline_registry_dir, "completed")
+    return env_file_path
+
+
+def test_import_offline_delta(tmpdir, monkeypatch):
+    source_dir, target_dir = str(tmpdir.mkdir("source")), str(tmpdir.mkdir("target"))
+    # find_available_port picked another port on each host
+    activate_offline_mode(tmpdir, monkeypatch, source_dir, "1.0.0", [b"base", b"api-1"], port=5001)
+    activate_offline_mode(tmpdir, monkeypatch, target_dir, "1.0.0", [b"base", b"api-1"], port=5002)
+    env_file_path = activate_offline_mode(tmpdir, monkeypatch, source_dir, "1.1.0", [b"base", b"api-2"], port=5001)
+
+    assert make_delta_archive(source_dir, env_file_path, "1.0.0")
+    delta_archive_path = generate_offline_delta_archive_path(source_dir, "1.0.0", "1.1.0")
+    with tarfile.open(delta_archive_path, "r:gz") as tar:
+        # the delta doesn't carry the registry image nor what 1.0.0 has
+        assert len([name for name in tar.getnames() if name.startswith("./blobs/")]) == 2
+
+    assert import_offline_delta(target_dir, delta_archive_path) == (True, None)
+
+    imported = read_archive_bundle(generate_offline_registry_archive_path(target_dir))
+    assert imported == read_archive_bundle(generate_offline_registry_archive_path(source_dir))
+    with tarfile.open(generate_offline_registry_archive_path(target_dir), "r:gz") as tar:
+        names = tar.getnames()
+    assert "./syntho-offline-registry.tar" in names
+    assert sorted(name[len("./blobs/sha256/") :] for name in names if name.startswith("./blobs/sha256/")) == sorted(
+        digest.split(":")[1] for digest in imported["blobs"]
+    )
+    target_registry_dir = os.path.join(target_dir, "utilities", "activate-offline-mode")
+    env = read_env_bundle(os.path.join(target_registry_dir, ".env"))
+    assert (env["VERSION"], env["OFFLINE_REGISTRY"]) == ("1.1.0", "localhost:5002")
+    # the images are pulled from the registry the deployment starts on this host's port
+    with open(os.path.join(target_registry_dir, ".images-offline.env")) as file:
+        assert file.read() == make_images_env("1.1.0", 5002)
+
+    # it's been imported already
+    assert import_offline_delta(target_dir, delta_archive_path)[0] is False
+
+
+def test_rebase_images_env():
+    images_env = make_images_env("1.1.0", 5001) + "OFFLINE_UI_IMG_REPO=localhost:50010/syntho-ui\n"
+
+    rebased = rebase_images_env(images_env, "localhost:5002")
+
+    assert rebased == make_images_env("1.1.0", 5002) + "OFFLINE_UI_IMG_REPO=localhost:50010/syntho-ui\n"
+    assert rebase_images_env(images_env, "localhost:5001") == images_env
@@ -0,0 +1,112 @@
+import json
+import multiprocessing
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from cli.lease import LEASE_FILE, acquire_lease, get_lease_info, is_lease_alive, release_lease
+from cli.utils import clear_dir
+
+
+def hold_lease(file_dir, acquired, finish):
+    acquired.put(acquire_lease(file_dir))
+    finish.wait()
+    release_lease(file_dir)
+
+
+def crash_with_lease(file_dir):
+    acquire_lease(file_dir)
+    os._exit(1)
+
+
+def write_lease(file_dir, host, heartbeat):
+    with open(f"{file_dir}/{LEASE_FILE}", "w") as file:
+        json.dump({"pid": 12345, "host": host, "started_at": heartbeat, "heartbeat": heartbeat}, file)
+
+
+def test_lease_is_exclusive_across_processes(tmpdir):
+    file_dir = str(tmpdir)
+    context = multiprocessing.get_context("fork")
+    acquired, finish = context.Queue(), context.Event()
+    owner = context.Process(target=hold_lease, args=(file_dir, acquired, finish))
+    owner.start()
+    assert acquired.get(timeout=10) is True
+
+    assert is_lease_alive(file_dir) is True
+    assert get_lease_info(file_dir)["pid"] == owner.pid
+    assert acquire_lease(file_dir) is False
+
+    finish.set()
+    owner.join()
+
+    assert is_lease_alive(file_dir) is False
+    assert acquire_lease(file_dir) is True
+    release_lease(file_dir)
+
+
+def test_lease_of_a_crashed_owner_is_reclaimed(tmpdir):
+    file_dir = str(tmpdir)
+    context = multiprocessing.get_context("fork")
+    owner = context.Process(target=crash_with_lease, args=(file_dir,))
+    owner.start()
+    owner.join()
+
+    # the lease file is still there, but nobody holds it
+    assert os.path.exists(f"{file_dir}/{LEASE_FILE}")
+    assert is_lease_alive(file_dir) is False
+    assert get_lease_info(file_dir) is None
+
+    assert acquire_lease(file_dir) is True
+    assert get_lease_info(file_dir)["pid"] == os.getpid()
+    release_lease(file_dir)
+
+
+def test_lease_from_another_host_expires_with_its_heartbeat(tmpdir):
+    file_dir = str(tmpdir)
+
+    write_lease(file_dir, "another-host", datetime.utcnow().isoformat())
+    assert is_lease_alive(file_dir) is True
+    assert acquire_lease(file_dir) is False
+
+    write_lease(file_dir, "another-host", (datetime.utcnow() - timedelta(minutes=5)).isoformat())
+    assert is_lease_alive(file_dir) is False
+    assert acquire_lease(file_dir) is True
+    release_lease(file_dir)
+
+    # on this host flock is authoritative, the heartbeat doesn't matter
+    write_lease(file_dir, socket.gethostname(), datetime.utcnow().isoformat())
+    assert is_lease_alive(file_dir) is False
+
+
+def test_heartbeat_is_refreshed(tmpdir):
+    file_dir = str(tmpdir)
+    with mock.patch("cli.lease.HEARTBEAT_INTERVAL", 0.01):
+        acquire_lease(file_dir)
+        try:
+            started_at = get_lease_info(file_dir)["started_at"]
+            for _ in range(100):
+                info = get_lease_info(file_dir)
+                if info and info["heartbeat"] > started_at:
+                    break
+                time.sleep(0.01)
+            assert info["heartbeat"] > started_at
+        finally:
+            release_lease(file_dir)
+
+
+def test_clear_dir_keeps_the_lease(tmpdir):
+    file_dir = str(tmpdir)
+    acquire_lease(file_dir)
+    try:
+        os.makedirs(f"{file_dir}/shared/process")
+        with open(f"{file_dir}/status", "w") as file:
+            file.write("completed")
+
+        clear_dir(file_dir)
+
+        assert os.listdir(file_dir) == [LEASE_FILE]
+        assert is_lease_alive(file_dir) is True
+    finally:
+        release_lease(file_dir)
@@ -0,0 +1,145 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from cli import offline_bundle
+from cli.compression import extract_archive
+from cli.layer_store import LayerStore, read_bundle, restore_registry
+from cli.offline_bundle import REGISTRY_IMAGE_MEMBER, write_offline_archive
+from cli.utilities.offline_ops import generate_offline_registry_archive_path, get_packaging, package_syntho_registry
+from cli.utils import write_env_bundle
+from tests.test_layer_store import get_digest, list_files, use_fake_docker, write_registry
+
+IMAGES = {
+    ("syntho-core-api", "1.0.0"): [b"base", b"api" * 1000],
+    ("syntho-core-backend", "1.0.0"): [b"base", b"backend"],
+}
+
+
+def make_registry_stream(registry_dir):
+    """The storage of a registry as `docker cp <container>:/var/lib/registry -` streams it"""
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        tar.add(registry_dir, arcname="registry")
+    stream.seek(0)
+    return stream
+
+
+def test_write_offline_archive(tmpdir):
+    registry_dir = str(tmpdir.join("registry"))
+    write_registry(registry_dir, IMAGES)
+    store = LayerStore(str(tmpdir.join("store")))
+    archive_path = str(tmpdir.join("activate-offline-mode.tar.gz"))
+
+    result = write_offline_archive(
+        archive_path, store, "1.0.0", "amd", make_registry_stream(registry_dir), io.BytesIO(b"registry:2")
+    )
+
+    # base and the config are shared, they are archived once next to the two manifests
+    assert len(result.bundle["blobs"]) == 4 + 2
+    assert result.stored_blobs == len(result.bundle["blobs"])
+    assert result.peak_scratch_bytes == 0
+    assert not os.path.exists(f"{archive_path}.tmp")
+
+    bundle_dir = str(tmpdir.join("bundle"))
+    extract_archive(archive_path, bundle_dir)
+    assert read_bundle(bundle_dir) == result.bundle
+    with open(os.path.join(bundle_dir, REGISTRY_IMAGE_MEMBER), "rb") as file:
+        assert file.read() == b"registry:2"
+    restore_registry(bundle_dir, str(tmpdir.join("restored")))
+    assert list_files(str(tmpdir.join("restored"))) == list_files(registry_dir)
+
+    # the store has every blob already
+    result = write_offline_archive(
+        archive_path, store, "1.0.0", "amd", make_registry_stream(registry_dir), io.BytesIO(b"registry:2")
+    )
+    assert result.stored_blobs == 0
+
+
+def test_write_offline_archive_spools_large_image(tmpdir, monkeypatch):
+    monkeypatch.setattr(offline_bundle, "SPOOL_SIZE", 1024)
+    monkeypatch.setattr(offline_bundle, "CHUNK_SIZE", 1000)
+    registry_dir = str(tmpdir.join("registry"))
+    write_registry(registry_dir, IMAGES)
+    scratch_dir = tmpdir.mkdir("scratch")
+
+    result = write_offline_archive(
+        str(tmpdir.join("activate-offline-mode.tar.gz")),
+        LayerStore(str(tmpdir.join("store"))),
+        "1.0.0",
+        "amd",
+        make_registry_stream(registry_dir),
+        io.BytesIO(b"i" * 10000),
+        scratch_dir=str(scratch_dir),
+    )
+
+    assert result.peak_scratch_bytes == 10000
+    assert scratch_dir.listdir() == []
+
+
+def test_write_offline_archive_checks_digests(tmpdir):
+    registry_dir = str(tmpdir.join("registry"))
+    write_registry(registry_dir, IMAGES)
+    hex_digest = get_digest(b"backend").split(":")[1]
+    with open(
+        os.path.join(registry_dir, "docker/registry/v2/blobs/sha256", hex_digest[:2], hex_digest, "data"), "wb"
+    ) as file:
+        file.write(b"tampered")
+    store = LayerStore(str(tmpdir.join("store")))
+    archive_path = str(tmpdir.join("activate-offline-mode.tar.gz"))
+
+    with pytest.raises(ValueError, match=hex_digest):
+        write_offline_archive(
+            archive_path, store, "1.0.0", "amd", make_registry_stream(registry_dir), io.BytesIO(b"registry:2")
+        )
+
+    assert not store.has_blob(get_digest(b"backend"))
+    assert not os.path.exists(archive_path) and not os.path.exists(f"{archive_path}.tmp")
+
+
+def test_write_offline_archive_reports_truncated_stream(tmpdir):
+    registry_dir = str(tmpdir.join("registry"))
+    write_registry(registry_dir, IMAGES)
+    data = make_registry_stream(registry_dir).getvalue()
+    # the stream stops in the middle of the largest blob
+    cut_off = data.index(b"api" * 1000) + 1000
+    store = LayerStore(str(tmpdir.join("store")))
+
+    with pytest.raises(tarfile.ReadError, match="unexpected end of data"):
+        write_offline_archive(
+            str(tmpdir.join("activate-offline-mode.tar.gz")),
+            store,
+            "1.0.0",
+            "amd",
+            io.BytesIO(data[:cut_off]),
+            io.BytesIO(b"registry:2"),
+        )
+
+    assert not store.has_blob(get_digest(b"api" * 1000))
+    assert not [name for name in os.listdir(store.root) if name.startswith(".blob.")]
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_package_syntho_registry(tmpdir, monkeypatch, fail):
+    scripts_dir = str(tmpdir.mkdir("scripts"))
+    offline_registry_dir = os.path.join(scripts_dir, "utilities", "activate-offline-mode")
+    os.makedirs(offline_registry_dir)
+    env_file_path = os.path.join(offline_registry_dir, ".env")
+    write_env_bundle(env_file_path, {"VERSION": "1.0.0", "ARCH": "amd"})
+    calls = use_fake_docker(tmpdir, monkeypatch, IMAGES)
+    if fail:
+        # the registry container is gone
+        monkeypatch.setenv("REGISTRY_STORAGE", str(tmpdir.join("missing")))
+
+    assert package_syntho_registry(scripts_dir, env_file_path) is not fail
+
+    # the container is removed either way
+    assert calls.read().splitlines()[-1] == "rm -f syntho-offline-registry"
+    if fail:
+        assert get_packaging(scripts_dir) == {}
+        return
+    packaging = get_packaging(scripts_dir)
+    assert packaging["archive"] == generate_offline_registry_archive_path(scripts_dir)
+    assert (packaging["blobs"], packaging["stored_blobs"], packaging["peak_scratch_bytes"]) == (6, 6, 0)
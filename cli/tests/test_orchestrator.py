@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from cli.orchestrator import Step, StepTiming, format_critical_path, get_critical_path, get_predecessors, run_steps
+
+
+def recording(events, name, succeeded=True, duration=0.0):
+    def run():
+        events.append(f"{name}:start")
+        time.sleep(duration)
+        events.append(f"{name}:end")
+        return succeeded
+
+    return run
+
+
+def test_independent_quiet_steps_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def run():
+        barrier.wait()
+        return True
+
+    result = run_steps([Step("a", run, console=False), Step("b", run, console=False)])
+
+    assert result.succeeded
+    assert [timing.name for timing in result.timings] == ["a", "b"]
+
+
+def test_console_steps_run_in_order():
+    events = []
+    result = run_steps(
+        [
+            Step("fetch", recording(events, "fetch", duration=0.05), console=False),
+            Step("check", recording(events, "check", duration=0.1)),
+            Step("show", recording(events, "show"), depends_on=("fetch",)),
+        ]
+    )
+
+    assert result.succeeded
+    # fetch overlaps check, show waits for both
+    assert events.index("fetch:start") < events.index("check:end")
+    assert events[-2:] == ["show:start", "show:end"]
+    assert [timing.name for timing in result.critical_path] == ["check", "show"]
+
+
+def test_failure_stops_scheduling_and_reports_the_first_failed_step():
+    events = []
+    result = run_steps(
+        [
+            Step("check", recording(events, "check", succeeded=False)),
+            Step("fetch", recording(events, "fetch", succeeded=False, duration=0.05), console=False),
+            Step("deploy", recording(events, "deploy"), depends_on=("fetch",)),
+        ]
+    )
+
+    assert not result.succeeded
+    assert result.failed_step == "check"
+    # the running step is waited for, the dependent one never starts
+    assert "fetch:end" in events
+    assert "deploy:start" not in events
+
+
+def test_optional_steps_do_not_fail_the_run():
+    result = run_steps([Step("lookup", lambda: None, required=False), Step("deploy", lambda: True)])
+    assert result.succeeded
+
+
+def test_dependencies_outside_of_the_run_are_satisfied():
+    # e.g. steps that already succeeded before a resume
+    assert get_predecessors([Step("deploy", lambda: True, depends_on=("configuration",))]) == {"deploy": []}
+
+
+def test_invalid_graphs():
+    with pytest.raises(ValueError):
+        get_predecessors([Step("a", lambda: True), Step("a", lambda: True)])
+
+    with pytest.raises(ValueError):
+        get_predecessors(
+            [
+                Step("a", lambda: True, depends_on=("b",), console=False),
+                Step("b", lambda: True, depends_on=("a",), console=False),
+            ]
+        )
+
+
+def test_critical_path():
+    predecessors = {"check": [], "fetch": [], "show": ["fetch", "check"]}
+    timings = {
+        "check": StepTiming("check", True, 0.0, 2.0),
+        "fetch": StepTiming("fetch", True, 0.0, 5.0),
+        "show": StepTiming("show", True, 5.0, 6.0),
+    }
+
+    critical_path = get_critical_path(predecessors, timings)
+
+    assert [timing.name for timing in critical_path] == ["fetch", "show"]
+    assert format_critical_path(critical_path) == "fetch (5.0s) -> show (1.0s), 6.0s in total"
@@ -0,0 +1,123 @@
+import json
+import os
+
+from cli.registry import ImageCopier
+from cli.utilities.prepull_images import MirrorJob, get_image_progress, get_mirror_jobs, mirror_images
+
+# logs its arguments, serves a manifest of SIZE_<name> bytes and fails the first FAIL_<name> runs
+FAKE_DOCKER = """#!/bin/bash
+echo "$*" >> "$DOCKER_CALLS"
+image="${@: -1}"
+name="${image##*/}"
+name="${name%%:*}"
+if [[ "$1" == "manifest" ]]; then
+    size_var="SIZE_$name"
+    printf '{"SchemaV2Manifest": {"config": {"size": 1}, "layers": [{"size": %s}]}}' "${!size_var:-0}"
+    exit 0
+fi
+fail_var="FAIL_$name"
+count_file="$DOCKER_CALLS.$name"
+count=$(( $(cat "$count_file" 2>/dev/null || echo 0) + 1 ))
+echo "$count" > "$count_file"
+if (( count <= ${!fail_var:-0} )); then
+    exit 1
+fi
+"""
+
+
+def use_fake_docker(tmpdir, monkeypatch, **env):
+    bin_dir = tmpdir.mkdir("bin")
+    docker = bin_dir.join("docker")
+    docker.write(FAKE_DOCKER)
+    os.chmod(str(docker), 0o755)
+    calls = tmpdir.join("calls")
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    monkeypatch.setenv("DOCKER_CALLS", str(calls))
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    return calls
+
+
+def make_jobs(*names):
+    return [MirrorJob(name, f"syntho.azurecr.io/{name}:1.0.0", f"trusted.io/{name}:1.0.0") for name in names]
+
+
+def test_get_mirror_jobs(tmpdir):
+    tmpdir.join(".images-final.env").write(
+        "CORE_IMG_REPO=syntho.azurecr.io/syntho-core\nCORE_IMG_TAG=1.0.0\nREDIS_IMG_REPO=redis\nREDIS_IMG_TAG=7.2\n"
+    )
+    tmpdir.join(".images-trusted.env").write(
+        "TRUSTED_IMAGE_REGISTRY_SERVER=trusted.io\n"
+        "TRUSTED_CORE_IMG_REPO=trusted.io/syntho-core\nTRUSTED_CORE_IMG_TAG=1.0.0\n"
+        "TRUSTED_REDIS_IMG_REPO=trusted.io/syntho-redis\nTRUSTED_REDIS_IMG_TAG=7.2\n"
+    )
+
+    assert get_mirror_jobs(str(tmpdir)) == [
+        MirrorJob("CORE", "syntho.azurecr.io/syntho-core:1.0.0", "trusted.io/syntho-core:1.0.0"),
+        MirrorJob("REDIS", "redis:7.2", "trusted.io/syntho-redis:7.2"),
+    ]
+
+
+def test_mirror_images_largest_first_with_retries(tmpdir, monkeypatch):
+    calls = use_fake_docker(tmpdir, monkeypatch, SIZE_small=10, SIZE_large=1000, SIZE_medium=100, FAIL_medium=1)
+    progress = []
+
+    result = mirror_images(
+        make_jobs("small", "large", "medium"),
+        str(tmpdir),
+        "amd",
+        concurrency=1,
+        backoff=0,
+        log_path=str(tmpdir.join("process", "pull.log")),
+        on_progress=progress.append,
+    )
+
+    assert result.succeeded
+    pulls = [line.split("/")[-1] for line in calls.read().splitlines() if line.startswith("pull")]
+    # the first pull of medium failed and was retried
+    assert pulls == ["large:1.0.0", "medium:1.0.0", "medium:1.0.0", "small:1.0.0"]
+    images = progress[-1]
+    assert {name: image["state"] for name, image in images.items()} == dict.fromkeys(
+        ["small", "large", "medium"], "mirrored"
+    )
+    assert (images["medium"]["attempt"], images["large"]["size"]) == (2, 1001)
+    assert "docker push trusted.io/large:1.0.0" in tmpdir.join("process", "pull.log").read()
+
+
+def test_mirror_images_gives_up(tmpdir, monkeypatch):
+    use_fake_docker(tmpdir, monkeypatch, FAIL_broken=10)
+    scripts_dir = tmpdir.mkdir("scripts")
+    prepull_images_dir = scripts_dir.mkdir("utilities").mkdir("prepull-images")
+
+    def record(images):
+        prepull_images_dir.join("status.json").write(json.dumps({"images": images}))
+
+    result = mirror_images(
+        make_jobs("core", "broken"), str(tmpdir), "amd", concurrency=2, attempts=2, backoff=0, on_progress=record
+    )
+
+    assert not result.succeeded
+    assert result.failed_images == ["broken"]
+    progress = get_image_progress(str(scripts_dir))
+    assert (progress["broken"]["state"], progress["broken"]["attempt"]) == ("failed", 2)
+    assert progress["core"]["state"] == "mirrored"
+
+
+def test_mirror_images_without_docker(tmpdir, monkeypatch, fake_registry):
+    calls = use_fake_docker(tmpdir, monkeypatch)
+    source = fake_registry(users={"syntho": "secret"})
+    target = fake_registry()
+    source.add_image("syntho-core", "1.0.0", [b"core" * 100])
+    source.add_image("syntho-ui", "1.0.0", [b"ui"])
+    jobs = [
+        MirrorJob(name, f"{source.host}/syntho-{name}:1.0.0", f"{target.host}/syntho-{name}:1.0.0")
+        for name in ("ui", "core")
+    ]
+    copier = ImageCopier({source.host: ("syntho", "secret")})
+
+    result = mirror_images(jobs, str(tmpdir), "amd", backoff=0, copier=copier)
+
+    assert result.succeeded
+    assert ("syntho-core", "1.0.0") in target.manifests and ("syntho-ui", "1.0.0") in target.manifests
+    # neither the sizes nor the images went through docker
+    assert not calls.exists()
@@ -0,0 +1,52 @@
+import io
+
+from cli.progress import Badge, StepProgress, format_elapsed
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_format_elapsed():
+    assert format_elapsed(0) == "00:00:00"
+    assert format_elapsed(59.9) == "00:00:59"
+    assert format_elapsed(3723) == "01:02:03"
+
+
+def test_terminal_progress():
+    clock = FakeClock()
+    terminal = FakeTerminal()
+    progress = StepProgress("Deploying", indentation_level=2, stream=terminal, clock=clock)
+
+    progress.start()
+    clock.now += 61
+    progress.tick()
+    progress.finish(Badge.DONE, " (2.0s saved by waiting on readiness)")
+
+    assert terminal.getvalue() == (
+        "\r\t\t* [00:00:00] Deploying /"
+        "\r\t\t* [00:01:01] Deploying -"
+        "\r\t\t* [\033[1;37;42mdone\033[0m] Deploying (2.0s saved by waiting on readiness) \033[K\n"
+    )
+
+
+def test_line_progress():
+    clock = FakeClock()
+    log = io.StringIO()
+    progress = StepProgress("Deploying", stream=log, clock=clock)
+
+    progress.start()
+    clock.now += 5
+    progress.tick()
+    progress.finish(Badge.TIMEOUT)
+
+    assert log.getvalue() == "\t- [started] Deploying\n\t- [timeout] Deploying (took 00:00:05)\n"
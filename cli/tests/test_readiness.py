@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from cli.kubernetes import get_client
+from cli.readiness import FALLBACK_EXITCODE, is_pod_ready, is_pod_running, main, wait_until_ready
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli", "scripts")
+PODS = "/api/v1/namespaces/syntho/pods"
+RAYCLUSTERS = "/apis/ray.io/v1/namespaces/syntho/rayclusters"
+
+
+def pod(phase="Running", ready=False):
+    return {"status": {"phase": phase, "conditions": [{"type": "Ready", "status": str(ready)}]}}
+
+
+def update_later(api, collection, name, obj, delay=0.3):
+    timer = threading.Timer(delay, api.update, (collection, name, obj))
+    timer.start()
+    return timer
+
+
+def test_pod_checks():
+    assert is_pod_running(pod())
+    assert not is_pod_running(pod(phase="Pending"))
+    assert not is_pod_running({"metadata": {"deletionTimestamp": "now"}, **pod()})
+    assert not is_pod_running({"status": {"phase": "Running", "containerStatuses": [{"state": {"waiting": {}}}]}})
+    assert is_pod_ready(pod(ready=True))
+    assert not is_pod_ready(pod())
+
+
+def test_reacts_to_the_first_ready_event(fake_kube_api):
+    fake_kube_api.add(RAYCLUSTERS, "ray-cluster", {"status": {"state": "unhealthy"}})
+    update_later(fake_kube_api, RAYCLUSTERS, "ray-cluster", {"status": {"state": "ready"}})
+    started = time.monotonic()
+
+    args = ["raycluster-ready", "--kubeconfig", fake_kube_api.kubeconfig_path, "--namespace", "syntho"]
+    assert main([*args, "--name", "ray-cluster", "--timeout", "10"]) == 0
+
+    # one list, then the watch from its version that saw the cluster get ready
+    assert time.monotonic() - started < 2
+    assert [request.split("?")[0] for request in fake_kube_api.requests] == [RAYCLUSTERS, RAYCLUSTERS]
+    assert "resourceVersion=1" in fake_kube_api.requests[1]
+
+
+def test_polls_without_watches(fake_kube_api):
+    fake_kube_api.watch_supported = False
+    fake_kube_api.add(PODS, "frontend-abc", pod(phase="Pending"))
+    update_later(fake_kube_api, PODS, "frontend-abc", pod(ready=True))
+    client = get_client(fake_kube_api.kubeconfig_path)
+
+    assert wait_until_ready(client, "pods", "syntho", is_pod_ready, timeout=10)
+    assert not any("watch=1" in request for request in fake_kube_api.requests[2:])
+
+
+def test_times_out(fake_kube_api, tmpdir):
+    fake_kube_api.add(PODS, "frontend-abc", pod(phase="Pending"))
+    args = ["pod-running", "--namespace", "syntho", "--name", "frontend-", "--timeout", "1"]
+
+    assert main([*args, "--kubeconfig", fake_kube_api.kubeconfig_path]) == 1
+
+    exec_kubeconfig = fake_kube_api.write_kubeconfig(str(tmpdir.join("exec-kubeconfig")), user={"exec": {}})
+    assert main([*args, "--kubeconfig", exec_kubeconfig]) == FALLBACK_EXITCODE
+
+
+def test_wait_for_running_pod_script(fake_kube_api, tmpdir):
+    fake_kube_api.add(PODS, "ray-cluster-head-xyz", pod())
+
+    result = subprocess.run(
+        [
+            "bash",
+            "-c",
+            f'source "{SCRIPTS_DIR}/utils.sh" --source-only\n'
+            f'KUBECONFIG="{fake_kube_api.kubeconfig_path}"\n'
+            "wait_for_running_pod syntho ray-cluster-head 5",
+        ],
+        env={"DEPLOYMENT_DIR": str(tmpdir), "PATH": os.environ.get("PATH", ""), "SYNTHO_CLI_PYTHON": sys.executable},
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+
+    assert result.returncode == 0, result.stderr
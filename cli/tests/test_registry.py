@@ -0,0 +1,118 @@
+import base64
+import json
+import os
+
+from cli.registry import (
+    FALLBACK_EXITCODE,
+    ImageCopier,
+    ImageReference,
+    get_docker_credentials,
+    main,
+    parse_reference,
+)
+from cli.utils import write_env_bundle
+from tests.fake_registry import get_digest
+
+
+def count_requests(registry, prefix):
+    return sum(1 for request in registry.requests if request.startswith(prefix))
+
+
+def test_parse_reference():
+    assert parse_reference("syntho.azurecr.io/syntho-core:1.0.0") == ImageReference(
+        "syntho.azurecr.io", "syntho-core", "1.0.0"
+    )
+    assert parse_reference("localhost:5020/syntho/core") == ImageReference("localhost:5020", "syntho/core", "latest")
+    assert parse_reference("redis:7.2") == ImageReference("docker.io", "library/redis", "7.2")
+    assert parse_reference("bitnami/redis:7.2") == ImageReference("docker.io", "bitnami/redis", "7.2")
+
+
+def test_copy_image(fake_registry):
+    source = fake_registry(users={"syntho": "secret"})
+    target = fake_registry()
+    manifest = source.add_image("syntho-core", "1.0.0", [b"layer-1" * 1000, b"layer-2"])
+    copier = ImageCopier({source.host: ("syntho", "secret")})
+
+    result = copier.copy(f"{source.host}/syntho-core:1.0.0", f"{target.host}/syntho-syntho-core:1.0.0")
+
+    assert (result.copied_blobs, result.skipped_blobs, result.digest) == (3, 0, get_digest(manifest))
+    assert target.manifests[("syntho-syntho-core", "1.0.0")][1] == manifest
+    assert target.received_bytes == result.copied_bytes == sum(len(blob) for blob in source.blobs.values())
+    # one token for the repository
+    assert source.scopes == [["repository:syntho-core:pull"]]
+
+    # everything is there already, only the manifest is read again
+    result = copier.copy(f"{source.host}/syntho-core:1.0.0", f"{target.host}/syntho-syntho-core:1.0.0")
+    assert (result.copied_blobs, result.skipped_blobs) == (0, 3)
+    assert count_requests(source, "GET /v2/syntho-core/blobs/") == 3
+
+
+def test_copy_mounts_shared_blobs(fake_registry):
+    source = fake_registry()
+    source.add_image("syntho-core", "1.0.0", [b"base", b"core"])
+    source.add_image("syntho-backend", "1.0.0", [b"base", b"backend"])
+
+    for mount_supported, expected in ((True, (1, 2)), (False, (3, 0))):
+        target = fake_registry(mount_supported=mount_supported)
+        copier = ImageCopier()
+        copier.copy(f"{source.host}/syntho-core:1.0.0", f"{target.host}/syntho-core:1.0.0")
+        result = copier.copy(f"{source.host}/syntho-backend:1.0.0", f"{target.host}/syntho-backend:1.0.0")
+
+        # the config and the base layer are mounted from syntho-core where it's supported
+        assert (result.copied_blobs, result.mounted_blobs) == expected
+        assert count_requests(target, "PUT /v2/syntho-backend/manifests/1.0.0") == 1
+
+
+def test_copy_platform(fake_registry):
+    source = fake_registry()
+    target = fake_registry()
+    source.add_index("ray", "2.9", {"amd64": [b"amd" * 10], "arm64": [b"arm" * 100]})
+    copier = ImageCopier(arch="arm")
+
+    assert copier.get_size(f"{source.host}/ray:2.9") == 300 + len(json.dumps({"architecture": "arm64"}))
+    copier.copy(f"{source.host}/ray:2.9", f"{target.host}/syntho-ray:2.9")
+    assert target.manifests[("syntho-ray", "2.9")] == source.manifests[("ray", "2.9-arm64")]
+
+
+def test_docker_credentials(tmpdir, monkeypatch):
+    docker_config = tmpdir.mkdir("docker")
+    docker_config.join("config.json").write(
+        json.dumps(
+            {
+                "auths": {"trusted.io": {"auth": base64.b64encode(b"user:p:wd").decode()}},
+                "credHelpers": {"helped.io": "fake"},
+            }
+        )
+    )
+    bin_dir = tmpdir.mkdir("bin")
+    helper = bin_dir.join("docker-credential-fake")
+    helper.write('#!/bin/bash\nread server\necho "{\\"Username\\": \\"$server\\", \\"Secret\\": \\"token\\"}"\n')
+    os.chmod(str(helper), 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+
+    assert get_docker_credentials(str(docker_config), "trusted.io") == ("user", "p:wd")
+    assert get_docker_credentials(str(docker_config), "helped.io") == ("helped.io", "token")
+    assert get_docker_credentials(str(docker_config), "other.io") is None
+
+
+def test_main_writes_remaining(fake_registry, tmpdir, capsys):
+    source = fake_registry(users={"syntho": "secret"})
+    target = fake_registry()
+    source.add_image("syntho-core", "1.0.0", [b"core"])
+    env_file_path = str(tmpdir.join(".env"))
+    write_env_bundle(
+        env_file_path, {"SYNTHO_REGISTRY": source.host, "REGISTRY_USER": "syntho", "REGISTRY_PWD": "secret"}
+    )
+    pairs = tmpdir.join("pairs")
+    pairs.write(
+        f"{source.host}/syntho-core:1.0.0 {target.host}/syntho-core:1.0.0\n"
+        f"{source.host}/syntho-missing:1.0.0 {target.host}/syntho-missing:1.0.0\n"
+    )
+    remaining = tmpdir.join("remaining")
+
+    exitcode = main(["--pairs", str(pairs), "--remaining", str(remaining), "--env-file", env_file_path])
+
+    assert exitcode == FALLBACK_EXITCODE
+    assert remaining.read() == f"{source.host}/syntho-missing:1.0.0 {target.host}/syntho-missing:1.0.0\n"
+    assert ("syntho-core", "1.0.0") in target.manifests
+    assert "syntho-missing" in capsys.readouterr().err
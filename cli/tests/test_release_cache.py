@@ -0,0 +1,144 @@
+import json
+import os
+
+import pytest
+import requests
+import urllib3
+
+from cli import release_cache
+from cli.release_cache import ReleaseFetchError, fetch_release, get_sha256
+
+RELEASE = os.urandom(300 * 1024)
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(release_cache, "RETRY_DELAY", 0)
+    # every test gets a pool of its own
+    monkeypatch.setattr(release_cache, "_SESSION", None)
+
+
+def read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_fetch_release_is_cached(tmpdir, fake_release_server):
+    url = fake_release_server.add_release("1.0.0", RELEASE)
+    cache_dir = str(tmpdir.join("release-cache"))
+
+    result = fetch_release(url, "1.0.0", cache_dir)
+
+    assert result.path == os.path.join(cache_dir, "1.0.0", "syntho-1.0.0.tar.gz")
+    assert (result.downloaded_bytes, result.resumed_from, result.cached) == (len(RELEASE), 0, False)
+    assert read(result.path) == RELEASE
+    assert result.sha256 == get_sha256(result.path)
+    with open(f"{result.path}.json", "r") as file:
+        assert json.load(file)["sha256"] == result.sha256
+
+    # a second deployment of the same version downloads nothing
+    result = fetch_release(url, "1.0.0", cache_dir)
+    assert (result.downloaded_bytes, result.cached) == (0, True)
+    assert len(fake_release_server.requests) == 1
+
+
+def test_fetch_release_resumes(tmpdir, fake_release_server):
+    url = fake_release_server.add_release("1.0.0", RELEASE)
+    path = url[len(fake_release_server.url) :]
+    fake_release_server.cut_offs[path] = 100 * 1024
+
+    result = fetch_release(url, "1.0.0", str(tmpdir))
+
+    assert read(result.path) == RELEASE
+    assert fake_release_server.requests == [(path, None), (path, f"bytes={100 * 1024}-")]
+    assert (result.resumed_from, result.downloaded_bytes) == (100 * 1024, 200 * 1024)
+    assert not os.path.exists(f"{result.path}.part")
+
+
+def test_fetch_release_resumes_previous_run(tmpdir, fake_release_server, monkeypatch):
+    url = fake_release_server.add_release("1.0.0", RELEASE)
+    path = url[len(fake_release_server.url) :]
+    monkeypatch.setattr(release_cache, "RETRIES", 0)
+    fake_release_server.cut_offs[path] = 1000
+
+    with pytest.raises(ReleaseFetchError):
+        fetch_release(url, "1.0.0", str(tmpdir))
+    result = fetch_release(url, "1.0.0", str(tmpdir))
+
+    assert read(result.path) == RELEASE
+    assert (result.resumed_from, result.downloaded_bytes) == (1000, len(RELEASE) - 1000)
+
+
+def test_fetch_release_restarts_changed_release(tmpdir, fake_release_server, monkeypatch):
+    url = fake_release_server.add_release("1.0.0", RELEASE)
+    path = url[len(fake_release_server.url) :]
+    monkeypatch.setattr(release_cache, "RETRIES", 0)
+    fake_release_server.cut_offs[path] = 1000
+    with pytest.raises(ReleaseFetchError):
+        fetch_release(url, "1.0.0", str(tmpdir))
+
+    # the release was published again, the If-Range doesn't match anymore
+    fake_release_server.files[path] = b"republished" * 1000
+    result = fetch_release(url, "1.0.0", str(tmpdir))
+
+    assert read(result.path) == b"republished" * 1000
+    assert result.resumed_from == 0
+    assert fake_release_server.requests[-1] == (path, "bytes=1000-")
+
+
+def test_fetch_release_checks_digest(tmpdir, fake_release_server):
+    url = fake_release_server.add_release("1.0.0", RELEASE)
+    cache_dir = str(tmpdir)
+
+    with pytest.raises(ReleaseFetchError, match="sha256"):
+        fetch_release(url, "1.0.0", cache_dir, sha256="sha256:" + "0" * 64)
+    assert os.listdir(os.path.join(cache_dir, "1.0.0")) == [".syntho-1.0.0.tar.gz.lock", "syntho-1.0.0.tar.gz.json"]
+
+    result = fetch_release(url, "1.0.0", cache_dir)
+    # a damaged tarball is downloaded again, and checked against the recorded sha256
+    with open(result.path, "ab") as file:
+        file.write(b"damaged")
+    fake_release_server.files[url[len(fake_release_server.url) :]] = b"tampered"
+    with pytest.raises(ReleaseFetchError, match=result.sha256):
+        fetch_release(url, "1.0.0", cache_dir)
+    assert not os.path.exists(result.path)
+
+
+def test_fetch_release_not_found(tmpdir, fake_release_server):
+    with pytest.raises(ReleaseFetchError, match="given version exists"):
+        fetch_release(f"{fake_release_server.url}/missing/syntho-9.9.9.tar.gz", "9.9.9", str(tmpdir))
+
+
+def test_main(tmpdir, fake_release_server):
+    current = fake_release_server.add_release("1.0.0", RELEASE)
+    new = fake_release_server.add_release("1.1.0", b"new" * 1000)
+    argv = ["--cache-dir", str(tmpdir.join("release-cache"))]
+    argv += ["--release", "1.0.0", current, str(tmpdir.join("current", "syntho-1.0.0.tar.gz"))]
+    argv += ["--release", "1.1.0", new, str(tmpdir.join("new", "syntho-1.1.0.tar.gz"))]
+
+    assert release_cache.main(argv) == 0
+    assert release_cache.main(argv) == 0
+
+    assert read(str(tmpdir.join("current", "syntho-1.0.0.tar.gz"))) == RELEASE
+    assert read(str(tmpdir.join("new", "syntho-1.1.0.tar.gz"))) == b"new" * 1000
+    # both releases came over one kept-alive connection
+    assert (len(fake_release_server.requests), fake_release_server.connections) == (2, 1)
+
+    argv = ["--release", "9.9.9", f"{fake_release_server.url}/missing.tar.gz", str(tmpdir.join("missing.tar.gz"))]
+    assert release_cache.main(argv + ["--cache-dir", str(tmpdir)]) == 1
+    assert isinstance(release_cache.get_session(), requests.Session)
+
+
+def test_fetch_release_without_read1(tmpdir, fake_release_server, monkeypatch):
+    # urllib3 1.x responses only have read
+    monkeypatch.delattr(urllib3.response.HTTPResponse, "read1")
+    monkeypatch.delattr(urllib3.response.BaseHTTPResponse, "read1")
+    monkeypatch.setattr(release_cache, "CHUNK_SIZE", 64 * 1024)
+    url = fake_release_server.add_release("1.0.0", RELEASE)
+    fake_release_server.cut_offs[url[len(fake_release_server.url) :]] = 100 * 1024
+
+    result = fetch_release(url, "1.0.0", str(tmpdir))
+
+    assert read(result.path) == RELEASE
+    # at most the chunk the connection was dropped in is downloaded again
+    assert 64 * 1024 <= result.resumed_from <= 100 * 1024
@@ -0,0 +1,312 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+from datetime import datetime
+from unittest import mock
+
+import pytest
+import yaml
+
+from cli.state import (
+    STATE_BACKEND_ENV,
+    DeploymentJournal,
+    SqliteStateBackend,
+    StateBackend,
+    YamlStateBackend,
+    get_state_backend,
+)
+from cli.telemetry import TIMINGS_FILE, ScriptTiming, record_script_timing
+
+
+def make_deployment(deployment_id, status="initializing"):
+    return {
+        "id": deployment_id,
+        "status": status,
+        "initial_version": "1.0.0",
+        "version": "1.0.0",
+        "started_at": "2024-01-01T00:00:00",
+        "finished_at": None,
+        "cluster_name": None,
+    }
+
+
+@pytest.fixture(params=[SqliteStateBackend, YamlStateBackend])
+def backend(request, tmpdir):
+    return request.param(str(tmpdir.mkdir("deployments")), "k8s")
+
+
+def test_empty_state(backend):
+    assert backend.get_deployments_state() == {"active_deployment_id": None, "deployments": []}
+    assert backend.get_deployment("k8s-1") is None
+    assert backend.get_active_deployment_id() is None
+
+
+def test_add_update_and_remove_deployments(backend):
+    backend.add_deployment(make_deployment("k8s-1"))
+    backend.add_deployment(make_deployment("k8s-2"))
+    assert backend.get_active_deployment_id() == "k8s-2"
+
+    backend.update_deployment("k8s-1", status="completed", finished_at="2024-01-01T01:00:00")
+    deployment = backend.get_deployment("k8s-1")
+    assert deployment["status"] == "completed"
+    assert deployment["finished_at"] == "2024-01-01T01:00:00"
+    assert backend.get_deployment("k8s-2")["status"] == "initializing"
+
+    # updating an unknown deployment is a no-op
+    backend.update_deployment("k8s-unknown", status="completed")
+    assert [d["id"] for d in backend.get_deployments()] == ["k8s-1", "k8s-2"]
+
+    backend.remove_deployment("k8s-2")
+    assert backend.get_active_deployment_id() == "k8s-1"
+    backend.remove_deployment("k8s-1")
+    assert backend.get_deployments_state() == {"active_deployment_id": None, "deployments": []}
+
+
+def test_update_deployments_state_replaces_everything(backend):
+    backend.add_deployment(make_deployment("k8s-1"))
+    backend.update_deployments_state({"active_deployment_id": "k8s-3", "deployments": [make_deployment("k8s-3")]})
+
+    assert backend.get_deployments_state() == {
+        "active_deployment_id": "k8s-3",
+        "deployments": [make_deployment("k8s-3")],
+    }
+
+
+def test_sqlite_migrates_existing_yaml_state_once(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+    yaml_state = {
+        "active_deployment_id": "k8s-2",
+        "deployments": [make_deployment("k8s-1", "completed"), make_deployment("k8s-2")],
+    }
+    with open(f"{deployments_dir}/k8s-deployment-state.yaml", "w") as file:
+        yaml.dump(yaml_state, file)
+
+    backend = SqliteStateBackend(deployments_dir, "k8s")
+    assert backend.get_deployments_state() == yaml_state
+
+    # later changes to the yaml file are not imported again
+    backend.remove_deployment("k8s-2")
+    assert SqliteStateBackend(deployments_dir, "k8s").get_active_deployment_id() == "k8s-1"
+
+    # the yaml file is left untouched for compatibility
+    with open(f"{deployments_dir}/k8s-deployment-state.yaml", "r") as file:
+        assert yaml.safe_load(file) == yaml_state
+
+
+def test_sqlite_indexes_deployments_by_id(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+    backend = SqliteStateBackend(deployments_dir, "dc")
+    backend.add_deployment(make_deployment("dc-1"))
+
+    connection = sqlite3.connect(backend.path)
+    plan = connection.execute("EXPLAIN QUERY PLAN SELECT data FROM deployments WHERE id = 'dc-1'").fetchall()
+    connection.close()
+
+    assert "USING INDEX" in plan[0][-1]
+
+
+def test_sqlite_rolls_back_failed_transactions(tmpdir):
+    backend = SqliteStateBackend(str(tmpdir.mkdir("deployments")), "k8s")
+    backend.add_deployment(make_deployment("k8s-1"))
+
+    with pytest.raises(RuntimeError):
+        with backend.transaction() as connection:
+            connection.execute("DELETE FROM deployments")
+            raise RuntimeError("interrupted")
+
+    assert backend.get_deployment("k8s-1") is not None
+
+
+def test_get_state_backend(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+
+    with mock.patch.dict(os.environ, {}, clear=True):
+        assert isinstance(get_state_backend(deployments_dir, "k8s"), SqliteStateBackend)
+
+    with mock.patch.dict(os.environ, {STATE_BACKEND_ENV: "yaml"}):
+        assert isinstance(get_state_backend(deployments_dir, "k8s"), YamlStateBackend)
+
+    with mock.patch.dict(os.environ, {STATE_BACKEND_ENV: "unknown"}):
+        with pytest.raises(ValueError):
+            get_state_backend(deployments_dir, "k8s")
+
+
+def test_incomplete_state_backend_cannot_be_created(tmpdir):
+    class IncompleteStateBackend(StateBackend):
+        @property
+        def path(self):
+            return str(tmpdir.join("state"))
+
+    with pytest.raises(TypeError, match="add_deployment"):
+        IncompleteStateBackend(str(tmpdir), "k8s")
+
+
+def test_deployments_state_is_cached_until_the_file_changes(backend):
+    backend.add_deployment(make_deployment("k8s-1"))
+
+    with mock.patch.object(backend, "_load_deployments_state", wraps=backend._load_deployments_state) as load:
+        for _ in range(5):
+            assert backend.get_deployment("k8s-1")["status"] == "initializing"
+        assert load.call_count <= 1
+
+        # results are copies, mutating them doesn't leak into the cache
+        backend.get_deployment("k8s-1")["status"] = "mutated"
+        assert backend.get_deployment("k8s-1")["status"] == "initializing"
+
+        # a write by another process is picked up
+        if isinstance(backend, YamlStateBackend):
+            with open(backend.path, "w") as file:
+                yaml.dump({"active_deployment_id": None, "deployments": [make_deployment("k8s-1", "completed")]}, file)
+        else:
+            connection = sqlite3.connect(backend.path)
+            with connection:
+                connection.execute(
+                    "UPDATE deployments SET data = ? WHERE id = 'k8s-1'",
+                    (json.dumps(make_deployment("k8s-1", "completed")),),
+                )
+            connection.close()
+        assert backend.get_deployment("k8s-1")["status"] == "completed"
+
+
+def test_yaml_writes_refresh_the_cache(tmpdir):
+    backend = YamlStateBackend(str(tmpdir.mkdir("deployments")), "k8s")
+    backend.add_deployment(make_deployment("k8s-1"))
+
+    with mock.patch.object(backend, "_load_deployments_state") as load:
+        backend.update_deployment("k8s-1", status="completed")
+        assert backend.get_deployment("k8s-1")["status"] == "completed"
+        load.assert_not_called()
+
+
+def test_journal_records_transitions(tmpdir):
+    journal = DeploymentJournal(str(tmpdir))
+    assert journal.read() is None
+
+    with mock.patch("cli.state.datetime") as mock_datetime:
+        mock_datetime.fromisoformat = datetime.fromisoformat
+        mock_datetime.utcnow.side_effect = [
+            datetime(2024, 1, 1, 0, 0, 0),
+            datetime(2024, 1, 1, 0, 0, 30),
+            datetime(2024, 1, 1, 0, 1, 30),
+        ]
+        journal.append("pre-req-check-in-progress")
+        journal.append("pre-req-check-succeeded", exitcode=0)
+        journal.append("completed", finished_at="2024-01-01T00:01:30")
+
+    journal_state = journal.read()
+    assert journal_state["status"] == "completed"
+    assert journal_state["finished_at"] == "2024-01-01T00:01:30"
+    assert [(e["seq"], e["step"], e["duration"], e["exitcode"]) for e in journal_state["timeline"]] == [
+        (1, "pre-req-check-in-progress", 0.0, None),
+        (2, "pre-req-check-succeeded", 30.0, 0),
+        (3, "completed", 60.0, None),
+    ]
+
+
+def test_journal_compaction(tmpdir):
+    journal = DeploymentJournal(str(tmpdir))
+    journal.append("initializing")
+    journal.append("preparing-env")
+    before = journal.read()
+
+    journal.compact()
+    assert os.path.getsize(journal.journal_path) == 0
+    assert journal.read() == before
+
+    # appends continue the sequence of the snapshot
+    journal.append("initialized")
+    assert [e["seq"] for e in journal.read()["timeline"]] == [1, 2, 3]
+
+
+def test_interrupted_journal_compaction_does_not_duplicate_entries(tmpdir):
+    journal = DeploymentJournal(str(tmpdir))
+    journal.append("initializing")
+    journal.append("preparing-env")
+    with open(journal.journal_path, "rb") as file:
+        journal_content = file.read()
+
+    # the snapshot got written but the journal wasn't truncated
+    journal.compact()
+    with open(journal.journal_path, "wb") as file:
+        file.write(journal_content)
+
+    assert [e["step"] for e in journal.read()["timeline"]] == ["initializing", "preparing-env"]
+
+
+def test_transitions_are_journaled_and_compacted(backend):
+    os.makedirs(f"{backend.deployments_dir}/k8s-1")
+    backend.add_deployment(make_deployment("k8s-1"))
+
+    backend.record_transition("k8s-1", "preparing-env")
+    backend.record_transition("k8s-1", "completed", exitcode=0, finished_at="2024-01-01T01:00:00")
+
+    # the index isn't rewritten, readers see the journal tail
+    assert backend._load_deployments_state()["deployments"][0]["status"] == "initializing"
+    deployment = backend.get_deployment("k8s-1")
+    assert deployment["status"] == "completed"
+    assert deployment["finished_at"] == "2024-01-01T01:00:00"
+    assert [e["step"] for e in backend.get_deployment_timeline("k8s-1")] == ["preparing-env", "completed"]
+
+    backend.compact_deployment("k8s-1")
+    assert backend._load_deployments_state()["deployments"][0]["status"] == "completed"
+
+    with mock.patch("cli.state.JOURNAL_COMPACTION_THRESHOLD", 0):
+        backend.record_transition("k8s-1", "completed")
+    assert os.path.getsize(backend.journal("k8s-1").journal_path) == 0
+
+
+def test_archive_deployment(backend):
+    os.makedirs(f"{backend.deployments_dir}/k8s-1")
+    backend.add_deployment(make_deployment("k8s-1"))
+    backend.record_transition("k8s-1", "completed", exitcode=0)
+
+    archive_path = backend.archive_deployment("k8s-1")
+
+    with open(archive_path, "r") as file:
+        archive = json.load(file)
+    assert archive["deployment"]["status"] == "completed"
+    assert [e["step"] for e in archive["timeline"]] == ["completed"]
+    assert archive["script_timings"] == []
+
+
+def test_script_timings(backend):
+    deployment_dir = f"{backend.deployments_dir}/k8s-1"
+    os.makedirs(deployment_dir)
+    backend.add_deployment(make_deployment("k8s-1"))
+    timing = ScriptTiming("deploy.sh", "2024-01-01T00:00:00", 3.0, 1.0, 0.5, 1024, 0)
+    record_script_timing(deployment_dir, timing)
+    with open(f"{deployment_dir}/{TIMINGS_FILE}", "a") as file:
+        file.write('{"script": "interrupted.sh", ')
+
+    assert backend.get_script_timings("k8s-1") == [timing._asdict()]
+    assert backend.get_script_timings("k8s-2") == []
+
+
+def record_transitions(deployments_dir, deployment_id, count):
+    backend = YamlStateBackend(deployments_dir, "k8s")
+    for index in range(count):
+        backend.record_transition(deployment_id, f"step-{index}")
+        backend.get_deployment(deployment_id)
+
+
+def test_concurrent_processes_keep_all_transitions(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+    backend = YamlStateBackend(deployments_dir, "k8s")
+    for deployment_id in ("k8s-1", "k8s-2"):
+        os.makedirs(f"{deployments_dir}/{deployment_id}")
+        backend.add_deployment(make_deployment(deployment_id))
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=record_transitions, args=(deployments_dir, deployment_id, 25))
+        for deployment_id in ("k8s-1", "k8s-1", "k8s-2")
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    assert [e["seq"] for e in backend.get_deployment_timeline("k8s-1")] == list(range(1, 51))
+    assert len(backend.get_deployment_timeline("k8s-2")) == 25
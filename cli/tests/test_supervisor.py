@@ -0,0 +1,123 @@
+import io
+import os
+import subprocess
+import sys
+import time
+
+from cli.progress import StepProgress
+from cli.supervisor import FAILED_EXITCODE, TIMEOUT_EXITCODE, is_running, supervise, wait_for_exit
+from cli.utils import wait_until
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli", "scripts")
+
+
+def start_group(command):
+    return subprocess.Popen(["bash", "-c", command], start_new_session=True)
+
+
+def running_in_group(pgid):
+    states = subprocess.run(["ps", "-o", "stat=", "-g", str(pgid)], capture_output=True, text=True).stdout.split()
+    return [state for state in states if not state.startswith("Z")]
+
+
+def test_wait_for_exit():
+    proc = start_group("sleep 0.2")
+    started = time.monotonic()
+
+    assert wait_for_exit(proc.pid, 5)
+    assert time.monotonic() - started < 2
+    proc.wait()
+
+
+def test_supervise_kills_the_whole_group_on_timeout():
+    proc = start_group("sleep 30 & sleep 30")
+    started = time.monotonic()
+
+    assert supervise(proc.pid, 0.2, StepProgress("Step", stream=io.StringIO())) == TIMEOUT_EXITCODE
+    proc.wait(timeout=5)
+    assert time.monotonic() - started < 5
+    # the leader is gone and so is the rest of its group, apart from zombies that init didn't reap yet
+    assert not is_running(proc.pid)
+    assert wait_until(lambda: not running_in_group(proc.pid), timeout=5).succeeded
+
+
+def test_supervise_outcomes(tmpdir):
+    status_path = str(tmpdir.join("step.status"))
+    saved_path = str(tmpdir.join("step.saved"))
+    with open(saved_path, "w") as file:
+        file.write("1.5\n2.0\n")
+
+    for exitcode, outcome, line in (
+        (0, 0, "- [done] Step (3.5s saved by waiting on readiness)"),
+        (1, FAILED_EXITCODE, "- [failed] Step"),
+    ):
+        with open(status_path, "w") as file:
+            file.write(f"{exitcode}\n")
+        proc = start_group(f"exit {exitcode}")
+        stream = io.StringIO()
+
+        assert supervise(proc.pid, 5, StepProgress("Step", stream=stream), status_path, saved_path) == outcome
+        assert stream.getvalue().splitlines()[-1].startswith(f"\t{line} (took 00:00:0")
+        proc.wait()
+
+
+def run_with_loading(tmpdir, body, use_supervisor=True):
+    script_path = str(tmpdir.join("steps.sh"))
+    with open(script_path, "w") as script:
+        script.write(f'#!/bin/bash\nsource "{SCRIPTS_DIR}/utils.sh" --source-only\n{body}\n')
+
+    env = {"DEPLOYMENT_DIR": str(tmpdir), "PATH": os.environ.get("PATH", "")}
+    if use_supervisor:
+        env["SYNTHO_CLI_PYTHON"] = sys.executable
+    return subprocess.run(["bash", script_path], env=env, capture_output=True, text=True, timeout=30)
+
+
+def test_with_loading_collects_errors(tmpdir):
+    for use_supervisor in (True, False):
+        result = run_with_loading(
+            tmpdir,
+            "failing() {\n"
+            '    mkdir -p "$SYNTHO_CLI_PROCESS_DIR" && echo "things" > "$SYNTHO_CLI_PROCESS_DIR/failing.log"\n'
+            '    write_and_exit "Failed to install things" "failing"\n'
+            "}\n"
+            'with_loading "Installing things" failing\n'
+            "echo unreachable",
+            use_supervisor=use_supervisor,
+        )
+
+        assert result.returncode == 1
+        assert "failed" in result.stdout
+        # with or without the supervisor, the failed step points to its process logs
+        assert "Installing things (More detail can be found here: /tmp/syntho/failing.log)" in result.stdout
+        assert "Failed to install things" in result.stdout
+        assert "unreachable" not in result.stdout
+
+
+def test_with_loading_times_out(tmpdir):
+    for use_supervisor in (True, False):
+        result = run_with_loading(
+            tmpdir,
+            "slow() { sleep 30; }\n"
+            'on_timeout() { echo "timeout callback"; }\n'
+            'with_loading "Waiting for things" slow 1 on_timeout',
+            use_supervisor=use_supervisor,
+        )
+
+        assert result.returncode == 1
+        assert "timeout callback" in result.stdout
+        assert "Process couldn't be finalized in a defined TTL" in result.stdout
+
+
+def test_with_loading_succeeds(tmpdir):
+    result = run_with_loading(
+        tmpdir,
+        'quick() { write_and_exit "" "quick"; }\nwith_loading "Doing things" quick\necho "after"',
+    )
+
+    # not a terminal, so line by line
+    assert result.returncode == 0
+    assert result.stdout.splitlines() == [
+        "\t- [started] Doing things",
+        "\t- [done] Doing things (took 00:00:00)",
+        "after",
+    ]
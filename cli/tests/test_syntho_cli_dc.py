@@ -92,8 +92,40 @@ See all releases: syntho-cli releases
             False,
             self.cli_version,
             False,
+            False,
         )
 
+    def test_failed_deployment_is_kept_when_resumable(self):
+        self.mock_dc_deployment_start.return_value = DeploymentResult(
+            succeeded=False,
+            deployment_id="dc-123456789",
+            error="Syntho UI deployment failed",
+            deployment_status="deployment-failed",
+        )
+        with (
+            mock.patch("cli.syntho_cli.dc_deployment_manager.is_resumable", return_value=True),
+            mock.patch("cli.syntho_cli.dc_deployment_manager.cleanup") as mock_cleanup,
+        ):
+            result = self.runner.invoke(
+                syntho_cli.dc_deployment,
+                [
+                    "--license-key",
+                    self.license_key,
+                    "--registry-user",
+                    self.registry_user,
+                    "--registry-pwd",
+                    self.registry_pwd,
+                    "--version",
+                    "1.0.0",
+                    "--resume",
+                ],
+            )
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("rerun the same command with `--resume`", result.output)
+        mock_cleanup.assert_not_called()
+        self.assertTrue(self.mock_dc_deployment_start.call_args.args[-1])
+
     def test_deployment_to_default_docker_daemon_skip_configuration(self):
         result = self.runner.invoke(
             syntho_cli.dc_deployment,
@@ -128,6 +160,7 @@ See all releases: syntho-cli releases
             False,
             self.cli_version,
             False,
+            False,
         )
 
     def test_deployment_to_remote_docker_daemon(self):
@@ -167,6 +200,7 @@ See all releases: syntho-cli releases
             False,
             self.cli_version,
             False,
+            False,
         )
 
     def test_deployment_from_trusted_registry(self):
@@ -206,6 +240,7 @@ See all releases: syntho-cli releases
                 False,
                 self.cli_version,
                 False,
+                False,
             )
 
     def test_deployment_from_offline_registry(self):
@@ -245,6 +280,7 @@ See all releases: syntho-cli releases
                 True,
                 self.cli_version,
                 False,
+                False,
             )
 
 
@@ -1,3 +1,5 @@
+import json
+import tempfile
 from pathlib import Path
 from unittest import TestCase, mock
 
@@ -104,7 +106,41 @@ users:
             False,
             "2.0.0",
             False,
+            False,
+        )
+
+    def test_failed_deployment_is_kept_when_resumable(self):
+        self.mock_k8s_deployment_start.return_value = DeploymentResult(
+            succeeded=False,
+            deployment_id="k8s-123456789",
+            error="Syntho UI deployment failed",
+            deployment_status="syntho-ui-deployment-failed",
         )
+        with (
+            mock.patch("cli.syntho_cli.k8s_deployment_manager.is_resumable", return_value=True),
+            mock.patch("cli.syntho_cli.k8s_deployment_manager.cleanup") as mock_cleanup,
+        ):
+            result = self.runner.invoke(
+                syntho_cli.k8s_deployment,
+                [
+                    "--license-key",
+                    "my-license-key",
+                    "--registry-user",
+                    "syntho-user",
+                    "--registry-pwd",
+                    "syntho-pwd",
+                    "--kubeconfig",
+                    self.sample_kubeconfig_content,
+                    "--version",
+                    "1.0.0",
+                    "--resume",
+                ],
+            )
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("rerun the same command with `--resume`", result.output)
+        mock_cleanup.assert_not_called()
+        self.assertTrue(self.mock_k8s_deployment_start.call_args.args[-1])
 
     def test_deployment_with_kubeconfig_file_path_and_registry_creds(self):
         safe_load_return_value = yaml.safe_load(self.sample_kubeconfig_content)
@@ -147,6 +183,7 @@ users:
                 False,
                 "2.0.0",
                 False,
+                False,
             )
             mock_open.assert_called_once_with("kubeconfig.yaml", "r")
 
@@ -189,6 +226,7 @@ users:
                 True,
                 "2.0.0",
                 False,
+                False,
             )
 
 
@@ -577,3 +615,46 @@ Compatible releases:
         self.assertEqual(result.output.strip(), self.expected_output_for_not_compatible_version.strip())
         self.mock_get_deployment.assert_called_with(syntho_cli.scripts_dir, "k8s-123456789")
         self.mock_get_releases.assert_called_with(with_compatibility="1.0.0")
+
+
+class TestK8sTimings(TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.timings = [
+            {
+                "script": "pre-requirements-k8s.sh",
+                "started_at": "2024-01-01T00:00:00.123456",
+                "wall": 12.5,
+                "user": 1.25,
+                "sys": 0.5,
+                "max_rss_kb": 204800,
+                "exitcode": 0,
+            },
+        ]
+
+    def test_timings_table_and_json_export(self):
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            mock.patch(
+                "cli.syntho_cli.k8s_deployment_manager.get_deployment", return_value={"id": "k8s-1", "version": "1.0.0"}
+            ),
+            mock.patch("cli.syntho_cli.k8s_deployment_manager.get_script_timings", return_value=self.timings),
+        ):
+            result = self.runner.invoke(
+                syntho_cli.k8s_timings, ["--deployment-id", "k8s-1", "--json", f"{tmp_dir}/timings.json"]
+            )
+
+            assert result.exit_code == 0
+            assert "pre-requirements-k8s.sh  2024-01-01T00:00:00  12.5s  1.2s  0.5s  200.0MiB  0" in result.output
+            with open(f"{tmp_dir}/timings.json", "r") as file:
+                assert json.load(file) == {"deployment_id": "k8s-1", "version": "1.0.0", "script_timings": self.timings}
+
+    def test_no_timings(self):
+        with (
+            mock.patch("cli.syntho_cli.k8s_deployment_manager.get_deployment", return_value=None),
+            mock.patch("cli.syntho_cli.k8s_deployment_manager.get_script_timings", return_value=[]),
+        ):
+            result = self.runner.invoke(syntho_cli.k8s_timings, ["--deployment-id", "k8s-1"])
+
+        assert result.exit_code == 0
+        assert "There are no timings recorded for the deployment (k8s-1) yet" in result.output
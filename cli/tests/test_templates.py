@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+
+from cli.templates import UNRESOLVED_EXITCODE, get_cache_key, main, render, render_file
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli", "scripts")
+
+
+def test_render():
+    result = render(
+        "image: {{ REPO }}:{{ TAG }}\nhost: {{ DOMAIN }}\nname: {{ .Values.name }}\n",
+        {"REPO": "syntho/core", "TAG": "{{ DOMAIN }}", "UNUSED": "x"},
+    )
+
+    # values aren't substituted again and Helm's own syntax is left alone
+    assert result.text == "image: syntho/core:{{ DOMAIN }}\nhost: {{ DOMAIN }}\nname: {{ .Values.name }}\n"
+    assert result.unresolved == ["DOMAIN"]
+
+
+def test_cache_key():
+    template = "{{ A }} {{ B }}"
+
+    assert get_cache_key(template, {"A": "1", "B": "2"}) == get_cache_key(template, {"A": "1", "B": "2", "C": "3"})
+    assert get_cache_key(template, {"A": "1", "B": "2"}) != get_cache_key(template, {"A": "1", "B": "3"})
+    assert get_cache_key(template, {"A": "1", "B": ""}) != get_cache_key(template, {"A": "1"})
+    assert get_cache_key(template, {"A": "1"}) != get_cache_key("{{ A }}", {"A": "1"})
+
+
+def test_render_file_caches_output(tmpdir):
+    template_path = str(tmpdir.join("values.yaml.tpl"))
+    output_path = str(tmpdir.join("values-generated.yaml"))
+    cache_dir = str(tmpdir.join("cache"))
+    with open(template_path, "w") as file:
+        file.write("version: {{ VERSION }}\n")
+
+    assert not render_file(template_path, output_path, {"VERSION": "1.0.0"}, cache_dir).cached
+    result = render_file(template_path, output_path, {"VERSION": "1.0.0"}, cache_dir)
+    assert result.cached
+    assert result.text == "version: 1.0.0\n"
+
+    result = render_file(template_path, output_path, {"VERSION": "1.1.0"}, cache_dir)
+    assert not result.cached
+    with open(output_path, "r") as file:
+        assert file.read() == "version: 1.1.0\n"
+
+
+def test_main_reports_unresolved_placeholders(tmpdir, capsys, monkeypatch):
+    template_path = str(tmpdir.join("images.env.tpl"))
+    output_path = str(tmpdir.join("images.env"))
+    with open(template_path, "w") as file:
+        file.write("TAG={{ SYNTHO_STACK_VERSION }}\nREPO={{ SYNTHO_TEST_UNSET }}\n")
+    monkeypatch.setenv("SYNTHO_STACK_VERSION", "1.0.0")
+    monkeypatch.delenv("SYNTHO_TEST_UNSET", raising=False)
+
+    assert main(["--template", template_path, "--output", output_path]) == 0
+    assert "SYNTHO_TEST_UNSET" in capsys.readouterr().err
+    with open(output_path, "r") as file:
+        assert file.read() == "TAG=1.0.0\nREPO={{ SYNTHO_TEST_UNSET }}\n"
+
+    assert main(["--template", template_path, "--output", output_path, "--strict"]) == UNRESOLVED_EXITCODE
+
+
+def test_render_template_script(tmpdir):
+    template_path = str(tmpdir.join("values.yaml.tpl"))
+    with open(template_path, "w") as file:
+        file.write("domain: {{ DOMAIN }}\npassword: {{ PASSWORD }}\nkey: {{ LICENSE_KEY }}\n")
+
+    for use_python in (True, False):
+        output_path = str(tmpdir.join(f"values-{use_python}.yaml"))
+        env = {"DEPLOYMENT_DIR": str(tmpdir), "PATH": os.environ.get("PATH", "")}
+        if use_python:
+            env["SYNTHO_CLI_PYTHON"] = sys.executable
+        subprocess.run(
+            [
+                "bash",
+                "-c",
+                f'source "{SCRIPTS_DIR}/utils.sh" --source-only\n'
+                "DOMAIN=example.com\n"
+                "PASSWORD='a|b&c\\d'\n"
+                f'render_template "{template_path}" "{output_path}"',
+            ],
+            env=env,
+            check=True,
+            capture_output=True,
+            timeout=30,
+        )
+
+        with open(output_path, "r") as file:
+            assert file.read() == "domain: example.com\npassword: a|b&c\\d\nkey: {{ LICENSE_KEY }}\n"
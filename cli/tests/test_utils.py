@@ -1,15 +1,24 @@
 # tests/test_utils.py
 import fcntl
+import json
 import os
+import socket
 import subprocess
+import tarfile
+import tempfile
+import threading
 import unittest
 from unittest.mock import MagicMock, mock_open, patch
 
+import pytest
+
+from cli.telemetry import read_script_timings
 from cli.utils import (
     CURSOR_TRACKER,
     acquire,
     check_acquired,
     deployment_exists,
+    deployments_lock,
     find_available_port,
     generate_utilities_dir,
     get_architecture,
@@ -18,13 +27,18 @@ from cli.utils import (
     make_tarfile,
     make_utilities_dir,
     release,
+    remove_dir,
     reset_cursor_tracker,
     run_script,
     set_status,
+    state_transaction,
+    stream_script,
     tail,
     thread_safe,
     utility_exists,
+    wait_until,
     with_working_directory,
+    write_env_bundle,
 )
 
 
@@ -97,6 +111,82 @@ def test_thread_safe():
     assert lock_released is True
 
 
+def try_flock(lock_file_path, operation):
+    with open(lock_file_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+
+def test_deployments_lock(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+    index_lock = os.path.join(deployments_dir, ".lock")
+    deployment_lock = os.path.join(deployments_dir, ".locks", "k8s-1.lock")
+    other_deployment_lock = os.path.join(deployments_dir, ".locks", "k8s-2.lock")
+
+    # Readers share the lock, writers are kept out
+    with deployments_lock(deployments_dir, shared=True, deployment_id="k8s-1"):
+        assert try_flock(deployment_lock, fcntl.LOCK_SH) is True
+        assert try_flock(deployment_lock, fcntl.LOCK_EX) is False
+
+    # A writer on one deployment blocks neither other deployments nor the index
+    with deployments_lock(deployments_dir, deployment_id="k8s-1"):
+        assert try_flock(deployment_lock, fcntl.LOCK_SH) is False
+        assert try_flock(other_deployment_lock, fcntl.LOCK_EX) is True
+        assert try_flock(index_lock, fcntl.LOCK_EX) is True
+
+    with deployments_lock(deployments_dir):
+        assert try_flock(index_lock, fcntl.LOCK_SH) is False
+        assert try_flock(deployment_lock, fcntl.LOCK_EX) is True
+
+
+def test_state_transaction(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+    state_file_path = os.path.join(deployments_dir, "state.yaml")
+
+    # A missing file starts from the default and is written once on exit
+    with state_transaction(deployments_dir, "state.yaml", default=lambda: {"counter": 0}) as state:
+        assert state == {"counter": 0}
+        state["counter"] += 1
+
+    with open(state_file_path, "r") as file:
+        assert file.read() == "counter: 1\n"
+
+    # Nothing is written when the block raises
+    try:
+        with state_transaction(deployments_dir, "state.yaml") as state:
+            state["counter"] = 100
+            raise RuntimeError("interrupted")
+    except RuntimeError:
+        pass
+
+    with state_transaction(deployments_dir, "state.yaml") as state:
+        assert state == {"counter": 1}
+
+    assert not os.path.exists(f"{state_file_path}.tmp")
+
+
+def test_state_transaction_does_not_lose_updates(tmpdir):
+    deployments_dir = str(tmpdir.mkdir("deployments"))
+
+    def increment():
+        for _ in range(20):
+            with state_transaction(deployments_dir, "state.yaml", default=lambda: {"counter": 0}) as state:
+                state["counter"] += 1
+
+    threads = [threading.Thread(target=increment) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with state_transaction(deployments_dir, "state.yaml") as state:
+        assert state["counter"] == 100
+
+
 def test_with_working_directory():
     # Define a mock function that changes the working directory
     def mock_function():
@@ -117,6 +207,35 @@ def test_with_working_directory():
     assert decorated_directory == original_directory
 
 
+def test_wait_until_returns_as_soon_as_the_predicate_holds():
+    calls = iter([False, False, True])
+
+    with patch("cli.utils.time.sleep") as mock_sleep:
+        result = wait_until(lambda: next(calls), timeout=10, interval=0.1, backoff=2.0, max_interval=0.3)
+
+    assert result.succeeded
+    assert result.attempts == 3
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.1, 0.2]
+
+
+def test_wait_until_does_not_overshoot_the_deadline():
+    result = wait_until(lambda: False, timeout=0.3, interval=0.2, backoff=10.0)
+
+    assert not result.succeeded
+    assert result.attempts == 3
+    assert 0.3 <= result.elapsed < 0.5
+
+
+def test_remove_dir(tmpdir):
+    path = tmpdir.mkdir("deployment")
+    path.join("state.journal").write("{}")
+
+    assert remove_dir(str(path))
+    assert not os.path.exists(str(path))
+    # removing a missing directory is not an error
+    assert remove_dir(str(path))
+
+
 def test_get_deployments_dir(tmpdir):
     # Create a temporary directory for testing
     temp_dir = tmpdir.mkdir("test_dir")
@@ -137,46 +256,155 @@ def test_get_deployments_dir(tmpdir):
     os.rmdir(deployments_dir)
 
 
-def test_run_script():
-    # Define a test scripts directory
-    scripts_dir = "/path/to/scripts"
+def write_script(scripts_dir, body):
+    script_path = os.path.join(scripts_dir, "script.sh")
+    with open(script_path, "w") as script:
+        script.write(f"#!/bin/bash\n{body}\n")
+    os.chmod(script_path, 0o755)
+    return "script.sh"
+
+
+def test_run_script(tmpdir):
+    script_name = write_script(str(tmpdir), 'echo "Hello, $NAME!"; echo "to stderr" >&2')
+
+    result = run_script(str(tmpdir), str(tmpdir), script_name, capture_output=True, NAME="world")
+
+    assert result.succeeded is True
+    assert result.output == "Hello, world!"
+    assert result.exitcode == 0
+
+
+def test_run_script_failure_returns_stderr(tmpdir):
+    script_name = write_script(str(tmpdir), 'echo "went wrong" >&2; exit 4')
+
+    result = run_script(str(tmpdir), str(tmpdir), script_name, capture_output=True)
 
-    # Define a test deployment directory
-    deployment_dir = "/path/to/deployment"
+    assert result.succeeded is False
+    assert result.output == "went wrong\n"
+    assert result.exitcode == 4
 
-    # Define a test script name
-    script_name = "test_script.sh"
 
-    # Define the expected output of the mock subprocess
-    expected_output = "Hello, world!"
+def test_run_script_records_timings(tmpdir):
+    script_name = write_script(str(tmpdir), "sleep 0.1; exit 2")
+    missing_dir = os.path.join(str(tmpdir), "removed-deployment")
 
-    # Mock subprocess.run() to return a predefined result
-    with patch("subprocess.run") as mock_subprocess_run:
-        # Define the mock return value
-        mock_subprocess_run.return_value = subprocess.CompletedProcess(
-            args=[script_name],
-            returncode=0,
-            stdout=expected_output.encode(),
-            stderr=b"",
-        )
+    run_script(str(tmpdir), str(tmpdir), script_name)
+    stream_script(str(tmpdir), str(tmpdir), script_name)
+    run_script(str(tmpdir), missing_dir, script_name)
 
-        # Call the function under test
-        result = run_script(scripts_dir, deployment_dir, script_name, capture_output=True)
+    timings = read_script_timings(str(tmpdir))
+    assert [(timing["script"], timing["exitcode"]) for timing in timings] == [(script_name, 2), (script_name, 2)]
+    assert all(timing["wall"] >= 0.1 for timing in timings)
+    assert all(timing["max_rss_kb"] > 0 for timing in timings)
 
-        # Assert that subprocess.run() was called with the correct arguments
-        mock_subprocess_run.assert_called_once_with(
-            [os.path.join(scripts_dir, script_name)],
-            check=True,
-            shell=False,
-            env={"DEPLOYMENT_DIR": deployment_dir, "PATH": os.environ.get("PATH", "")},
-            capture_output=True,
-            text=True,
-        )
 
-        # Assert that the result matches the expected output
-        assert result.succeeded is True
-        assert result.output.decode() == expected_output
-        assert result.exitcode == 0
+def test_stream_script_hands_over_lines_as_they_arrive(tmpdir):
+    script_name = write_script(str(tmpdir), 'echo one; echo oops >&2; printf "50%%\\r100%%\\n"; printf "last"')
+    lines = []
+
+    result = stream_script(str(tmpdir), str(tmpdir), script_name, on_line=lines.append)
+
+    assert result.succeeded
+    assert result.output == "one\n50%\r100%\nlast"
+    assert ("stderr", "oops", "\n") in lines
+    assert [(line.text, line.end) for line in lines if line.stream == "stdout"] == [
+        ("one", "\n"),
+        ("50%", "\r"),
+        ("100%", "\n"),
+        ("last", ""),
+    ]
+
+
+def test_stream_script_keeps_a_bounded_tail(tmpdir):
+    script_name = write_script(str(tmpdir), 'for i in $(seq 1 1000); do echo "line $i"; done; echo failed >&2; exit 3')
+
+    result = stream_script(str(tmpdir), str(tmpdir), script_name, tail_size=3)
+
+    assert not result.succeeded
+    assert result.exitcode == 3
+    assert result.output == "line 998\nline 999\nline 1000"
+    assert result.tail == ["line 999", "line 1000", "failed"]
+
+
+def test_stream_script_collects_the_whole_output(tmpdir):
+    script_name = write_script(str(tmpdir), 'for i in $(seq 1 1000); do echo "line $i"; done')
+
+    result = stream_script(str(tmpdir), str(tmpdir), script_name, tail_size=3, collect_output=True)
+
+    assert result.output == "\n".join(f"line {i}" for i in range(1, 1001))
+    assert result.tail == ["line 998", "line 999", "line 1000"]
+
+
+def test_stream_script_passes_the_environment(tmpdir):
+    script_name = write_script(str(tmpdir), 'echo "$DEPLOYMENT_DIR $PARAMS"')
+
+    result = stream_script(str(tmpdir), "/a/deployment", script_name, PARAMS="get pods")
+
+    assert result.output == "/a/deployment get pods"
+
+
+def test_stream_script_that_cannot_start(tmpdir):
+    result = stream_script(str(tmpdir), str(tmpdir), "missing.sh")
+    assert not result.succeeded
+    assert result.exitcode == 1
+
+
+def test_write_env_bundle(tmpdir):
+    path = str(tmpdir.join(".env"))
+    env = {
+        "LICENSE_KEY": "abc=def==",
+        "SSL_CERT": "-----BEGIN CERTIFICATE-----\nMII ...\n-----END CERTIFICATE-----",
+        "DOMAIN": "it's a domain; $(rm -rf /)",
+        "IMAGE_PULL_SECRET": None,
+        "AVAILABLE_PORT": 5000,
+    }
+
+    assert write_env_bundle(path, env)
+
+    script = (
+        f'source "{path}"; printf "%s\\0" "$LICENSE_KEY" "$SSL_CERT" "$DOMAIN" "$IMAGE_PULL_SECRET" "$AVAILABLE_PORT"'
+    )
+    sourced = subprocess.run(["bash", "-c", script], capture_output=True, text=True, check=True).stdout
+    expected = ["abc=def==", env["SSL_CERT"], env["DOMAIN"], "", "5000"]
+    assert sourced.split("\0")[:-1] == expected
+    with open(f"{path}.json", "r") as file:
+        assert list(json.load(file).values()) == expected
+    assert oct(os.stat(path).st_mode & 0o777) == "0o600"
+
+
+def test_source_without_prefix(tmpdir):
+    env_file = str(tmpdir.join(".images-trusted.env"))
+    with open(env_file, "w") as file:
+        file.write("TRUSTED_IMAGE_REGISTRY_SERVER=registry:5000\nTRUSTED_CORE_IMG_REPO=registry:5000/core\n")
+    scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli", "scripts")
+    script = f'source "{scripts_dir}/utils.sh" --source-only\nsource_without_prefix "{env_file}" TRUSTED_\nenv'
+
+    # a TRUSTED_ variable of the shell that isn't in the file stays as it is
+    env = {"PATH": os.environ.get("PATH", ""), "TRUSTED_STRAY": "stray"}
+    exported = subprocess.run(["bash", "-c", script], env=env, capture_output=True, text=True, check=True).stdout
+    exported = dict(line.split("=", 1) for line in exported.splitlines() if "=" in line)
+    assert exported["IMAGE_REGISTRY_SERVER"] == "registry:5000"
+    assert exported["CORE_IMG_REPO"] == "registry:5000/core"
+    assert "STRAY" not in exported
+
+
+def test_write_env_bundle_only_writes_changes(tmpdir):
+    path = str(tmpdir.join(".env"))
+    assert write_env_bundle(path, {"VERSION": "1.0.0"})
+    inode = os.stat(path).st_ino
+
+    assert not write_env_bundle(path, {"VERSION": "1.0.0"})
+    assert os.stat(path).st_ino == inode
+
+    assert write_env_bundle(path, {"VERSION": "1.0.1"})
+    assert os.stat(path).st_ino != inode
+    # no temporary files are left behind
+    assert sorted(os.listdir(str(tmpdir))) == [".env", ".env.json"]
+
+
+def test_write_env_bundle_rejects_invalid_names(tmpdir):
+    with pytest.raises(ValueError):
+        write_env_bundle(str(tmpdir.join(".env")), {"NOT VALID": "value"})
 
 
 class TestTailFunction(unittest.TestCase):
@@ -263,34 +491,47 @@ def test_generate_utilities_dir():
 
 
 class TestCheckAcquired(unittest.TestCase):
-    @patch("os.path.exists")
-    def test_check_acquired(self, mock_exists):
-        # Mock the return value of os.path.exists to simulate the presence of the lock file
-        mock_exists.return_value = True
+    def test_check_acquired(self):
+        with tempfile.TemporaryDirectory() as file_dir:
+            # No lease file at all
+            self.assertFalse(check_acquired(file_dir))
 
-        # Call the function with a mocked file directory
-        result = check_acquired("mocked_directory")
+            # A lock file left behind by a crashed run doesn't count as acquired
+            with open(f"{file_dir}/.lock", "w") as lock_file:
+                lock_file.write('{"pid": 1, "host": "%s", "heartbeat": "2024-01-01T00:00:00"}' % socket.gethostname())
+            self.assertFalse(check_acquired(file_dir))
 
-        # Assert that the result is True since the lock file exists
-        self.assertTrue(result)
+            self.assertTrue(acquire(file_dir))
+            try:
+                self.assertTrue(check_acquired(file_dir))
+            finally:
+                release(file_dir)
 
 
 class TestAcquireRelease(unittest.TestCase):
-    @patch("builtins.open", new_callable=mock_open)
-    def test_acquire(self, mock_open):
-        # Mock the open function to simulate opening a file
-        acquire("mocked_directory")
-
-        # Assert that open is called with the correct file path and mode
-        mock_open.assert_called_once_with("mocked_directory/.lock", "a")
-
-    @patch("os.remove")
-    def test_release(self, mock_remove):
-        # Call the release function
-        release("mocked_directory")
-
-        # Assert that os.remove is called with the correct file path
-        mock_remove.assert_called_once_with("mocked_directory/.lock")
+    def test_acquire(self):
+        with tempfile.TemporaryDirectory() as file_dir:
+            self.assertTrue(acquire(file_dir))
+            try:
+                # The lease file describes its owner
+                with open(f"{file_dir}/.lock", "r") as lock_file:
+                    lease = json.load(lock_file)
+                self.assertEqual(lease["pid"], os.getpid())
+                self.assertEqual(lease["host"], socket.gethostname())
+                self.assertEqual(lease["started_at"], lease["heartbeat"])
+            finally:
+                release(file_dir)
+
+    def test_release(self):
+        with tempfile.TemporaryDirectory() as file_dir:
+            acquire(file_dir)
+
+            # Call the release function
+            release(file_dir)
+
+            # Assert that the lease file is removed and can be acquired again
+            self.assertFalse(os.path.exists(f"{file_dir}/.lock"))
+            self.assertFalse(check_acquired(file_dir))
 
 
 class TestSetStatus(unittest.TestCase):
@@ -331,17 +572,20 @@ class TestFindAvailablePort(unittest.TestCase):
 
 
 class TestMakeTarfile(unittest.TestCase):
-    @patch("cli.utils.tarfile.open")
-    def test_make_tarfile(self, mock_tarfile_open):
-        # Call the function
-        make_tarfile("output.tar.gz", "/path/to/source")
-
-        # Check that tarfile.open was called with the correct arguments
-        mock_tarfile_open.assert_called_once_with("output.tar.gz", "w:gz")
-
-        # Check that the tarfile.add method was called with the correct arguments
-        mock_tarfile_instance = mock_tarfile_open.return_value.__enter__.return_value
-        mock_tarfile_instance.add.assert_called_once_with("/path/to/source", arcname="source")
+    def test_make_tarfile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_dir = os.path.join(tmp_dir, "source")
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, "data"), "wb") as file:
+                file.write(os.urandom(3 * 1024 * 1024))
+
+            make_tarfile(os.path.join(tmp_dir, "output.tar.gz"), source_dir)
+
+            # one gzip member per block, read back as one stream
+            with tarfile.open(os.path.join(tmp_dir, "output.tar.gz"), "r:gz") as tar:
+                self.assertEqual(tar.getnames(), ["source", "source/data"])
+                with open(os.path.join(source_dir, "data"), "rb") as file:
+                    self.assertEqual(tar.extractfile("source/data").read(), file.read())
 
 
 class TestGetArchitecture(unittest.TestCase):